@@ -0,0 +1,87 @@
+""" Standard sentiment for a lot of texts at once, calculated in a pool of worker processes """
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import math
+import multiprocessing
+import os
+import threading
+
+from django.conf import settings
+
+from letter_sentiment.sentiment import get_textblob_polarity, get_vader_analyzer, polarity_many
+
+# Number of chunks of texts to give each worker process, so a slow chunk doesn't hold up the others for long
+CHUNKS_PER_PROCESS = 4
+
+# The pool gets created the first time it's needed, and then kept for the life of this process
+sentiment_pool = None
+sentiment_pool_lock = threading.Lock()
+
+
+def init_sentiment_worker():
+    """
+    Load the TextBlob and Vader models when a worker process starts, instead of for the first texts it gets
+    """
+
+    get_vader_analyzer()
+    get_textblob_polarity('Loading the TextBlob lexicon')
+
+
+def get_sentiment_processes():
+    """
+    Return the number of worker processes to calculate sentiment in
+    """
+
+    return settings.SENTIMENT_PROCESSES or os.cpu_count() or 1
+
+
+def get_sentiment_pool():
+    """
+    Return the pool of worker processes, creating it if necessary
+    """
+
+    global sentiment_pool
+    with sentiment_pool_lock:
+        if sentiment_pool is None:
+            # Spawn the worker processes instead of forking, because the web server might have threads running
+            sentiment_pool = ProcessPoolExecutor(max_workers=get_sentiment_processes(),
+                                                 mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=init_sentiment_worker)
+        return sentiment_pool
+
+
+def shutdown_sentiment_pool():
+    """
+    Shut down the pool of worker processes, so a new one gets created the next time it's needed
+    """
+
+    global sentiment_pool
+    with sentiment_pool_lock:
+        if sentiment_pool is not None:
+            sentiment_pool.shutdown(wait=False, cancel_futures=True)
+            sentiment_pool = None
+
+
+def get_polarities(texts):
+    """
+    Return the TextBlob and vaderSentiment polarity of each of the texts, as a list of Polarity in the same order
+
+    If there are at least settings.SENTIMENT_POOL_MIN_TEXTS texts, they get split up among the worker processes,
+    otherwise starting the pool and sending the texts to it would take longer than analyzing them here
+    """
+
+    texts = list(texts)
+    processes = get_sentiment_processes()
+    if processes < 2 or len(texts) < settings.SENTIMENT_POOL_MIN_TEXTS:
+        return polarity_many(texts)
+
+    chunk_size = math.ceil(len(texts) / (processes * CHUNKS_PER_PROCESS))
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    try:
+        # map() returns the results in the same order as the chunks
+        return [polarity for polarities in get_sentiment_pool().map(polarity_many, chunks)
+                for polarity in polarities]
+    except BrokenProcessPool:
+        # A worker process died, so start again with a new pool next time, and analyze the texts here
+        shutdown_sentiment_pool()
+        return polarity_many(texts)
@@ -1,41 +1,143 @@
 """functions for calculating custom sentiment of letters and other text"""
 
-from letters.elasticsearch import get_sentiment_termvector_for_text, \
-    index_temp_document, delete_temp_document
-from letter_sentiment.models import CustomSentiment
-from letter_sentiment.elasticsearch import calculate_custom_sentiment
+from asgiref.sync import sync_to_async
+
+from letters.elasticsearch import get_sentiment_termvector_for_text
+from letters.models import IndexOutboxEntry
+from letter_sentiment.models import CustomSentiment, CustomSentimentScore
+from letter_sentiment.elasticsearch import async_calculate_custom_sentiments, calculate_custom_sentiment, \
+    calculate_custom_sentiments
 from letter_sentiment.sentiment import format_sentiment
+from letter_sentiment.text_sentiment import score_text_for_custom_sentiment
 
 
-# temporarily index text as contents of letter and calculate custom sentiment for that letter
+# calculate custom sentiment of text the way it would be calculated for a letter with text as its contents,
+# without putting the text in the index
 def get_custom_sentiment_for_text(text, custom_sentiment_id):
-    index_temp_document(text)
-    sentiment = get_custom_sentiment_for_letter('temp', custom_sentiment_id)
-    delete_temp_document()
-    return sentiment
+    custom_sentiment = get_custom_sentiment(custom_sentiment_id)
+    if not custom_sentiment or not custom_sentiment.get_terms():
+        return 0
+
+    sentiment = score_text_for_custom_sentiment(text or '', custom_sentiment)
 
+    return format_sentiment(custom_sentiment.name, sentiment)
 
+
+# return the stored custom sentiment of a letter, like search results do, or calculate and store it
 def get_custom_sentiment_for_letter(letter_id, custom_sentiment_id):
     custom_sentiment = get_custom_sentiment(custom_sentiment_id)
     if not custom_sentiment or not custom_sentiment.get_terms():
         return 0
 
-    sentiment = calculate_custom_sentiment(letter_id, custom_sentiment_id)
+    scores = CustomSentimentScore.objects.filter(custom_sentiment_id=custom_sentiment.id, letter_id=letter_id)
+    sentiment = scores.values_list('score', flat=True).first()
+    if sentiment is None:
+        sentiment = calculate_custom_sentiment(letter_id, custom_sentiment_id)
+        # A letter that's waiting in the index outbox gets scored with its old contents, so don't keep that score
+        if not IndexOutboxEntry.objects.filter(letter_id=letter_id).exists():
+            scores.update_or_create(custom_sentiment_id=custom_sentiment.id, letter_id=letter_id,
+                                    defaults={'score': sentiment})
 
     return format_sentiment(custom_sentiment.name, sentiment)
 
 
+# calculate custom sentiments for a batch of letters at once, returned by custom sentiment id and letter id
+def get_custom_sentiments_for_letters(letter_ids, custom_sentiment_ids):
+    if not letter_ids or not custom_sentiment_ids:
+        return {custom_sentiment_id: {letter_id: 0 for letter_id in letter_ids}
+                for custom_sentiment_id in custom_sentiment_ids}
+
+    custom_sentiments, ids_to_calculate = get_custom_sentiments_to_calculate(custom_sentiment_ids)
+    sentiments, missing_letter_ids, missing_sentiment_ids = get_stored_custom_sentiments(letter_ids, ids_to_calculate)
+    if missing_letter_ids:
+        add_custom_sentiments(sentiments, calculate_custom_sentiments(missing_letter_ids, missing_sentiment_ids))
+
+    return format_custom_sentiments_for_letters(letter_ids, custom_sentiment_ids, custom_sentiments, sentiments)
+
+
+# async version of get_custom_sentiments_for_letters(), for async views
+async def async_get_custom_sentiments_for_letters(letter_ids, custom_sentiment_ids):
+    if not letter_ids or not custom_sentiment_ids:
+        return {custom_sentiment_id: {letter_id: 0 for letter_id in letter_ids}
+                for custom_sentiment_id in custom_sentiment_ids}
+
+    custom_sentiments, ids_to_calculate = await sync_to_async(get_custom_sentiments_to_calculate)(
+        custom_sentiment_ids
+    )
+    sentiments, missing_letter_ids, missing_sentiment_ids = await sync_to_async(get_stored_custom_sentiments)(
+        letter_ids, ids_to_calculate
+    )
+    if missing_letter_ids:
+        add_custom_sentiments(sentiments,
+                              await async_calculate_custom_sentiments(missing_letter_ids, missing_sentiment_ids))
+
+    return format_custom_sentiments_for_letters(letter_ids, custom_sentiment_ids, custom_sentiments, sentiments)
+
+
+# return custom sentiments by id, and the ids of the ones that have terms, so they can be calculated
+def get_custom_sentiments_to_calculate(custom_sentiment_ids):
+    custom_sentiments = {custom_sentiment.id: custom_sentiment for custom_sentiment in
+                         CustomSentiment.objects.filter(pk__in=custom_sentiment_ids).prefetch_related('terms')}
+    ids_to_calculate = [custom_sentiment_id for custom_sentiment_id in custom_sentiment_ids
+                        if custom_sentiment_id in custom_sentiments
+                        and custom_sentiments[custom_sentiment_id].get_terms()]
+
+    return custom_sentiments, ids_to_calculate
+
+
+def get_stored_custom_sentiments(letter_ids, custom_sentiment_ids):
+    """
+    Return the stored scores of the letters for the custom sentiments, by custom sentiment id and letter id,
+    and the ids of the letters and custom sentiments that still have to be calculated with Elasticsearch
+    """
+
+    sentiments = {custom_sentiment_id: {} for custom_sentiment_id in custom_sentiment_ids}
+    if letter_ids and custom_sentiment_ids:
+        scores = CustomSentimentScore.objects.filter(letter_id__in=letter_ids,
+                                                     custom_sentiment_id__in=custom_sentiment_ids)
+        for custom_sentiment_id, letter_id, score in scores.values_list('custom_sentiment_id', 'letter_id', 'score'):
+            sentiments[custom_sentiment_id][letter_id] = score
+
+    missing_sentiment_ids = [custom_sentiment_id for custom_sentiment_id in custom_sentiment_ids
+                             if any(letter_id not in sentiments[custom_sentiment_id] for letter_id in letter_ids)]
+    missing_letter_ids = [letter_id for letter_id in letter_ids
+                          if any(letter_id not in sentiments[custom_sentiment_id]
+                                 for custom_sentiment_id in missing_sentiment_ids)]
+
+    return sentiments, missing_letter_ids, missing_sentiment_ids
+
+
+# add calculated custom sentiments to the stored ones, without replacing any of the stored ones
+def add_custom_sentiments(sentiments, calculated_sentiments):
+    for custom_sentiment_id, letter_sentiments in calculated_sentiments.items():
+        for letter_id, sentiment in letter_sentiments.items():
+            sentiments[custom_sentiment_id].setdefault(letter_id, sentiment)
+
+    return sentiments
+
+
+# format calculated custom sentiments with their names, and 0 for the ones that couldn't be calculated
+def format_custom_sentiments_for_letters(letter_ids, custom_sentiment_ids, custom_sentiments, sentiments):
+    letter_sentiments = {}
+    for custom_sentiment_id in custom_sentiment_ids:
+        if custom_sentiment_id in sentiments:
+            name = custom_sentiments[custom_sentiment_id].name
+            letter_sentiments[custom_sentiment_id] = {
+                letter_id: format_sentiment(name, sentiment)
+                for letter_id, sentiment in sentiments[custom_sentiment_id].items()
+            }
+        else:
+            letter_sentiments[custom_sentiment_id] = {letter_id: 0 for letter_id in letter_ids}
+
+    return letter_sentiments
+
+
 # surround relevant term in text with styled <span>
 def highlight_for_custom_sentiment(text, custom_sentiment_id):
     custom_sentiment = get_custom_sentiment(custom_sentiment_id)
     if not custom_sentiment or not custom_sentiment.get_terms():
         return text
 
-    highlight_normal_class = 'sentiment-highlight-normal'
-    highlight_extra_class = 'sentiment-highlight-extra'
-
-    highlighted_text = text
-
     terms = sort_terms_by_number_of_words(custom_sentiment.get_terms())
     termvector = get_sentiment_termvector_for_text(text)
     terms_to_place = {}
@@ -53,29 +155,43 @@ def highlight_for_custom_sentiment(text, custom_sentiment_id):
                     terms_to_place[position] = (start, end, term.weight)
                     termvector = update_tokens_in_termvector(termvector, term, token)
 
-    # Offsets will be altered by insertions of highlighting markup,
-    # depending on position in text, so start inserting at the end
-    sorted_terms_to_place \
-        = [terms_to_place[pos] for pos in sorted(terms_to_place.keys(), reverse=True)]
-
-    # If there are overlapping terms in the text, adjust start or end position of one of them
-    prev_start_pos = 0
-    for idx, (start_pos, end_pos, weight) in enumerate(sorted_terms_to_place):
-        if prev_start_pos and end_pos > prev_start_pos:
-            new_end = prev_start_pos - 1
-            sorted_terms_to_place[idx] = (start_pos, new_end, weight)
-        prev_start_pos = start_pos
-
-    # Apply css classes for highlighting
-    for start_pos, end_pos, weight in sorted_terms_to_place:
+    return build_highlighted_text(text, get_highlight_spans(terms_to_place))
+
+
+def get_highlight_spans(terms_to_place):
+    """
+    Return the (start, end, weight) of the terms to highlight in the order they're in the text,
+    with terms that overlap the next one ending before it
+    """
+
+    spans = [terms_to_place[pos] for pos in sorted(terms_to_place.keys())]
+    for idx, (start_pos, end_pos, weight) in enumerate(spans[:-1]):
+        next_start_pos = spans[idx + 1][0]
+        if next_start_pos and end_pos > next_start_pos:
+            spans[idx] = (start_pos, next_start_pos - 1, weight)
+
+    return spans
+
+
+def build_highlighted_text(text, spans):
+    """
+    Return text with each of the spans, in the order they're in the text, surrounded with styled <span>,
+    putting the text together in one pass instead of copying it for every span
+    """
+
+    highlight_normal_class = 'sentiment-highlight-normal'
+    highlight_extra_class = 'sentiment-highlight-extra'
+
+    pieces = []
+    text_pos = 0
+    for start_pos, end_pos, weight in spans:
         highlight_class = highlight_normal_class if weight == 1 else highlight_extra_class
-        highlighted_text = str.format('{0}<span class="{1}">{2}</span>{3}',
-                                      highlighted_text[:start_pos],
-                                      highlight_class,
-                                      highlighted_text[start_pos:end_pos],
-                                      highlighted_text[end_pos:])
+        pieces.append(text[text_pos:start_pos])
+        pieces.append(str.format('<span class="{0}">{1}</span>', highlight_class, text[start_pos:end_pos]))
+        text_pos = end_pos
+    pieces.append(text[text_pos:])
 
-    return highlighted_text
+    return ''.join(pieces)
 
 
 def get_token_offsets(token):
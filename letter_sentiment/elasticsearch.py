@@ -1,8 +1,10 @@
 """ Elasticsearch-specific functionality for custom sentiment calculations """
 import json
 
+from asgiref.sync import sync_to_async
+
 from letter_sentiment.models import CustomSentiment
-from letters.elasticsearch import do_es_search
+from letters.elasticsearch import CUSTOM_SENTIMENT_FIELD, async_do_es_msearch, do_es_msearch, do_es_search
 from letters.models import Letter
 
 
@@ -21,17 +23,72 @@ def calculate_custom_sentiment(letter_id, sentiment_id):
     return custom_sentiment_es
 
 
+# Use Elasticsearch scoring to calculate custom sentiments for a batch of letters with a single multi search,
+# and return the scores keyed by sentiment id and letter id
+def calculate_custom_sentiments(letter_ids, sentiment_ids):
+    if not letter_ids or not sentiment_ids:
+        return get_custom_sentiments_from_responses(letter_ids, sentiment_ids, responses=[])
+
+    searches = get_custom_sentiment_searches(letter_ids, sentiment_ids)
+    responses = do_es_msearch(index=Letter._meta.es_index_name, searches=searches)
+
+    return get_custom_sentiments_from_responses(letter_ids, sentiment_ids, responses)
+
+
+# Async version of calculate_custom_sentiments(), for async views
+async def async_calculate_custom_sentiments(letter_ids, sentiment_ids):
+    if not letter_ids or not sentiment_ids:
+        return get_custom_sentiments_from_responses(letter_ids, sentiment_ids, responses=[])
+
+    # The custom sentiment terms for the queries come from the database
+    searches = await sync_to_async(get_custom_sentiment_searches)(letter_ids, sentiment_ids)
+    responses = await async_do_es_msearch(index=Letter._meta.es_index_name, searches=searches)
+
+    return get_custom_sentiments_from_responses(letter_ids, sentiment_ids, responses)
+
+
+# One search per custom sentiment, for a multi search
+def get_custom_sentiment_searches(letter_ids, sentiment_ids):
+    stored_fields = get_custom_sentiment_stored_fields()
+    return [
+        {
+            'query': get_custom_sentiment_query_for_letters(letter_ids, sentiment_id),
+            'size': len(letter_ids),
+            'stored_fields': stored_fields
+        } for sentiment_id in sentiment_ids
+    ]
+
+
+# Get the scores from the multi search responses, which are in the same order as sentiment_ids
+# Letters that weren't in the hits of a response get a score of 0
+def get_custom_sentiments_from_responses(letter_ids, sentiment_ids, responses):
+    custom_sentiments = {sentiment_id: {letter_id: 0 for letter_id in letter_ids} for sentiment_id in sentiment_ids}
+
+    letter_ids_by_doc_id = {str(letter_id): letter_id for letter_id in letter_ids}
+    for sentiment_id, response in zip(sentiment_ids, responses):
+        if 'hits' in response and 'hits' in response['hits']:
+            for hit in response['hits']['hits']:
+                if hit['_id'] in letter_ids_by_doc_id:
+                    custom_sentiments[sentiment_id][letter_ids_by_doc_id[hit['_id']]] = hit['_score']
+
+    return custom_sentiments
+
+
 def get_custom_sentiment_query(letter_id, sentiment_id):
+    return get_custom_sentiment_query_for_letters([letter_id], sentiment_id)
+
+
+def get_custom_sentiment_query_for_letters(letter_ids, sentiment_id):
     # get the query with all the custom sentiment terms in it
     sentiment_match_query = get_sentiment_match_query(sentiment_id)
     should_conditions = [condition for condition in sentiment_match_query if condition]
 
-    # filter by id
+    # filter by ids
     bool_query = {
         "should": should_conditions,
         "must": {
             "terms": {
-                "_id": [str(letter_id)]
+                "_id": [str(letter_id) for letter_id in letter_ids]
             }
         }
     }
@@ -79,13 +136,17 @@ def get_sentiment_match_query(sentiment_id):
         max_weight = my_custom_sentiment.max_weight
         terms = my_custom_sentiment.get_terms()
         for term in terms:
-            boost = term.weight * term.number_of_words() / max_weight
             term_match_query = {
                 'match_phrase': {
-                    'contents.custom_sentiment': {'query': term.text, 'boost': boost, }
+                    CUSTOM_SENTIMENT_FIELD: {'query': term.text, 'boost': get_term_boost(term, max_weight), }
                 }
             }
 
             sentiment_match_query.append(term_match_query)
 
     return sentiment_match_query
+
+
+# Terms with more words and more weight count for more in the score
+def get_term_boost(term, max_weight):
+    return term.weight * term.number_of_words() / max_weight
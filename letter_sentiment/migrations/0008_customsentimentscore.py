@@ -0,0 +1,27 @@
+# Generated by Django 4.2.8 on 2026-10-17 08:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('letters', '0021_letter_body_text_letter_contents_text'),
+        ('letter_sentiment', '0007_auto_20220531_0130'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomSentimentScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('custom_sentiment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scores', to='letter_sentiment.customsentiment')),
+                ('letter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='custom_sentiment_scores', to='letters.letter')),
+            ],
+            options={
+                'unique_together': {('custom_sentiment', 'letter')},
+            },
+        ),
+    ]
@@ -4,6 +4,7 @@
 from django.db import models
 
 from letters.elasticsearch import analyze_term
+from letters.search_cache import bump_corpus_generation
 
 
 class CustomSentiment(models.Model):
@@ -16,6 +17,17 @@ class CustomSentiment(models.Model):
     def get_terms(self):
         return self.terms.all()
 
+    def save(self, *args, **kwargs):
+        super(CustomSentiment, self).save(*args, **kwargs)
+        # Stored scores were calculated with the old max_weight
+        self.scores.all().delete()
+        bump_corpus_generation()
+
+    def delete(self, *args, **kwargs):
+        result = super(CustomSentiment, self).delete(*args, **kwargs)
+        bump_corpus_generation()
+        return result
+
 
 class Term(models.Model):
     text = models.CharField(max_length=100)
@@ -44,10 +56,37 @@ class Term(models.Model):
             self.analyzed_text = analyze_text(self.text)
         super(Term, self).save(*args, **kwargs)
         self.__original_text = self.text
+        CustomSentimentScore.objects.filter(custom_sentiment_id=self.custom_sentiment_id).delete()
+        bump_corpus_generation()
+
+    def delete(self, *args, **kwargs):
+        result = super(Term, self).delete(*args, **kwargs)
+        CustomSentimentScore.objects.filter(custom_sentiment_id=self.custom_sentiment_id).delete()
+        bump_corpus_generation()
+        return result
 
     class Meta:
         ordering = ('text',)
 
 
+class CustomSentimentScore(models.Model):
+    """
+    Custom sentiment of a letter, stored by update_letter_sentiment --custom or the first time a letter page shows it,
+    so it doesn't have to be calculated with Elasticsearch every time it's shown
+
+    Scores get deleted when the custom sentiment, its terms or the letter change
+    """
+
+    custom_sentiment = models.ForeignKey(CustomSentiment, on_delete=models.CASCADE, related_name='scores')
+    letter = models.ForeignKey('letters.Letter', on_delete=models.CASCADE, related_name='custom_sentiment_scores')
+    score = models.FloatField()
+
+    def __str__(self):
+        return str.format('{0}: {1}', self.custom_sentiment, self.score)
+
+    class Meta:
+        unique_together = ('custom_sentiment', 'letter')
+
+
 def analyze_text(text):
     return analyze_term(text, analyzer='string_sentiment_analyzer')
@@ -1,13 +1,24 @@
+from collections import namedtuple
+from functools import lru_cache
+
 from textblob import TextBlob
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer as vaderSentiment
 
+# TextBlob and vaderSentiment polarity of a text
+Polarity = namedtuple('Polarity', ['textblob', 'vader'])
+# Sentences of a text with the Polarity of each one, and the Polarity of the whole text, if it was calculated
+TextAnalysis = namedtuple('TextAnalysis', ['sentences', 'polarities', 'polarity'])
+
 
 def get_sentiment(text_to_analyze):
-    polarity = get_textblob_polarity(text_to_analyze)
-    tb_sentiment = format_sentiment(sentiment_to_string(polarity), polarity)
+    return format_standard_sentiment(get_textblob_polarity(text_to_analyze),
+                                     get_vadersentiment_polarity(text_to_analyze))
+
 
-    polarity = get_vadersentiment_polarity(text_to_analyze)
-    v_sentiment = format_sentiment(sentiment_to_string(polarity), polarity)
+# format TextBlob and vaderSentiment polarities that have already been calculated
+def format_standard_sentiment(textblob_polarity, vader_polarity):
+    tb_sentiment = format_sentiment(sentiment_to_string(textblob_polarity), textblob_polarity)
+    v_sentiment = format_sentiment(sentiment_to_string(vader_polarity), vader_polarity)
 
     return [str.format('TextBlob: {0}', tb_sentiment), str.format('Vader: {0}', v_sentiment)]
 
@@ -36,35 +47,87 @@ def get_textblob_polarity(text_to_analyze):
     return text.sentiment.polarity
 
 
+@lru_cache(maxsize=None)
+def get_vader_analyzer():
+    """
+    Return the vaderSentiment analyzer for this process, creating it the first time,
+    because creating one loads the whole Vader lexicon from disk
+    """
+
+    return vaderSentiment()
+
+
 def get_vadersentiment_polarity(text_to_analyze):
-    analyzer = vaderSentiment()
-    scores = analyzer.polarity_scores(text_to_analyze)
+    scores = get_vader_analyzer().polarity_scores(text_to_analyze)
     neg = scores['neg']
     pos = scores['pos']
     polarity = pos - neg
     return polarity
 
 
+def polarity_many(texts):
+    """
+    Return the TextBlob and vaderSentiment polarity of each of the texts, as a list of Polarity,
+    analyzing them all with the same analyzers
+    """
+
+    return [Polarity(get_textblob_polarity(text), get_vadersentiment_polarity(text)) for text in texts]
+
+
+def analyze_text(text, get_polarities=None, whole_text=True):
+    """
+    Split text into sentences once, and return TextAnalysis with the polarity of each sentence
+    and, if whole_text, the polarity of the whole text, all calculated with one call to get_polarities
+
+    get_polarities can be given to calculate the polarities some other way than polarity_many()
+    """
+
+    get_polarities = get_polarities or polarity_many
+    text = text or ''
+    sentences = [sentence.string for sentence in TextBlob(text).sentences]
+    polarities = get_polarities(sentences + [text] if whole_text else sentences)
+    if whole_text:
+        return TextAnalysis(sentences, polarities[:-1], polarities[-1])
+    return TextAnalysis(sentences, polarities, None)
+
+
 # surround sentences in text with styled <span>
-def highlight_text_for_sentiment(text):
+def highlight_text_for_sentiment(text, get_polarities=None):
+    return highlight_text_analysis(analyze_text(text, get_polarities, whole_text=False))
+
+
+def highlight_text_analysis(analysis):
+    """
+    Return the text of analysis with each sentence highlighted for TextBlob sentiment,
+    and with each sentence highlighted for vaderSentiment
+    """
+
     # get highlights for both TextBlob sentiment and vaderSentiment
     highlighted_text_blob = ''
     highlighted_text_vader = ''
 
-    blob = TextBlob(text)
-    for sentence in blob.sentences:
+    for sentence, polarity in zip(analysis.sentences, analysis.polarities):
         # TextBlob sentiment
-        highlight = do_sentiment_highlight(sentence.string, sentence.polarity)
+        highlight = do_sentiment_highlight(sentence, polarity.textblob)
         highlighted_text_blob += highlight + ' '
 
         # vaderSentiment
-        polarity = get_vadersentiment_polarity(sentence.string)
-        highlight = do_sentiment_highlight(sentence.string, polarity)
+        highlight = do_sentiment_highlight(sentence, polarity.vader)
         highlighted_text_vader += highlight + ' '
 
     return [highlighted_text_blob, highlighted_text_vader]
 
 
+def get_sentiment_and_highlights(text, get_polarities=None):
+    """
+    Return the same as get_sentiment(text) and highlight_text_for_sentiment(text),
+    from one analysis of the text
+    """
+
+    analysis = analyze_text(text, get_polarities)
+    return format_standard_sentiment(*analysis.polarity), highlight_text_analysis(analysis)
+
+
 def do_sentiment_highlight(text, polarity):
     if polarity < -0.5:
         css_class = 'sentiment-highlight-neg'
@@ -0,0 +1,77 @@
+from unittest.mock import patch
+
+from django.test import SimpleTestCase, override_settings
+
+from letter_sentiment import batch_sentiment
+from letter_sentiment.batch_sentiment import get_polarities, get_sentiment_pool, get_sentiment_processes, \
+    shutdown_sentiment_pool
+from letter_sentiment.sentiment import polarity_many
+
+
+class GetPolaritiesTestCase(SimpleTestCase):
+    """
+    get_polarities() should return the polarities of the texts in the same order,
+    calculating them in worker processes if there are enough texts
+    """
+
+    def tearDown(self):
+        shutdown_sentiment_pool()
+
+    @override_settings(SENTIMENT_PROCESSES=2, SENTIMENT_POOL_MIN_TEXTS=5)
+    @patch.object(batch_sentiment, 'get_sentiment_pool', autospec=True)
+    def test_get_polarities_few_texts(self, mock_get_sentiment_pool):
+        texts = ['This is terrific', 'This is awful']
+
+        self.assertEqual(get_polarities(texts), polarity_many(texts),
+                         'get_polarities() should return the same polarities as polarity_many()')
+        self.assertEqual(mock_get_sentiment_pool.call_count, 0,
+                         "get_polarities() shouldn't use worker processes for just a few texts")
+
+    @override_settings(SENTIMENT_PROCESSES=2, SENTIMENT_POOL_MIN_TEXTS=5)
+    def test_get_polarities_in_pool(self):
+        texts = ['This is terrific', 'This is awful', 'This is neutral', 'What a lovely day',
+                 'I am so sorry to hear it', ''] * 3
+
+        self.assertEqual(get_polarities(texts), polarity_many(texts),
+                         'get_polarities() should return the same polarities as polarity_many(), in the same order')
+        self.assertIsNotNone(batch_sentiment.sentiment_pool,
+                             'get_polarities() should use worker processes for enough texts')
+
+    @override_settings(SENTIMENT_PROCESSES=1, SENTIMENT_POOL_MIN_TEXTS=5)
+    @patch.object(batch_sentiment, 'get_sentiment_pool', autospec=True)
+    def test_get_polarities_one_process(self, mock_get_sentiment_pool):
+        get_polarities(['This is terrific'] * 10)
+
+        self.assertEqual(mock_get_sentiment_pool.call_count, 0,
+                         "get_polarities() shouldn't use worker processes if there's only supposed to be one")
+
+
+class GetSentimentPoolTestCase(SimpleTestCase):
+    """
+    get_sentiment_pool() should return the same pool until it gets shut down
+    """
+
+    @override_settings(SENTIMENT_PROCESSES=2)
+    def test_get_sentiment_pool(self):
+        pool = get_sentiment_pool()
+        self.assertIs(get_sentiment_pool(), pool, 'get_sentiment_pool() should only create one pool')
+
+        shutdown_sentiment_pool()
+        self.assertIsNone(batch_sentiment.sentiment_pool, 'shutdown_sentiment_pool() should get rid of the pool')
+        self.assertIsNot(get_sentiment_pool(), pool, 'get_sentiment_pool() should create a new pool after shutdown')
+        shutdown_sentiment_pool()
+
+
+class GetSentimentProcessesTestCase(SimpleTestCase):
+    """
+    get_sentiment_processes() should return settings.SENTIMENT_PROCESSES, or the number of CPUs if it's 0
+    """
+
+    @patch('letter_sentiment.batch_sentiment.os.cpu_count', autospec=True, return_value=8)
+    def test_get_sentiment_processes(self, mock_cpu_count):
+        with override_settings(SENTIMENT_PROCESSES=3):
+            self.assertEqual(get_sentiment_processes(), 3,
+                             'get_sentiment_processes() should return settings.SENTIMENT_PROCESSES')
+        with override_settings(SENTIMENT_PROCESSES=0):
+            self.assertEqual(get_sentiment_processes(), 8,
+                             'get_sentiment_processes() should return number of CPUs if SENTIMENT_PROCESSES is 0')
@@ -3,10 +3,112 @@ from unittest.mock import patch
 
 from django.test import SimpleTestCase, TestCase
 
-from letter_sentiment.custom_sentiment import get_analyzed_custom_sentiment_terms, get_custom_sentiment, \
-    get_custom_sentiment_for_letter, get_custom_sentiment_for_text, get_custom_sentiment_name, get_custom_sentiments, \
-    get_token_offsets, highlight_for_custom_sentiment, sort_terms_by_number_of_words, update_tokens_in_termvector
+from letter_sentiment.custom_sentiment import add_custom_sentiments, async_get_custom_sentiments_for_letters, \
+    build_highlighted_text, format_custom_sentiments_for_letters, get_analyzed_custom_sentiment_terms, \
+    get_custom_sentiment, get_custom_sentiment_for_letter, get_custom_sentiment_for_text, get_custom_sentiment_name, \
+    get_custom_sentiments, get_custom_sentiments_for_letters, get_custom_sentiments_to_calculate, \
+    get_highlight_spans, get_stored_custom_sentiments, get_token_offsets, highlight_for_custom_sentiment, \
+    sort_terms_by_number_of_words, update_tokens_in_termvector
+from letter_sentiment.models import CustomSentimentScore
 from letter_sentiment.tests.factories import CustomSentimentFactory, TermFactory
+from letters.models import IndexOutboxEntry
+from letters.tests.factories import LetterFactory
+
+
+class AddCustomSentimentsTestCase(SimpleTestCase):
+    """
+    add_custom_sentiments(sentiments, calculated_sentiments) should add calculated custom sentiments
+    to the stored ones, without replacing any of them
+    """
+
+    def test_add_custom_sentiments(self):
+        sentiments = {4: {1: 0.5}, 5: {}}
+        result = add_custom_sentiments(sentiments, {4: {1: 0, 2: 0.25}, 5: {1: 0.75}})
+
+        self.assertEqual(result, {4: {1: 0.5, 2: 0.25}, 5: {1: 0.75}},
+                         'add_custom_sentiments() should add calculated custom sentiments to the stored ones')
+
+
+class AsyncGetCustomSentimentsForLettersTestCase(SimpleTestCase):
+    """
+    async_get_custom_sentiments_for_letters(letter_ids, custom_sentiment_ids) should return custom sentiments
+    calculated with async_calculate_custom_sentiments(), by custom sentiment id and letter id
+    """
+
+    @patch('letter_sentiment.custom_sentiment.async_calculate_custom_sentiments', autospec=True)
+    @patch('letter_sentiment.custom_sentiment.get_stored_custom_sentiments', autospec=True)
+    @patch('letter_sentiment.custom_sentiment.get_custom_sentiments_to_calculate', autospec=True)
+    @patch('letter_sentiment.custom_sentiment.format_custom_sentiments_for_letters', autospec=True)
+    async def test_async_get_custom_sentiments_for_letters(self, mock_format_custom_sentiments_for_letters,
+                                                           mock_get_custom_sentiments_to_calculate,
+                                                           mock_get_stored_custom_sentiments,
+                                                           mock_async_calculate_custom_sentiments):
+        mock_get_custom_sentiments_to_calculate.return_value = ({4: 'custom_sentiment'}, [4])
+        mock_get_stored_custom_sentiments.return_value = ({4: {}}, [1], [4])
+        mock_async_calculate_custom_sentiments.return_value = {4: {1: 0.5}}
+        mock_format_custom_sentiments_for_letters.return_value = 'formatted'
+
+        result = await async_get_custom_sentiments_for_letters([1], [4])
+
+        args, kwargs = mock_async_calculate_custom_sentiments.call_args
+        self.assertEqual(args, ([1], [4]),
+                         'async_get_custom_sentiments_for_letters() should calculate sentiments with terms')
+        args, kwargs = mock_format_custom_sentiments_for_letters.call_args
+        self.assertEqual(args, ([1], [4], {4: 'custom_sentiment'}, {4: {1: 0.5}}),
+                         'async_get_custom_sentiments_for_letters() should format calculated custom sentiments')
+        self.assertEqual(result, 'formatted',
+                         'async_get_custom_sentiments_for_letters() should return formatted custom sentiments')
+
+        # If all the custom sentiments are stored, nothing should get calculated
+        mock_async_calculate_custom_sentiments.reset_mock()
+        mock_get_stored_custom_sentiments.return_value = ({4: {1: 0.25}}, [], [])
+        await async_get_custom_sentiments_for_letters([1], [4])
+        self.assertEqual(mock_async_calculate_custom_sentiments.call_count, 0,
+                         "async_get_custom_sentiments_for_letters() shouldn't calculate stored custom sentiments")
+        args, kwargs = mock_format_custom_sentiments_for_letters.call_args
+        self.assertEqual(args[3], {4: {1: 0.25}},
+                         'async_get_custom_sentiments_for_letters() should format stored custom sentiments')
+
+        # If no letter ids, nothing should get calculated
+        mock_async_calculate_custom_sentiments.reset_mock()
+        self.assertEqual(await async_get_custom_sentiments_for_letters([], [4]), {4: {}},
+                         'async_get_custom_sentiments_for_letters() should return empty results if no letter ids')
+        self.assertEqual(mock_async_calculate_custom_sentiments.call_count, 0,
+                         "async_get_custom_sentiments_for_letters() shouldn't calculate anything if no letter ids")
+
+
+class BuildHighlightedTextTestCase(SimpleTestCase):
+    """
+    build_highlighted_text(text, spans) should surround each span of text with styled <span>
+    """
+
+    def test_build_highlighted_text(self):
+        text = 'tofu artisan pabst'
+
+        self.assertEqual(build_highlighted_text(text, [(0, 4, 1), (13, 18, 2)]),
+                         '<span class="sentiment-highlight-normal">tofu</span> artisan '
+                         '<span class="sentiment-highlight-extra">pabst</span>',
+                         'build_highlighted_text() should highlight spans with weight 1 normally and others extra')
+        self.assertEqual(build_highlighted_text(text, []), text,
+                         'build_highlighted_text() should return text if there are no spans')
+
+
+class FormatCustomSentimentsForLettersTestCase(SimpleTestCase):
+    """
+    format_custom_sentiments_for_letters() should format calculated custom sentiments with their names,
+    and return 0 for the ones that weren't calculated
+    """
+
+    @patch('letter_sentiment.custom_sentiment.format_sentiment', autospec=True)
+    def test_format_custom_sentiments_for_letters(self, mock_format_sentiment):
+        mock_format_sentiment.side_effect = lambda name, sentiment: '{} ({})'.format(name, sentiment)
+        custom_sentiment = CustomSentimentFactory.build(id=4, name='OMG Ponies!')
+
+        result = format_custom_sentiments_for_letters([1, 2], [4, 5], {4: custom_sentiment}, {4: {1: 0.5, 2: 0}})
+
+        self.assertEqual(result, {4: {1: 'OMG Ponies! (0.5)', 2: 'OMG Ponies! (0)'}, 5: {1: 0, 2: 0}},
+                         'format_custom_sentiments_for_letters() should return formatted custom sentiments, '
+                         "and 0 for the ones that weren't calculated")
 
 
 class GetAnalyzedCustomSentimentTermsTestCase(TestCase):
@@ -68,7 +170,9 @@ class GetCustomSentimentForLetterTestCase(TestCase):
                                              mock_calculate_custom_sentiment,
                                              mock_get_custom_sentiment):
         custom_sentiment_name = 'OMG Ponies!'
-        letter_id = 3
+        letter_id = LetterFactory().pk
+        # The letter has been indexed, so it isn't waiting in the outbox anymore
+        IndexOutboxEntry.objects.all().delete()
 
         # If no CustomSentiment found with custom_sentiment_id (get_custom_sentiment() returns None),
         # get_custom_sentiment_for_letter() should return 0
@@ -110,46 +214,65 @@ class GetCustomSentimentForLetterTestCase(TestCase):
         self.assertEqual(custom_sentiment_for_letter, mock_format_sentiment.return_value,
                          'get_custom_sentiment_for_letter() should return the value of format_sentiment()')
 
+        # The calculated score should be stored, and the stored score used after that
+        self.assertEqual(CustomSentimentScore.objects.get(custom_sentiment=custom_sentiment, letter_id=letter_id).score,
+                         mock_calculate_custom_sentiment.return_value,
+                         'get_custom_sentiment_for_letter() should store the score it calculated')
+        CustomSentimentScore.objects.filter(letter_id=letter_id).update(score=0.75)
+        mock_calculate_custom_sentiment.reset_mock()
+        get_custom_sentiment_for_letter(letter_id=letter_id, custom_sentiment_id=custom_sentiment.id)
+        self.assertEqual(mock_calculate_custom_sentiment.call_count, 0,
+                         "get_custom_sentiment_for_letter() shouldn't calculate a score that's stored")
+        args, kwargs = mock_format_sentiment.call_args
+        self.assertEqual(args, (custom_sentiment_name, 0.75),
+                         'get_custom_sentiment_for_letter() should return the stored score, like search results')
+
+        # The score of a letter that's waiting to be indexed shouldn't be stored
+        CustomSentimentScore.objects.all().delete()
+        IndexOutboxEntry.queue_letters([letter_id])
+        get_custom_sentiment_for_letter(letter_id=letter_id, custom_sentiment_id=custom_sentiment.id)
+        self.assertFalse(CustomSentimentScore.objects.exists(),
+                         "get_custom_sentiment_for_letter() shouldn't store the score of a letter in the index outbox")
+
 
 class GetCustomSentimentForTextTestCase(SimpleTestCase):
     """
-    get_custom_sentiment_for_text() should temporarily index text as contents of letter,
-    calculate custom sentiment for that letter, and return the sentiment
+    get_custom_sentiment_for_text() should score text for the custom sentiment in this process
+    and return the formatted sentiment, or 0 if the custom sentiment doesn't exist or has no terms
     """
 
-    @patch('letter_sentiment.custom_sentiment.index_temp_document', autospec=True)
-    @patch('letter_sentiment.custom_sentiment.get_custom_sentiment_for_letter', autospec=True)
-    @patch('letter_sentiment.custom_sentiment.delete_temp_document', autospec=True)
-    def test_get_custom_sentiment_for_text(self, mock_delete_temp_document,
-                                           mock_get_custom_sentiment_for_letter,
-                                           mock_index_temp_document):
-        mock_get_custom_sentiment_for_letter.return_value = 0.3
-
+    @patch('letter_sentiment.custom_sentiment.get_custom_sentiment', autospec=True)
+    @patch('letter_sentiment.custom_sentiment.score_text_for_custom_sentiment', autospec=True, return_value=0.3)
+    @patch('letter_sentiment.custom_sentiment.format_sentiment', autospec=True, return_value='Sentiment (0.3)')
+    def test_get_custom_sentiment_for_text(self, mock_format_sentiment, mock_score_text_for_custom_sentiment,
+                                           mock_get_custom_sentiment):
         text = 'Shopping you know is very dangerous'
-        custom_sentiment_id = 1
-
-        sentiment = get_custom_sentiment_for_text(text=text, custom_sentiment_id=custom_sentiment_id)
+        custom_sentiment = mock_get_custom_sentiment.return_value
+        custom_sentiment.name = 'Sentiment'
 
-        # index_temp_document(text) should be called
-        args, kwargs = mock_index_temp_document.call_args
-        self.assertEqual(args[0], text,
-                         'get_custom_sentiment_for_text() should call index_temp_document(text)')
+        sentiment = get_custom_sentiment_for_text(text=text, custom_sentiment_id=1)
 
-        # get_custom_sentiment_for_letter('temp', custom_sentiment_id) should be called
-        args, kwargs = mock_get_custom_sentiment_for_letter.call_args
-        self.assertEqual(args, ('temp', custom_sentiment_id),
-                         'get_custom_sentiment_for_text() should call get_custom_sentiment_for_letter(text, id)')
-
-        # delete_temp_document() should be called
-        self.assertEqual(mock_delete_temp_document.call_count, 1,
-                         'get_custom_sentiment_for_text() should call delete_temp_document()')
-
-        # get_custom_sentiment_for_text() should return the sentiment that was returned
-        # from get_custom_sentiment_for_letter()
-        self.assertEqual(
-            sentiment, mock_get_custom_sentiment_for_letter.return_value,
-            'get_custom_sentiment_for_text() should return sentiment from get_custom_sentiment_for_letter()'
-        )
+        args, kwargs = mock_score_text_for_custom_sentiment.call_args
+        self.assertEqual(args, (text, custom_sentiment),
+                         'get_custom_sentiment_for_text() should call score_text_for_custom_sentiment()')
+        args, kwargs = mock_format_sentiment.call_args
+        self.assertEqual(args, ('Sentiment', 0.3),
+                         'get_custom_sentiment_for_text() should format sentiment with name of custom sentiment')
+        self.assertEqual(sentiment, mock_format_sentiment.return_value,
+                         'get_custom_sentiment_for_text() should return formatted sentiment')
+
+        # If custom sentiment has no terms, 0 should be returned without scoring text
+        mock_score_text_for_custom_sentiment.reset_mock()
+        custom_sentiment.get_terms.return_value = []
+        self.assertEqual(get_custom_sentiment_for_text(text=text, custom_sentiment_id=1), 0,
+                         "get_custom_sentiment_for_text() should return 0 if custom sentiment has no terms")
+        self.assertEqual(mock_score_text_for_custom_sentiment.call_count, 0,
+                         "get_custom_sentiment_for_text() shouldn't score text if custom sentiment has no terms")
+
+        # If custom sentiment doesn't exist, 0 should be returned
+        mock_get_custom_sentiment.return_value = None
+        self.assertEqual(get_custom_sentiment_for_text(text=text, custom_sentiment_id=1), 0,
+                         "get_custom_sentiment_for_text() should return 0 if custom sentiment doesn't exist")
 
 
 class GetCustomSentimentNameTestCase(TestCase):
@@ -186,6 +309,131 @@ class GetCustomSentimentsTestCase(TestCase):
         self.assertEqual(set(get_custom_sentiments()), set([hipster_sentiment, pony_sentiment]))
 
 
+class GetCustomSentimentsForLettersTestCase(TestCase):
+    """
+    get_custom_sentiments_for_letters(letter_ids, custom_sentiment_ids) should return calculated custom sentiments
+    by custom sentiment id and letter id, calculated in one batch
+    """
+
+    @patch('letter_sentiment.custom_sentiment.calculate_custom_sentiments', autospec=True)
+    @patch('letter_sentiment.custom_sentiment.format_sentiment', autospec=True)
+    def test_get_custom_sentiments_for_letters(self, mock_format_sentiment, mock_calculate_custom_sentiments):
+        mock_format_sentiment.side_effect = lambda name, sentiment: '{} ({})'.format(name, sentiment)
+
+        custom_sentiment = CustomSentimentFactory(name='OMG Ponies!')
+        TermFactory(text='pony', custom_sentiment=custom_sentiment)
+        custom_sentiment_without_terms = CustomSentimentFactory(name='Nothing')
+        mock_calculate_custom_sentiments.return_value = {custom_sentiment.id: {1: 0.5, 2: 0}}
+
+        result = get_custom_sentiments_for_letters(
+            [1, 2], [custom_sentiment.id, custom_sentiment_without_terms.id, 0]
+        )
+
+        # calculate_custom_sentiments() should only get called for custom sentiments with terms
+        self.assertEqual(mock_calculate_custom_sentiments.call_count, 1,
+                         'get_custom_sentiments_for_letters() should call calculate_custom_sentiments() once')
+        args, kwargs = mock_calculate_custom_sentiments.call_args
+        self.assertEqual(
+            args, ([1, 2], [custom_sentiment.id]),
+            'get_custom_sentiments_for_letters() should call calculate_custom_sentiments() for sentiments with terms'
+        )
+
+        # Custom sentiments with terms should get formatted, and the rest should be 0
+        self.assertEqual(
+            result,
+            {custom_sentiment.id: {1: 'OMG Ponies! (0.5)', 2: 'OMG Ponies! (0)'},
+             custom_sentiment_without_terms.id: {1: 0, 2: 0},
+             0: {1: 0, 2: 0}},
+            'get_custom_sentiments_for_letters() should return formatted custom sentiments by id and letter id'
+        )
+
+        # Stored custom sentiments shouldn't get calculated again
+        letter = LetterFactory()
+        CustomSentimentScore.objects.create(custom_sentiment=custom_sentiment, letter=letter, score=0.75)
+        mock_calculate_custom_sentiments.reset_mock()
+        mock_calculate_custom_sentiments.return_value = {custom_sentiment.id: {1: 0.5}}
+        result = get_custom_sentiments_for_letters([letter.pk, 1], [custom_sentiment.id])
+        args, kwargs = mock_calculate_custom_sentiments.call_args
+        self.assertEqual(args, ([1], [custom_sentiment.id]),
+                         'get_custom_sentiments_for_letters() should only calculate custom sentiments not stored')
+        self.assertEqual(result, {custom_sentiment.id: {letter.pk: 'OMG Ponies! (0.75)', 1: 'OMG Ponies! (0.5)'}},
+                         'get_custom_sentiments_for_letters() should return stored and calculated custom sentiments')
+
+        # If no letter ids, calculate_custom_sentiments() shouldn't get called
+        mock_calculate_custom_sentiments.reset_mock()
+        self.assertEqual(get_custom_sentiments_for_letters([], [custom_sentiment.id]), {custom_sentiment.id: {}},
+                         'get_custom_sentiments_for_letters() should return empty results if no letter ids')
+        self.assertEqual(mock_calculate_custom_sentiments.call_count, 0,
+                         "get_custom_sentiments_for_letters() shouldn't call calculate_custom_sentiments() if no ids")
+
+
+class GetCustomSentimentsToCalculateTestCase(TestCase):
+    """
+    get_custom_sentiments_to_calculate(custom_sentiment_ids) should return custom sentiments by id,
+    and ids of the ones that have terms
+    """
+
+    def test_get_custom_sentiments_to_calculate(self):
+        custom_sentiment = CustomSentimentFactory(name='OMG Ponies!')
+        TermFactory(text='pony', custom_sentiment=custom_sentiment)
+        custom_sentiment_without_terms = CustomSentimentFactory(name='Nothing')
+
+        custom_sentiments, ids_to_calculate = get_custom_sentiments_to_calculate(
+            [custom_sentiment.id, custom_sentiment_without_terms.id, 0]
+        )
+
+        self.assertEqual(custom_sentiments,
+                         {custom_sentiment.id: custom_sentiment,
+                          custom_sentiment_without_terms.id: custom_sentiment_without_terms},
+                         'get_custom_sentiments_to_calculate() should return existing custom sentiments by id')
+        self.assertEqual(ids_to_calculate, [custom_sentiment.id],
+                         'get_custom_sentiments_to_calculate() should return ids of custom sentiments with terms')
+
+
+class GetHighlightSpansTestCase(SimpleTestCase):
+    """
+    get_highlight_spans(terms_to_place) should return spans to highlight in order of position,
+    with overlapping ones ending before the next one
+    """
+
+    def test_get_highlight_spans(self):
+        terms_to_place = {2: (13, 18, 1), 0: (0, 12, 2), 1: (5, 18, 1)}
+
+        self.assertEqual(get_highlight_spans(terms_to_place), [(0, 4, 2), (5, 12, 1), (13, 18, 1)],
+                         'get_highlight_spans() should return spans in order, ending before the next one')
+        self.assertEqual(get_highlight_spans({}), [], 'get_highlight_spans() should return empty list if no terms')
+
+
+class GetStoredCustomSentimentsTestCase(TestCase):
+    """
+    get_stored_custom_sentiments(letter_ids, custom_sentiment_ids) should return stored custom sentiments
+    by custom sentiment id and letter id, and ids of the letters and custom sentiments that aren't stored
+    """
+
+    def test_get_stored_custom_sentiments(self):
+        custom_sentiment = CustomSentimentFactory(name='OMG Ponies!')
+        other_custom_sentiment = CustomSentimentFactory(name='Nothing')
+        letters = [LetterFactory() for _ in range(2)]
+        letter_ids = [letter.pk for letter in letters]
+        CustomSentimentScore.objects.create(custom_sentiment=custom_sentiment, letter=letters[0], score=0.5)
+        CustomSentimentScore.objects.create(custom_sentiment=custom_sentiment, letter=letters[1], score=0)
+        CustomSentimentScore.objects.create(custom_sentiment=other_custom_sentiment, letter=letters[1], score=0.25)
+
+        sentiments, missing_letter_ids, missing_sentiment_ids = get_stored_custom_sentiments(
+            letter_ids, [custom_sentiment.id, other_custom_sentiment.id])
+
+        self.assertEqual(sentiments, {custom_sentiment.id: {letter_ids[0]: 0.5, letter_ids[1]: 0},
+                                      other_custom_sentiment.id: {letter_ids[1]: 0.25}},
+                         'get_stored_custom_sentiments() should return stored custom sentiments by id and letter id')
+        self.assertEqual(missing_letter_ids, [letter_ids[0]],
+                         "get_stored_custom_sentiments() should return ids of letters that aren't stored")
+        self.assertEqual(missing_sentiment_ids, [other_custom_sentiment.id],
+                         "get_stored_custom_sentiments() should return ids of custom sentiments that aren't stored")
+
+        self.assertEqual(get_stored_custom_sentiments([], [custom_sentiment.id]), ({custom_sentiment.id: {}}, [], []),
+                         'get_stored_custom_sentiments() should return empty results if no letter ids')
+
+
 class GetTokenOffsetsTestCase(SimpleTestCase):
     """
     get_token_offsets() should extract 'start_offset', 'end_offset', and 'position'
@@ -370,6 +618,11 @@ class HighlightForCustomSentimentTestCase(TestCase):
         self.assertTrue('artisan' in highlighted_text, 'Overlapping terms should be highlighted separately')
         self.assertFalse('artisan pabst' in highlighted_text, "Overlapping terms shouldn't be highlighted together")
         self.assertTrue('pabst' in highlighted_text, 'Overlapping terms should be highlighted separately')
+        self.assertEqual(highlighted_text,
+                         '<span class="sentiment-highlight-normal">tofu</span> '
+                         '<span class="sentiment-highlight-normal">artisan</span> '
+                         '<span class="sentiment-highlight-normal">pabst</span>',
+                         'Overlapping terms should be highlighted up to the start of the next one')
 
 
 class SortTermsByNumberOfWordsTestCase(TestCase):
@@ -3,14 +3,51 @@ from unittest.mock import patch
 
 from django.test import SimpleTestCase, TestCase
 
-from letters import es_settings
+from letters.index_outbox import flush_index_outbox
 from letters.models import Letter
 from letters.tests.factories import LetterFactory
-from letter_sentiment.elasticsearch import calculate_custom_sentiment, get_custom_sentiment_query, \
-    get_sentiment_function_score_query, get_sentiment_match_query
+from letter_sentiment.elasticsearch import async_calculate_custom_sentiments, calculate_custom_sentiment, \
+    calculate_custom_sentiments, get_custom_sentiment_query, get_custom_sentiment_query_for_letters, \
+    get_custom_sentiment_searches, get_custom_sentiments_from_responses, get_sentiment_function_score_query, \
+    get_sentiment_match_query
 from letter_sentiment.tests.factories import CustomSentimentFactory, TermFactory
 
 
+class AsyncCalculateCustomSentimentsTestCase(SimpleTestCase):
+    """
+    async_calculate_custom_sentiments() should do one async Elasticsearch multi search, with one search
+    per custom sentiment over all the letters, and return the scores by sentiment id and letter id
+    """
+
+    @patch('letters.models.Letter._meta.es_index_name', 'letterpress_test')
+    @patch('letter_sentiment.elasticsearch.get_custom_sentiment_query_for_letters', autospec=True)
+    @patch('letter_sentiment.elasticsearch.async_do_es_msearch', autospec=True)
+    async def test_async_calculate_custom_sentiments(self, mock_async_do_es_msearch,
+                                                     mock_get_custom_sentiment_query_for_letters):
+        mock_get_custom_sentiment_query_for_letters.side_effect = lambda letter_ids, sentiment_id: sentiment_id
+        mock_async_do_es_msearch.return_value = [
+            {'hits': {'hits': [{'_id': '2', '_score': 0.5}]}},
+            {'hits': {'hits': [{'_id': '1', '_score': 0.75}]}}
+        ]
+
+        result = await async_calculate_custom_sentiments([1, 2], [4, 5])
+
+        args, kwargs = mock_async_do_es_msearch.call_args
+        self.assertEqual(kwargs['index'], Letter._meta.es_index_name,
+                         'async_calculate_custom_sentiments() should call async_do_es_msearch() with index as kwarg')
+        self.assertEqual([search['query'] for search in kwargs['searches']], [4, 5],
+                         'async_calculate_custom_sentiments() should do one search per custom sentiment')
+        self.assertEqual(result, {4: {1: 0, 2: 0.5}, 5: {1: 0.75, 2: 0}},
+                         'async_calculate_custom_sentiments() should return scores by sentiment id and letter id')
+
+        # If no letter ids, async_do_es_msearch() shouldn't be called
+        mock_async_do_es_msearch.reset_mock()
+        self.assertEqual(await async_calculate_custom_sentiments([], [4]), {4: {}},
+                         'async_calculate_custom_sentiments() should return empty scores if no letter ids')
+        self.assertEqual(mock_async_do_es_msearch.call_count, 0,
+                         "async_calculate_custom_sentiments() shouldn't search if nothing to calculate")
+
+
 class CalculateCustomSentimentTestCase(TestCase):
     """
     calculate_custom_sentiment() should retrieve a custom sentiment query,
@@ -66,17 +103,56 @@ class CalculateCustomSentimentTestCase(TestCase):
 
         letter = LetterFactory(date=ApproximateDate(1970, 1, 1),
                                body='Look at the horse. Look at the pony.')
-
-        # Make sure there's not already an indexed document with the same Id
-        # because it might not have gotten cleaned up properly after a previous test
-        if es_settings.ES_CLIENT.exists(index=[Letter._meta.es_index_name],
-                                        id=letter.pk):
-            letter.delete_from_elasticsearch(pk=letter.pk)
-        letter.create_or_update_in_elasticsearch(is_new=None)
+        # Index the letter, replacing any document with the same id that didn't get cleaned up after a previous test
+        flush_index_outbox(refresh='true')
 
         calculate_custom_sentiment(letter_id=letter.id, sentiment_id=sentiment.id)
 
-        letter.delete_from_elasticsearch(pk=letter.pk)
+        letter.delete()
+        flush_index_outbox(refresh='true')
+
+
+class CalculateCustomSentimentsTestCase(SimpleTestCase):
+    """
+    calculate_custom_sentiments() should do one Elasticsearch multi search, with one search per custom sentiment
+    over all the letters, and return the scores by sentiment id and letter id
+    """
+
+    @patch('letters.models.Letter._meta.es_index_name', 'letterpress_test')
+    @patch('letter_sentiment.elasticsearch.get_custom_sentiment_query_for_letters', autospec=True)
+    @patch('letter_sentiment.elasticsearch.do_es_msearch', autospec=True)
+    def test_calculate_custom_sentiments(self, mock_do_es_msearch, mock_get_custom_sentiment_query_for_letters):
+        mock_get_custom_sentiment_query_for_letters.side_effect = lambda letter_ids, sentiment_id: sentiment_id
+        mock_do_es_msearch.return_value = [
+            {'hits': {'hits': [{'_id': '2', '_score': 0.5}, {'_id': '1', '_score': 0.25}]}},
+            {'hits': {'hits': [{'_id': '3', '_score': 0.75}]}}
+        ]
+
+        result = calculate_custom_sentiments([1, 2, 3], [4, 5])
+
+        self.assertEqual(mock_do_es_msearch.call_count, 1,
+                         'calculate_custom_sentiments() should call do_es_msearch() once')
+        args, kwargs = mock_do_es_msearch.call_args
+        self.assertEqual(kwargs['index'], Letter._meta.es_index_name,
+                         'calculate_custom_sentiments() should call do_es_msearch() with index as kwarg')
+        self.assertEqual([search['query'] for search in kwargs['searches']], [4, 5],
+                         'calculate_custom_sentiments() should do one search per custom sentiment')
+        for search in kwargs['searches']:
+            self.assertEqual(search['size'], 3,
+                             'calculate_custom_sentiments() searches should have size big enough for all letters')
+
+        # Scores should be returned by sentiment id and letter id, and letters without hits should get 0
+        self.assertEqual(result, {4: {1: 0.25, 2: 0.5, 3: 0}, 5: {1: 0, 2: 0, 3: 0.75}},
+                         'calculate_custom_sentiments() should return scores by sentiment id and letter id')
+
+        # If no letter ids or no sentiment ids, do_es_msearch() shouldn't be called
+        mock_do_es_msearch.reset_mock()
+        self.assertEqual(calculate_custom_sentiments([], [4]), {4: {}},
+                         'calculate_custom_sentiments() should return empty scores if no letter ids')
+        self.assertEqual(calculate_custom_sentiments([1], []), {},
+                         'calculate_custom_sentiments() should return {} if no sentiment ids')
+        self.assertEqual(mock_do_es_msearch.call_count, 0,
+                         "calculate_custom_sentiments() shouldn't call do_es_msearch() if nothing to calculate")
 
 
 class GetCustomSentimentQuery(SimpleTestCase):
@@ -103,6 +179,57 @@ class GetCustomSentimentQuery(SimpleTestCase):
             self.assertIn(key, query.keys(), 'get_custom_sentiment_query() should return query with key {}'.format(key))
 
 
+class GetCustomSentimentQueryForLetters(SimpleTestCase):
+    """
+    Should get the query with all the custom sentiment terms in it, filtered by all the given letter ids
+    """
+
+    @patch('letter_sentiment.elasticsearch.get_sentiment_match_query', autospec=True, return_value=['match', None])
+    def test_get_custom_sentiment_query_for_letters(self, mock_get_sentiment_match_query):
+        query = get_custom_sentiment_query_for_letters(letter_ids=[1, 2], sentiment_id=3)
+
+        args, kwargs = mock_get_sentiment_match_query.call_args
+        self.assertEqual(args[0], 3,
+                         'get_custom_sentiment_query_for_letters() should call get_sentiment_match_query(sentiment_id)')
+
+        bool_query = query['function_score']['query']['bool']
+        self.assertEqual(bool_query['must'], {'terms': {'_id': ['1', '2']}},
+                         'get_custom_sentiment_query_for_letters() should filter by all letter ids')
+        self.assertEqual(bool_query['should'], ['match'],
+                         'get_custom_sentiment_query_for_letters() should leave out empty match conditions')
+
+
+class GetCustomSentimentSearches(SimpleTestCase):
+    """
+    get_custom_sentiment_searches(letter_ids, sentiment_ids) should return one search per custom sentiment
+    """
+
+    @patch('letter_sentiment.elasticsearch.get_custom_sentiment_query_for_letters', autospec=True)
+    def test_get_custom_sentiment_searches(self, mock_get_custom_sentiment_query_for_letters):
+        mock_get_custom_sentiment_query_for_letters.side_effect = lambda letter_ids, sentiment_id: sentiment_id
+
+        searches = get_custom_sentiment_searches([1, 2, 3], [4, 5])
+
+        self.assertEqual(searches, [{'query': 4, 'size': 3, 'stored_fields': ['contents.word_count']},
+                                    {'query': 5, 'size': 3, 'stored_fields': ['contents.word_count']}],
+                         'get_custom_sentiment_searches() should return search for each custom sentiment, '
+                         'with size big enough for all letters')
+
+
+class GetCustomSentimentsFromResponses(SimpleTestCase):
+    """
+    get_custom_sentiments_from_responses(letter_ids, sentiment_ids, responses) should return scores
+    by sentiment id and letter id, with 0 for letters that aren't in the hits
+    """
+
+    def test_get_custom_sentiments_from_responses(self):
+        responses = [{'hits': {'hits': [{'_id': '2', '_score': 0.5}, {'_id': 'temp', '_score': 1}]}}, {}]
+
+        self.assertEqual(get_custom_sentiments_from_responses([1, 2], [4, 5], responses),
+                         {4: {1: 0, 2: 0.5}, 5: {1: 0, 2: 0}},
+                         'get_custom_sentiments_from_responses() should return scores by sentiment id and letter id')
+
+
 class GetSentimentFunctionScoreQuery(SimpleTestCase):
     """
     Should return dict with 'query' and 'script_score'
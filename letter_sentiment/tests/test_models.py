@@ -2,8 +2,9 @@ from unittest.mock import patch
 
 from django.test import TestCase
 
-from letter_sentiment.models import analyze_text, Term
+from letter_sentiment.models import analyze_text, CustomSentimentScore, Term
 from letter_sentiment.tests.factories import CustomSentimentFactory, TermFactory
+from letters.tests.factories import LetterFactory
 
 
 class CustomSentimentTestCase(TestCase):
@@ -34,6 +35,47 @@ class CustomSentimentTestCase(TestCase):
         self.assertEqual(set(custom_sentiment.get_terms()), set([dreamcatcher_term, taxidermy_term]),
                          "get_terms() should return CustomSentiment's terms")
 
+    @patch('letter_sentiment.models.bump_corpus_generation', autospec=True)
+    def test_save_and_delete(self, mock_bump_corpus_generation):
+        """
+        CustomSentiment.save() and CustomSentiment.delete() should call bump_corpus_generation(),
+        because search results contain custom sentiments
+        """
+
+        custom_sentiment = CustomSentimentFactory(name='Hipster')
+        self.assertEqual(mock_bump_corpus_generation.call_count, 1,
+                         'CustomSentiment.save() should call bump_corpus_generation()')
+
+        custom_sentiment.delete()
+        self.assertEqual(mock_bump_corpus_generation.call_count, 2,
+                         'CustomSentiment.delete() should call bump_corpus_generation()')
+
+    def test_save_deletes_scores(self):
+        """
+        CustomSentiment.save() should delete its stored scores, because max_weight might have changed
+        """
+
+        custom_sentiment = CustomSentimentFactory(name='Hipster')
+        CustomSentimentScore.objects.create(custom_sentiment=custom_sentiment, letter=LetterFactory(), score=0.5)
+
+        custom_sentiment.max_weight = 2
+        custom_sentiment.save()
+        self.assertFalse(custom_sentiment.scores.exists(), 'CustomSentiment.save() should delete its stored scores')
+
+
+class CustomSentimentScoreTestCase(TestCase):
+    """
+    Test CustomSentimentScore model
+    """
+
+    def test__str__(self):
+        """
+        __str__() should return name of custom sentiment and score
+        """
+
+        score = CustomSentimentScore(custom_sentiment=CustomSentimentFactory(name='Hipster'), score=0.5)
+        self.assertEqual(str(score), 'Hipster: 0.5', '__str__() should return name of custom sentiment and score')
+
 
 class TermTestCase(TestCase):
     """
@@ -81,6 +123,48 @@ class TermTestCase(TestCase):
         self.assertEqual(mock_analyze_text.call_count, 1,
                          'If Term.text has changed, it should be analyzed again')
 
+    @patch('letter_sentiment.models.analyze_text', autospec=True, return_value='analyzed')
+    @patch('letter_sentiment.models.bump_corpus_generation', autospec=True)
+    def test_save_and_delete_bump_corpus_generation(self, mock_bump_corpus_generation, mock_analyze_text):
+        """
+        Term.save() and Term.delete() should call bump_corpus_generation(),
+        because custom sentiments in search results depend on terms
+        """
+
+        term = Term.objects.create(text='gluten-free pabst', custom_sentiment=CustomSentimentFactory())
+        mock_bump_corpus_generation.reset_mock()
+
+        term.save()
+        self.assertEqual(mock_bump_corpus_generation.call_count, 1, 'Term.save() should call bump_corpus_generation()')
+
+        term.delete()
+        self.assertEqual(mock_bump_corpus_generation.call_count, 2,
+                         'Term.delete() should call bump_corpus_generation()')
+
+    @patch('letter_sentiment.models.analyze_text', autospec=True, return_value='analyzed')
+    def test_save_and_delete_delete_scores(self, mock_analyze_text):
+        """
+        Term.save() and Term.delete() should delete the stored scores of the term's custom sentiment
+        """
+
+        custom_sentiment = CustomSentimentFactory()
+        other_custom_sentiment = CustomSentimentFactory()
+        letter = LetterFactory()
+        term = Term.objects.create(text='gluten-free pabst', custom_sentiment=custom_sentiment)
+
+        for sentiment in [custom_sentiment, other_custom_sentiment]:
+            CustomSentimentScore.objects.create(custom_sentiment=sentiment, letter=letter, score=0.5)
+        term.save()
+        self.assertFalse(custom_sentiment.scores.exists(),
+                         "Term.save() should delete the stored scores of the term's custom sentiment")
+        self.assertTrue(other_custom_sentiment.scores.exists(),
+                        "Term.save() shouldn't delete the stored scores of other custom sentiments")
+
+        CustomSentimentScore.objects.create(custom_sentiment=custom_sentiment, letter=letter, score=0.5)
+        term.delete()
+        self.assertFalse(custom_sentiment.scores.exists(),
+                         "Term.delete() should delete the stored scores of the term's custom sentiment")
+
     @patch('letter_sentiment.models.analyze_term', autospec=True)
     def test_analyze_text(self, mock_analyze_term):
         """
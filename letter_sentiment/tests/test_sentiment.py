@@ -1,10 +1,69 @@
-from unittest.mock import patch
+from unittest.mock import Mock, PropertyMock, patch
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer as vaderSentiment
 
 from django.test import SimpleTestCase
 
-from letter_sentiment.sentiment import do_sentiment_highlight, format_sentiment, get_sentiment, get_textblob_polarity, \
-    get_vadersentiment_polarity, highlight_text_for_sentiment, sentiment_to_string
+from letter_sentiment.sentiment import Polarity, TextAnalysis, analyze_text, do_sentiment_highlight, \
+    format_sentiment, format_standard_sentiment, get_sentiment, get_sentiment_and_highlights, get_textblob_polarity, \
+    get_vader_analyzer, get_vadersentiment_polarity, highlight_text_analysis, highlight_text_for_sentiment, \
+    polarity_many, sentiment_to_string
+
+
+class AnalyzeTextTestCase(SimpleTestCase):
+    """
+    analyze_text() should split text into sentences once and get the polarity of each sentence,
+    and of the whole text, with one call to get_polarities
+    """
+
+    def setUp(self):
+        self.sentences = ['Squid pok pok!', 'Tofu synth gastropub.']
+        self.text = ' '.join(self.sentences)
+
+    @patch('letter_sentiment.sentiment.polarity_many', autospec=True)
+    @patch('letter_sentiment.sentiment.TextBlob', autospec=True)
+    def test_analyze_text(self, mock_textblob, mock_polarity_many):
+        mock_textblob.return_value.sentences = [Mock(string=sentence) for sentence in self.sentences]
+        polarities = [Polarity(0.5, 0.6), Polarity(-0.5, -0.6), Polarity(0.1, 0.2)]
+        mock_polarity_many.return_value = polarities
+
+        result = analyze_text(self.text)
+
+        self.assertEqual(mock_textblob.call_count, 1, 'analyze_text() should split text into sentences once')
+        self.assertEqual(mock_polarity_many.call_count, 1, 'analyze_text() should call polarity_many() once')
+        args, kwargs = mock_polarity_many.call_args
+        self.assertEqual(args[0], self.sentences + [self.text],
+                         'analyze_text() should get the polarity of each sentence and of the whole text')
+        self.assertEqual(result, TextAnalysis(self.sentences, polarities[:2], polarities[2]),
+                         'analyze_text() should return sentences, their polarities and the polarity of the text')
+
+        # If whole_text is False, only the sentences should be analyzed
+        mock_polarity_many.return_value = polarities[:2]
+        result = analyze_text(self.text, whole_text=False)
+        args, kwargs = mock_polarity_many.call_args
+        self.assertEqual(args[0], self.sentences,
+                         'analyze_text() should only get the polarity of each sentence if whole_text is False')
+        self.assertEqual(result, TextAnalysis(self.sentences, polarities[:2], None),
+                         'analyze_text() should return no polarity for the text if whole_text is False')
+
+        # get_polarities should be used instead of polarity_many() if it's given
+        mock_polarity_many.reset_mock()
+        get_polarities = Mock(return_value=polarities)
+        analyze_text(self.text, get_polarities)
+        self.assertEqual(get_polarities.call_count, 1, 'analyze_text() should call get_polarities if given')
+        self.assertEqual(mock_polarity_many.call_count, 0,
+                         "analyze_text() shouldn't call polarity_many() if get_polarities is given")
+
+    @patch('letter_sentiment.sentiment.TextBlob.sentences', new_callable=PropertyMock)
+    def test_analyze_text_same_as_get_sentiment(self, mock_sentences):
+        """
+        The polarity of the whole text should be the same as what get_sentiment() calculates
+        """
+
+        mock_sentences.return_value = [Mock(string=sentence) for sentence in self.sentences]
+        analysis = analyze_text(self.text)
+
+        self.assertEqual(format_standard_sentiment(*analysis.polarity), get_sentiment(self.text),
+                         'analyze_text() should calculate the same polarity of the whole text as get_sentiment()')
 
 
 class DoSentimentHighlight(SimpleTestCase):
@@ -67,6 +126,24 @@ class FormatSentimentTestCase(SimpleTestCase):
                         'format_sentiment() should return string containing float-formatted polarity')
 
 
+class FormatStandardSentimentTestCase(SimpleTestCase):
+    """
+    format_standard_sentiment(textblob_polarity, vader_polarity) should return a list of formatted
+    TextBlob and vaderSentiment sentiments
+    """
+
+    def test_format_standard_sentiment(self):
+        self.assertEqual(format_standard_sentiment(-0.7, 0.3),
+                         ['TextBlob: negative (-0.700)', 'Vader: slightly positive (0.300)'],
+                         'format_standard_sentiment() should return list of formatted sentiments')
+
+        # Result should be the same as get_sentiment() for the same polarities
+        text = 'Tis difficult to sympathize with the bereft untill we are ourselves bereaved'
+        self.assertEqual(format_standard_sentiment(get_textblob_polarity(text), get_vadersentiment_polarity(text)),
+                         get_sentiment(text),
+                         'format_standard_sentiment() should return the same as get_sentiment() for same polarities')
+
+
 class GetSentimentTestCase(SimpleTestCase):
     """
     get_sentiment() should analyze sentiment of text_to_analyze with both vaderSentiment and TextBlob,
@@ -106,6 +183,34 @@ class GetSentimentTestCase(SimpleTestCase):
         self.assertTrue('Vader' in vader, "get_sentiment() should return value that contains ''Vader''")
 
 
+class GetSentimentAndHighlightsTestCase(SimpleTestCase):
+    """
+    get_sentiment_and_highlights() should return standard sentiment and highlights from one analysis of the text
+    """
+
+    @patch('letter_sentiment.sentiment.highlight_text_analysis', autospec=True)
+    @patch('letter_sentiment.sentiment.analyze_text', autospec=True)
+    def test_get_sentiment_and_highlights(self, mock_analyze_text, mock_highlight_text_analysis):
+        text = 'Kale chips humblebrag'
+        get_polarities = Mock()
+        mock_analyze_text.return_value = TextAnalysis([text], [Polarity(0.3, -0.3)], Polarity(0.3, -0.3))
+        mock_highlight_text_analysis.return_value = ['TextBlob highlight', 'vaderSentiment highlight']
+
+        sentiment, highlights = get_sentiment_and_highlights(text, get_polarities)
+
+        self.assertEqual(mock_analyze_text.call_count, 1,
+                         'get_sentiment_and_highlights() should call analyze_text() once')
+        args, kwargs = mock_analyze_text.call_args
+        self.assertEqual(args, (text, get_polarities),
+                         'get_sentiment_and_highlights() should call analyze_text() with text and get_polarities')
+        self.assertEqual(mock_highlight_text_analysis.call_args[0][0], mock_analyze_text.return_value,
+                         'get_sentiment_and_highlights() should highlight the result of analyze_text()')
+        self.assertEqual(sentiment, format_standard_sentiment(0.3, -0.3),
+                         'get_sentiment_and_highlights() should return sentiment of the whole text')
+        self.assertEqual(highlights, mock_highlight_text_analysis.return_value,
+                         'get_sentiment_and_highlights() should return highlights from highlight_text_analysis()')
+
+
 class GetTextblobPolarityTestCase(SimpleTestCase):
     """
     get_textblob_polarity() should analyze text with TextBlob and return the polarity
@@ -128,6 +233,18 @@ class GetTextblobPolarityTestCase(SimpleTestCase):
                              "get_textblob_polarity() should return polarity <>> 0 for 'This is awful'")
 
 
+class GetVaderAnalyzerTestCase(SimpleTestCase):
+    """
+    get_vader_analyzer() should return the same vaderSentiment analyzer every time
+    """
+
+    def test_get_vader_analyzer(self):
+        analyzer = get_vader_analyzer()
+
+        self.assertIsInstance(analyzer, vaderSentiment, 'get_vader_analyzer() should return a vaderSentiment analyzer')
+        self.assertIs(get_vader_analyzer(), analyzer, 'get_vader_analyzer() should only create one analyzer')
+
+
 class GetVadersentimentPolarityTestCase(SimpleTestCase):
     """
     get_vadersentiment_polarity() should get the positive and negative scores of the vaderSentiment analyzer
@@ -144,13 +261,36 @@ class GetVadersentimentPolarityTestCase(SimpleTestCase):
         self.assertAlmostEqual(result, -0.2)
 
 
+class HighlightTextAnalysisTestCase(SimpleTestCase):
+    """
+    highlight_text_analysis() should highlight each sentence of the analysis
+    for both TextBlob sentiment and vaderSentiment
+    """
+
+    def test_highlight_text_analysis(self):
+        sentences = ['Mixtape chia!', 'Fanny pack.']
+        polarities = [Polarity(0.6, -0.6), Polarity(0, 0.3)]
+        analysis = TextAnalysis(sentences, polarities, Polarity(0.3, -0.3))
+
+        result = highlight_text_analysis(analysis)
+
+        self.assertEqual(result, [
+            ''.join(do_sentiment_highlight(sentence, polarity.textblob) + ' '
+                    for sentence, polarity in zip(sentences, polarities)),
+            ''.join(do_sentiment_highlight(sentence, polarity.vader) + ' '
+                    for sentence, polarity in zip(sentences, polarities)),
+        ], 'highlight_text_analysis() should return sentences highlighted with TextBlob and vaderSentiment polarity')
+        self.assertEqual(highlight_text_analysis(TextAnalysis([], [], None)), ['', ''],
+                         'highlight_text_analysis() should return empty highlights if there are no sentences')
+
+
 class HighlightTextForSentimentTestCase(SimpleTestCase):
     """
     highlight_text_for_sentiment() should get highlights for both TextBlob sentiment and vaderSentiment
     """
-    @patch('letter_sentiment.sentiment.get_vadersentiment_polarity', autospec=True)
+    @patch('letter_sentiment.sentiment.polarity_many', autospec=True, return_value=[Polarity(0.3, -0.3)])
     @patch('letter_sentiment.sentiment.do_sentiment_highlight', autospec=True)
-    def test_highlight_text_for_sentiment(self, mock_do_sentiment_highlight, mock_get_vadersentiment_polarity):
+    def test_highlight_text_for_sentiment(self, mock_do_sentiment_highlight, mock_polarity_many):
         textblob_highlight = 'TextBlob sentiment highlight'
         vader_highlight = 'vaderSentiment highlight'
         mock_do_sentiment_highlight.side_effect = [textblob_highlight, vader_highlight]
@@ -160,8 +300,10 @@ class HighlightTextForSentimentTestCase(SimpleTestCase):
 
         result = highlight_text_for_sentiment(text)
 
-        args, kwargs = mock_get_vadersentiment_polarity.call_args
-        self.assertEqual(args[0], text, 'highlight_text_for_sentiment() should call get_vadersentiment_polarity()')
+        args, kwargs = mock_polarity_many.call_args
+        self.assertEqual(args[0], [text], 'highlight_text_for_sentiment() should call polarity_many() with sentences')
+        self.assertEqual([call[0][1] for call in mock_do_sentiment_highlight.call_args_list], [0.3, -0.3],
+                         'highlight_text_for_sentiment() should highlight with TextBlob and vaderSentiment polarity')
         self.assertEqual(mock_do_sentiment_highlight.call_count, 2,
                          'highlight_text_for_sentiment() should call do_sentiment_highlight() at least twice')
 
@@ -172,6 +314,21 @@ class HighlightTextForSentimentTestCase(SimpleTestCase):
                         'highlight_text_for_sentiment() should return text highlighted with vaderSentiment')
 
 
+class PolarityManyTestCase(SimpleTestCase):
+    """
+    polarity_many() should return the TextBlob and vaderSentiment polarity of each text
+    """
+
+    def test_polarity_many(self):
+        texts = ['This is terrific', 'This is awful', '']
+        result = polarity_many(texts)
+
+        self.assertEqual(result, [Polarity(get_textblob_polarity(text), get_vadersentiment_polarity(text))
+                                  for text in texts],
+                         'polarity_many() should return the same polarities as analyzing each text separately')
+        self.assertEqual(polarity_many([]), [], 'polarity_many() should return empty list if there are no texts')
+
+
 class SentimentToStringTestCase(SimpleTestCase):
     """
     sentiment_to_string(polarity) should return a string corresponding to polarity
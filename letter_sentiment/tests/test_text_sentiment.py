@@ -0,0 +1,122 @@
+import math
+from unittest.mock import Mock, patch
+
+from django.test import SimpleTestCase
+
+from letter_sentiment.models import Term
+from letter_sentiment.text_sentiment import count_term_matches, get_bm25_score, get_idf, get_lucene_field_length, \
+    get_term_matcher, get_tokens, normalize_custom_sentiment_score, score_text_for_custom_sentiment
+
+
+def get_termvector(tokens, doc_freqs, doc_count, sum_ttf):
+    """
+    Return a term vector like Elasticsearch returns for an artificial document with the given tokens
+    """
+
+    terms = {}
+    for position, token in enumerate(tokens):
+        terms.setdefault(token, {'doc_freq': doc_freqs.get(token, 0), 'term_freq': 0, 'tokens': []})
+        terms[token]['term_freq'] += 1
+        terms[token]['tokens'].append({'position': position})
+    return {'field_statistics': {'doc_count': doc_count, 'sum_ttf': sum_ttf}, 'terms': terms}
+
+
+class CountTermMatchesTestCase(SimpleTestCase):
+    """
+    count_term_matches(tokens, matcher) should return the number of times each term occurs in tokens
+    """
+
+    def test_count_term_matches(self):
+        terms = [Term(text='pony'), Term(text='pony pony'), Term(text='pony ride'), Term(text='unicorn')]
+        for term in terms:
+            term.analyzed_text = term.text
+        tokens = ['a', 'pony', 'pony', 'pony', 'ride', 'pony']
+
+        self.assertEqual(dict(count_term_matches(tokens, get_term_matcher(terms))), {0: 4, 1: 2, 2: 1},
+                         'count_term_matches() should count each occurrence of each term, including overlapping ones')
+        self.assertEqual(count_term_matches([], get_term_matcher(terms)), {},
+                         "count_term_matches() shouldn't count anything if there are no tokens")
+
+
+class GetLuceneFieldLengthTestCase(SimpleTestCase):
+    """
+    get_lucene_field_length(length) should return length the way Lucene stores it
+    """
+
+    def test_get_lucene_field_length(self):
+        for length in range(40):
+            self.assertEqual(get_lucene_field_length(length), length,
+                             'get_lucene_field_length() should return short lengths as they are')
+
+        self.assertEqual([get_lucene_field_length(length) for length in [41, 42, 43, 100, 1000]],
+                         [40, 42, 42, 96, 984],
+                         'get_lucene_field_length() should only keep the 4 most significant bits of longer lengths')
+
+
+class GetTokensTestCase(SimpleTestCase):
+    """
+    get_tokens(termvector) should return the tokens of the term vector in the order they're in the text
+    """
+
+    def test_get_tokens(self):
+        termvector = {'terms': {'b': {'tokens': [{'position': 1}, {'position': 3}]}, 'a': {'tokens': [{'position': 0}]},
+                                'c': {'tokens': [{'position': 2}]}}}
+
+        self.assertEqual(get_tokens(termvector), ['a', 'b', 'c', 'b'],
+                         'get_tokens() should return tokens in order of their positions')
+        self.assertEqual(get_tokens({}), [], 'get_tokens() should return empty list if term vector has no terms')
+
+
+class NormalizeCustomSentimentScoreTestCase(SimpleTestCase):
+    """
+    normalize_custom_sentiment_score(query_score, word_count) should return the same score as
+    the function_score query
+    """
+
+    def test_normalize_custom_sentiment_score(self):
+        factor = (math.log1p(10 * 0.5) / math.log1p(2)) * 20
+        self.assertEqual(normalize_custom_sentiment_score(3, 10), 3 * 3 / factor,
+                         'normalize_custom_sentiment_score() should return query score times the script score')
+        self.assertEqual(normalize_custom_sentiment_score(1, 10), 0,
+                         'normalize_custom_sentiment_score() should return 0 if no terms were found')
+        self.assertEqual(normalize_custom_sentiment_score(3, 0), 0,
+                         'normalize_custom_sentiment_score() should return 0 if there are no words')
+
+
+class ScoreTextForCustomSentimentTestCase(SimpleTestCase):
+    """
+    score_text_for_custom_sentiment(text, custom_sentiment) should return the custom sentiment of text,
+    scored the way Elasticsearch scores a letter, counting the text in the index statistics
+    """
+
+    def setUp(self):
+        self.terms = [Term(text='pony', weight=2), Term(text='pony ride', weight=1), Term(text='unicorn', weight=1)]
+        for term in self.terms:
+            term.analyzed_text = term.text
+        self.custom_sentiment = Mock(max_weight=2)
+        self.custom_sentiment.get_terms.return_value = self.terms
+
+    @patch('letter_sentiment.text_sentiment.get_custom_sentiment_termvector_for_text', autospec=True)
+    def test_score_text_for_custom_sentiment(self, mock_get_custom_sentiment_termvector_for_text):
+        tokens = ['i', 'want', 'a', 'pony', 'ride', 'on', 'a', 'pony']
+        mock_get_custom_sentiment_termvector_for_text.return_value = get_termvector(
+            tokens, doc_freqs={'pony': 3, 'ride': 9}, doc_count=99, sum_ttf=1192)
+
+        result = score_text_for_custom_sentiment('I want a pony ride on a pony', self.custom_sentiment)
+
+        # The text is counted as a document with 8 words, so there are 100 documents of 12 words on average
+        pony_score = get_bm25_score(2 * 1 / 2 * get_idf(100, 4), 2, 8, 12)
+        pony_ride_score = get_bm25_score(1 * 2 / 2 * (get_idf(100, 4) + get_idf(100, 10)), 1, 8, 12)
+        self.assertAlmostEqual(result, normalize_custom_sentiment_score(1 + pony_score + pony_ride_score, 8),
+                               msg='score_text_for_custom_sentiment() should return score of terms found in text')
+
+    @patch('letter_sentiment.text_sentiment.get_custom_sentiment_termvector_for_text', autospec=True)
+    def test_score_text_for_custom_sentiment_no_terms_found(self, mock_get_custom_sentiment_termvector_for_text):
+        mock_get_custom_sentiment_termvector_for_text.return_value = get_termvector(
+            ['no', 'ponies', 'here'], doc_freqs={}, doc_count=99, sum_ttf=1192)
+        self.assertEqual(score_text_for_custom_sentiment('No ponies here', self.custom_sentiment), 0,
+                         'score_text_for_custom_sentiment() should return 0 if no terms are found in text')
+
+        mock_get_custom_sentiment_termvector_for_text.return_value = {}
+        self.assertEqual(score_text_for_custom_sentiment('', self.custom_sentiment), 0,
+                         'score_text_for_custom_sentiment() should return 0 if text has no words')
@@ -0,0 +1,137 @@
+"""
+Custom sentiment of a piece of text that isn't a letter, calculated in this process the same way
+Elasticsearch scores letters with the function_score query in letter_sentiment.elasticsearch,
+so the text doesn't have to be indexed
+"""
+from collections import Counter
+import math
+
+from letter_sentiment.elasticsearch import get_term_boost
+from letters.elasticsearch import get_custom_sentiment_termvector_for_text
+
+# Parameters of the BM25 similarity that Elasticsearch uses by default
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Lucene stores the length of a field in one byte: lengths up to this are exact,
+# and longer ones only keep their 4 most significant bits
+LUCENE_EXACT_LENGTHS = 24
+
+
+def score_text_for_custom_sentiment(text, custom_sentiment):
+    """
+    Return the custom sentiment of text, as calculate_custom_sentiment() would if text were a letter in the index
+
+    The text gets analyzed by Elasticsearch, which also returns the statistics of the index
+    that the score depends on, and then the terms of the custom sentiment get matched and scored here
+    """
+
+    terms = [term for term in custom_sentiment.get_terms() if term.analyzed_text]
+    termvector = get_custom_sentiment_termvector_for_text(text) or {}
+    tokens = get_tokens(termvector)
+    if not terms or not tokens:
+        return 0
+
+    field_statistics = termvector.get('field_statistics', {})
+    # The text used to be indexed to score it, so it's counted in the statistics like a letter would be
+    doc_count = max(field_statistics.get('doc_count', 0), 0) + 1
+    average_length = (max(field_statistics.get('sum_ttf', 0), 0) + len(tokens)) / doc_count
+    doc_freqs = {token: max(values.get('doc_freq', 0), 0) + 1
+                 for token, values in termvector.get('terms', {}).items()}
+    length = get_lucene_field_length(len(tokens))
+
+    # A bool query's score is the sum of the scores of its matching clauses, and the query
+    # for the letter id always matches with a score of 1
+    query_score = 1
+    matcher = get_term_matcher(terms)
+    for term_index, freq in count_term_matches(tokens, matcher).items():
+        term = terms[term_index]
+        idf = sum(get_idf(doc_count, doc_freqs.get(token, 1)) for token in term.analyzed_text.split(' '))
+        query_score += get_bm25_score(get_term_boost(term, custom_sentiment.max_weight) * idf, freq,
+                                      length, average_length)
+
+    return normalize_custom_sentiment_score(query_score, len(tokens))
+
+
+def get_tokens(termvector):
+    """
+    Return the tokens of the term vector in the order they're in the text
+    """
+
+    positions = {}
+    for token, values in termvector.get('terms', {}).items():
+        for token_info in values.get('tokens', []):
+            positions[token_info.get('position', 0)] = token
+    return [positions[position] for position in sorted(positions)]
+
+
+def get_term_matcher(terms):
+    """
+    Return a trie of the analyzed words of the terms, so all the terms can be found in one pass through the tokens
+
+    Each node is a dict of the next words, and the indexes of the terms that end at a node
+    are stored under None
+    """
+
+    matcher = {}
+    for term_index, term in enumerate(terms):
+        node = matcher
+        for word in term.analyzed_text.split(' '):
+            node = node.setdefault(word, {})
+        node.setdefault(None, []).append(term_index)
+    return matcher
+
+
+def count_term_matches(tokens, matcher):
+    """
+    Return the number of times each term occurs as a phrase in tokens, by term index,
+    counting overlapping occurrences the way a match_phrase query does
+    """
+
+    counts = Counter()
+    for start in range(len(tokens)):
+        node = matcher
+        for token in tokens[start:]:
+            node = node.get(token)
+            if node is None:
+                break
+            for term_index in node.get(None, []):
+                counts[term_index] += 1
+    return counts
+
+
+def get_idf(doc_count, doc_freq):
+    return math.log(1 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+
+
+def get_bm25_score(weight, freq, length, average_length):
+    return weight * freq / (freq + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length))
+
+
+def get_lucene_field_length(length):
+    """
+    Return length the way Lucene stores it with a field, which is what BM25 uses instead of the actual length
+    """
+
+    if length < LUCENE_EXACT_LENGTHS:
+        return length
+    length -= LUCENE_EXACT_LENGTHS
+    shift = length.bit_length() - 4
+    if shift < 0:
+        # Lengths with fewer than 4 bits are stored exactly
+        return LUCENE_EXACT_LENGTHS + length
+    return LUCENE_EXACT_LENGTHS + ((length >> shift) << shift)
+
+
+def normalize_custom_sentiment_score(query_score, word_count):
+    """
+    Return the same score as the script in get_sentiment_function_score_query(),
+    multiplied by the query score, like function_score does by default
+    """
+
+    # A query score of 1 means that no terms were found
+    if query_score == 1:
+        return 0
+    factor = (math.log1p(word_count * 0.5) / math.log1p(2)) * 20
+    if factor == 0:
+        return 0
+    return query_score * (query_score / factor)
@@ -11,7 +11,10 @@ env = environ.Env(
     # set casting, default value
     CIRCLECI=(bool, False),
     CIRCLECI_ELASTICSEARCH_USER=(str, ''),
-    CIRCLECI_ELASTICSEARCH_PASSWORD=(str, '')
+    CIRCLECI_ELASTICSEARCH_PASSWORD=(str, ''),
+    ASYNC_SEARCH_VIEWS=(bool, False),
+    ELASTICSEARCH_HTTP_COMPRESS=(bool, False),
+    SENTIMENT_PROCESSES=(int, 0)
 )
 
 # If this is running under CircleCI, then settings_secret won't be available
@@ -97,6 +100,10 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'letterpress.wsgi.application'
+ASGI_APPLICATION = 'letterpress.asgi.application'
+# Use the async versions of the search, stats and place search views, which should only be done
+# when running under ASGI, because the async Elasticsearch client belongs to the server's event loop
+ASYNC_SEARCH_VIEWS = env('ASYNC_SEARCH_VIEWS')
 
 # Database
 DATABASES = {
@@ -109,6 +116,25 @@ DATABASES = {
 # https://docs.djangoproject.com/en/stable/ref/settings/#std:setting-DEFAULT_AUTO_FIELD
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Cache, used for search results
+# It has to be shared by all the processes, because management commands and the index outbox worker
+# invalidate cached search results through it, so with several servers use Memcached or Redis instead
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(DB_DIR, 'cache'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+# Cached search results get invalidated whenever letters or custom sentiments change,
+# so they can be kept for a while
+SEARCH_CACHE_TIMEOUT = 60 * 60
+
+# Tests use a cache in memory, so they don't touch the one above
+TEST_RUNNER = 'letterpress.test_runner.TestRunner'
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -193,3 +219,38 @@ else:
     ELASTICSEARCH_URL = 'http://elasticsearch:9200/'
     ELASTICSEARCH_USER = settings_secret.ELASTICSEARCH_USER
     ELASTICSEARCH_PASSWORD = settings_secret.ELASTICSEARCH_PASSWORD
+
+# Elasticsearch client: every Elasticsearch request goes through one client per process,
+# so its connection pool and the keep-alive connections in it get reused
+# Maximum number of connections kept open to each Elasticsearch node
+ELASTICSEARCH_CONNECTIONS_PER_NODE = 10
+# Timeout in seconds for searches and other requests made while handling a page request
+ELASTICSEARCH_REQUEST_TIMEOUT = 10
+# Timeout in seconds for bulk indexing and index management, which can take much longer
+ELASTICSEARCH_BULK_REQUEST_TIMEOUT = 120
+# Retry a request this many times if it times out, the connection fails,
+# or Elasticsearch responds with 429, 502, 503 or 504
+ELASTICSEARCH_MAX_RETRIES = 3
+ELASTICSEARCH_RETRY_ON_TIMEOUT = True
+ELASTICSEARCH_RETRY_ON_STATUS = (429, 502, 503, 504)
+# Wait ELASTICSEARCH_RETRY_BACKOFF_FACTOR * 2 ** (number of retries so far) seconds before retrying,
+# but never more than ELASTICSEARCH_MAX_RETRY_BACKOFF seconds
+ELASTICSEARCH_RETRY_BACKOFF_FACTOR = 0.5
+ELASTICSEARCH_MAX_RETRY_BACKOFF = 10
+# Gzip request bodies and ask for gzipped responses, worthwhile if Elasticsearch isn't on the same host
+ELASTICSEARCH_HTTP_COMPRESS = env('ELASTICSEARCH_HTTP_COMPRESS')
+
+# Letters that get saved or deleted are queued in an outbox and updated in the index by flush_index_outbox
+# Number of outbox entries to flush in each bulk request
+ELASTICSEARCH_OUTBOX_BATCH_SIZE = 500
+# Refresh policy for flushing: 'wait_for' returns once the letters are searchable, without forcing a refresh,
+# 'true' forces a refresh, and 'false' leaves it to the index refresh interval
+ELASTICSEARCH_OUTBOX_REFRESH = 'wait_for'
+
+# Number of letter bodies whose text is kept in memory by html_to_text(), in each process
+HTML_TO_TEXT_CACHE_SIZE = 1000
+
+# Number of worker processes that calculate standard sentiment for a lot of texts at once (0 means one per CPU,
+# 1 means calculate it in the same process), and the number of texts it takes for them to be used
+SENTIMENT_PROCESSES = env('SENTIMENT_PROCESSES')
+SENTIMENT_POOL_MIN_TEXTS = 20
@@ -0,0 +1,26 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+# The search cache is shared with the running site, so tests get their own one in memory
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'letterpress-tests',
+    }
+}
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Run tests with a cache in memory instead of the one in DB_DIR, so running them doesn't
+    clear the search cache and corpus generation of the running site, or leave test data in it
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_settings = override_settings(CACHES=TEST_CACHES)
+        self.cache_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_settings.disable()
+        super().teardown_test_environment(**kwargs)
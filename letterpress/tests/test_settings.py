@@ -3,6 +3,8 @@ import os
 
 from unittest.mock import patch
 
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
 from django.test import SimpleTestCase
 
 # Normally Django settings should be imported as "from django.conf import settings"
@@ -60,3 +62,13 @@ class TestCircleCISettingsTestCase(SimpleTestCase):
             # ELASTICSEARCH_URL should have localhost as host
             self.assertTrue('localhost' in letterpress.settings.ELASTICSEARCH_URL,
                             "When setting CIRCLECI is True, ELASTICSEARCH_URL should contain 'localhost'")
+
+
+class TestRunnerCacheTestCase(SimpleTestCase):
+    """
+    Tests should use a cache in memory, not the search cache of the running site
+    """
+
+    def test_test_runner_cache(self):
+        self.assertIsInstance(caches['default'], LocMemCache,
+                              'Tests should use LocMemCache instead of the cache in DB_DIR')
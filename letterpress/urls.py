@@ -4,15 +4,21 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.conf.urls import include
 from django.urls import path
-from letters.views import GetStatsView, GetTextSentimentView, GetWordCloudView, LetterDetailView, \
-    LetterSentimentView, LettersView, PlaceDetailView, PlaceListView, PlaceSearchView, RandomLetterView, \
-    SearchView, SentimentView, StatsView, TextSentimentView, WordCloudView
+from letters.views import AsyncGetStatsView, AsyncPlaceSearchView, AsyncSearchView, GetStatsView, \
+    GetTextSentimentView, GetWordCloudView, IndexOutboxStatsView, LetterDetailView, LetterSentimentView, LettersView, \
+    PlaceDetailView, PlaceListView, PlaceSearchView, RandomLetterView, SearchCacheStatsView, SearchView, \
+    SentimentView, StatsView, TextSentimentView, WordCloudView
 from letterpress.views import ElasticsearchErrorView, HomeView
 
 from django.contrib import admin
 
 admin.autodiscover()
 
+if settings.ASYNC_SEARCH_VIEWS:
+    search_view, get_stats_view, place_search_view = AsyncSearchView, AsyncGetStatsView, AsyncPlaceSearchView
+else:
+    search_view, get_stats_view, place_search_view = SearchView, GetStatsView, PlaceSearchView
+
 urlpatterns = [
                   path('admin/', admin.site.urls),
                   path('accounts/', include('django.contrib.auth.urls')),
@@ -23,14 +29,16 @@ urlpatterns = [
                        LetterSentimentView.as_view(), name='letter_sentiment_view'),
                   path('letters/<pk>/', LetterDetailView.as_view(), name='letter_detail'),
                   path('letters/', LettersView.as_view(), name='letters_view'),
-                  path('search/', SearchView.as_view(), name='search'),
+                  path('search/', search_view.as_view(), name='search'),
+                  path('search_cache_stats/', SearchCacheStatsView.as_view(), name='search_cache_stats'),
+                  path('index_outbox_stats/', IndexOutboxStatsView.as_view(), name='index_outbox_stats'),
                   path('random_letter/', RandomLetterView.as_view(), name='random_letter'),
                   path('stats/', StatsView.as_view(), name='stats_view'),
-                  path('get_stats/', GetStatsView.as_view(), name='get_stats'),
+                  path('get_stats/', get_stats_view.as_view(), name='get_stats'),
                   path('sentiment/', SentimentView.as_view(), name='sentiment_view'),
                   path('text_sentiment/', TextSentimentView.as_view(), name='text_sentiment_view'),
                   path('get_text_sentiment/', GetTextSentimentView.as_view(), name='get_text_sentiment'),
-                  path('places/search/', PlaceSearchView.as_view(), name='place_search'),
+                  path('places/search/', place_search_view.as_view(), name='place_search'),
                   path('places/<pk>/', PlaceDetailView.as_view(), name='place_detail'),
                   path('places/', PlaceListView.as_view(), name='place_list'),
                   path('tinymce/', include('tinymce.urls')),
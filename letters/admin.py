@@ -1,6 +1,8 @@
 from django.contrib import admin
 from django.contrib.gis import admin as gisAdmin
-from .models import Correspondent, Place, Letter, DocumentImage, DocumentSource, Envelope, MiscDocument
+from django.db import transaction
+from .models import Correspondent, Place, Letter, DocumentImage, DocumentSource, Envelope, IndexOutboxEntry, \
+    MiscDocument
 from letters.admin_filters import CorrespondentSourceFilter, ImageSourceFilter, MonthFilter, \
     RecipientFilter, WriterFilter, YearFilter
 
@@ -79,12 +81,15 @@ class LetterAdmin(DocumentAdmin):
         form.base_fields['ps'].widget.attrs['style'] = 'height: 3em;'
         return form
 
-    # Override Django Admin's delete_queryset action to use model's
-    # delete method and update elasticsearch index
-    # Unfortunately, we lose the confirmation dialogue
+    # Override Django Admin's delete_queryset, which the delete_selected action calls
+    # after the confirmation page, to queue the deleted letters for removal from
+    # the elasticsearch index in the same transaction as the set-based delete.
+    # Cached search results get invalidated once the outbox has been flushed
     def delete_queryset(self, request, queryset):
-        for obj in queryset:
-            obj.delete()
+        with transaction.atomic():
+            letter_ids = list(queryset.values_list('pk', flat=True))
+            super(LetterAdmin, self).delete_queryset(request, queryset)
+            IndexOutboxEntry.queue_letters(letter_ids)
 
 
 class DocumentImageAdmin(MyModelAdmin):
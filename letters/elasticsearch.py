@@ -1,12 +1,17 @@
 # elasticsearch stuff that's completely separate from any models
+from datetime import datetime
 import elasticsearch
 import json
-import requests
 
-from letters.es_settings import ES_CLIENT, ES_LETTER_URL
+from letters.es_settings import ES_CLIENT, get_es_async_client
 from letters.models import Letter
 from letterpress.exceptions import ElasticsearchException
 
+# Key in the _meta of the index mapping for the time the index was last synced with the database
+INDEX_CHECKPOINT_KEY = 'synced_at'
+# Field of the letter contents that custom sentiment terms get matched against
+CUSTOM_SENTIMENT_FIELD = 'contents.custom_sentiment'
+
 
 def analyze_term(term, analyzer):
     """
@@ -48,6 +53,30 @@ def get_sentiment_termvector_for_text(text):
     return termvector
 
 
+def get_custom_sentiment_termvector_for_text(text):
+    """
+    Return the term vector of text as the contents.custom_sentiment field of a letter, with positions,
+    and the statistics of its terms and of the field in the index, without indexing the text
+
+    Elasticsearch analyzes text as an artificial document, so nothing gets written to the index
+    """
+
+    try:
+        response = ES_CLIENT.termvectors(index=Letter._meta.es_index_name, doc={'contents': text},
+                                         fields=[CUSTOM_SENTIMENT_FIELD], field_statistics=True, offsets=False,
+                                         positions=True, term_statistics=True)
+
+        if 'term_vectors' in response:
+            return response['term_vectors'].get(CUSTOM_SENTIMENT_FIELD, {})
+
+        # Query didn't find anything, probably because there was an error with Elasticsearch
+        raise_exception_from_response_error(response)
+
+    except elasticsearch.exceptions.RequestError as exception:
+        # Error with Elasticsearch client
+        raise_exception_from_request_error(exception)
+
+
 def get_termvector_from_result(result):
     """
     Return the 'terms' portion of term_vectors contents from result,
@@ -68,10 +97,34 @@ def get_stored_fields_for_letter(letter_id, stored_fields):
     Return the Elasticsearch stored fields for letter with the given id
     """
 
-    url = str.format('{0}{1}?stored_fields={2}', ES_LETTER_URL,
-                     str(letter_id), ','.join(stored_fields))
-    response = requests.get(url)
-    return json.loads(response.text)
+    try:
+        return ES_CLIENT.get(index=Letter._meta.es_index_name, id=letter_id, stored_fields=stored_fields)
+    except elasticsearch.exceptions.NotFoundError as exception:
+        return exception.body
+
+
+def get_index_checkpoint(index=None):
+    """
+    Return the time up to which the index (by default the Letter alias) has been synced with the database,
+    which is stored in the _meta of its mapping, or None if it hasn't been recorded
+    """
+
+    response = ES_CLIENT.indices.get_mapping(index=index or Letter._meta.es_index_name)
+    for mapping in response.values():
+        synced_at = mapping['mappings'].get('_meta', {}).get(INDEX_CHECKPOINT_KEY)
+        if synced_at:
+            return datetime.fromisoformat(synced_at)
+    return None
+
+
+def set_index_checkpoint(synced_at, index=None):
+    """
+    Record in the _meta of the mapping of the index (by default the Letter alias) that it has been synced
+    with the database up to the given time
+    """
+
+    ES_CLIENT.indices.put_mapping(index=index or Letter._meta.es_index_name,
+                                  meta={INDEX_CHECKPOINT_KEY: synced_at.isoformat()})
 
 
 def do_es_analyze(index, analyzer, text):
@@ -137,16 +190,19 @@ def do_es_termvectors_for_text(index, doc=None, field_statistics=None, fields=No
 
 
 def do_es_search(index, query=None, aggs=None, from_offset=None, size=None, highlight=None, source=None,
-                 stored_fields=None, sort=None):
+                 stored_fields=None, sort=None, pit=None, search_after=None, track_total_hits=None):
     """
     Call Elasticsearch search for the given query and return result
 
+    If pit (point in time) is given, index has to be None, because the point in time already belongs to an index
+
     If there was an error, raise an exception
     """
 
     try:
         response = ES_CLIENT.search(index=index, query=query, aggs=aggs, from_=from_offset, size=size,
-                                    highlight=highlight, source=source, stored_fields=stored_fields, sort=sort)
+                                    highlight=highlight, source=source, stored_fields=stored_fields, sort=sort,
+                                    pit=pit, search_after=search_after, track_total_hits=track_total_hits)
 
         if 'hits' in response:
             return response
@@ -159,31 +215,161 @@ def do_es_search(index, query=None, aggs=None, from_offset=None, size=None, high
         raise_exception_from_request_error(exception)
 
 
-def index_temp_document(text):
+def do_es_msearch(index, searches):
     """
-    Temporarily index a document to use Elasticsearch to calculate
-    custom sentiment score for a piece of arbitrary text
+    Call Elasticsearch multi search with the given list of search bodies, all for the same index,
+    and return the list of responses in the same order
+
+    If there was an error, raise an exception
     """
 
-    ES_CLIENT.index(
-        index=Letter._meta.es_index_name,
-        id='temp',
-        refresh=True,
-        body={'contents': text}
-    )
+    try:
+        response = ES_CLIENT.msearch(searches=get_msearch_request_body(index, searches))
+        return get_msearch_responses(response)
+
+    except (elasticsearch.exceptions.RequestError, elasticsearch.exceptions.NotFoundError) as exception:
+        # Error with Elasticsearch client
+        raise_exception_from_request_error(exception)
 
 
-def delete_temp_document():
+def get_msearch_request_body(index, searches):
     """
-    Delete temporarily indexed document from Elasticsearch index because it's not an actual transcription
-    and was only used to get a score for sentiment
+    Return the request body for Elasticsearch multi search, with a header for each search
     """
 
-    ES_CLIENT.delete(
-        index=Letter._meta.es_index_name,
-        id='temp',
-        refresh=True,
-    )
+    request_body = []
+    for search in searches:
+        request_body.extend([{'index': index}, search])
+
+    return request_body
+
+
+def get_msearch_responses(response):
+    """
+    Return the list of responses from Elasticsearch multi search,
+    or raise an exception if any of the searches returned an error
+    """
+
+    if 'responses' in response:
+        for search_response in response['responses']:
+            if 'error' in search_response:
+                root_cause = search_response['error']['root_cause'][0]
+                raise ElasticsearchException(status=search_response.get('status', 0),
+                                             error=root_cause.get('reason'))
+        return response['responses']
+
+    # Query didn't find anything, probably because there was an error with Elasticsearch
+    raise_exception_from_response_error(response)
+
+
+def open_point_in_time(index, keep_alive):
+    """
+    Open an Elasticsearch point in time for the given index and return its id
+
+    If there was an error, raise an exception
+    """
+
+    try:
+        response = ES_CLIENT.open_point_in_time(index=index, keep_alive=keep_alive)
+        return response['id']
+    except (elasticsearch.exceptions.RequestError, elasticsearch.exceptions.NotFoundError) as exception:
+        # Error with Elasticsearch client
+        raise_exception_from_request_error(exception)
+
+
+def close_point_in_time(pit_id):
+    """
+    Close an Elasticsearch point in time when it isn't needed anymore, instead of waiting for it to expire
+
+    It might have already expired, so errors don't matter
+    """
+
+    try:
+        ES_CLIENT.close_point_in_time(id=pit_id)
+    except (elasticsearch.exceptions.RequestError, elasticsearch.exceptions.NotFoundError):
+        pass
+
+
+async def async_do_es_search(index, query=None, aggs=None, from_offset=None, size=None, highlight=None, source=None,
+                             stored_fields=None, sort=None, pit=None, search_after=None, track_total_hits=None):
+    """
+    Async version of do_es_search(), using the AsyncElasticsearch client
+    """
+
+    try:
+        response = await get_es_async_client().search(
+            index=index, query=query, aggs=aggs, from_=from_offset, size=size, highlight=highlight, source=source,
+            stored_fields=stored_fields, sort=sort, pit=pit, search_after=search_after,
+            track_total_hits=track_total_hits
+        )
+
+        if 'hits' in response:
+            return response
+
+        # Query didn't find anything, probably because there was an error with Elasticsearch
+        raise_exception_from_response_error(response)
+
+    except (elasticsearch.exceptions.RequestError, elasticsearch.exceptions.NotFoundError) as exception:
+        # Error with Elasticsearch client
+        raise_exception_from_request_error(exception)
+
+
+async def async_do_es_msearch(index, searches):
+    """
+    Async version of do_es_msearch(), using the AsyncElasticsearch client
+    """
+
+    try:
+        response = await get_es_async_client().msearch(searches=get_msearch_request_body(index, searches))
+        return get_msearch_responses(response)
+
+    except (elasticsearch.exceptions.RequestError, elasticsearch.exceptions.NotFoundError) as exception:
+        # Error with Elasticsearch client
+        raise_exception_from_request_error(exception)
+
+
+async def async_get_mtermvectors(ids, fields):
+    """
+    Async version of get_mtermvectors(), using the AsyncElasticsearch client
+    """
+
+    try:
+        response = await get_es_async_client().mtermvectors(index=Letter._meta.es_index_name,
+                                                            field_statistics=False, fields=fields, ids=ids,
+                                                            offsets=False, positions=False)
+        if 'docs' in response:
+            return response
+
+        # Query didn't find anything, probably because there was an error with Elasticsearch
+        raise_exception_from_response_error(response)
+
+    except elasticsearch.exceptions.RequestError as exception:
+        # Error with Elasticsearch client
+        raise_exception_from_request_error(exception)
+
+
+async def async_open_point_in_time(index, keep_alive):
+    """
+    Async version of open_point_in_time(), using the AsyncElasticsearch client
+    """
+
+    try:
+        response = await get_es_async_client().open_point_in_time(index=index, keep_alive=keep_alive)
+        return response['id']
+    except (elasticsearch.exceptions.RequestError, elasticsearch.exceptions.NotFoundError) as exception:
+        # Error with Elasticsearch client
+        raise_exception_from_request_error(exception)
+
+
+async def async_close_point_in_time(pit_id):
+    """
+    Async version of close_point_in_time(), using the AsyncElasticsearch client
+    """
+
+    try:
+        await get_es_async_client().close_point_in_time(id=pit_id)
+    except (elasticsearch.exceptions.RequestError, elasticsearch.exceptions.NotFoundError):
+        pass
 
 
 def raise_exception_from_response_error(response):
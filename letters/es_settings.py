@@ -1,21 +1,136 @@
 # Elasticsearch settings
+import asyncio
+from functools import lru_cache
 import ssl
+import time
 
-from elasticsearch import Elasticsearch
+from elastic_transport import AsyncTransport, ConnectionError, ConnectionTimeout, Transport
+from elastic_transport.client_utils import DEFAULT
+from elasticsearch import AsyncElasticsearch, Elasticsearch
 
-from django.conf import settings
+# The analyzer settings at the end of this module are called settings, so Django's settings need another name
+from django.conf import settings as django_settings
+
+
+def get_retry_backoff(retries):
+    """
+    Return the number of seconds to wait before retrying a request that has already been retried
+    the given number of times: it doubles every time, up to settings.ELASTICSEARCH_MAX_RETRY_BACKOFF
+    """
+
+    backoff = django_settings.ELASTICSEARCH_RETRY_BACKOFF_FACTOR * 2 ** retries
+    return min(backoff, django_settings.ELASTICSEARCH_MAX_RETRY_BACKOFF)
+
+
+class BackoffTransportMixin:
+    """
+    The Elasticsearch transport retries failed requests immediately, which doesn't give an overloaded
+    or restarting node any time to recover, so the transports below do the retrying themselves,
+    with exponential backoff in between
+    """
+
+    def get_retry_options(self, kwargs):
+        """
+        Remove the retry options from the keyword arguments for perform_request(),
+        and return max_retries, retry_on_status and retry_on_timeout for the request,
+        taking the transport's own options for the ones that weren't given
+        """
+
+        max_retries = kwargs.pop('max_retries', DEFAULT)
+        retry_on_status = kwargs.pop('retry_on_status', DEFAULT)
+        retry_on_timeout = kwargs.pop('retry_on_timeout', DEFAULT)
+
+        return (
+            self.max_retries if max_retries is DEFAULT else max_retries,
+            self.retry_on_status if retry_on_status is DEFAULT else retry_on_status,
+            self.retry_on_timeout if retry_on_timeout is DEFAULT else retry_on_timeout,
+        )
+
+    @staticmethod
+    def should_retry_after_error(error, retry_on_timeout):
+        """
+        Return True if a request that failed with the given transport error should be retried
+        """
+
+        if isinstance(error, ConnectionTimeout):
+            return retry_on_timeout
+        return isinstance(error, ConnectionError)
+
+
+class BackoffTransport(BackoffTransportMixin, Transport):
+    """
+    Transport for ES_CLIENT that waits longer and longer between retries
+    """
+
+    def perform_request(self, method, target, **kwargs):
+        max_retries, retry_on_status, retry_on_timeout = self.get_retry_options(kwargs)
+
+        for retries in range(max_retries + 1):
+            if retries:
+                time.sleep(get_retry_backoff(retries - 1))
+            try:
+                response = super().perform_request(method, target, max_retries=0, **kwargs)
+            except (ConnectionError, ConnectionTimeout) as error:
+                if retries == max_retries or not self.should_retry_after_error(error, retry_on_timeout):
+                    raise
+            else:
+                if retries == max_retries or response.meta.status not in retry_on_status:
+                    return response
+
+
+class AsyncBackoffTransport(BackoffTransportMixin, AsyncTransport):
+    """
+    Transport for the AsyncElasticsearch client that waits longer and longer between retries,
+    without blocking the event loop
+    """
+
+    async def perform_request(self, method, target, **kwargs):
+        max_retries, retry_on_status, retry_on_timeout = self.get_retry_options(kwargs)
+
+        for retries in range(max_retries + 1):
+            if retries:
+                await asyncio.sleep(get_retry_backoff(retries - 1))
+            try:
+                response = await super().perform_request(method, target, max_retries=0, **kwargs)
+            except (ConnectionError, ConnectionTimeout) as error:
+                if retries == max_retries or not self.should_retry_after_error(error, retry_on_timeout):
+                    raise
+            else:
+                if retries == max_retries or response.meta.status not in retry_on_status:
+                    return response
 
-ES_LETTER_URL = settings.ELASTICSEARCH_URL + 'letterpress/letter/'
 
 # If no options are given and the certifi package is installed then certifi’s CA
 # bundle is used by default:
 # https://www.elastic.co/guide/en/elasticsearch/client/python-api/current/config.html#tls-and-ssl
-ES_CLIENT = Elasticsearch(
-    hosts=[settings.ELASTICSEARCH_URL],
-    basic_auth=(settings.ELASTICSEARCH_USER, settings.ELASTICSEARCH_PASSWORD),
-    verify_certs=False,
-    ssl_version=ssl.TLSVersion.TLSv1_3
-)
+ES_CLIENT_OPTIONS = {
+    'hosts': [django_settings.ELASTICSEARCH_URL],
+    'basic_auth': (django_settings.ELASTICSEARCH_USER, django_settings.ELASTICSEARCH_PASSWORD),
+    'verify_certs': False,
+    'ssl_version': ssl.TLSVersion.TLSv1_3,
+    'connections_per_node': django_settings.ELASTICSEARCH_CONNECTIONS_PER_NODE,
+    'request_timeout': django_settings.ELASTICSEARCH_REQUEST_TIMEOUT,
+    'max_retries': django_settings.ELASTICSEARCH_MAX_RETRIES,
+    'retry_on_status': django_settings.ELASTICSEARCH_RETRY_ON_STATUS,
+    'retry_on_timeout': django_settings.ELASTICSEARCH_RETRY_ON_TIMEOUT,
+    'http_compress': django_settings.ELASTICSEARCH_HTTP_COMPRESS,
+}
+ES_CLIENT = Elasticsearch(transport_class=BackoffTransport, **ES_CLIENT_OPTIONS)
+# Same client, connection pool and retries, with a longer timeout for bulk indexing and index management
+ES_BULK_CLIENT = ES_CLIENT.options(request_timeout=django_settings.ELASTICSEARCH_BULK_REQUEST_TIMEOUT)
+
+
+@lru_cache(maxsize=None)
+def get_es_async_client():
+    """
+    Return the AsyncElasticsearch client used by the async views, with the same options as ES_CLIENT
+
+    It only gets created the first time it's needed, because it requires aiohttp,
+    and it should only be used from within the event loop of the ASGI server
+    """
+
+    return AsyncElasticsearch(transport_class=AsyncBackoffTransport, **ES_CLIENT_OPTIONS)
+
 
 # Settings for custom analyzer
 AMPERSAND_REPLACEMENT = 'DHPEOPIJOJOIUYTUXBTEEXFGOPMBFR'
@@ -0,0 +1,102 @@
+""" Outbox of letters waiting to be updated in the Elasticsearch index, which gets flushed in bulk by a worker """
+from django.conf import settings
+from django.utils import timezone
+from elasticsearch.helpers import streaming_bulk
+
+from letters import es_settings
+from letters.models import IndexOutboxEntry, Letter
+from letters.search_cache import bump_corpus_generation
+
+
+def get_index_outbox_stats():
+    """
+    Return the number of entries in the outbox, and how long the oldest one has been waiting
+    """
+
+    entries = IndexOutboxEntry.objects.all()
+    oldest = entries.order_by('created').values_list('created', flat=True).first()
+    return {
+        'pending': entries.count(),
+        'oldest_queued': oldest.isoformat() if oldest else None,
+        'lag_seconds': round((timezone.now() - oldest).total_seconds(), 1) if oldest else 0,
+    }
+
+
+def flush_index_outbox(batch_size=None, refresh=None):
+    """
+    Update the index for the letters in the outbox, with one bulk request per batch of entries,
+    and remove the entries for letters that were updated successfully
+
+    Entries for letters that failed are left in the outbox, to be tried again next time,
+    and so are all the entries from the batch where Elasticsearch couldn't be reached, which raises TransportError
+
+    Return the number of letters indexed, the number deleted from the index, and the number that failed
+    """
+
+    batch_size = batch_size or settings.ELASTICSEARCH_OUTBOX_BATCH_SIZE
+    refresh = settings.ELASTICSEARCH_OUTBOX_REFRESH if refresh is None else refresh
+
+    totals = [0, 0, 0]
+    last_pk = 0
+    try:
+        while True:
+            entries = list(IndexOutboxEntry.objects.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+            if not entries:
+                break
+            last_pk = entries[-1].pk
+            for i, count in enumerate(flush_entries(entries, refresh)):
+                totals[i] += count
+    finally:
+        # Even if Elasticsearch stopped responding, the batches before that have been flushed,
+        # and cached search results might contain the old versions of their letters
+        if totals[0] or totals[1]:
+            bump_corpus_generation()
+    return tuple(totals)
+
+
+def flush_entries(entries, refresh):
+    """
+    Index the letters for the given outbox entries, or delete them from the index if they don't exist anymore,
+    in one bulk request, then store their content hashes and delete the entries that are done
+
+    Return the number of letters indexed, deleted and failed
+    """
+
+    letter_ids = sorted({entry.letter_id for entry in entries})
+    letters = Letter.objects.select_related('writer', 'recipient', 'place').in_bulk(letter_ids)
+    actions = [get_outbox_action(letter_id, letters.get(letter_id)) for letter_id in letter_ids]
+
+    indexed = []
+    deleted = []
+    failed = set()
+    for ok, item in streaming_bulk(client=es_settings.ES_BULK_CLIENT, actions=actions, chunk_size=len(actions),
+                                   refresh=refresh, raise_on_error=False, raise_on_exception=False):
+        op_type, result = next(iter(item.items()))
+        letter_id = int(result['_id'])
+        if op_type == 'delete' and (ok or result.get('status') == 404):
+            # A letter that never made it into the index doesn't have to be deleted from it
+            deleted.append(letter_id)
+        elif ok:
+            indexed.append(letter_id)
+        else:
+            failed.add(letter_id)
+
+    Letter.objects.bulk_update([letters[letter_id] for letter_id in indexed], ['content_hash'])
+    IndexOutboxEntry.objects.filter(pk__in=[entry.pk for entry in entries if entry.letter_id not in failed]).delete()
+    return len(indexed), len(deleted), len(failed)
+
+
+def get_outbox_action(letter_id, letter):
+    """
+    Return the bulk action for the letter: index it, with its content hash,
+    or delete it from the index if it doesn't exist anymore
+    """
+
+    index_name = Letter._meta.es_index_name
+    if letter is None:
+        return {'_op_type': 'delete', '_index': index_name, '_id': letter_id}
+
+    data = letter.es_repr()
+    letter.content_hash = data['content_hash'] = letter.get_content_hash(data)
+    data.update(_op_type='index', _index=index_name)
+    return data
@@ -1,29 +1,235 @@
 """ (elastic)search stuff that's specific to letters and related models """
+import asyncio
 from collections import namedtuple
+import json
+
+from asgiref.sync import sync_to_async
 
 from letters import filter as letters_filter
-from letters.elasticsearch import do_es_search, get_mtermvectors, get_stored_fields_for_letter
+from letterpress.exceptions import ElasticsearchException
+from letters.elasticsearch import async_close_point_in_time, async_do_es_search, async_get_mtermvectors, \
+    async_open_point_in_time, close_point_in_time, do_es_search, get_mtermvectors, get_stored_fields_for_letter, \
+    open_point_in_time
 from letters.models import Letter
+from letters.models.letter import ES_DISPLAY_FIELDS
+from letters.search_cache import cache_search_result, get_cached_search_result, get_search_cache_key
 from letters.sort_by import DATE, SENTIMENT, get_selected_sentiment_id
-from letter_sentiment.custom_sentiment import get_custom_sentiment_for_letter, \
-    get_custom_sentiment_name
+from letter_sentiment.custom_sentiment import async_get_custom_sentiments_for_letters, \
+    get_custom_sentiment_for_letter, get_custom_sentiment_name, get_custom_sentiments_for_letters
 from letter_sentiment.elasticsearch import get_sentiment_function_score_query, \
     get_sentiment_match_query
 from letter_sentiment.sentiment import format_sentiment
 
-
-def do_letter_search(request, size, page_number):
+# What gets shown in search results for a letter, if it's taken from the Elasticsearch index instead of the database
+LetterSummary = namedtuple('LetterSummary', ['id', 'pk', 'list_date', 'writer', 'recipient', 'place', 'place_id'])
+# Defined here rather than in do_letter_search(), so search results can be pickled for the search cache
+# pit_id and search_after are only filled in if search was done with a point in time, and are needed
+# to get the next page of search results
+ES_Result = namedtuple('ES_Result', ['search_results', 'total', 'pages', 'pit_id', 'search_after'],
+                       defaults=[None, None])
+# Everything about a letter search that doesn't depend on the Elasticsearch results:
+# search_kwargs for do_es_search(), id and name of the custom sentiment to sort by (0 and None if not sorting
+# by custom sentiment), the other sentiments to show, and the match query for the search text
+LetterSearchParameters = namedtuple('LetterSearchParameters', ['search_kwargs', 'sentiment_id',
+                                                               'custom_sentiment_name', 'other_sentiment_ids',
+                                                               'letter_match_query'])
+
+# How long Elasticsearch should keep a point in time open between requests for pages of search results
+PIT_KEEP_ALIVE = '10m'
+# Elasticsearch index.max_result_window: from + size can't be bigger than this
+MAX_RESULT_WINDOW = 10000
+# How many letters to retrieve at a time for export
+EXPORT_BATCH_SIZE = 500
+
+
+def do_letter_search(request, size, page_number, from_index=False, use_cache=False, use_pit=False):
     """
     Based on search criteria in request, query elasticsearch and
     return list of tuples containing letter and highlight
+
+    If from_index is True, letters will be LetterSummary namedtuples taken from the Elasticsearch index
+    wherever possible, instead of Letter objects from the database
+
+    If use_cache is True, the result for the same search, page and size will be taken from the search cache
+    if it's there, and put into it if it isn't
+
+    If use_pit is True, search will be done with an Elasticsearch point in time, and the point in time id
+    and search_after cursor in the request will be used to get the page, if they're there. The point in time
+    of the previous search gets closed, if it's in the request
     """
 
     filter_values = letters_filter.get_filter_values_from_request(request)
+    # Standard sentiment needs the letter text, so it has to come from the database
+    from_index = from_index and 0 not in filter_values.sentiment_ids
+    pit_id, search_after = get_search_cursor_from_request(request) if use_pit else (None, None)
+    if use_pit:
+        superseded_pit_id = get_superseded_pit_id_from_request(request)
+        if superseded_pit_id and superseded_pit_id != pit_id:
+            close_point_in_time(superseded_pit_id)
+
+    # A page of a search that already has a point in time has to come from that point in time
+    if use_cache and not pit_id:
+        cache_key = get_search_cache_key(filter_values, page_number, size, from_index)
+        es_result = get_cached_search_result(cache_key)
+        if es_result is None:
+            es_result = get_letter_search_result(filter_values, size, page_number, from_index,
+                                                 use_pit=use_pit, pit_id=pit_id, search_after=search_after)
+            cache_search_result(cache_key, get_cacheable_search_result(es_result))
+        return es_result
+
+    return get_letter_search_result(filter_values, size, page_number, from_index,
+                                    use_pit=use_pit, pit_id=pit_id, search_after=search_after)
+
+
+def get_search_cursor_from_request(request):
+    """
+    Get point in time id and search_after cursor (sort values of the last hit on the previous page)
+    from request, if they're there
+    """
 
-    if page_number > 0:
-        results_from = (page_number - 1) * size
+    if request.method == 'GET':
+        get_or_post = request.GET
+    else:
+        get_or_post = request.POST
+
+    pit_id = get_or_post.get('pit_id') or None
+    try:
+        search_after = json.loads(get_or_post.get('search_after') or 'null')
+    except ValueError:
+        search_after = None
+    if not isinstance(search_after, list):
+        search_after = None
+
+    return pit_id, search_after
+
+
+def get_superseded_pit_id_from_request(request):
+    """
+    Get id of the point in time of the previous search from request, if it's there, so it can be closed
+    instead of staying open until it expires
+    """
+
+    if request.method == 'GET':
+        get_or_post = request.GET
+    else:
+        get_or_post = request.POST
+
+    return get_or_post.get('superseded_pit_id') or None
+
+
+def get_cacheable_search_result(es_result):
+    """
+    Return es_result without point in time id and search_after cursor, so it can be put into the search cache
+
+    A point in time belongs to the search that opened it and expires, so it can't be shared with other searches
+    """
+
+    return es_result._replace(pit_id=None, search_after=None)
+
+
+def get_letter_search_result(filter_values, size, page_number, from_index, use_pit=False, pit_id=None,
+                             search_after=None):
+    """
+    Query elasticsearch based on filter_values and return ES_Result with list of tuples
+    containing letter, highlight, sentiments and score
+    """
+
+    results_from = get_results_from(page_number, size)
+    parameters = get_letter_search_parameters(filter_values, from_index)
+
+    if use_pit:
+        results = do_point_in_time_search(parameters.search_kwargs, size, results_from, pit_id, search_after)
+    else:
+        results = do_es_search(index=[Letter._meta.es_index_name], from_offset=results_from, size=size,
+                               **parameters.search_kwargs)
+    letters = {}
+    custom_sentiments = {}
+    if 'hits' in results:
+        letters = get_search_result_letters(results['hits']['hits'], from_index)
+        # Custom sentiments for the whole page get calculated at once, instead of for each letter separately
+        custom_sentiments = get_custom_sentiments_for_letters(list(letters.keys()),
+                                                              get_custom_sentiment_ids(parameters))
+
+    return get_es_result(results, parameters, letters, custom_sentiments, size, use_pit)
+
+
+async def async_do_letter_search(request, size, page_number, from_index=False, use_cache=False, use_pit=False):
+    """
+    Async version of do_letter_search(), for async views
+    """
+
+    filter_values = letters_filter.get_filter_values_from_request(request)
+    # Standard sentiment needs the letter text, so it has to come from the database
+    from_index = from_index and 0 not in filter_values.sentiment_ids
+    pit_id, search_after = get_search_cursor_from_request(request) if use_pit else (None, None)
+    if use_pit:
+        superseded_pit_id = get_superseded_pit_id_from_request(request)
+        if superseded_pit_id and superseded_pit_id != pit_id:
+            await async_close_point_in_time(superseded_pit_id)
+
+    # A page of a search that already has a point in time has to come from that point in time
+    if use_cache and not pit_id:
+        cache_key = await sync_to_async(get_search_cache_key)(filter_values, page_number, size, from_index)
+        es_result = await sync_to_async(get_cached_search_result)(cache_key)
+        if es_result is None:
+            es_result = await async_get_letter_search_result(filter_values, size, page_number, from_index,
+                                                             use_pit=use_pit, pit_id=pit_id, search_after=search_after)
+            await sync_to_async(cache_search_result)(cache_key, get_cacheable_search_result(es_result))
+        return es_result
+
+    return await async_get_letter_search_result(filter_values, size, page_number, from_index,
+                                                use_pit=use_pit, pit_id=pit_id, search_after=search_after)
+
+
+async def async_get_letter_search_result(filter_values, size, page_number, from_index, use_pit=False, pit_id=None,
+                                         search_after=None):
+    """
+    Async version of get_letter_search_result()
+
+    Once the hits are there, the letters get retrieved from the database while the custom sentiments
+    are being calculated, because they don't depend on each other
+    """
+
+    results_from = get_results_from(page_number, size)
+    # Custom sentiment terms for the queries come from the database
+    parameters = await sync_to_async(get_letter_search_parameters)(filter_values, from_index)
+
+    if use_pit:
+        results = await async_do_point_in_time_search(parameters.search_kwargs, size, results_from, pit_id,
+                                                      search_after)
     else:
-        results_from = 0
+        results = await async_do_es_search(index=[Letter._meta.es_index_name], from_offset=results_from, size=size,
+                                           **parameters.search_kwargs)
+    letters = {}
+    custom_sentiments = {}
+    if 'hits' in results:
+        hits = results['hits']['hits']
+        letter_ids = [letter_id for letter_id in (get_letter_id_from_doc(doc) for doc in hits)
+                      if letter_id is not None]
+        letters, custom_sentiments = await asyncio.gather(
+            sync_to_async(get_search_result_letters)(hits, from_index),
+            async_get_custom_sentiments_for_letters(letter_ids, get_custom_sentiment_ids(parameters))
+        )
+
+    # Standard sentiment gets calculated for letters that don't have it stored yet, so keep it out of the event loop
+    return await sync_to_async(get_es_result)(results, parameters, letters, custom_sentiments, size, use_pit)
+
+
+def get_results_from(page_number, size):
+    """
+    Return the offset of the first result on page page_number, which is 0 for page 0 and 1
+    """
+
+    if page_number > 0:
+        return (page_number - 1) * size
+
+    return 0
+
+
+def get_letter_search_parameters(filter_values, from_index):
+    """
+    Return LetterSearchParameters for a letter search based on filter_values
+    """
 
     if filter_values.sort_by and filter_values.sort_by.startswith(SENTIMENT):
         sentiment_id = get_selected_sentiment_id(filter_values.sort_by)
@@ -32,6 +238,90 @@ def do_letter_search(request, size, page_number):
     else:
         sentiment_match_query = []
         sentiment_id = 0
+        custom_sentiment_name = None
+
+    letter_match_query = get_letter_match_query(filter_values)
+    query = get_letter_search_query(filter_values, sentiment_match_query, letter_match_query)
+
+    search_kwargs = {
+        'query': query,
+        'highlight': get_highlight_options(filter_values),
+        'source': ES_DISPLAY_FIELDS if from_index else None,
+        'stored_fields': ['contents.word_count'],
+        'sort': [get_sort_conditions(filter_values.sort_by)]
+    }
+
+    # The custom sentiment being sorted by is the score, so it doesn't need to be calculated separately
+    if sentiment_id:
+        other_sentiment_ids = [id for id in filter_values.sentiment_ids if id != sentiment_id]
+    else:
+        other_sentiment_ids = filter_values.sentiment_ids
+
+    return LetterSearchParameters(search_kwargs=search_kwargs, sentiment_id=sentiment_id,
+                                  custom_sentiment_name=custom_sentiment_name,
+                                  other_sentiment_ids=other_sentiment_ids, letter_match_query=letter_match_query)
+
+
+def get_custom_sentiment_ids(parameters):
+    """
+    Return ids of the custom sentiments that have to be calculated for the search results,
+    leaving out standard sentiment, which has id 0
+    """
+
+    return [id for id in parameters.other_sentiment_ids if id != 0]
+
+
+def get_es_result(results, parameters, letters, custom_sentiments, size, use_pit):
+    """
+    Return ES_Result for Elasticsearch results, with search results made from letters and custom_sentiments,
+    both keyed by letter id
+    """
+
+    search_results = []
+    total = 0
+    next_search_after = None
+    if 'hits' in results:
+        total = results['hits']['total']['value']
+        if 0 in [int(sentiment_id) for sentiment_id in parameters.other_sentiment_ids or []]:
+            # Letters that haven't been saved since sentiment started being stored won't have it yet,
+            # so calculate it for all of them at once, instead of one at a time in letter.sentiment(),
+            # without storing it, which is left to update_letter_sentiment
+            letters_without_sentiment = [letter for letter in letters.values()
+                                         if letter.textblob_polarity is None or letter.vader_polarity is None]
+            if letters_without_sentiment:
+                Letter.update_sentiment_many(letters_without_sentiment, in_worker_processes=False)
+        for doc in results['hits']['hits']:
+            letter = letters.get(get_letter_id_from_doc(doc))
+            # Letter might have been deleted since it was indexed
+            if not letter:
+                continue
+            # Only show Elasticsearch highlights if user explicitly searched for a term
+            # Don't show highlights associated with custom sentiment search terms
+            highlight = get_doc_highlights(doc) if parameters.letter_match_query else ''
+            score = doc['_score']
+            sentiments = get_letter_sentiments(letter, parameters.other_sentiment_ids, custom_sentiments)
+            if parameters.sentiment_id:
+                sentiments.append((parameters.sentiment_id,
+                                   format_sentiment(parameters.custom_sentiment_name, score)))
+
+            search_results.append((letter, highlight, sentiments, score))
+        # Sort values of the last hit are where the next page starts
+        if use_pit and len(results['hits']['hits']) == size:
+            next_search_after = results['hits']['hits'][-1].get('sort')
+    if total % size:
+        pages = int(total / size + 1)
+    else:
+        pages = int(total / size)
+
+    es_result = ES_Result(search_results=search_results, total=total, pages=pages,
+                          pit_id=results.get('pit_id') if use_pit else None, search_after=next_search_after)
+    return es_result
+
+
+def get_letter_search_query(filter_values, sentiment_match_query, letter_match_query):
+    """
+    Return Elasticsearch query for letters that meet the criteria in filter_values
+    """
 
     # when sorting by custom sentiment, wrap the bool query in a function_score query
     bool_query = {
@@ -39,7 +329,6 @@ def do_letter_search(request, size, page_number):
         'filter': get_filter_conditions_for_query(filter_values)
     }
 
-    letter_match_query = get_letter_match_query(filter_values)
     if letter_match_query:
         bool_query['must'] = letter_match_query
 
@@ -52,38 +341,241 @@ def do_letter_search(request, size, page_number):
             'bool': bool_query
         }
 
-    results = do_es_search(index=[Letter._meta.es_index_name],
-                           query=query, from_offset=results_from,
-                           size=size,
-                           highlight=get_highlight_options(filter_values),
-                           stored_fields=['contents.word_count'],
-                           sort=[get_sort_conditions(filter_values.sort_by)])
-    search_results = []
-    total = 0
-    if 'hits' in results:
-        total = results['hits']['total']['value']
-        for doc in results['hits']['hits']:
-            letter = Letter.objects.get(pk=doc['_id'])
-            # Only show Elasticsearch highlights if user explicitly searched for a term
-            # Don't show highlights associated with custom sentiment search terms
-            highlight = get_doc_highlights(doc) if letter_match_query else ''
-            score = doc['_score']
-            if sentiment_id:
-                sentiments = get_letter_sentiments(letter,
-                                                   [id for id in filter_values.sentiment_ids if id != sentiment_id])
-                sentiments.append((sentiment_id, format_sentiment(custom_sentiment_name, score)))
-            else:
-                sentiments = get_letter_sentiments(letter, filter_values.sentiment_ids)
+    return query
 
-            search_results.append((letter, highlight, sentiments, score))
-    if total % size:
-        pages = int(total / size + 1)
+
+def get_letters_for_export(request, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Return an iterator over all letters that meet search criteria in request, in sort order
+
+    Letters get retrieved in batches with an Elasticsearch point in time and search_after,
+    so there's no limit to the number of letters and memory use stays the same however many there are
+
+    The first batch gets searched for right away, so any Elasticsearch error gets raised here,
+    before anything gets exported
+    """
+
+    filter_values = letters_filter.get_filter_values_from_request(request)
+
+    if filter_values.sort_by and filter_values.sort_by.startswith(SENTIMENT):
+        sentiment_match_query = get_sentiment_match_query(get_selected_sentiment_id(filter_values.sort_by))
     else:
-        pages = int(total / size)
+        sentiment_match_query = []
+    search_kwargs = {
+        'query': get_letter_search_query(filter_values, sentiment_match_query,
+                                         get_letter_match_query(filter_values)),
+        'sort': [get_sort_conditions(filter_values.sort_by)],
+        'size': batch_size,
+        # Only the ids are needed, because the letters come from the database
+        'source': False,
+    }
 
-    ES_Result = namedtuple('ES_Result', ['search_results', 'total', 'pages'])
-    es_result = ES_Result(search_results=search_results, total=total, pages=pages)
-    return es_result
+    pit_id = open_point_in_time(index=Letter._meta.es_index_name, keep_alive=PIT_KEEP_ALIVE)
+    try:
+        hits = do_es_search(index=None, pit={'id': pit_id, 'keep_alive': PIT_KEEP_ALIVE},
+                            **search_kwargs)['hits']['hits']
+    except ElasticsearchException:
+        close_point_in_time(pit_id)
+        raise
+
+    return iterate_letters_for_hits(search_kwargs, pit_id, hits)
+
+
+def iterate_letters_for_hits(search_kwargs, pit_id, hits):
+    """
+    Generator that yields letters for hits, one batch at a time, then searches for the next batch
+    of hits after the last one, until there aren't any more
+
+    The point in time gets closed when there are no more letters, or the generator gets closed
+    """
+
+    try:
+        while hits:
+            letters = get_letters_for_hits(hits)
+            for doc in hits:
+                letter = letters.get(get_letter_id_from_doc(doc))
+                # Letter might have been deleted since it was indexed
+                if letter:
+                    yield letter
+
+            if len(hits) < search_kwargs['size']:
+                break
+            hits = do_es_search(index=None, pit={'id': pit_id, 'keep_alive': PIT_KEEP_ALIVE},
+                                search_after=hits[-1]['sort'], **search_kwargs)['hits']['hits']
+    finally:
+        close_point_in_time(pit_id)
+
+
+def do_point_in_time_search(search_kwargs, size, results_from, pit_id=None, search_after=None):
+    """
+    Do search for one page of results with an Elasticsearch point in time, so results stay consistent
+    from page to page, even if letters are changed in the meantime
+
+    If search_after is given, the page starts right after it, otherwise it starts at results_from.
+    Pages beyond max_result_window can't be requested with from/size, so a search_after for them
+    gets looked up first
+
+    If no pit_id is given, or the point in time has expired, a new one gets opened
+    """
+
+    opened_pit = not pit_id
+    if opened_pit:
+        pit_id = open_point_in_time(index=Letter._meta.es_index_name, keep_alive=PIT_KEEP_ALIVE)
+        search_after = None
+
+    try:
+        pit = {'id': pit_id, 'keep_alive': PIT_KEEP_ALIVE}
+        from_offset = results_from
+        if not search_after and results_from + size > MAX_RESULT_WINDOW:
+            # If there's still no search_after, there aren't any hits at all
+            search_after = get_search_after_for_offset(search_kwargs, pit, results_from)
+            from_offset = 0
+        elif search_after:
+            from_offset = 0
+        return do_es_search(index=None, pit=pit, search_after=search_after, from_offset=from_offset, size=size,
+                            track_total_hits=True, **search_kwargs)
+    except ElasticsearchException as exception:
+        # Point in time has expired, so start again with a new one
+        if exception.status == 404 and not opened_pit:
+            return do_point_in_time_search(search_kwargs, size, results_from)
+        raise
+
+
+def get_search_after_for_offset(search_kwargs, pit, offset):
+    """
+    Return the sort values of the hit right before offset, by paging through the hits with search_after,
+    without fetching anything but the sort values
+    """
+
+    search_after = None
+    remaining = offset
+    while remaining > 0:
+        batch_size = min(remaining, MAX_RESULT_WINDOW)
+        results = do_es_search(index=None, query=search_kwargs['query'], sort=search_kwargs['sort'], pit=pit,
+                               search_after=search_after, size=batch_size, source=False, track_total_hits=False)
+        hits = results['hits']['hits']
+        if hits:
+            search_after = hits[-1]['sort']
+        # No more hits after these
+        if len(hits) < batch_size:
+            break
+        remaining -= len(hits)
+
+    return search_after
+
+
+async def async_do_point_in_time_search(search_kwargs, size, results_from, pit_id=None, search_after=None):
+    """
+    Async version of do_point_in_time_search()
+    """
+
+    opened_pit = not pit_id
+    if opened_pit:
+        pit_id = await async_open_point_in_time(index=Letter._meta.es_index_name, keep_alive=PIT_KEEP_ALIVE)
+        search_after = None
+
+    try:
+        pit = {'id': pit_id, 'keep_alive': PIT_KEEP_ALIVE}
+        from_offset = results_from
+        if not search_after and results_from + size > MAX_RESULT_WINDOW:
+            # If there's still no search_after, there aren't any hits at all
+            search_after = await async_get_search_after_for_offset(search_kwargs, pit, results_from)
+            from_offset = 0
+        elif search_after:
+            from_offset = 0
+        return await async_do_es_search(index=None, pit=pit, search_after=search_after, from_offset=from_offset,
+                                        size=size, track_total_hits=True, **search_kwargs)
+    except ElasticsearchException as exception:
+        # Point in time has expired, so start again with a new one
+        if exception.status == 404 and not opened_pit:
+            return await async_do_point_in_time_search(search_kwargs, size, results_from)
+        raise
+
+
+async def async_get_search_after_for_offset(search_kwargs, pit, offset):
+    """
+    Async version of get_search_after_for_offset()
+    """
+
+    search_after = None
+    remaining = offset
+    while remaining > 0:
+        batch_size = min(remaining, MAX_RESULT_WINDOW)
+        results = await async_do_es_search(index=None, query=search_kwargs['query'], sort=search_kwargs['sort'],
+                                           pit=pit, search_after=search_after, size=batch_size, source=False,
+                                           track_total_hits=False)
+        hits = results['hits']['hits']
+        if hits:
+            search_after = hits[-1]['sort']
+        # No more hits after these
+        if len(hits) < batch_size:
+            break
+        remaining -= len(hits)
+
+    return search_after
+
+
+def get_search_result_letters(hits, from_index):
+    """
+    Return a dict of letters for Elasticsearch hits, keyed by id
+
+    If from_index is True, take them from the index wherever possible, and only get the ones
+    that were indexed without the fields shown in search results from the database
+    """
+
+    if not from_index:
+        return get_letters_for_hits(hits)
+
+    letters = {}
+    hits_to_load = []
+    for doc in hits:
+        letter_summary = get_letter_summary_from_doc(doc)
+        if letter_summary:
+            letters[letter_summary.id] = letter_summary
+        else:
+            hits_to_load.append(doc)
+
+    if hits_to_load:
+        letters.update(get_letters_for_hits(hits_to_load))
+
+    return letters
+
+
+def get_letter_summary_from_doc(doc):
+    """
+    Return a LetterSummary with the fields shown in search results from a doc returned by Elasticsearch,
+    or None if they aren't all in the doc
+    """
+
+    letter_id = get_letter_id_from_doc(doc)
+    source = doc.get('_source', {})
+    if letter_id is None or not all(field_name in source for field_name in ES_DISPLAY_FIELDS):
+        return None
+
+    return LetterSummary(id=letter_id, pk=letter_id, list_date=source['list_date'], writer=source['writer_name'],
+                         recipient=source['recipient_name'], place=source['place_name'], place_id=source['place_id'])
+
+
+def get_letters_for_hits(hits):
+    """
+    Retrieve the letters for Elasticsearch hits in a single query, with the related objects
+    that get shown in search results, and return a dict of letters keyed by id
+    """
+
+    letter_ids = [get_letter_id_from_doc(doc) for doc in hits]
+    return Letter.objects.select_related('writer', 'recipient', 'place', 'source') \
+        .in_bulk([letter_id for letter_id in letter_ids if letter_id is not None])
+
+
+def get_letter_id_from_doc(doc):
+    """
+    Return the letter id for a doc returned by Elasticsearch, or None if it isn't a letter id
+    """
+
+    try:
+        return int(doc['_id'])
+    except ValueError:
+        return None
 
 
 def get_doc_highlights(doc):
@@ -100,10 +592,13 @@ def get_doc_highlights(doc):
     return ''
 
 
-def get_letter_sentiments(letter, sentiment_ids):
+def get_letter_sentiments(letter, sentiment_ids, custom_sentiments=None):
     """
     Return a list of (id, name/result) consisting of sentiments with sentiment_ids
     for letter
+
+    custom_sentiments can contain custom sentiments that have already been calculated for a batch of letters,
+    by custom sentiment id and letter id
     """
 
     if not sentiment_ids:
@@ -119,6 +614,8 @@ def get_letter_sentiments(letter, sentiment_ids):
         if sentiment_id == 0:
             letter_sentiments = letter.sentiment()
             sentiments.append((sentiment_id, letter_sentiments))
+        elif custom_sentiments and sentiment_id in custom_sentiments:
+            sentiments.append((sentiment_id, custom_sentiments[sentiment_id][letter.id]))
         else:
             custom_sentiment = get_custom_sentiment_for_letter(letter.id, sentiment_id)
             sentiments.append((sentiment_id, custom_sentiment))
@@ -152,24 +649,56 @@ def get_multiple_word_frequencies(filter_values):
     Get term frequencies for mtermvectors returned by Elasticsearch using the given filters
     """
 
-    words = filter_values.words
+    es_result = do_es_search(**get_multiple_word_frequencies_search(filter_values))
+    matching_docs = get_matching_docs_from_result(es_result)
+    mtermvectors = get_mtermvectors(list(matching_docs.keys()), fields=['contents'])
+
+    return get_word_frequencies_from_mtermvectors(mtermvectors, matching_docs, filter_values.words)
+
+
+async def async_get_multiple_word_frequencies(filter_values):
+    """
+    Async version of get_multiple_word_frequencies()
+    """
+
+    es_result = await async_do_es_search(**get_multiple_word_frequencies_search(filter_values))
+    matching_docs = get_matching_docs_from_result(es_result)
+    mtermvectors = await async_get_mtermvectors(list(matching_docs.keys()), fields=['contents'])
+
+    return get_word_frequencies_from_mtermvectors(mtermvectors, matching_docs, filter_values.words)
+
+
+def get_multiple_word_frequencies_search(filter_values):
+    """
+    Return do_es_search() kwargs for finding the letters that contain words in filter_values
+    """
+
     query = {
         'bool': {
-            'must': {'match': {'contents': ' '.join(words)}},
+            'must': {'match': {'contents': ' '.join(filter_values.words)}},
             'filter': get_filter_conditions_for_query(filter_values)
         }
     }
 
-    es_result = do_es_search(index=[Letter._meta.es_index_name], query=query, size=10000, source=['date'])
+    return {'index': [Letter._meta.es_index_name], 'query': query, 'size': 10000, 'source': ['date']}
+
+
+def get_matching_docs_from_result(es_result):
+    """
+    Return dates of the docs in es_result, keyed by id
+    """
 
     if 'hits' in es_result and 'hits' in es_result['hits']:
-        matching_docs = {hit['_id']: hit['_source']['date'] for hit in es_result['hits']['hits']}
-        ids = list(matching_docs.keys())
-    else:
-        matching_docs = {}
-        ids = []
+        return {hit['_id']: hit['_source']['date'] for hit in es_result['hits']['hits']}
+
+    return {}
+
+
+def get_word_frequencies_from_mtermvectors(mtermvectors, matching_docs, words):
+    """
+    Add up the term frequencies of words in mtermvectors per month, using the dates in matching_docs
+    """
 
-    mtermvectors = get_mtermvectors(ids, fields=['contents'])
     result = {}
 
     if 'docs' in mtermvectors:
@@ -179,7 +708,7 @@ def get_multiple_word_frequencies(filter_values):
             if year_month not in result:
                 result[year_month] = {word: 0 for word in words}
             terms = mtvdoc['term_vectors']['contents']['terms']
-            for word in filter_values.words:
+            for word in words:
                 # all words are indexed as lowercase, so look for lowercase version in termvector
                 if word.lower() in terms:
                     result[year_month][word] += terms[word.lower()]['term_freq']
@@ -205,6 +734,25 @@ def get_word_counts_per_month(filter_values):
     for words given in filter_values, and return them
     """
 
+    es_result = do_es_search(**get_word_counts_per_month_search(filter_values))
+    return get_word_counts_from_result(es_result)
+
+
+async def async_get_word_counts_per_month(filter_values):
+    """
+    Async version of get_word_counts_per_month()
+    """
+
+    es_result = await async_do_es_search(**get_word_counts_per_month_search(filter_values))
+    return get_word_counts_from_result(es_result)
+
+
+def get_word_counts_per_month_search(filter_values):
+    """
+    Return do_es_search() kwargs for aggregating word counts per month of letters that meet the criteria
+    in filter_values
+    """
+
     aggs = {
         "words_per_month": {
             "date_histogram": {
@@ -233,9 +781,15 @@ def get_word_counts_per_month(filter_values):
         }
     }
 
-    es_result = do_es_search(index=[Letter._meta.es_index_name],  query=query, aggs=aggs,
-                             size=10000, sort={'date': {'order': 'asc'}}, source=['date'],
-                             stored_fields=['contents.word_count'])
+    return {'index': [Letter._meta.es_index_name], 'query': query, 'aggs': aggs, 'size': 10000,
+            'sort': {'date': {'order': 'asc'}}, 'source': ['date'], 'stored_fields': ['contents.word_count']}
+
+
+def get_word_counts_from_result(es_result):
+    """
+    Return average words, total words and number of letters per month from aggregations in es_result
+    """
+
     word_counts = {}
     if 'aggregations' in es_result and 'words_per_month' in es_result['aggregations']:
         for bucket in es_result['aggregations']['words_per_month']['buckets']:
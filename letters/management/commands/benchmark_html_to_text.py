@@ -0,0 +1,76 @@
+import time
+
+from bs4 import BeautifulSoup
+from django.core.management.base import BaseCommand, CommandError
+
+from letters.models import Letter
+from letters.models.util import HTML_TO_TEXT_CACHE, convert_html_to_text, html_to_text
+
+DEFAULT_REPEAT = 3
+
+
+def beautifulsoup_html_to_text(html):
+    """
+    Convert html to text the way html_to_text() used to, by building a BeautifulSoup tree,
+    to compare with the text and speed of html_to_text()
+    """
+
+    if not html:
+        return ''
+    soup = BeautifulSoup(html, 'lxml')
+    for br in soup.find_all('br'):
+        br.replace_with('\n')
+    return soup.get_text()
+
+
+class Command(BaseCommand):
+    help = 'Compare the speed of html_to_text() with converting letter bodies using BeautifulSoup, ' \
+           'and check that they produce the same text'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                            help='Number of times to convert all the bodies with each converter')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Number of letters to use (default: all)')
+
+    def handle(self, *args, **options):
+        bodies = self.get_bodies(options.get('limit'))
+        if not bodies:
+            raise CommandError('There are no letters with a body to convert')
+        repeat = max(options.get('repeat', DEFAULT_REPEAT), 1)
+
+        mismatches = [body for body in bodies if convert_html_to_text(body) != beautifulsoup_html_to_text(body)]
+        timings = [
+            ('BeautifulSoup', self.time_converter(beautifulsoup_html_to_text, bodies, repeat)),
+            ('lxml parser target', self.time_converter(convert_html_to_text, bodies, repeat)),
+            ('html_to_text() uncached', self.time_converter(html_to_text, bodies, repeat, clear_cache=True)),
+            ('html_to_text() cached', self.time_converter(html_to_text, bodies, repeat)),
+        ]
+
+        self.stdout.write('Converted {} letter bodies ({} characters), best of {}:'.format(
+            len(bodies), sum(len(body) for body in bodies), repeat))
+        baseline = timings[0][1]
+        for name, seconds in timings:
+            self.stdout.write('{:<24} {:>10.1f} ms {:>8.1f}x'.format(
+                name, seconds * 1000, baseline / seconds if seconds else 0))
+        self.stdout.write('{} bodies converted to different text'.format(len(mismatches)))
+
+    def get_bodies(self, limit):
+        letters = Letter.objects.exclude(body__isnull=True).exclude(body='').order_by('pk')
+        bodies = letters.values_list('body', flat=True)
+        return list(bodies[:limit] if limit else bodies)
+
+    def time_converter(self, converter, bodies, repeat, clear_cache=False):
+        """
+        Return the shortest time it took to convert all the bodies with converter
+        """
+
+        timings = []
+        for _ in range(repeat):
+            if clear_cache:
+                HTML_TO_TEXT_CACHE.clear()
+            start_time = time.perf_counter()
+            for body in bodies:
+                converter(body)
+            timings.append(time.perf_counter() - start_time)
+        return min(timings)
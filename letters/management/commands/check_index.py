@@ -0,0 +1,119 @@
+from collections import namedtuple
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from elasticsearch.helpers import streaming_bulk
+
+from letters import es_settings
+from letters.management.commands.push_to_index import format_bulk_failure, iterate_chunks
+from letters.management.commands.sync_index import get_index_actions, get_index_hashes, get_letter_chunks, \
+    get_orphan_ids
+from letters.models import Letter
+from letters.search_cache import bump_corpus_generation
+
+DEFAULT_CHUNK_SIZE = 500
+# Number of ids of each kind of problem to list in the report
+DEFAULT_IDS_TO_REPORT = 20
+
+# Letters that aren't in the index, letters whose content hash in the index doesn't match,
+# and documents in the index that aren't letters in the database, e.g. a 'temp' document left by an older version
+IndexDrift = namedtuple('IndexDrift', ['missing', 'stale', 'orphaned'])
+
+
+class Command(BaseCommand):
+    help = 'Compare the letters in the database with the documents in the Elasticsearch index, ' \
+           'report letters that are missing or out of date and documents that shouldn\'t be there, ' \
+           'and optionally repair them'
+    # Number of letters that compare() has checked
+    checked = 0
+    # Number of documents that repair() has repaired, and the number that failed
+    repaired = 0
+    failed = 0
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help='Number of letters or documents to read at once from the database or the index, '
+                                 'and to send to Elasticsearch at once when repairing')
+        parser.add_argument('--repair', action='store_true',
+                            help='Index missing and out of date letters, and delete documents that aren\'t letters')
+        parser.add_argument('--report', type=int, default=DEFAULT_IDS_TO_REPORT,
+                            help='Number of ids to list for each kind of problem')
+
+    def handle(self, *args, **options):
+        index_name = Letter._meta.es_index_name
+        if not es_settings.ES_BULK_CLIENT.indices.exists(index=index_name):
+            raise CommandError("{} doesn't exist yet, so run push_to_index first".format(index_name))
+
+        start_time = time.monotonic()
+        chunk_size = options.get('chunk_size', DEFAULT_CHUNK_SIZE)
+        drift = self.compare(chunk_size, options.get('repair', False))
+        self.report(drift, options.get('report', DEFAULT_IDS_TO_REPORT))
+        self.stdout.write('Checked {} letters in {:.1f} seconds'.format(self.checked, time.monotonic() - start_time))
+
+        if options.get('repair') and any(drift):
+            if self.repaired:
+                # Cached search results might contain the wrong letters
+                bump_corpus_generation()
+            self.stdout.write('Repaired {} documents, {} failed'.format(self.repaired, self.failed))
+
+    def compare(self, chunk_size, repair=False):
+        """
+        Compare the content hash of every letter with the one in the index, a chunk at a time,
+        and find the documents in the index that aren't letters
+
+        If repair, index the letters that don't match and delete those documents as they're found,
+        so only one chunk of letters is kept in memory
+
+        Return the ids of the letters and documents that don't match, as IndexDrift
+        """
+
+        self.checked = self.repaired = self.failed = 0
+        drift = IndexDrift([], [], [])
+        letters = Letter.objects.select_related('writer', 'recipient', 'place').order_by('pk')
+        for chunk in get_letter_chunks(letters, chunk_size):
+            self.checked += len(chunk)
+            index_hashes = get_index_hashes([letter.pk for letter in chunk])
+            actions, changed_hashes = get_index_actions(chunk, index_hashes)
+            for action in actions:
+                if str(action['_id']) in index_hashes:
+                    drift.stale.append(action['_id'])
+                else:
+                    drift.missing.append(action['_id'])
+            if repair and actions:
+                self.repair(actions, chunk_size, chunk)
+
+        for orphan_ids in iterate_chunks(get_orphan_ids(chunk_size), chunk_size):
+            drift.orphaned.extend(orphan_ids)
+            if repair:
+                self.repair([{'_op_type': 'delete', '_index': Letter._meta.es_index_name, '_id': doc_id}
+                             for doc_id in orphan_ids], chunk_size)
+        return drift
+
+    def report(self, drift, ids_to_report):
+        for problem, ids in zip(['missing from the index', 'out of date in the index', 'orphaned in the index'],
+                                drift):
+            message = '{} {}'.format(len(ids), problem)
+            if ids and ids_to_report:
+                message += ': {}{}'.format(', '.join(str(doc_id) for doc_id in ids[:ids_to_report]),
+                                           ', ...' if len(ids) > ids_to_report else '')
+            self.stdout.write(message)
+
+    def repair(self, actions, chunk_size, letters=()):
+        """
+        Send index and delete actions from compare() to Elasticsearch with bulk requests,
+        count the documents repaired and failed, and store the content hashes of the letters that were indexed
+        """
+
+        indexed = set()
+        for ok, item in streaming_bulk(client=es_settings.ES_BULK_CLIENT, actions=actions, chunk_size=chunk_size,
+                                       raise_on_error=False, raise_on_exception=False):
+            if ok:
+                self.repaired += 1
+                op_type, result = next(iter(item.items()))
+                if op_type == 'index':
+                    indexed.add(result['_id'])
+            else:
+                self.failed += 1
+                self.stderr.write(format_bulk_failure(item))
+        # bulk_update() leaves modified alone, so sync_index won't reindex these letters again
+        Letter.objects.bulk_update([letter for letter in letters if str(letter.pk) in indexed], ['content_hash'])
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from elastic_transport import TransportError
+
+from letters.index_outbox import flush_index_outbox
+
+DEFAULT_INTERVAL = 5
+
+
+class Command(BaseCommand):
+    help = 'Update the Elasticsearch index for the letters that have been saved or deleted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Number of outbox entries to flush in each bulk request '
+                                 '(default: settings.ELASTICSEARCH_OUTBOX_BATCH_SIZE)')
+        parser.add_argument('--refresh', choices=['true', 'false', 'wait_for'], default=None,
+                            help='Refresh policy for the bulk requests '
+                                 '(default: settings.ELASTICSEARCH_OUTBOX_REFRESH)')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running as a worker, flushing the outbox every --interval seconds')
+        parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                            help='Number of seconds to wait between flushes with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                self.flush(options.get('batch_size'), options.get('refresh'))
+            except TransportError as exception:
+                # The entries that weren't flushed are still in the outbox, so a worker just tries again later
+                message = "Couldn't reach Elasticsearch ({}), so the outbox will be flushed later".format(exception)
+                if not options.get('loop'):
+                    raise CommandError(message)
+                self.stderr.write(message)
+            if not options.get('loop'):
+                break
+            time.sleep(options.get('interval', DEFAULT_INTERVAL))
+
+    def flush(self, batch_size, refresh):
+        indexed, deleted, failed = flush_index_outbox(batch_size=batch_size, refresh=refresh)
+        if indexed or deleted or failed:
+            self.stdout.write('Indexed {} letters and deleted {} from the index, {} failed'.format(
+                indexed, deleted, failed))
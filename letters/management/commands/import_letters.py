@@ -0,0 +1,255 @@
+import csv
+import json
+import os
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django_date_extensions.fields import ApproximateDate
+from elastic_transport import TransportError
+
+from letters.index_outbox import flush_entries
+from letters.management.commands.push_to_index import iterate_chunks
+from letters.models import Correspondent, DocumentSource, IndexOutboxEntry, Letter, Place
+from letters.models.place import DEFAULT_COUNTRY
+from letters.models.util import Language
+from letters.search_cache import bump_corpus_generation
+
+DEFAULT_BATCH_SIZE = 500
+FORMATS = ['csv', 'jsonl']
+# Letter fields that get copied from an imported row as they are
+TEXT_FIELDS = ['heading', 'greeting', 'body', 'closing', 'signature', 'ps', 'notes']
+# Fields of an imported row that can be given as JSON true/false or numbers, as well as text
+FLAG_FIELDS = ['complete_transcription']
+TRUE_VALUES = ['1', 'true', 'yes', 'y']
+# yyyy-MM-dd or yyyy-MM or yyyy, like dates in the Elasticsearch index
+IMPORT_DATE_RE = re.compile(r'^\d{4}(-\d{1,2}){0,2}$')
+MARRIED_NAME_RE = re.compile(r'^(?P<first_names>.*?)\s*\((?P<married_name>[^)]*)\)$')
+
+
+class Command(BaseCommand):
+    help = 'Import letters from CSV or JSON Lines files, creating correspondents, places and sources as needed, ' \
+           'and add them to the Elasticsearch index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+',
+                            help='CSV files with a header row, or JSON Lines files with one letter per line. '
+                                 'Columns: source, date (yyyy-MM-dd, yyyy-MM or yyyy), writer, recipient, place, '
+                                 'heading, greeting, body, closing, signature, ps, language, '
+                                 'complete_transcription, notes. Correspondents are given as "Last, First", '
+                                 'places as "Name, ST" or "Name, ST, Country", sources by name')
+        parser.add_argument('--format', choices=FORMATS, default=None,
+                            help='Format of the files (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Number of letters to insert into the database and index at once')
+        parser.add_argument('--source', default=None,
+                            help='Name of the source for letters that don\'t have one')
+
+    def handle(self, *args, **options):
+        start_time = time.monotonic()
+        batch_size = options.get('batch_size', DEFAULT_BATCH_SIZE)
+        self.default_source = options.get('source')
+        self.load_lookups()
+
+        imported = 0
+        skipped = 0
+        failed = 0
+        for file_name in options['files']:
+            rows = self.read_rows(file_name, options.get('format') or self.get_format(file_name))
+            for chunk in iterate_chunks(rows, batch_size):
+                letters = []
+                for line_number, row in chunk:
+                    try:
+                        letters.append(self.get_letter(row))
+                    except ValueError as exception:
+                        skipped += 1
+                        self.stderr.write('Skipped {} line {}: {}'.format(file_name, line_number, exception))
+                batch_imported, batch_failed = self.import_batch(letters)
+                imported += batch_imported
+                failed += batch_failed
+
+        if imported:
+            # Cached search results don't contain the new letters
+            bump_corpus_generation()
+        elapsed = time.monotonic() - start_time
+        self.stdout.write('Imported {} letters in {:.1f} seconds ({:.1f} letters/min), {} skipped, '
+                          '{} not indexed yet'.format(imported, elapsed, imported / elapsed * 60 if elapsed else 0,
+                                                      skipped, failed))
+
+    def get_format(self, file_name):
+        extension = os.path.splitext(file_name)[1].lower().lstrip('.')
+        if extension in ['json', 'jsonl', 'ndjson']:
+            return 'jsonl'
+        if extension == 'csv':
+            return 'csv'
+        raise CommandError("Can't tell the format of {}, so use --format".format(file_name))
+
+    def read_rows(self, file_name, file_format):
+        """
+        Generate the line number and a dict of field values (or a line of JSON) for each letter in the file
+        """
+
+        try:
+            with open(file_name, newline='', encoding='utf-8') as file:
+                if file_format == 'csv':
+                    reader = csv.DictReader(file)
+                    for row in reader:
+                        yield reader.line_num, row
+                else:
+                    # Each line gets parsed by get_letter(), so a bad line only skips one letter
+                    for line_number, line in enumerate(file, start=1):
+                        if line.strip():
+                            yield line_number, line
+        except (OSError, ValueError, csv.Error) as exception:
+            raise CommandError('Unable to read {}: {}'.format(file_name, exception))
+
+    def load_lookups(self):
+        """
+        Load all correspondents, places and sources into dicts keyed by the way they're shown,
+        so resolving them for each letter doesn't take a query
+        """
+
+        self.correspondents = {correspondent.get_display_string(): correspondent
+                               for correspondent in Correspondent.objects.all()}
+        self.places = {str(place): place for place in Place.objects.all()}
+        self.sources = {source.name: source for source in DocumentSource.objects.all()}
+
+    def get_letter(self, row):
+        """
+        Return an unsaved letter for the imported row, with its text,
+        or raise ValueError if the row can't be imported
+
+        The whole row gets validated before any correspondents, places or sources get created for it,
+        so a row that gets skipped doesn't leave any behind
+        """
+
+        if isinstance(row, str):
+            row = json.loads(row)
+            if not isinstance(row, dict):
+                raise ValueError('Expected a JSON object')
+        row = {key.strip().lower(): self.get_row_value(key.strip().lower(), value)
+               for key, value in row.items() if key}
+        for field_name in ['writer', 'recipient', 'place']:
+            if not row.get(field_name):
+                raise ValueError('{} is missing'.format(field_name))
+        language = (row.get('language') or Language.ENGLISH).upper()
+        if language not in Language.values:
+            raise ValueError('Unknown language {}'.format(language))
+        date = self.get_date(row.get('date'))
+        source_name = row.get('source') or self.default_source
+        if not source_name:
+            raise ValueError('source is missing')
+        place_parts = self.get_place_parts(row['place'])
+
+        letter = Letter(
+            date=date,
+            source=self.get_source(source_name),
+            writer=self.get_correspondent(row['writer']),
+            recipient=self.get_correspondent(row['recipient']),
+            place=self.get_place(row['place'], place_parts),
+            language=language,
+            complete_transcription=row.get('complete_transcription', '').lower() in TRUE_VALUES,
+            **{field_name: row.get(field_name) or '' for field_name in TEXT_FIELDS}
+        )
+        # bulk_create() doesn't call save(), which is where text normally gets calculated
+        letter.update_text()
+        return letter
+
+    def get_row_value(self, field_name, value):
+        """
+        Return the value of a field in an imported row as text, or raise ValueError if it's the wrong type,
+        e.g. a number or a list in a JSON object where a name should be
+        """
+
+        if value is None:
+            return ''
+        if isinstance(value, str):
+            return value.strip()
+        if field_name in FLAG_FIELDS and isinstance(value, (bool, int, float)):
+            return str(value).lower()
+        raise ValueError('{} should be text, not {}'.format(field_name, json.dumps(value)))
+
+    def get_date(self, value):
+        if not value:
+            return ''
+        if not IMPORT_DATE_RE.match(value):
+            raise ValueError('Invalid date {}'.format(value))
+        parts = [int(part) for part in value.split('-')]
+        parts += [0] * (3 - len(parts))
+        return ApproximateDate(*parts)
+
+    def get_source(self, name):
+        if name not in self.sources:
+            self.sources[name] = DocumentSource.objects.create(name=name)
+        return self.sources[name]
+
+    def get_correspondent(self, name):
+        """
+        Return the correspondent shown as name, e.g. "Last, First (Married), Jr.", creating it if necessary
+        """
+
+        if name not in self.correspondents:
+            parts = [part.strip() for part in name.split(',')]
+            field_values = {'last_name': parts[0]}
+            if len(parts) > 1:
+                match = MARRIED_NAME_RE.match(parts[1])
+                if match:
+                    field_values.update(match.groupdict())
+                else:
+                    field_values['first_names'] = parts[1]
+            if len(parts) > 2:
+                field_values['suffix'] = ', '.join(parts[2:])
+            self.correspondents[name] = Correspondent.objects.create(**field_values)
+        return self.correspondents[name]
+
+    def get_place_parts(self, name):
+        """
+        Return the name, state and country of the place shown as name, e.g. "Name, ST",
+        or raise ValueError if it isn't a valid place
+        """
+
+        parts = [part.strip() for part in name.split(',')]
+        if len(parts) > 3:
+            raise ValueError('Invalid place {}'.format(name))
+        parts += [''] * (2 - len(parts))
+        if len(parts) < 3:
+            parts.append(DEFAULT_COUNTRY)
+        return parts
+
+    def get_place(self, name, parts):
+        """
+        Return the place shown as name, creating it from parts, as returned by get_place_parts(), if necessary
+        """
+
+        if name not in self.places:
+            place = Place.objects.create(name=parts[0], state=parts[1], country=parts[2])
+            self.places[name] = self.places[str(place)] = place
+        return self.places[name]
+
+    def import_batch(self, letters):
+        """
+        Insert the letters into the database and queue them in the index outbox in one transaction,
+        then index them with one bulk request
+
+        Letters that can't be indexed, even if Elasticsearch can't be reached at all,
+        stay in the outbox for flush_index_outbox to try again
+
+        Return the number of letters imported and the number that couldn't be indexed
+        """
+
+        if not letters:
+            return 0, 0
+        # bulk_create() doesn't call save(), which is where sentiment normally gets calculated
+        Letter.update_sentiment_many(letters)
+        with transaction.atomic():
+            Letter.objects.bulk_create(letters)
+            entries = IndexOutboxEntry.queue_letters([letter.pk for letter in letters])
+        try:
+            indexed, deleted, failed = flush_entries(entries, refresh='false')
+        except TransportError as exception:
+            # The letters have been committed, so keep importing and leave indexing them to the outbox
+            self.stderr.write("Couldn't reach Elasticsearch to index {} letters ({}), so they were left "
+                              'in the outbox'.format(len(letters), exception))
+            failed = len(letters)
+        return len(letters), failed
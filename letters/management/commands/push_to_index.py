@@ -1,38 +1,274 @@
-from django.core.management.base import BaseCommand
-from elasticsearch.helpers import bulk
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import multiprocessing
+import os
+import time
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from elasticsearch.helpers import parallel_bulk
 
 from letters import es_settings
+from letters.elasticsearch import set_index_checkpoint
 from letters.models import Letter
+from letters.models.util import html_to_text
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_THREAD_COUNT = 4
+DEFAULT_VERSIONS_TO_KEEP = 2
+
+# While letters are being loaded into a new index, refreshing and replicating it would only slow things down
+BULK_LOAD_INDEX_SETTINGS = {'refresh_interval': '-1', 'number_of_replicas': 0}
+# Once loading is done, go back to the defaults (None) or whatever is in the index settings
+SERVING_INDEX_SETTINGS = {key: es_settings.settings.get(key) for key in BULK_LOAD_INDEX_SETTINGS}
+
+
+def iterate_chunks(iterable, chunk_size):
+    """
+    Generate lists of up to chunk_size items from iterable
+    """
+
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, chunk_size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, chunk_size))
+
+
+def format_bulk_failure(item):
+    """
+    Return a message for the bulk response item of a letter that couldn't be indexed
+    """
+
+    op_type, result = next(iter(item.items()))
+    return 'Failed to {} letter {}: {}'.format(op_type, result.get('_id'), result.get('error', result.get('status')))
 
 
 class Command(BaseCommand):
+    help = 'Build a new version of the Elasticsearch index with all letters, and switch searches over to it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help='Number of letters to read from the database and send to Elasticsearch at once')
+        parser.add_argument('--thread-count', type=int, default=DEFAULT_THREAD_COUNT,
+                            help='Number of bulk requests to send to Elasticsearch in parallel')
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Number of processes converting letter bodies from html to text '
+                                 '(default: number of CPUs)')
+        parser.add_argument('--keep', type=int, default=DEFAULT_VERSIONS_TO_KEEP,
+                            help='Number of index versions to keep, including the new one, for rolling back')
+        parser.add_argument('--rollback', action='store_true',
+                            help="Don't build a new index, just switch back to the previous version")
+
     def handle(self, *args, **options):
-        self.recreate_index()
-        self.push_db_to_index()
-
-    def recreate_index(self):
-        indices_client = es_settings.ES_CLIENT.indices
-        index_name = Letter._meta.es_index_name
-        if indices_client.exists(index=index_name):
-            indices_client.delete(index=index_name)
+        if options.get('rollback'):
+            self.rollback()
+            return
+
+        index_name = self.create_index()
+        try:
+            self.push_db_to_index(index_name=index_name,
+                                  chunk_size=options.get('chunk_size', DEFAULT_CHUNK_SIZE),
+                                  thread_count=options.get('thread_count', DEFAULT_THREAD_COUNT),
+                                  processes=options.get('processes'))
+            self.finish_index(index_name)
+            self.check_index(index_name)
+        except BaseException:
+            # Searches are still using the old index, so just get rid of the incomplete new one
+            es_settings.ES_BULK_CLIENT.indices.delete(index=index_name)
+            raise
+        self.move_alias(index_name)
+        self.delete_old_versions(options.get('keep', DEFAULT_VERSIONS_TO_KEEP))
+
+    def get_versioned_index_name(self):
+        """
+        Return a name for a new version of the index, which sorts after the names of the older versions
+        """
+
+        return '{}_v{}'.format(Letter._meta.es_index_name, timezone.now().strftime('%Y%m%d%H%M%S'))
+
+    def get_versions(self):
+        """
+        Return the names of all versions of the index, oldest first
+        """
+
+        indices_client = es_settings.ES_BULK_CLIENT.indices
+        return sorted(indices_client.get(index='{}_v*'.format(Letter._meta.es_index_name)).keys())
+
+    def get_current_versions(self):
+        """
+        Return the names of the indices the alias currently points to
+        """
+
+        indices_client = es_settings.ES_BULK_CLIENT.indices
+        alias = Letter._meta.es_index_name
+        if indices_client.exists_alias(name=alias):
+            return list(indices_client.get_alias(name=alias).keys())
+        return []
+
+    def create_index(self):
+        """
+        Create a new version of the index, set up for bulk loading, and return its name
+        """
+
+        indices_client = es_settings.ES_BULK_CLIENT.indices
+        index_name = self.get_versioned_index_name()
+        # Letters saved after this get added to the old index, not this one, so sync_index has to catch up with them
+        synced_at = timezone.now()
         indices_client.create(index=index_name,
-                              settings=es_settings.settings)
+                              settings=dict(es_settings.settings, **BULK_LOAD_INDEX_SETTINGS))
         indices_client.put_mapping(
             properties=Letter._meta.es_mapping['properties'],
             index=index_name
         )
+        set_index_checkpoint(synced_at, index=index_name)
+        return index_name
+
+    def finish_index(self, index_name):
+        """
+        Restore the normal settings of the new index after bulk loading, and make everything in it searchable
+        """
+
+        indices_client = es_settings.ES_BULK_CLIENT.indices
+        indices_client.put_settings(index=index_name, settings=SERVING_INDEX_SETTINGS)
+        indices_client.refresh(index=index_name)
+
+    def check_index(self, index_name):
+        """
+        Raise CommandError if the new index doesn't contain every letter in the database
+        """
+
+        index_count = es_settings.ES_BULK_CLIENT.count(index=index_name)['count']
+        db_count = Letter.objects.count()
+        if index_count != db_count:
+            raise CommandError('{} contains {} letters, but the database contains {}, '
+                               'so searches will keep using the old index'.format(index_name, index_count, db_count))
+
+    def move_alias(self, index_name):
+        """
+        Point the alias that everything else uses as the index name at the given index, in one atomic update
+        """
+
+        indices_client = es_settings.ES_BULK_CLIENT.indices
+        alias = Letter._meta.es_index_name
+        current_versions = self.get_current_versions()
+        if current_versions:
+            actions = [{'remove': {'index': old_index, 'alias': alias}} for old_index in current_versions]
+        elif indices_client.exists(index=alias):
+            # The index from before there were versions has the name the alias needs
+            actions = [{'remove_index': {'index': alias}}]
+        else:
+            actions = []
+        actions.append({'add': {'index': index_name, 'alias': alias}})
+        indices_client.update_aliases(actions=actions)
+        self.stdout.write('{} now points to {}'.format(alias, index_name))
+
+    def delete_old_versions(self, keep):
+        """
+        Delete all but the newest keep versions of the index, never deleting the one currently in use
+        """
+
+        current_versions = self.get_current_versions()
+        versions = self.get_versions()
+        old_versions = [version for version in versions[:-max(keep, 1)] if version not in current_versions]
+        if old_versions:
+            es_settings.ES_BULK_CLIENT.indices.delete(index=','.join(old_versions))
+            self.stdout.write('Deleted old index versions {}'.format(', '.join(old_versions)))
+
+    def rollback(self):
+        """
+        Point the alias back at the version of the index before the current one
+        """
+
+        current_versions = self.get_current_versions()
+        versions = self.get_versions()
+        previous_versions = [version for version in versions if current_versions and version < min(current_versions)]
+        if not previous_versions:
+            raise CommandError('There is no earlier version of the index to roll back to')
+        self.move_alias(previous_versions[-1])
+
+    def push_db_to_index(self, index_name=None, chunk_size=DEFAULT_CHUNK_SIZE, thread_count=DEFAULT_THREAD_COUNT,
+                         processes=None):
+        """
+        Stream letters from the database to the given Elasticsearch index (by default the alias used for searching),
+        converting html to text
+        in a process pool and sending bulk requests in parallel
+
+        Report indexing speed and any letters that couldn't be indexed,
+        and return the number of letters indexed and the number that failed
+        """
+
+        processes = processes or os.cpu_count() or 1
+        indexed = 0
+        failed = 0
+        start_time = time.monotonic()
+
+        # Spawn the worker processes instead of forking, because parallel_bulk() will already have started
+        # its threads when the first letters get converted, and each one has to set up Django for itself
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=django.setup) as executor:
+            actions = self.get_bulk_actions(executor, chunk_size, processes, index_name)
+            for ok, item in parallel_bulk(client=es_settings.ES_BULK_CLIENT, actions=actions,
+                                          chunk_size=chunk_size, thread_count=thread_count,
+                                          raise_on_error=False, raise_on_exception=False):
+                if ok:
+                    indexed += 1
+                else:
+                    failed += 1
+                    self.stderr.write(format_bulk_failure(item))
+
+        elapsed = time.monotonic() - start_time
+        self.stdout.write('Indexed {} letters in {:.1f} seconds ({:.1f} docs/sec), {} failed'.format(
+            indexed, elapsed, indexed / elapsed if elapsed else 0, failed))
+        return indexed, failed
+
+    def get_letters(self):
+        return Letter.objects.select_related('writer', 'recipient', 'place').order_by('pk')
+
+    def get_bulk_actions(self, executor, chunk_size, processes, index_name=None):
+        """
+        Generate a bulk action for every letter, reading letters from the database in chunks
+
+        The bodies of each chunk that haven't been stored as text yet get converted by the process pool
+        while the actions for the previous chunk are being indexed
+        """
+
+        previous = None
+        for letters in iterate_chunks(self.get_letters().iterator(chunk_size=chunk_size), chunk_size):
+            unconverted = [letter.body for letter in letters if letter.contents_text is None]
+            bodies = executor.map(html_to_text, unconverted, chunksize=max(1, len(unconverted) // processes))
+            if previous:
+                yield from self.convert_chunk_for_bulk(*previous, index_name)
+            previous = (letters, bodies)
+        if previous:
+            yield from self.convert_chunk_for_bulk(*previous, index_name)
 
-    def push_db_to_index(self):
-        data = [
-            self.convert_for_bulk(s, 'create') for s in Letter.objects.all()
-            ]
-        bulk(client=es_settings.ES_CLIENT, actions=data, stats_only=True)
+    def convert_chunk_for_bulk(self, letters, bodies, index_name=None):
+        # bodies only contains the letters without stored contents, in the same order
+        bodies = iter(bodies)
+        changed_hashes = []
+        for letter in letters:
+            contents = letter.contents_text
+            if contents is None:
+                contents = letter.contents(body_as_text=next(bodies))
+            stored_hash = letter.content_hash
+            yield self.convert_for_bulk(letter, 'create', index_name=index_name, contents=contents)
+            if letter.content_hash != stored_hash:
+                changed_hashes.append(letter)
+        if changed_hashes:
+            # Store the hashes that were indexed, so sync_index and check_index don't see these letters as changed.
+            # bulk_update() leaves modified alone
+            Letter.objects.bulk_update(changed_hashes, ['content_hash'])
 
-    def convert_for_bulk(self, django_object, action=None):
-        data = django_object.es_repr()
+    def convert_for_bulk(self, django_object, action=None, index_name=None, **field_values):
+        data = django_object.es_repr(**field_values)
+        # The stored content hash is empty for letters that haven't been indexed since it was added,
+        # and out of date for letters whose index update is still in the outbox
+        django_object.content_hash = data['content_hash'] = django_object.get_content_hash(data)
         metadata = {
             '_op_type': action,
-            "_index": django_object._meta.es_index_name,
+            "_index": index_name or django_object._meta.es_index_name,
         }
         data.update(**metadata)
         return data
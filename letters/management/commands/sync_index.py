@@ -0,0 +1,180 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+from elasticsearch.helpers import scan, streaming_bulk
+
+from letters import es_settings
+from letters.elasticsearch import get_index_checkpoint, set_index_checkpoint
+from letters.management.commands.push_to_index import format_bulk_failure, iterate_chunks
+from letters.models import Letter
+from letters.search_cache import bump_corpus_generation
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+def get_letter_chunks(letters, chunk_size):
+    """
+    Generate lists of up to chunk_size of the letters in id order, getting each chunk with a query
+    for the letters after the last one in the chunk before, so later chunks don't get slower
+    and content hashes can be stored while going through them
+    """
+
+    last_pk = 0
+    while True:
+        chunk = list(letters.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def get_index_hashes(letter_ids):
+    """
+    Return a dict of the content hash in the index for each of the letter ids that are in the index,
+    by document id
+    """
+
+    response = es_settings.ES_BULK_CLIENT.mget(index=Letter._meta.es_index_name, ids=letter_ids,
+                                               source=['content_hash'])
+    return {doc['_id']: doc['_source'].get('content_hash') for doc in response['docs'] if doc.get('found')}
+
+
+def get_index_actions(letters, index_hashes):
+    """
+    Compare the content hash of each letter with the one in index_hashes
+
+    Return an index action for each letter whose content hash doesn't match,
+    and the letters whose stored content hash has changed, e.g. because it hadn't been calculated yet
+    """
+
+    actions = []
+    changed_hashes = []
+    for letter in letters:
+        data = letter.es_repr()
+        content_hash = letter.get_content_hash(data)
+        if content_hash != letter.content_hash:
+            letter.content_hash = data['content_hash'] = content_hash
+            changed_hashes.append(letter)
+        if index_hashes.get(str(letter.pk)) != content_hash:
+            data.update(_op_type='index', _index=Letter._meta.es_index_name)
+            actions.append(data)
+    return actions, changed_hashes
+
+
+def get_orphan_ids(chunk_size):
+    """
+    Generate the ids of the documents in the index that aren't letters in the database,
+    scrolling through the index chunk_size documents at a time and looking up each chunk of ids in the database,
+    so neither all the document ids nor all the letter ids have to be kept in memory
+    """
+
+    hits = scan(es_settings.ES_BULK_CLIENT, index=Letter._meta.es_index_name, query={'_source': False},
+                size=chunk_size)
+    for chunk in iterate_chunks((hit['_id'] for hit in hits), chunk_size):
+        # Documents that aren't letters, e.g. 'temp', don't have numeric ids
+        letter_ids = {str(letter_id) for letter_id in Letter.objects.filter(
+            pk__in=[int(doc_id) for doc_id in chunk if doc_id.isdigit()]).values_list('pk', flat=True)}
+        yield from sorted(doc_id for doc_id in chunk if doc_id not in letter_ids)
+
+
+class Command(BaseCommand):
+    help = 'Reindex letters that have changed since the index was last synced, ' \
+           'and delete letters from the index that are no longer in the database'
+    # Number of letters that get_bulk_actions() has compared with the index
+    checked = 0
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help='Number of letters to check and send to Elasticsearch at once')
+        parser.add_argument('--full', action='store_true',
+                            help='Check all letters, not just the ones saved since the last sync')
+
+    def handle(self, *args, **options):
+        index_name = Letter._meta.es_index_name
+        if not es_settings.ES_BULK_CLIENT.indices.exists(index=index_name):
+            raise CommandError("{} doesn't exist yet, so run push_to_index first".format(index_name))
+
+        start_time = time.monotonic()
+        synced_at = timezone.now()
+        checkpoint = None if options.get('full') else get_index_checkpoint()
+        chunk_size = options.get('chunk_size', DEFAULT_CHUNK_SIZE)
+
+        # Add any fields that are new since the index was built
+        es_settings.ES_BULK_CLIENT.indices.put_mapping(index=index_name,
+                                                       properties=Letter._meta.es_mapping['properties'])
+        reindexed, failed = self.reindex_changed_letters(self.get_changed_letters(checkpoint), chunk_size)
+        deleted = self.delete_orphans(chunk_size)
+
+        if reindexed or deleted:
+            # Cached search results might contain the old versions of the letters
+            bump_corpus_generation()
+        if not failed:
+            # Otherwise the letters that failed will be tried again next time
+            set_index_checkpoint(synced_at)
+
+        self.stdout.write('Checked {} letters, reindexed {} and deleted {} from the index in {:.1f} seconds, '
+                          '{} failed'.format(self.checked, reindexed, deleted, time.monotonic() - start_time, failed))
+
+    def get_changed_letters(self, checkpoint):
+        """
+        Return the letters saved since checkpoint, and any letters without a content hash,
+        or all letters if there's no checkpoint
+        """
+
+        letters = Letter.objects.select_related('writer', 'recipient', 'place').order_by('pk')
+        if checkpoint:
+            letters = letters.filter(Q(modified__gte=checkpoint) | Q(content_hash=''))
+        return letters
+
+    def reindex_changed_letters(self, letters, chunk_size):
+        """
+        Reindex the given letters if what's in the index doesn't match them,
+        and return the number of letters reindexed and the number that failed
+        """
+
+        reindexed = 0
+        failed = 0
+        self.checked = 0
+        actions = self.get_bulk_actions(letters, chunk_size)
+        for ok, item in streaming_bulk(client=es_settings.ES_BULK_CLIENT, actions=actions, chunk_size=chunk_size,
+                                       raise_on_error=False, raise_on_exception=False):
+            if ok:
+                reindexed += 1
+            else:
+                failed += 1
+                self.stderr.write(format_bulk_failure(item))
+        return reindexed, failed
+
+    def get_bulk_actions(self, letters, chunk_size):
+        """
+        Generate an index action for each letter whose content hash doesn't match the one in the index,
+        storing content hashes that have changed, e.g. because they hadn't been calculated yet
+        """
+
+        for chunk in get_letter_chunks(letters, chunk_size):
+            self.checked += len(chunk)
+            actions, changed_hashes = get_index_actions(chunk, get_index_hashes([letter.pk for letter in chunk]))
+            yield from actions
+            if changed_hashes:
+                # bulk_update() leaves modified alone, so these letters won't get checked again next time
+                Letter.objects.bulk_update(changed_hashes, ['content_hash'])
+
+    def delete_orphans(self, chunk_size):
+        """
+        Delete letters from the index that aren't in the database anymore, and documents that aren't letters,
+        e.g. a 'temp' document left by an older version, and return the number of documents deleted
+        """
+
+        actions = ({'_op_type': 'delete', '_index': Letter._meta.es_index_name, '_id': orphan_id}
+                   for orphan_id in get_orphan_ids(chunk_size))
+
+        deleted = 0
+        for ok, item in streaming_bulk(client=es_settings.ES_BULK_CLIENT, actions=actions, chunk_size=chunk_size,
+                                       raise_on_error=False, raise_on_exception=False):
+            if ok:
+                deleted += 1
+            else:
+                self.stderr.write(format_bulk_failure(item))
+        return deleted
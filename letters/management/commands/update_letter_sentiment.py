@@ -0,0 +1,173 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from letterpress.exceptions import ElasticsearchException
+from letter_sentiment.custom_sentiment import get_custom_sentiments_to_calculate, get_stored_custom_sentiments
+from letter_sentiment.elasticsearch import calculate_custom_sentiments
+from letter_sentiment.models import CustomSentiment, CustomSentimentScore
+from letters.models import Letter
+from letters.search_cache import bump_corpus_generation
+
+DEFAULT_BATCH_SIZE = 500
+STANDARD_PHASE = 'standard sentiment'
+CUSTOM_PHASE = 'custom sentiments'
+
+
+class Command(BaseCommand):
+    help = 'Calculate and store standard sentiment for letters that have been saved without it, ' \
+           'and optionally custom sentiments'
+    # Id of the last letter whose sentiment has been stored, to continue from if the command gets interrupted,
+    # and whether that was standard sentiment or custom sentiments
+    last_pk = 0
+    phase = STANDARD_PHASE
+    # Number of custom sentiment scores stored
+    custom_count = 0
+    verbosity = 1
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Recalculate sentiment for all letters, not just the ones without it')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Number of letters to update in the database at once')
+        parser.add_argument('--custom', type=int, nargs='*', default=None, metavar='ID',
+                            help='Also calculate and store custom sentiments, all of them or the ones with these ids')
+        parser.add_argument('--start-after', type=int, default=0, metavar='ID',
+                            help='Only update letters with an id greater than this, '
+                                 'to continue where an interrupted --all left off')
+
+    def handle(self, *args, **options):
+        start_time = time.monotonic()
+        update_all = options['all']
+        batch_size = options['batch_size']
+        start_after = options.get('start_after', 0)
+        self.verbosity = options.get('verbosity', 1)
+        custom = options.get('custom') is not None
+        self.last_pk = start_after
+        self.phase = STANDARD_PHASE
+        self.custom_count = 0
+
+        try:
+            count = self.update_sentiment(self.get_letters(update_all, start_after), batch_size)
+            if custom:
+                self.phase = CUSTOM_PHASE
+                self.update_custom_sentiments(self.get_custom_sentiment_ids(options['custom']), update_all,
+                                              batch_size, start_after)
+        except (ElasticsearchException, KeyboardInterrupt) as exception:
+            # Everything up to the last letter has been stored, so cached search results are out of date too
+            bump_corpus_generation()
+            raise CommandError('Stopped after letter {} while storing {} ({}), so {}'.format(
+                self.last_pk, self.phase, str(exception) or 'interrupted', self.get_how_to_continue(custom)))
+
+        if count or self.custom_count:
+            # Cached search results might contain the old sentiment
+            bump_corpus_generation()
+        elapsed = time.monotonic() - start_time
+        rate = count / elapsed * 60 if elapsed else 0
+        self.stdout.write('Updated sentiment for {} letters and stored {} custom sentiment scores '
+                          'in {:.1f} seconds ({:.1f} letters/min)'.format(count, self.custom_count, elapsed, rate))
+
+    def get_how_to_continue(self, custom):
+        """
+        Return how to run the command again to continue after self.last_pk
+
+        --start-after applies to custom sentiments too, so it can't be used to continue standard sentiment
+        without skipping custom sentiments of the letters before it
+        """
+
+        if self.phase == STANDARD_PHASE and custom:
+            return 'run again with --start-after {} and without --custom to continue, ' \
+                   'then with --custom and without --start-after to store custom sentiments'.format(self.last_pk)
+        return 'run again with --start-after {} to continue'.format(self.last_pk)
+
+    def get_letters(self, update_all, start_after=0):
+        letters = Letter.objects.filter(pk__gt=start_after)
+        if not update_all:
+            letters = letters.filter(Q(textblob_polarity__isnull=True) | Q(vader_polarity__isnull=True))
+        return letters.order_by('pk')
+
+    def get_letter_batches(self, letters, batch_size):
+        """
+        Generate lists of up to batch_size letters in id order, getting each batch with a query
+        for the letters after the last one in the batch before, so batches can be saved while going through them
+        """
+
+        last_pk = 0
+        while True:
+            batch = list(letters.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                return
+            yield batch
+            last_pk = batch[-1].pk
+
+    def update_sentiment(self, letters, batch_size):
+        """
+        Calculate sentiment for letters and save it in batches, without saving the rest of the letter
+        and updating the Elasticsearch index, which doesn't contain sentiment
+        """
+
+        count = 0
+        for batch in self.get_letter_batches(letters, batch_size):
+            count += self.save_batch(batch)
+            self.last_pk = batch[-1].pk
+            self.report_progress('letter sentiments', count)
+        return count
+
+    def save_batch(self, letters):
+        # The sentiment of a whole batch gets calculated in the pool of worker processes
+        Letter.update_sentiment_many(letters)
+        Letter.objects.bulk_update(letters, ['textblob_polarity', 'vader_polarity'])
+        return len(letters)
+
+    def get_custom_sentiment_ids(self, custom_sentiment_ids):
+        """
+        Return the ids of the custom sentiments that can be calculated, out of the given ones or all of them
+        """
+
+        if not custom_sentiment_ids:
+            custom_sentiment_ids = list(CustomSentiment.objects.order_by('pk').values_list('pk', flat=True))
+        custom_sentiments, ids_to_calculate = get_custom_sentiments_to_calculate(custom_sentiment_ids)
+        return ids_to_calculate
+
+    def update_custom_sentiments(self, custom_sentiment_ids, update_all, batch_size, start_after=0):
+        """
+        Calculate custom sentiments of letters with Elasticsearch, one multi search per batch,
+        and store them, skipping the ones that are already stored unless update_all
+        """
+
+        self.last_pk = start_after
+        if not custom_sentiment_ids:
+            return
+        letters = Letter.objects.filter(pk__gt=start_after).order_by('pk').only('pk')
+        for batch in self.get_letter_batches(letters, batch_size):
+            letter_ids = [letter.pk for letter in batch]
+            if update_all:
+                missing_letter_ids, missing_sentiment_ids = letter_ids, custom_sentiment_ids
+            else:
+                sentiments, missing_letter_ids, missing_sentiment_ids = get_stored_custom_sentiments(
+                    letter_ids, custom_sentiment_ids)
+            if missing_letter_ids:
+                self.custom_count += self.save_custom_sentiments(
+                    calculate_custom_sentiments(missing_letter_ids, missing_sentiment_ids))
+            self.last_pk = letter_ids[-1]
+            self.report_progress('custom sentiment scores', self.custom_count)
+
+    def save_custom_sentiments(self, sentiments):
+        """
+        Store custom sentiments, given by custom sentiment id and letter id, replacing any that are already stored
+
+        Return the number of scores stored
+        """
+
+        scores = [CustomSentimentScore(custom_sentiment_id=custom_sentiment_id, letter_id=letter_id, score=score)
+                  for custom_sentiment_id, letter_sentiments in sentiments.items()
+                  for letter_id, score in letter_sentiments.items()]
+        CustomSentimentScore.objects.bulk_create(scores, update_conflicts=True,
+                                                 unique_fields=['custom_sentiment', 'letter'],
+                                                 update_fields=['score'])
+        return len(scores)
+
+    def report_progress(self, what, count):
+        if self.verbosity > 1:
+            self.stdout.write('Stored {} {}, through letter {}'.format(count, what, self.last_pk))
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from letters.models import Letter
+
+DEFAULT_BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Convert letter bodies to text and store them with the letter contents, ' \
+           'for letters that have been saved without them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Convert all letters again, not just the ones without stored text')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Number of letters to update in the database at once')
+
+    def handle(self, *args, **options):
+        letters = self.get_letters(options['all'])
+        count = self.update_text(letters, options['batch_size'])
+        self.stdout.write('Updated text for {} letters'.format(count))
+
+    def get_letters(self, update_all):
+        letters = Letter.objects.all()
+        if not update_all:
+            letters = letters.filter(Q(body_text__isnull=True) | Q(contents_text__isnull=True))
+        return letters.order_by('pk')
+
+    def update_text(self, letters, batch_size):
+        """
+        Convert letter bodies to text and save them in batches, without saving the rest of the letter
+        and queueing it for the Elasticsearch index, which already contains the same contents
+        """
+
+        count = 0
+        batch = []
+        for letter in letters.iterator(chunk_size=batch_size):
+            letter.update_text()
+            batch.append(letter)
+            if len(batch) >= batch_size:
+                count += self.save_batch(batch)
+                batch = []
+        if batch:
+            count += self.save_batch(batch)
+        return count
+
+    def save_batch(self, letters):
+        Letter.objects.bulk_update(letters, ['body_text', 'contents_text'])
+        return len(letters)
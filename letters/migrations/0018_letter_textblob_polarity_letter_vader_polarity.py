@@ -0,0 +1,23 @@
+# Generated by Django 4.2.8 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('letters', '0017_alter_envelope_writer_alter_letter_writer_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='letter',
+            name='textblob_polarity',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='letter',
+            name='vader_polarity',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.8 on 2026-10-17 14:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('letters', '0018_letter_textblob_polarity_letter_vader_polarity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='letter',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='letter',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.8 on 2026-10-17 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('letters', '0019_letter_modified_letter_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexOutboxEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('letter_id', models.IntegerField()),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name_plural': 'index outbox entries',
+                'ordering': ['pk'],
+            },
+        ),
+    ]
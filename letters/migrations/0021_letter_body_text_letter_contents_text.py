@@ -0,0 +1,23 @@
+# Generated by Django 4.2.8 on 2026-10-17 08:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('letters', '0020_indexoutboxentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='letter',
+            name='body_text',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='letter',
+            name='contents_text',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -6,3 +6,4 @@ from .document import Document  # noqa
 from .envelope import Envelope  # noqa
 from .letter import Letter  # noqa
 from .misc_document import MiscDocument  # noqa
+from .index_outbox import IndexOutboxEntry  # noqa
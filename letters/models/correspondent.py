@@ -1,6 +1,7 @@
-from django.db import models
+from django.db import models, transaction
 from letters.models import DocumentImage
-from letters.models.util import get_image_preview
+from letters.models.index_outbox import IndexOutboxEntry
+from letters.models.util import get_image_preview, get_loaded_field_values, loaded_field_values_changed
 
 
 class Correspondent(models.Model):
@@ -12,6 +13,17 @@ class Correspondent(models.Model):
     description = models.TextField(blank=True)
     images = models.ManyToManyField(DocumentImage, blank=True)
 
+    # Fields that get_display_string() depends on
+    DISPLAY_FIELDS = ['last_name', 'married_name', 'first_names', 'suffix']
+
+    __original_display_values = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        correspondent = super(Correspondent, cls).from_db(db, field_names, values)
+        correspondent.__original_display_values = get_loaded_field_values(correspondent, cls.DISPLAY_FIELDS)
+        return correspondent
+
     def __str__(self):
         return self.get_display_string()
 
@@ -39,5 +51,21 @@ class Correspondent(models.Model):
     def image_preview(self):
         return get_image_preview(self)
 
+    def save(self, *args, **kwargs):
+        """
+        If the display string has changed, the letters written by or to this correspondent
+        need to be updated in Elasticsearch, because it gets shown in search results,
+        so they get queued in the index outbox in the same transaction
+        """
+
+        is_new = self.pk is None
+        with transaction.atomic():
+            super(Correspondent, self).save(*args, **kwargs)
+            if not is_new and loaded_field_values_changed(self, self.__original_display_values, self.DISPLAY_FIELDS):
+                letter_ids = set(self.letter_writer.values_list('pk', flat=True))
+                letter_ids.update(self.recipient.values_list('pk', flat=True))
+                IndexOutboxEntry.queue_letters(sorted(letter_ids))
+        self.__original_display_values = get_loaded_field_values(self, self.DISPLAY_FIELDS)
+
     class Meta:
         ordering = ['last_name', 'first_names']
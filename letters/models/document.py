@@ -51,9 +51,12 @@ class Document(models.Model):
 
     def index_date(self):
         """
-        Return date in the format yyyy-MM-dd or yyyy-MM or yyyy for elasticsearch index
+        Return date in the format yyyy-MM-dd or yyyy-MM or yyyy for elasticsearch index,
+        or None if undated
         """
 
+        if not self.date:
+            return None
         index_date = str.format('{:0>4}', self.date.year)
         if self.date.month:
             index_date += str.format('-{:0>2}', self.date.month)
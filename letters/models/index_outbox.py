@@ -0,0 +1,32 @@
+from django.db import models
+
+
+class IndexOutboxEntry(models.Model):
+    """
+    Letter that has been saved or deleted and still has to be updated in the Elasticsearch index
+
+    Entries get created in the same transaction as the change to the letter,
+    so if the transaction gets rolled back, the index doesn't get changed either
+    """
+
+    # Not a foreign key, because the letter might not exist anymore
+    letter_id = models.IntegerField()
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['pk']
+        verbose_name_plural = 'index outbox entries'
+
+    @classmethod
+    def queue_letters(cls, letter_ids):
+        """
+        Add letters to the outbox, so they get indexed, or deleted from the index if they don't exist anymore,
+        the next time the outbox is flushed
+
+        Call this inside the transaction that changes the letters, and return the new entries
+        """
+
+        return cls.objects.bulk_create([cls(letter_id=letter_id) for letter_id in letter_ids])
+
+    def __str__(self):
+        return str.format('Letter {0} queued {1}', self.letter_id, self.created)
@@ -1,10 +1,18 @@
-from django.db import models
+from django.db import models, transaction
 from tinymce import models as tinymce_models
 
-from letter_sentiment.sentiment import get_sentiment
-from letters import es_settings
+from letter_sentiment.batch_sentiment import get_polarities
+from letter_sentiment.sentiment import format_standard_sentiment, get_sentiment, get_textblob_polarity, \
+    get_vadersentiment_polarity, polarity_many
 from letters.models import Correspondent, Document, Envelope, Place
-from letters.models.util import get_envelope_preview, html_to_text
+from letters.models.index_outbox import IndexOutboxEntry
+from letters.models.util import get_content_hash, get_envelope_preview, html_to_text
+
+# Fields in the Elasticsearch index that contain what gets shown in search results
+ES_DISPLAY_FIELDS = ['list_date', 'writer_name', 'recipient_name', 'place_name', 'place_id']
+# Fields in the Elasticsearch index that aren't included in the content hash: display fields change
+# with the related Correspondent or Place, and get updated in the index separately
+ES_CONTENT_HASH_EXCLUDED_FIELDS = ['_id', 'content_hash'] + ES_DISPLAY_FIELDS
 
 
 class Letter(Document):
@@ -19,6 +27,17 @@ class Letter(Document):
     ps = models.TextField(null=True, blank=True)
     complete_transcription = models.BooleanField(default=False)
     envelopes = models.ManyToManyField(Envelope, blank=True)
+    # standard sentiment, calculated from letter contents on save, so it doesn't have to be calculated every time
+    textblob_polarity = models.FloatField(null=True, blank=True, editable=False)
+    vader_polarity = models.FloatField(null=True, blank=True, editable=False)
+    # when the letter was last saved, and a hash of what got indexed in Elasticsearch,
+    # so that the index can be synced with just the letters that have changed
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+    content_hash = models.CharField(max_length=64, blank=True, editable=False)
+    # body without html markup and all the parts of the letter put together, stored on save,
+    # so the body doesn't have to be converted from html every time they're needed
+    body_text = models.TextField(null=True, blank=True, editable=False)
+    contents_text = models.TextField(null=True, blank=True, editable=False)
 
     def get_display_string(self):
         return str.format('Letter: {0}, {1} to {2}',
@@ -31,19 +50,76 @@ class Letter(Document):
         return get_envelope_preview(self)
 
     # body without html markup
+    # Letters that haven't been saved since the text started being stored won't have it yet
     def body_as_text(self):
+        if self.body_text is not None:
+            return self.body_text
         return html_to_text(self.body)
 
     # all the separate parts of the letter put together
-    def contents(self):
+    # body_as_text can be given if the body has already been converted to text, e.g. in another process
+    def contents(self, body_as_text=None):
+        if body_as_text is None:
+            if self.contents_text is not None:
+                return self.contents_text
+            body_as_text = self.body_as_text()
         letter_contents = ''
-        for part in [self.heading, self.greeting, self.body_as_text(), self.closing, self.signature, self.ps]:
+        for part in [self.heading, self.greeting, body_as_text, self.closing, self.signature, self.ps]:
             if part:
                 letter_contents += part + '\n'
         return letter_contents
 
     def sentiment(self):
-        return get_sentiment(self.contents())
+        # Letters that haven't been saved since sentiment started being stored won't have it yet
+        if self.textblob_polarity is None or self.vader_polarity is None:
+            return get_sentiment(self.contents())
+        return format_standard_sentiment(self.textblob_polarity, self.vader_polarity)
+
+    def update_text(self):
+        """
+        Convert the body to text and put the letter contents together, and store them in the letter, without saving
+        """
+
+        # Make sure they don't come from what was stored before the letter was changed
+        self.body_text = self.contents_text = None
+        self.body_text = self.body_as_text()
+        self.contents_text = self.contents()
+
+    def update_sentiment(self):
+        """
+        Calculate standard sentiment from letter contents and store it in the letter, without saving
+        """
+
+        text = self.contents()
+        self.textblob_polarity = get_textblob_polarity(text)
+        self.vader_polarity = get_vadersentiment_polarity(text)
+
+    @staticmethod
+    def update_sentiment_many(letters, in_worker_processes=True):
+        """
+        Calculate standard sentiment for all the letters at once, and store it in each letter, without saving
+
+        If in_worker_processes, the letters get analyzed in the pool of worker processes if there are enough of them,
+        which is worth it for batch commands but not while a request is waiting
+        """
+
+        analyze = get_polarities if in_worker_processes else polarity_many
+        for letter, polarity in zip(letters, analyze([letter.contents() for letter in letters])):
+            letter.textblob_polarity = polarity.textblob
+            letter.vader_polarity = polarity.vader
+
+    def get_content_hash(self, es_repr=None):
+        """
+        Return a hash of the letter fields indexed in Elasticsearch, apart from the display fields,
+        to compare with the hash in the index
+
+        es_repr can be given if it has already been generated
+        """
+
+        if es_repr is None:
+            es_repr = self.es_repr()
+        return get_content_hash({field_name: value for field_name, value in es_repr.items()
+                                 if field_name not in ES_CONTENT_HASH_EXCLUDED_FIELDS})
 
     class Meta:
         # elasticsearch index stuff
@@ -74,14 +150,22 @@ class Letter(Document):
                     "ignore_malformed": "false"
                 },
                 "source": {"type": "integer"},
-                "writer": {"type": "integer"}
+                "writer": {"type": "integer"},
+                # Values shown in search results, so they can be rendered without querying the database
+                "list_date": {"type": "keyword", "index": "false"},
+                "writer_name": {"type": "keyword", "index": "false"},
+                "recipient_name": {"type": "keyword", "index": "false"},
+                "place_name": {"type": "keyword", "index": "false"},
+                "place_id": {"type": "integer", "index": "false"},
+                "content_hash": {"type": "keyword", "index": "false"}
             }
         }
 
-    def es_repr(self):
+    def es_repr(self, **field_values):
         """
         Serialize letter fields for Elasticsearch indexing by getting mapping from Meta
-        and generating a representation of each field with field_es_repr
+        and generating a representation of each field with field_es_repr,
+        unless its value has already been calculated and given in field_values
 
         See https://qbox.io/blog/elasticsearch-and-django-bulk-index/
         """
@@ -90,7 +174,10 @@ class Letter(Document):
         mapping = self._meta.es_mapping
         data['_id'] = self.pk
         for field_name in mapping['properties'].keys():
-            data[field_name] = self.field_es_repr(field_name)
+            if field_name in field_values:
+                data[field_name] = field_values[field_name]
+            else:
+                data[field_name] = self.field_es_repr(field_name)
         return data
 
     def field_es_repr(self, field_name):
@@ -130,48 +217,39 @@ class Letter(Document):
     def get_es_source(self):
         return self.source_id
 
-    def save(self, *args, **kwargs):
-        is_new = self.pk
-        super(Letter, self).save(*args, **kwargs)
-        self.create_or_update_in_elasticsearch(is_new=is_new)
+    def get_es_list_date(self):
+        return self.list_date()
 
-    def create_or_update_in_elasticsearch(self, is_new):
-        """
-        If this is a newly-created Letter that hasn't been assigned a pk yet,
-        index it in Elasticsearch
+    def get_es_writer_name(self):
+        return str(self.writer)
+
+    def get_es_recipient_name(self):
+        return str(self.recipient)
 
-        If it's an existing Letter, update the Elasticsearch index
+    def get_es_place_name(self):
+        return str(self.place)
+
+    def es_display_repr(self):
+        """
+        Serialize the letter fields that are shown in search results
         """
 
-        es = es_settings.ES_CLIENT
-        payload = self.es_repr()
-        del payload['_id']
-        if is_new is None:
-            es.create(
-                index=self._meta.es_index_name,
-                id=self.pk,
-                refresh=True,
-                document=payload
-            )
-        else:
-            es.update(
-                index=self._meta.es_index_name,
-                id=self.pk,
-                refresh=True,
-                body={
-                    "doc": payload
-                }
-            )
+        return {field_name: self.field_es_repr(field_name) for field_name in ES_DISPLAY_FIELDS}
+
+    def save(self, *args, **kwargs):
+        self.update_text()
+        self.update_sentiment()
+        # The letter gets queued in the same transaction, so it only gets indexed if the save is committed.
+        # Cached search results get invalidated when the outbox is flushed, after the index has been updated,
+        # so a search in between can't cache the old version of the letter again
+        with transaction.atomic():
+            super(Letter, self).save(*args, **kwargs)
+            # Stored custom sentiment scores were calculated from the old contents
+            self.custom_sentiment_scores.all().delete()
+            IndexOutboxEntry.queue_letters([self.pk])
 
     def delete(self, *args, **kwargs):
         pk = self.pk
-        super(Letter, self).delete(*args, **kwargs)
-        self.delete_from_elasticsearch(pk)
-
-    def delete_from_elasticsearch(self, pk):
-        es = es_settings.ES_CLIENT
-        es.delete(
-            index=self._meta.es_index_name,
-            id=pk,
-            refresh=True,
-        )
+        with transaction.atomic():
+            super(Letter, self).delete(*args, **kwargs)
+            IndexOutboxEntry.queue_letters([pk])
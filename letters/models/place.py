@@ -1,6 +1,9 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.gis.db.models import PointField
 
+from letters.models.index_outbox import IndexOutboxEntry
+from letters.models.util import get_loaded_field_values, loaded_field_values_changed
+
 DEFAULT_COUNTRY = 'US'
 
 
@@ -12,6 +15,17 @@ class Place(models.Model):
     point = PointField(help_text='Represented as (longitude, latitude)', null=True, blank=True)
     notes = models.TextField(blank=True)
 
+    # Fields that __str__() depends on
+    DISPLAY_FIELDS = ['name', 'state', 'country']
+
+    __original_display_values = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        place = super(Place, cls).from_db(db, field_names, values)
+        place.__original_display_values = get_loaded_field_values(place, cls.DISPLAY_FIELDS)
+        return place
+
     def __str__(self):
         desc = self.name
         if self.state:
@@ -20,5 +34,19 @@ class Place(models.Model):
             desc += ', ' + self.country
         return desc
 
+    def save(self, *args, **kwargs):
+        """
+        If the place name has changed, the letters written from this place
+        need to be updated in Elasticsearch, because it gets shown in search results,
+        so they get queued in the index outbox in the same transaction
+        """
+
+        is_new = self.pk is None
+        with transaction.atomic():
+            super(Place, self).save(*args, **kwargs)
+            if not is_new and loaded_field_values_changed(self, self.__original_display_values, self.DISPLAY_FIELDS):
+                IndexOutboxEntry.queue_letters(self.letter_set.order_by('pk').values_list('pk', flat=True))
+        self.__original_display_values = get_loaded_field_values(self, self.DISPLAY_FIELDS)
+
     class Meta:
         ordering = ['name', 'state']
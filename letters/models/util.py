@@ -1,8 +1,14 @@
 # Misc. enums and methods that are used with multiple model
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+
+from django.conf import settings
 from django.db.models import TextChoices
 import django.db.models.options as options
 from django.utils.safestring import mark_safe
-from bs4 import BeautifulSoup
+from lxml import etree
 
 
 class DocType(TextChoices):
@@ -29,15 +35,163 @@ def get_image_preview(obj):
     return mark_safe('&nbsp;'.join(obj.image_tags()))
 
 
+def get_content_hash(data):
+    """
+    Return a SHA-256 hash of the given dict of Elasticsearch field values, which doesn't depend on key order
+    """
+
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+# Strings inside these tags aren't part of the text, the way BeautifulSoup.get_text() leaves them out
+HTML_TO_TEXT_SKIPPED_TAGS = {'script', 'style', 'template', 'rt', 'rp'}
+# Whitespace inside these tags is kept as it is, otherwise a string that's only whitespace
+# gets collapsed into one newline or space, the way BeautifulSoup does it
+HTML_TO_TEXT_PRESERVE_WHITESPACE_TAGS = {'pre', 'textarea'}
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+
+class HtmlToTextTarget:
+    """
+    lxml parser target that collects the text of an html document as it gets parsed,
+    with a newline for every <br>, without building a tree
+    """
+
+    def __init__(self):
+        self.text = []
+        self.strings = []
+        self.skipping = 0
+        self.preserving = 0
+
+    def flush_data(self):
+        # The parser can split a string into several data events, so they get put together at the next tag
+        if not self.strings:
+            return
+        string = ''.join(self.strings)
+        self.strings = []
+        if self.skipping:
+            return
+        if not self.preserving and not string.strip(ASCII_SPACES):
+            string = '\n' if '\n' in string else ' '
+        self.text.append(string)
+
+    def start(self, tag, attrib):
+        self.flush_data()
+        if tag in HTML_TO_TEXT_SKIPPED_TAGS:
+            self.skipping += 1
+        if tag in HTML_TO_TEXT_PRESERVE_WHITESPACE_TAGS:
+            self.preserving += 1
+        if tag == 'br':
+            # make sure we don't lose our line breaks
+            self.text.append('\n')
+
+    def end(self, tag):
+        self.flush_data()
+        if tag in HTML_TO_TEXT_SKIPPED_TAGS:
+            self.skipping -= 1
+        if tag in HTML_TO_TEXT_PRESERVE_WHITESPACE_TAGS:
+            self.preserving -= 1
+
+    def data(self, data):
+        self.strings.append(data)
+
+    # Comments, processing instructions and doctypes aren't part of the text, but they end a string
+    def comment(self, text):
+        self.flush_data()
+
+    def pi(self, target, data=None):
+        self.flush_data()
+
+    def doctype(self, *args):
+        self.flush_data()
+
+    def close(self):
+        self.flush_data()
+        return ''.join(self.text)
+
+
+class LRUCache:
+    """
+    Thread-safe dict that keeps the max_size most recently used items
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def __len__(self):
+        return len(self.items)
+
+
+HTML_TO_TEXT_CACHE = LRUCache(settings.HTML_TO_TEXT_CACHE_SIZE)
+
+
+def convert_html_to_text(html):
+    """
+    Convert the html content to text, with a newline for every <br>, by streaming it through the lxml parser
+
+    The text is the same as BeautifulSoup(html, 'lxml').get_text() with each <br> replaced by a newline
+    """
+
+    parser = etree.HTMLParser(target=HtmlToTextTarget(), recover=True)
+    parser.feed(html)
+    return parser.close()
+
+
 def html_to_text(html):
     """
-    Convert the html content into a beautiful soup object
+    Convert the html content to text, using the text cached for the same content if there is any
+    """
+
+    # Letters can be saved without a body
+    if not html:
+        return ''
+    # Keep a hash of the html as the key, instead of the html itself, which can be long
+    key = hashlib.blake2b(html.encode('utf-8'), digest_size=16).digest()
+    text = HTML_TO_TEXT_CACHE.get(key)
+    if text is None:
+        text = convert_html_to_text(html)
+        HTML_TO_TEXT_CACHE.set(key, text)
+    return text
+
+
+def get_loaded_field_values(instance, field_names):
+    """
+    Return the values of the given fields of a model instance that have been loaded,
+    without querying for deferred ones
+    """
+
+    deferred_fields = instance.get_deferred_fields()
+    return {field_name: getattr(instance, field_name) for field_name in field_names
+            if field_name not in deferred_fields}
+
+
+def loaded_field_values_changed(instance, original_values, field_names):
+    """
+    Return True if any of the given fields of a model instance has been changed since original_values
+    were taken with get_loaded_field_values(), or if there aren't any original values to compare with
     """
 
-    # use 'lxml' instead of 'html.parser' for speed
-    soup = BeautifulSoup(html, 'lxml')
-    # make sure we don't lose our line breaks
-    for br in soup.find_all('br'):
-        br.replace_with('\n')
-    # Get plain text
-    return soup.get_text()
+    if original_values is None:
+        return True
+    return any(field_name not in original_values or value != original_values[field_name]
+               for field_name, value in get_loaded_field_values(instance, field_names).items())
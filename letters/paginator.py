@@ -0,0 +1,13 @@
+from django.core.paginator import Paginator
+
+
+class CountPaginator(Paginator):
+    """
+    Paginator for Elasticsearch results, where only the total number of hits is known
+
+    The object list is a range, so the page links can be drawn without creating
+    an object for every hit, and pages contain the indexes of their hits
+    """
+
+    def __init__(self, count, per_page, orphans=0, allow_empty_first_page=True):
+        super().__init__(range(count), per_page, orphans=orphans, allow_empty_first_page=allow_empty_first_page)
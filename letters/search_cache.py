@@ -0,0 +1,102 @@
+""" Cache for letter search results, invalidated whenever anything that search results depend on changes """
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+CORPUS_GENERATION_KEY = 'letterpress:corpus_generation'
+SEARCH_CACHE_HITS_KEY = 'letterpress:search_cache:hits'
+SEARCH_CACHE_MISSES_KEY = 'letterpress:search_cache:misses'
+
+
+def get_corpus_generation():
+    """
+    Return the current corpus generation, which is part of every search cache key,
+    so bumping it makes all previously cached search results unreachable
+    """
+
+    generation = cache.get(CORPUS_GENERATION_KEY)
+    if generation is None:
+        # Key doesn't exist yet, or has been evicted, so start a generation that can't have been used before
+        cache.add(CORPUS_GENERATION_KEY, get_new_corpus_generation(), timeout=None)
+        generation = cache.get(CORPUS_GENERATION_KEY)
+    return generation
+
+
+def bump_corpus_generation():
+    """
+    Call whenever letters, custom sentiments or anything else that search results depend on change
+
+    Every call sets a new generation instead of incrementing it, so bumps from different processes at the same time
+    can't get lost
+    """
+
+    cache.set(CORPUS_GENERATION_KEY, get_new_corpus_generation(), timeout=None)
+
+
+def get_new_corpus_generation():
+    return time.time_ns()
+
+
+def get_normalized_filter_values(filter_values):
+    """
+    Return filter values in a form that's the same for equivalent searches
+
+    Order of sentiment ids is kept, because that's the order the sentiments are shown in
+    """
+
+    return {
+        'search_text': (filter_values.search_text or '').strip(),
+        'source_ids': sorted(set(filter_values.source_ids)),
+        'writer_ids': sorted(set(filter_values.writer_ids)),
+        'start_date': filter_values.start_date or '',
+        'end_date': filter_values.end_date or '',
+        'words': filter_values.words,
+        'sentiment_ids': filter_values.sentiment_ids,
+        'sort_by': filter_values.sort_by or '',
+    }
+
+
+def get_search_cache_key(filter_values, page_number, size, from_index):
+    search = get_normalized_filter_values(filter_values)
+    search.update({'page_number': max(page_number, 1), 'size': size, 'from_index': from_index})
+    search_hash = hashlib.md5(json.dumps(search, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return str.format('letterpress:search:{0}:{1}', get_corpus_generation(), search_hash)
+
+
+def get_cached_search_result(cache_key):
+    """
+    Return cached search result for cache_key, or None if there isn't one, and count the cache hit or miss
+    """
+
+    search_result = cache.get(cache_key)
+    increment_counter(SEARCH_CACHE_MISSES_KEY if search_result is None else SEARCH_CACHE_HITS_KEY)
+    return search_result
+
+
+def cache_search_result(cache_key, search_result):
+    cache.set(cache_key, search_result, timeout=settings.SEARCH_CACHE_TIMEOUT)
+
+
+def increment_counter(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+
+def get_search_cache_stats():
+    """
+    Return search cache hits, misses and current corpus generation
+    """
+
+    hits = cache.get(SEARCH_CACHE_HITS_KEY, 0)
+    misses = cache.get(SEARCH_CACHE_MISSES_KEY, 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / (hits + misses) if hits + misses else 0,
+        'corpus_generation': get_corpus_generation(),
+    }
@@ -3,17 +3,19 @@ jQuery(document).ready(function ($) {
 
     // If coming back to this page after a letter view, show the search results again
     if (history.state) {
-        search_results.restore(history.state.result, history.state.pagination);
+        search_results.restore(history.state.result, history.state.pagination, history.state.search_cursor);
     }
 
     // Enable going back and forth between pages of search results with back button
     window.addEventListener('popstate', function (event) {
         if (event.state) {
-            search_results.restore(event.state.result, event.state.pagination);
+            search_results.restore(event.state.result, event.state.pagination, event.state.search_cursor);
         }
     }, false);
 
     $("#search_button").click(function () {
+        // New search, so previous point in time and cursors don't apply anymore
+        search_cursor.reset();
         letter_search.do_search(0);
     });
 });
@@ -35,6 +37,9 @@ let letter_search = {
                 sentiments: the_filter_values.sentiments,
                 sort_by: the_filter_values.sort_by,
                 page_number: page_number,
+                pit_id: search_cursor.pit_id,
+                search_after: search_cursor.get(page_number),
+                superseded_pit_id: search_cursor.take_superseded_pit_id(),
             },
             url: "/search/",
             success: function (result) {
@@ -54,6 +59,7 @@ let search_results = {
     show(result, page_number) {
         $('#letters').html(result.letters);
         pagination.set(result.pagination);
+        search_cursor.update(page_number);
         last_page = result.pages;
 
         if (page_number === 0) {
@@ -64,14 +70,16 @@ let search_results = {
 
         var stateObj = {
             result: result,
-            pagination: $('#pagination-top').get(0).innerHTML
+            pagination: $('#pagination-top').get(0).innerHTML,
+            search_cursor: search_cursor.save()
         };
         history.replaceState(stateObj, '', '?page=' + page_number);
     },
 
-    restore(result, pagination_to_restore) {
+    restore(result, pagination_to_restore, search_cursor_to_restore) {
         $('#letters').html(result.letters);
         pagination.set(pagination_to_restore);
+        search_cursor.restore(search_cursor_to_restore);
         last_page = result.pages;
     }
 
@@ -122,3 +130,53 @@ let search_page = {
     }
 
 }
+
+let search_cursor = {
+
+    // Elasticsearch point in time, and search_after cursor for each page number we know of
+    pit_id: '',
+    search_after: {},
+    // Point in time of the previous search, which gets closed with the next search
+    superseded_pit_id: '',
+
+    reset() {
+        this.superseded_pit_id = this.pit_id || this.superseded_pit_id;
+        this.pit_id = '';
+        this.search_after = {};
+    },
+
+    take_superseded_pit_id() {
+        var pit_id = this.superseded_pit_id;
+        this.superseded_pit_id = '';
+        return pit_id;
+    },
+
+    get(page_number) {
+        var cursor = this.search_after[page_number];
+        return cursor ? JSON.stringify(cursor) : '';
+    },
+
+    update(page_number) {
+        // Point in time and cursor for the next page are carried in the pagination links
+        var pages = $('ul#pages.pagination').first();
+        if (pages.length) {
+            this.pit_id = pages.data('pit-id') || '';
+            var next_search_after = pages.data('search-after');
+            if (next_search_after) {
+                this.search_after[Math.max(page_number, 1) + 1] = next_search_after;
+            }
+        }
+    },
+
+    save() {
+        return {pit_id: this.pit_id, search_after: this.search_after};
+    },
+
+    restore(saved_search_cursor) {
+        if (saved_search_cursor) {
+            this.pit_id = saved_search_cursor.pit_id;
+            this.search_after = saved_search_cursor.search_after;
+        }
+    }
+
+}
@@ -1,6 +1,5 @@
 from factory import BUILD_STRATEGY, Faker, SubFactory
 from factory.django import DjangoModelFactory
-from unittest.mock import patch
 
 from letters.models import Correspondent, Document, DocumentImage, DocumentSource, Envelope, Letter, MiscDocument, Place
 
@@ -72,17 +71,6 @@ class LetterFactory(DocumentFactory):
     class Meta:
         model = Letter
 
-    @classmethod
-    @patch.object(Letter, 'create_or_update_in_elasticsearch', autospec=True)
-    def _create(cls, model_class, mock_create_or_update_in_elasticsearch, *args, **kwargs):
-        """
-        Mock create_or_update_in_elasticsearch() so a letter doesn't actually get indexed
-        """
-
-        obj = model_class(*args, **kwargs)
-        obj.save()
-        return obj
-
 
 class MiscDocumentFactory(DocumentFactory):
     """
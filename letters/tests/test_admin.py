@@ -5,7 +5,7 @@ from django.contrib.auth import get_user_model
 from django.test import RequestFactory, TestCase
 
 from letters.admin import LetterAdmin
-from letters.models import Letter
+from letters.models import IndexOutboxEntry, Letter
 from letters.tests.factories import LetterFactory
 
 User = get_user_model()
@@ -16,8 +16,8 @@ class LetterAdminTestCase(TestCase):
     @patch.object(Letter, 'delete', autospec=True)
     def test_delete_queryset(self, mock_delete):
         """
-        delete_queryset() should override Django Admin's delete_queryset action
-        to use model's delete method and update elasticsearch index
+        delete_queryset() should delete all letters in the queryset at once, without calling
+        each letter's delete method, and queue them to be deleted from the elasticsearch index
         """
         modeladmin = LetterAdmin(Letter, site)
 
@@ -25,18 +25,23 @@ class LetterAdminTestCase(TestCase):
         queryset = Letter.objects.all()
         modeladmin.delete_queryset(RequestFactory(), queryset)
 
-        self.assertEqual(mock_delete.call_count, 0,
-                         "delete_selected() shouldn't delete anything if queryset empty")
+        self.assertEqual(IndexOutboxEntry.objects.count(), 0,
+                         "delete_queryset() shouldn't queue anything if queryset empty")
 
         # Now a queryset with objects
-        LetterFactory()
-        LetterFactory()
+        letters = [LetterFactory(), LetterFactory(), LetterFactory()]
+        IndexOutboxEntry.objects.all().delete()
 
-        queryset = Letter.objects.all()
+        queryset = Letter.objects.filter(pk__in=[letters[0].pk, letters[1].pk])
         modeladmin.delete_queryset(RequestFactory(), queryset)
 
-        self.assertEqual(mock_delete.call_count, 2,
+        self.assertEqual(mock_delete.call_count, 0,
+                         "delete_queryset() shouldn't call each letter's delete method")
+        self.assertEqual(list(Letter.objects.all()), [letters[2]],
                          'delete_queryset() should delete all objects in queryset')
+        self.assertEqual(sorted(IndexOutboxEntry.objects.values_list('letter_id', flat=True)),
+                         sorted([letters[0].pk, letters[1].pk]),
+                         'delete_queryset() should queue deleted letters to be deleted from the index')
 
 
 class LetterAdminFormTestCase(TestCase):
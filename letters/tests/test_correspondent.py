@@ -2,8 +2,8 @@ from unittest.mock import patch
 
 from django.test import TestCase
 
-from letters.models import Correspondent
-from letters.tests.factories import CorrespondentFactory
+from letters.models import Correspondent, IndexOutboxEntry
+from letters.tests.factories import CorrespondentFactory, LetterFactory
 
 
 class CorrespondentTestCase(TestCase):
@@ -115,3 +115,43 @@ class CorrespondentTestCase(TestCase):
 
         self.assertEqual(CorrespondentFactory().image_preview(), mock_get_image_preview.return_value,
                          'Correspondent.image_preview() should return value of Correspondent.get_image_preview()')
+
+    def test_save(self):
+        """
+        If Correspondent.get_display_string() has changed, Correspondent.save() should queue
+        the letters written by or to that correspondent in the index outbox
+        """
+
+        # New correspondent shouldn't need any letters updated
+        correspondent = CorrespondentFactory(last_name='Waite', first_names='Elizabeth A.')
+        self.assertFalse(IndexOutboxEntry.objects.exists(),
+                         "Correspondent.save() shouldn't queue any letters for a new correspondent")
+
+        letter_from = LetterFactory(writer=correspondent)
+        letter_to = LetterFactory(recipient=correspondent)
+        LetterFactory()
+        IndexOutboxEntry.objects.all().delete()
+
+        # If nothing shown in search results has changed, letters don't need to be updated
+        correspondent.description = 'Description'
+        correspondent.save()
+        self.assertFalse(IndexOutboxEntry.objects.exists(),
+                         "Correspondent.save() shouldn't queue any letters if display string unchanged")
+
+        correspondent.married_name = 'Howard'
+        correspondent.save()
+        self.assertEqual(
+            sorted(IndexOutboxEntry.objects.values_list('letter_id', flat=True)),
+            sorted([letter_from.pk, letter_to.pk]),
+            'Correspondent.save() should queue letters from and to correspondent if display string changed'
+        )
+
+        # A correspondent loaded with deferred fields shouldn't need them queried to tell if it has changed
+        IndexOutboxEntry.objects.all().delete()
+        with self.assertNumQueries(1):
+            correspondent = Correspondent.objects.only('pk', 'description').get(pk=correspondent.pk)
+        correspondent.description = 'Other description'
+        correspondent.save()
+        self.assertFalse(IndexOutboxEntry.objects.exists(),
+                         "Correspondent.save() shouldn't queue any letters if display fields were deferred "
+                         "and haven't been set")
@@ -187,3 +187,6 @@ class DocumentTestCase(TestCase):
         expected = '1864-06-15'
         self.assertEqual(document.index_date(), expected,
                          "If date with year, month, and day, Document.index_date() should return '{}'".format(expected))
+
+        document = self.model.objects.create(source=self.source, writer=self.writer)
+        self.assertIsNone(document.index_date(), 'If no date, Document.index_date() should return None')
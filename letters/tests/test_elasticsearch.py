@@ -1,16 +1,20 @@
+from datetime import datetime, timezone
 import elasticsearch
 import json
 
 from elastic_transport import ApiResponseMeta
-from unittest.mock import MagicMock, Mock, patch, PropertyMock
+from unittest.mock import AsyncMock, MagicMock, Mock, patch, PropertyMock
 
 from django.test import SimpleTestCase
 
 from letterpress.exceptions import ElasticsearchException
-from letters.elasticsearch import analyze_term, delete_temp_document, do_es_analyze, \
-    do_es_mtermvectors, do_es_search, do_es_termvectors_for_text, get_mtermvectors, get_sentiment_termvector_for_text, \
-    get_stored_fields_for_letter, get_termvector_from_result, index_temp_document, \
-    raise_exception_from_response_error, raise_exception_from_request_error
+from letters.elasticsearch import analyze_term, async_close_point_in_time, async_do_es_msearch, async_do_es_search, \
+    async_get_mtermvectors, async_open_point_in_time, close_point_in_time, do_es_analyze, do_es_msearch, \
+    do_es_mtermvectors, do_es_search, do_es_termvectors_for_text, get_custom_sentiment_termvector_for_text, \
+    get_mtermvectors, get_msearch_request_body, get_index_checkpoint, get_msearch_responses, \
+    get_sentiment_termvector_for_text, get_stored_fields_for_letter, get_termvector_from_result, open_point_in_time, \
+    raise_exception_from_response_error, raise_exception_from_request_error, set_index_checkpoint, \
+    CUSTOM_SENTIMENT_FIELD, INDEX_CHECKPOINT_KEY
 from letters.models import Letter
 
 
@@ -44,19 +48,179 @@ class AnalyzeTermTestCase(SimpleTestCase):
                          "analyze_term() should return empty string if no tokens in return value of do_es_analyze()")
 
 
-class DeleteTempDocumentTestCase(SimpleTestCase):
+class AsyncClosePointInTimeTestCase(SimpleTestCase):
     """
-    delete_temp_document() delete temporarily indexed document from Elasticsearch index
+    async_close_point_in_time(pit_id) should close an Elasticsearch point in time with AsyncElasticsearch,
+    ignoring errors because it might have already expired
     """
 
-    @patch('letters.elasticsearch.ES_CLIENT.delete')
-    def test_delete_temp_document(self, mock_delete):
-        result = delete_temp_document()
+    @patch('letters.elasticsearch.get_es_async_client', autospec=True)
+    async def test_async_close_point_in_time(self, mock_get_es_async_client):
+        mock_close_point_in_time = mock_get_es_async_client.return_value.close_point_in_time = AsyncMock()
 
-        args, kwargs = mock_delete.call_args
-        self.assertEqual(kwargs['id'], 'temp',
-                         "delete_temp_document() should call ES_CLIENT.delete() with 'id' in kwargs")
-        self.assertIsNone(result, "delete_temp_document() shouldn't return anything")
+        result = await async_close_point_in_time('pit_id')
+
+        args, kwargs = mock_close_point_in_time.call_args
+        self.assertEqual(kwargs['id'], 'pit_id',
+                         'async_close_point_in_time() should call AsyncElasticsearch.close_point_in_time() with id')
+        self.assertIsNone(result, "async_close_point_in_time() shouldn't return anything")
+
+        # If point in time doesn't exist anymore, Elasticsearch client NotFoundError should be ignored
+        mock_close_point_in_time.side_effect = elasticsearch.exceptions.NotFoundError('error', '', '')
+        try:
+            await async_close_point_in_time('pit_id')
+        except elasticsearch.exceptions.NotFoundError:
+            self.fail("async_close_point_in_time() shouldn't raise NotFoundError")
+
+
+class AsyncDoEsMsearchTestCase(SimpleTestCase):
+    """
+    async_do_es_msearch(index, searches) should call AsyncElasticsearch multi search with all the searches
+    for the given index, and return the list of responses
+    """
+
+    @patch('letters.elasticsearch.raise_exception_from_request_error', autospec=True)
+    @patch('letters.elasticsearch.get_es_async_client', autospec=True)
+    async def test_async_do_es_msearch(self, mock_get_es_async_client, mock_raise_exception_from_request_error):
+        searches = [{'query': {'match': {'contents': 'horse'}}}]
+        responses = [{'hits': {'hits': []}}]
+        mock_msearch = mock_get_es_async_client.return_value.msearch = AsyncMock(return_value={'responses': responses})
+
+        result = await async_do_es_msearch(index=Letter._meta.es_index_name, searches=searches)
+
+        args, kwargs = mock_msearch.call_args
+        self.assertEqual(kwargs['searches'], [{'index': Letter._meta.es_index_name}, searches[0]],
+                         'async_do_es_msearch() should make Elasticsearch request with a header line for index '
+                         'before each search')
+        self.assertEqual(result, responses,
+                         'async_do_es_msearch() should return responses from Elasticsearch multi search')
+
+        # If there was an Elasticsearch client RequestError, raise_exception_from_request_error() should be called
+        mock_msearch.side_effect = elasticsearch.exceptions.RequestError('error', '', '')
+        await async_do_es_msearch(index=Letter._meta.es_index_name, searches=searches)
+        self.assertEqual(mock_raise_exception_from_request_error.call_count, 1,
+                         'async_do_es_msearch() should call exception_from_request_error if RequestError from msearch')
+
+
+class AsyncDoEsSearchTestCase(SimpleTestCase):
+    """
+    async_do_es_search(index, query) should call AsyncElasticsearch search for the given index and query,
+    and return the result
+    """
+
+    @patch('letters.elasticsearch.raise_exception_from_response_error', autospec=True)
+    @patch('letters.elasticsearch.raise_exception_from_request_error', autospec=True)
+    @patch('letters.elasticsearch.get_es_async_client', autospec=True)
+    async def test_async_do_es_search(self, mock_get_es_async_client, mock_raise_exception_from_request_error,
+                                      mock_raise_exception_from_response_error):
+        query = {'match': {'contents': 'horse'}}
+        mock_search = mock_get_es_async_client.return_value.search = AsyncMock(return_value={'hits': 'response'})
+
+        # If there was no error, search result should be returned
+        pit = {'id': 'pit_id', 'keep_alive': '1m'}
+        response = await async_do_es_search(index=None, query=query, from_offset=5, pit=pit, search_after=[1, 2])
+
+        args, kwargs = mock_search.call_args
+        self.assertEqual((kwargs['query'], kwargs['from_'], kwargs['pit'], kwargs['search_after']),
+                         (query, 5, pit, [1, 2]),
+                         'async_do_es_search() should make Elasticsearch request with query, from_offset, pit and '
+                         'search_after')
+        self.assertEqual(response, {'hits': 'response'},
+                         'async_do_es_search() should return result of Elasticsearch request')
+
+        # If there was an error in the response, raise_exception_from_response_error() should be called
+        mock_search.return_value = {'error': 'Something went wrong'}
+        await async_do_es_search(index=Letter._meta.es_index_name, query=query)
+        args, kwargs = mock_raise_exception_from_response_error.call_args
+        self.assertEqual(args[0], {'error': 'Something went wrong'},
+                         'async_do_es_search() should call raise_exception_from_response_error if error in search '
+                         'response')
+
+        # If there was an Elasticsearch client NotFoundError, raise_exception_from_request_error() should be called
+        mock_search.side_effect = elasticsearch.exceptions.NotFoundError('error', '', '')
+        await async_do_es_search(index=None, query=query, pit=pit)
+        self.assertEqual(mock_raise_exception_from_request_error.call_count, 1,
+                         'async_do_es_search() should call exception_from_request_error if NotFoundError from search')
+
+
+class AsyncGetMtermvectorsTestCase(SimpleTestCase):
+    """
+    async_get_mtermvectors(ids, fields) should call AsyncElasticsearch mtermvectors and return the result
+    """
+
+    @patch('letters.elasticsearch.raise_exception_from_response_error', autospec=True)
+    @patch('letters.elasticsearch.get_es_async_client', autospec=True)
+    async def test_async_get_mtermvectors(self, mock_get_es_async_client, mock_raise_exception_from_response_error):
+        mock_mtermvectors = mock_get_es_async_client.return_value.mtermvectors = AsyncMock(
+            return_value={'docs': []}
+        )
+
+        result = await async_get_mtermvectors(ids=['1', '2'], fields=['contents'])
+
+        args, kwargs = mock_mtermvectors.call_args
+        self.assertEqual((kwargs['index'], kwargs['ids'], kwargs['fields']),
+                         (Letter._meta.es_index_name, ['1', '2'], ['contents']),
+                         'async_get_mtermvectors() should make Elasticsearch request with index, ids and fields')
+        self.assertEqual(result, {'docs': []}, 'async_get_mtermvectors() should return result of Elasticsearch request')
+
+        # If there was an error in the response, raise_exception_from_response_error() should be called
+        mock_mtermvectors.return_value = {'error': 'Something went wrong'}
+        await async_get_mtermvectors(ids=['1', '2'], fields=['contents'])
+        self.assertEqual(mock_raise_exception_from_response_error.call_count, 1,
+                         'async_get_mtermvectors() should call raise_exception_from_response_error if error in '
+                         'response')
+
+
+class AsyncOpenPointInTimeTestCase(SimpleTestCase):
+    """
+    async_open_point_in_time(index, keep_alive) should open an Elasticsearch point in time with AsyncElasticsearch
+    and return its id
+    """
+
+    @patch('letters.elasticsearch.raise_exception_from_request_error', autospec=True)
+    @patch('letters.elasticsearch.get_es_async_client', autospec=True)
+    async def test_async_open_point_in_time(self, mock_get_es_async_client, mock_raise_exception_from_request_error):
+        mock_open_point_in_time = mock_get_es_async_client.return_value.open_point_in_time = AsyncMock(
+            return_value={'id': 'pit_id'}
+        )
+
+        result = await async_open_point_in_time(index=Letter._meta.es_index_name, keep_alive='1m')
+
+        args, kwargs = mock_open_point_in_time.call_args
+        self.assertEqual((kwargs['index'], kwargs['keep_alive']), (Letter._meta.es_index_name, '1m'),
+                         'async_open_point_in_time() should open point in time with index and keep_alive')
+        self.assertEqual(result, 'pit_id', 'async_open_point_in_time() should return point in time id')
+
+        # If there was an Elasticsearch client NotFoundError, raise_exception_from_request_error() should be called
+        mock_open_point_in_time.side_effect = elasticsearch.exceptions.NotFoundError('error', '', '')
+        await async_open_point_in_time(index=Letter._meta.es_index_name, keep_alive='1m')
+        self.assertEqual(mock_raise_exception_from_request_error.call_count, 1,
+                         'async_open_point_in_time() should call exception_from_request_error if NotFoundError')
+
+
+class ClosePointInTimeTestCase(SimpleTestCase):
+    """
+    close_point_in_time(pit_id) should close an Elasticsearch point in time, ignoring errors
+    because it might have already expired
+    """
+
+    def test_close_point_in_time(self):
+        with patch('elasticsearch.Elasticsearch.close_point_in_time', autospec=True) as mock_close_point_in_time:
+            result = close_point_in_time('pit_id')
+
+            args, kwargs = mock_close_point_in_time.call_args
+            self.assertEqual(kwargs['id'], 'pit_id',
+                             'close_point_in_time() should call Elasticsearch.close_point_in_time() with id')
+            self.assertIsNone(result, "close_point_in_time() shouldn't return anything")
+
+        # If point in time doesn't exist anymore, Elasticsearch client NotFoundError should be ignored
+        with patch('elasticsearch.Elasticsearch.close_point_in_time', autospec=True) as mock_close_point_in_time:
+            mock_close_point_in_time.side_effect = elasticsearch.exceptions.NotFoundError('error', '', '')
+
+            try:
+                close_point_in_time('pit_id')
+            except elasticsearch.exceptions.NotFoundError:
+                self.fail("close_point_in_time() shouldn't raise NotFoundError")
 
 
 class DoEsAnalyzeTestCase(SimpleTestCase):
@@ -111,6 +275,65 @@ class DoEsAnalyzeTestCase(SimpleTestCase):
                              'do_es_analyze() should call exception_from_request_error if RequestError from search')
 
 
+class DoEsMsearchTestCase(SimpleTestCase):
+    """
+    do_es_msearch(index, searches) should call Elasticsearch multi search with all the searches for the given index,
+    and return the list of responses
+    """
+
+    @patch('letters.elasticsearch.raise_exception_from_response_error', autospec=True)
+    @patch('letters.elasticsearch.raise_exception_from_request_error', autospec=True)
+    def test_do_es_msearch(self, mock_raise_exception_from_request_error, mock_raise_exception_from_response_error):
+        searches = [{'query': {'match': {'contents': 'horse'}}}, {'query': {'match': {'contents': 'pony'}}}]
+        responses = [{'hits': {'hits': []}}, {'hits': {'hits': []}}]
+
+        # If there was no error, list of responses should be returned
+        with patch(
+            'elasticsearch.Elasticsearch.msearch', autospec=True, return_value={'responses': responses}
+        ) as mock_Elasticsearch_msearch:
+
+            result = do_es_msearch(index=Letter._meta.es_index_name, searches=searches)
+
+            args, kwargs = mock_Elasticsearch_msearch.call_args
+            self.assertEqual(
+                kwargs['searches'],
+                [{'index': Letter._meta.es_index_name}, searches[0], {'index': Letter._meta.es_index_name},
+                 searches[1]],
+                'do_es_msearch() should make Elasticsearch request with a header line for index before each search'
+            )
+            self.assertEqual(result, responses,
+                             'do_es_msearch() should return responses from Elasticsearch multi search')
+
+        # If one of the searches failed, ElasticsearchException should be raised
+        error_responses = [{'hits': {'hits': []}},
+                           {'error': {'root_cause': [{'reason': 'Something went wrong'}]}, 'status': 400}]
+        with patch('elasticsearch.Elasticsearch.msearch', autospec=True, return_value={'responses': error_responses}):
+            with self.assertRaises(ElasticsearchException):
+                do_es_msearch(index=Letter._meta.es_index_name, searches=searches)
+
+        # If there was an error in the response, raise_exception_from_response_error() should be called
+        response_mock = MagicMock()
+        with patch('elasticsearch.Elasticsearch.msearch', autospec=True, return_value=response_mock):
+            do_es_msearch(index=Letter._meta.es_index_name, searches=searches)
+
+            args, kwargs = mock_raise_exception_from_response_error.call_args
+            self.assertEqual(
+                args[0], response_mock,
+                'do_es_msearch() should call raise_exception_from_response_error if error in msearch response'
+            )
+
+        # If there was an Elasticsearch client RequestError, raise_exception_from_request_error() should be called
+        with patch('elasticsearch.Elasticsearch.msearch', autospec=True) as mock_Elasticsearch_msearch:
+            mock_Elasticsearch_msearch.side_effect = elasticsearch.exceptions.RequestError('error', '', '')
+
+            do_es_msearch(index=Letter._meta.es_index_name, searches=searches)
+
+            self.assertEqual(
+                mock_raise_exception_from_request_error.call_count, 1,
+                'do_es_msearch() should call exception_from_request_error if RequestError from msearch'
+            )
+
+
 class DoEsMtermvectorsTestCase(SimpleTestCase):
     """
     Return the results of Elasticsearch mtermvector request for the given query
@@ -206,6 +429,15 @@ class DoEsSearchTestCase(SimpleTestCase):
             self.assertTrue('hits' in response,
                             'do_es_search() should return result of Elasticsearch request')
 
+            # Point in time and search_after should be passed on to Elasticsearch.search
+            pit = {'id': 'pit_id', 'keep_alive': '1m'}
+            do_es_search(index=None, query=query, pit=pit, search_after=[1, 2], track_total_hits=True)
+            args, kwargs = mock_Elasticsearch_search.call_args
+            self.assertEqual((kwargs['pit'], kwargs['search_after'], kwargs['track_total_hits']),
+                             (pit, [1, 2], True),
+                             'do_es_search() should make Elasticsearch request with pit, search_after and '
+                             'track_total_hits')
+
         # If there was an error in the response, raise_exception_from_response_error() should be called
         with patch.object(
             elasticsearch.Elasticsearch, 'search', autospec=True, return_value=response_mock
@@ -301,6 +533,61 @@ class DoEsTermvectorsForTextTestCase(SimpleTestCase):
             )
 
 
+class GetIndexCheckpointTestCase(SimpleTestCase):
+    """
+    get_index_checkpoint() should return the time stored in the _meta of the index mapping,
+    or None if there isn't one
+    """
+
+    @patch('letters.elasticsearch.ES_CLIENT.indices.get_mapping')
+    def test_get_index_checkpoint(self, mock_get_mapping):
+        synced_at = datetime(2024, 1, 1, 12, 30, tzinfo=timezone.utc)
+        mock_get_mapping.return_value = {
+            'letterpress_v1': {'mappings': {'_meta': {INDEX_CHECKPOINT_KEY: synced_at.isoformat()}}}
+        }
+        self.assertEqual(get_index_checkpoint(), synced_at,
+                         'get_index_checkpoint() should return the time stored in the index mapping')
+        args, kwargs = mock_get_mapping.call_args
+        self.assertEqual(kwargs['index'], Letter._meta.es_index_name,
+                         'get_index_checkpoint() should get the mapping of the Letter index by default')
+
+        mock_get_mapping.return_value = {'letterpress_v1': {'mappings': {'properties': {}}}}
+        self.assertIsNone(get_index_checkpoint(),
+                          "get_index_checkpoint() should return None if there's no time in the index mapping")
+
+
+class GetMsearchRequestBodyTestCase(SimpleTestCase):
+    """
+    get_msearch_request_body(index, searches) should return request body for multi search,
+    with a header for index before each search
+    """
+
+    def test_get_msearch_request_body(self):
+        searches = [{'query': 'query1'}, {'query': 'query2'}]
+
+        self.assertEqual(get_msearch_request_body('index', searches),
+                         [{'index': 'index'}, searches[0], {'index': 'index'}, searches[1]],
+                         'get_msearch_request_body() should return header for index before each search')
+
+
+class GetMsearchResponsesTestCase(SimpleTestCase):
+    """
+    get_msearch_responses(response) should return the list of responses from multi search,
+    or raise ElasticsearchException if any of them contains an error
+    """
+
+    def test_get_msearch_responses(self):
+        responses = [{'hits': {'hits': []}}]
+        self.assertEqual(get_msearch_responses({'responses': responses}), responses,
+                         'get_msearch_responses() should return list of responses')
+
+        error_responses = [{'error': {'root_cause': [{'reason': 'Something went wrong'}]}, 'status': 400}]
+        with self.assertRaises(ElasticsearchException) as context:
+            get_msearch_responses({'responses': error_responses})
+        self.assertEqual((context.exception.error, context.exception.status), ('Something went wrong', 400),
+                         'get_msearch_responses() should raise ElasticsearchException with error reason and status')
+
+
 class GetMtermvectorsTestCase(SimpleTestCase):
     """
     get_mtermvectors(ids, fields) should build an Elasticsearch query, using ids and fields,
@@ -325,6 +612,39 @@ class GetMtermvectorsTestCase(SimpleTestCase):
                          'get_mtermvectors() should return the return value of do_es_mtermvectors()')
 
 
+class GetCustomSentimentTermvectorForTextTestCase(SimpleTestCase):
+    """
+    get_custom_sentiment_termvector_for_text(text) should get the term vector of text as the custom sentiment field
+    of an artificial document, with term and field statistics, and return it
+    """
+
+    @patch('letters.elasticsearch.raise_exception_from_response_error', autospec=True)
+    @patch('letters.elasticsearch.ES_CLIENT.termvectors')
+    def test_get_custom_sentiment_termvector_for_text(self, mock_termvectors,
+                                                      mock_raise_exception_from_response_error):
+        text = 'air plant offal'
+        termvector = {'field_statistics': {'doc_count': 2}, 'terms': {'offal': {'term_freq': 1}}}
+        mock_termvectors.return_value = {'term_vectors': {CUSTOM_SENTIMENT_FIELD: termvector}}
+
+        result = get_custom_sentiment_termvector_for_text(text)
+
+        args, kwargs = mock_termvectors.call_args
+        self.assertEqual(kwargs['doc'], {'contents': text},
+                         'get_custom_sentiment_termvector_for_text() should get term vector of text as contents')
+        self.assertEqual(kwargs['fields'], [CUSTOM_SENTIMENT_FIELD],
+                         'get_custom_sentiment_termvector_for_text() should get term vector of custom sentiment field')
+        self.assertTrue(kwargs['term_statistics'] and kwargs['field_statistics'],
+                        'get_custom_sentiment_termvector_for_text() should get term and field statistics')
+        self.assertEqual(result, termvector,
+                         'get_custom_sentiment_termvector_for_text() should return term vector of the field')
+
+        # If there are no term vectors in the response, raise_exception_from_response_error() should be called
+        mock_termvectors.return_value = {'error': 'error'}
+        get_custom_sentiment_termvector_for_text(text)
+        self.assertEqual(mock_raise_exception_from_response_error.call_count, 1,
+                         'get_custom_sentiment_termvector_for_text() should raise exception if no term vectors')
+
+
 class GetSentimentTermvectorForTextTestCase(SimpleTestCase):
     """
     get_sentiment_termvector_for_text(text) should call do_es_termvectors_for_text() and return the result
@@ -350,30 +670,36 @@ class GetSentimentTermvectorForTextTestCase(SimpleTestCase):
 
 class GetStoredFieldsForLetterTestCase(SimpleTestCase):
     """
-    get_stored_fields_for_letter() should make a request to ES_LETTER_URL with stored_fields and letter_id
-    and return the json response
+    get_stored_fields_for_letter() should get the letter with the given id from Elasticsearch
+    with stored_fields and return the response, or the body of the response if the letter isn't in the index
     """
 
-    def test_get_stored_fields_for_letter(self):
-
-        response_text = {'stored_fields': 'stored fields'}
-
-        with patch(
-            'requests.get', autospec=True, return_value=Mock(text=json.dumps(response_text), status_code=200)
-        ) as mock_requests_get:
-
-            letter_id = 123
-            stored_fields = ['name', 'date']
-
-            result = get_stored_fields_for_letter(letter_id, stored_fields)
-            args, kwargs = mock_requests_get.call_args
-            self.assertTrue(str(letter_id) in args[0],
-                            'get_stored_fields_for_letter() should make request to url containing letter_id')
-            for stored_field in stored_fields:
-                self.assertTrue(stored_field in args[0],
-                                'get_stored_fields_for_letter() should make request to url containing stored_fields')
-            self.assertEqual(result, response_text,
-                             'get_stored_fields_for_letter() should return response.text from Elasticsearch request')
+    @patch('letters.elasticsearch.ES_CLIENT.get')
+    def test_get_stored_fields_for_letter(self, mock_get):
+        response = {'_id': '123', 'found': True, 'fields': {'contents.word_count': [42]}}
+        mock_get.return_value = response
+
+        letter_id = 123
+        stored_fields = ['name', 'date']
+
+        result = get_stored_fields_for_letter(letter_id, stored_fields)
+        args, kwargs = mock_get.call_args
+        self.assertEqual(kwargs['id'], letter_id,
+                         'get_stored_fields_for_letter() should call ES_CLIENT.get() with letter_id')
+        self.assertEqual(kwargs['stored_fields'], stored_fields,
+                         'get_stored_fields_for_letter() should call ES_CLIENT.get() with stored_fields')
+        self.assertEqual(kwargs['index'], Letter._meta.es_index_name,
+                         'get_stored_fields_for_letter() should call ES_CLIENT.get() with the Letter index')
+        self.assertEqual(result, response,
+                         'get_stored_fields_for_letter() should return response from ES_CLIENT.get()')
+
+        # If the letter isn't in the index, the body of the response should be returned
+        not_found = {'_id': '123', 'found': False}
+        mock_get.side_effect = elasticsearch.exceptions.NotFoundError(
+            message='Not found', meta=Mock(status=404), body=not_found)
+        result = get_stored_fields_for_letter(letter_id, stored_fields)
+        self.assertEqual(result, not_found,
+                         "get_stored_fields_for_letter() should return body of response if letter isn't found")
 
 
 class GetTermvectorFromResultTestCase(SimpleTestCase):
@@ -396,24 +722,33 @@ class GetTermvectorFromResultTestCase(SimpleTestCase):
                          "If ['term_vectors']['contents']['terms'] in result, terms should be returned")
 
 
-class IndexTempDocumentTestCase(SimpleTestCase):
+class OpenPointInTimeTestCase(SimpleTestCase):
     """
-    index_temp_document(text) should temporarily index a document to use elasticsearch to calculate
-    custom sentiment score for a piece of arbitrary text
+    open_point_in_time(index, keep_alive) should open an Elasticsearch point in time and return its id
     """
 
-    @patch('letters.elasticsearch.ES_CLIENT.index')
-    def test_index_temp_document(self, mock_index):
-        text = 'normcore unicorn'
+    @patch('letters.elasticsearch.raise_exception_from_request_error', autospec=True)
+    def test_open_point_in_time(self, mock_raise_exception_from_request_error):
+        with patch('elasticsearch.Elasticsearch.open_point_in_time', autospec=True,
+                   return_value={'id': 'pit_id'}) as mock_open_point_in_time:
+            result = open_point_in_time(index=Letter._meta.es_index_name, keep_alive='1m')
+
+            args, kwargs = mock_open_point_in_time.call_args
+            self.assertEqual((kwargs['index'], kwargs['keep_alive']), (Letter._meta.es_index_name, '1m'),
+                             'open_point_in_time() should call Elasticsearch.open_point_in_time() with index and '
+                             'keep_alive')
+            self.assertEqual(result, 'pit_id', 'open_point_in_time() should return point in time id')
 
-        result = index_temp_document(text)
+        # If there was an Elasticsearch client NotFoundError, raise_exception_from_request_error() should be called
+        with patch('elasticsearch.Elasticsearch.open_point_in_time', autospec=True) as mock_open_point_in_time:
+            mock_open_point_in_time.side_effect = elasticsearch.exceptions.NotFoundError('error', '', '')
 
-        args, kwargs = mock_index.call_args
-        self.assertEqual(kwargs['id'], 'temp',
-                         "test_index_temp_document(text) should call ES_CLIENT.index() with 'id' in kwargs")
-        self.assertEqual(kwargs['body'], {'contents': text},
-                         'test_index_temp_document(text) should call ES_CLIENT.index() with text in one of the kwargs')
-        self.assertIsNone(result, "test_index_temp_document(text) shouldn't return anything")
+            open_point_in_time(index=Letter._meta.es_index_name, keep_alive='1m')
+
+            self.assertEqual(
+                mock_raise_exception_from_request_error.call_count, 1,
+                'open_point_in_time() should call exception_from_request_error if NotFoundError'
+            )
 
 
 class RaiseExceptionFromResponseErrorTestCase(SimpleTestCase):
@@ -472,3 +807,20 @@ class RaiseExceptionFromRequestErrorTestCase(SimpleTestCase):
             raise_exception_from_request_error(request_error)
         self.assertEqual(context.exception.error, 'FooError')
         self.assertEqual(context.exception.status, 400)
+
+
+class SetIndexCheckpointTestCase(SimpleTestCase):
+    """
+    set_index_checkpoint() should store the given time in the _meta of the index mapping
+    """
+
+    @patch('letters.elasticsearch.ES_CLIENT.indices.put_mapping')
+    def test_set_index_checkpoint(self, mock_put_mapping):
+        synced_at = datetime(2024, 1, 1, 12, 30, tzinfo=timezone.utc)
+
+        set_index_checkpoint(synced_at, index='letterpress_v1')
+        args, kwargs = mock_put_mapping.call_args
+        self.assertEqual(kwargs['index'], 'letterpress_v1',
+                         'set_index_checkpoint() should put the mapping of the given index')
+        self.assertEqual(kwargs['meta'], {INDEX_CHECKPOINT_KEY: synced_at.isoformat()},
+                         'set_index_checkpoint() should store the time in the _meta of the mapping')
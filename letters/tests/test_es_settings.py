@@ -0,0 +1,141 @@
+from elastic_transport import AsyncTransport, ConnectionError, ConnectionTimeout, NodeConfig, Transport
+from unittest.mock import Mock, patch
+
+from django.test import SimpleTestCase, override_settings
+
+from letters.es_settings import ES_BULK_CLIENT, ES_CLIENT, AsyncBackoffTransport, BackoffTransport, \
+    get_retry_backoff
+
+
+def get_response(status):
+    return Mock(meta=Mock(status=status))
+
+
+def get_async_transport():
+    # Creating an AsyncTransport the normal way requires aiohttp,
+    # but perform_request() only needs the retry options
+    transport = AsyncBackoffTransport.__new__(AsyncBackoffTransport)
+    transport.max_retries = 3
+    transport.retry_on_status = (429, 502, 503, 504)
+    transport.retry_on_timeout = True
+    return transport
+
+
+class ESClientTestCase(SimpleTestCase):
+    """
+    ES_CLIENT should use BackoffTransport, and ES_BULK_CLIENT should share its transport
+    """
+
+    def test_es_client(self):
+        self.assertIsInstance(ES_CLIENT.transport, BackoffTransport,
+                              'ES_CLIENT should use BackoffTransport')
+        self.assertIs(ES_BULK_CLIENT.transport, ES_CLIENT.transport,
+                      'ES_BULK_CLIENT should use the same transport, and connection pool, as ES_CLIENT')
+
+
+@override_settings(ELASTICSEARCH_RETRY_BACKOFF_FACTOR=0.5, ELASTICSEARCH_MAX_RETRY_BACKOFF=3)
+class GetRetryBackoffTestCase(SimpleTestCase):
+    """
+    get_retry_backoff(retries) should return the number of seconds to wait before the next retry,
+    doubling each time, up to settings.ELASTICSEARCH_MAX_RETRY_BACKOFF
+    """
+
+    def test_get_retry_backoff(self):
+        self.assertEqual([get_retry_backoff(retries) for retries in range(5)], [0.5, 1, 2, 3, 3],
+                         'get_retry_backoff() should double the backoff each time, up to the maximum')
+
+
+@patch('letters.es_settings.time.sleep', autospec=True)
+class BackoffTransportTestCase(SimpleTestCase):
+    """
+    BackoffTransport.perform_request() should retry requests that time out, fail to connect,
+    or return a status in retry_on_status, up to max_retries times, sleeping in between
+    """
+
+    def test_perform_request(self, mock_sleep):
+        max_retries = 3
+        transport = BackoffTransport([NodeConfig('http', 'localhost', 9200)],
+                                     max_retries=max_retries, retry_on_timeout=True)
+
+        # Successful request doesn't get retried
+        with patch.object(Transport, 'perform_request', autospec=True,
+                          return_value=get_response(200)) as mock_perform_request:
+            response = transport.perform_request('GET', '/')
+            self.assertEqual(response.meta.status, 200,
+                             'BackoffTransport.perform_request() should return response')
+            self.assertEqual(mock_perform_request.call_count, 1,
+                             "BackoffTransport.perform_request() shouldn't retry successful request")
+            args, kwargs = mock_perform_request.call_args
+            self.assertEqual(kwargs['max_retries'], 0,
+                             'BackoffTransport.perform_request() should turn off retrying in Transport')
+            self.assertEqual(mock_sleep.call_count, 0,
+                             "BackoffTransport.perform_request() shouldn't sleep if request isn't retried")
+
+        # Retry after a connection error, then return successful response
+        with patch.object(Transport, 'perform_request', autospec=True,
+                          side_effect=[ConnectionError('Oops'), get_response(503), get_response(200)]) \
+                as mock_perform_request:
+            response = transport.perform_request('GET', '/')
+            self.assertEqual(response.meta.status, 200,
+                             'BackoffTransport.perform_request() should return response after retrying')
+            self.assertEqual(mock_perform_request.call_count, 3,
+                             'BackoffTransport.perform_request() should retry after connection error or 503')
+            self.assertEqual([args[0] for args, kwargs in mock_sleep.call_args_list],
+                             [get_retry_backoff(0), get_retry_backoff(1)],
+                             'BackoffTransport.perform_request() should sleep longer before each retry')
+        mock_sleep.reset_mock()
+
+        # Give up after max_retries and return the last response
+        with patch.object(Transport, 'perform_request', autospec=True,
+                          return_value=get_response(503)) as mock_perform_request:
+            response = transport.perform_request('GET', '/')
+            self.assertEqual(response.meta.status, 503,
+                             'BackoffTransport.perform_request() should return last response after max_retries')
+            self.assertEqual(mock_perform_request.call_count, max_retries + 1,
+                             'BackoffTransport.perform_request() should retry max_retries times')
+
+        # Give up after max_retries and raise the last error
+        with patch.object(Transport, 'perform_request', autospec=True,
+                          side_effect=ConnectionTimeout('Too slow')) as mock_perform_request:
+            with self.assertRaises(ConnectionTimeout):
+                transport.perform_request('GET', '/')
+            self.assertEqual(mock_perform_request.call_count, max_retries + 1,
+                             'BackoffTransport.perform_request() should retry timeout max_retries times')
+
+        # Retry options for the request override the transport's own
+        with patch.object(Transport, 'perform_request', autospec=True,
+                          side_effect=ConnectionTimeout('Too slow')) as mock_perform_request:
+            with self.assertRaises(ConnectionTimeout):
+                transport.perform_request('GET', '/', retry_on_timeout=False)
+            self.assertEqual(mock_perform_request.call_count, 1,
+                             "BackoffTransport.perform_request() shouldn't retry timeout if retry_on_timeout is False")
+
+
+@patch('letters.es_settings.asyncio.sleep', autospec=True)
+class AsyncBackoffTransportTestCase(SimpleTestCase):
+    """
+    AsyncBackoffTransport.perform_request() should retry requests the same way as BackoffTransport,
+    sleeping with asyncio.sleep() in between
+    """
+
+    async def test_perform_request(self, mock_sleep):
+        transport = get_async_transport()
+
+        with patch.object(AsyncTransport, 'perform_request', autospec=True,
+                          side_effect=[ConnectionTimeout('Too slow'), get_response(429), get_response(200)]) \
+                as mock_perform_request:
+            response = await transport.perform_request('GET', '/')
+            self.assertEqual(response.meta.status, 200,
+                             'AsyncBackoffTransport.perform_request() should return response after retrying')
+            self.assertEqual(mock_perform_request.call_count, 3,
+                             'AsyncBackoffTransport.perform_request() should retry after timeout or 429')
+            self.assertEqual([args[0] for args, kwargs in mock_sleep.call_args_list],
+                             [get_retry_backoff(0), get_retry_backoff(1)],
+                             'AsyncBackoffTransport.perform_request() should sleep longer before each retry')
+
+        with patch.object(AsyncTransport, 'perform_request', autospec=True,
+                          side_effect=ConnectionError('Oops')) as mock_perform_request:
+            with self.assertRaises(ConnectionError):
+                await transport.perform_request('GET', '/', max_retries=1)
+            self.assertEqual(mock_perform_request.call_count, 2,
+                             'AsyncBackoffTransport.perform_request() should use max_retries for the request')
@@ -0,0 +1,187 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+from elastic_transport import ConnectionError
+
+from letters.index_outbox import flush_entries, flush_index_outbox, get_index_outbox_stats, get_outbox_action
+from letters.models import IndexOutboxEntry, Letter
+from letters.tests.factories import LetterFactory
+
+
+def get_bulk_results(actions, failed_ids=()):
+    """
+    Return the results streaming_bulk() would return for actions, with the letters in failed_ids failing
+    """
+
+    results = []
+    for action in actions:
+        letter_id = action['_id']
+        ok = letter_id not in failed_ids
+        results.append((ok, {action['_op_type']: {'_id': str(letter_id), 'status': 200 if ok else 500}}))
+    return results
+
+
+class FlushEntriesTestCase(TestCase):
+    """
+    flush_entries() should update the index for the letters of the given outbox entries in one bulk request,
+    store their content hashes, and delete the entries that are done
+    """
+
+    def setUp(self):
+        self.letters = [LetterFactory(body='I take my pen in hand') for _ in range(2)]
+        self.deleted_letter_id = max(letter.pk for letter in self.letters) + 1
+        IndexOutboxEntry.objects.all().delete()
+        IndexOutboxEntry.queue_letters([letter.pk for letter in self.letters] + [self.deleted_letter_id])
+
+    @patch('letters.index_outbox.streaming_bulk', autospec=True)
+    def test_flush_entries(self, mock_streaming_bulk):
+        mock_streaming_bulk.side_effect = lambda **kwargs: get_bulk_results(kwargs['actions'])
+
+        result = flush_entries(list(IndexOutboxEntry.objects.all()), refresh='wait_for')
+
+        self.assertEqual(result, (2, 1, 0), 'flush_entries() should return numbers of letters indexed, deleted, failed')
+        args, kwargs = mock_streaming_bulk.call_args
+        self.assertEqual(kwargs['refresh'], 'wait_for', 'flush_entries() should use the given refresh policy')
+        self.assertEqual([action['_op_type'] for action in kwargs['actions']], ['index', 'index', 'delete'],
+                         "flush_entries() should index existing letters, and delete the ones that don't exist")
+        self.assertEqual(IndexOutboxEntry.objects.count(), 0, 'flush_entries() should delete the entries that are done')
+        for letter in self.letters:
+            self.assertEqual(Letter.objects.get(pk=letter.pk).content_hash, letter.get_content_hash(),
+                             'flush_entries() should store the content hashes of the letters indexed')
+
+    @patch('letters.index_outbox.streaming_bulk', autospec=True)
+    def test_flush_entries_failed(self, mock_streaming_bulk):
+        """
+        Entries for letters that failed should stay in the outbox
+        """
+
+        failed_id = self.letters[0].pk
+        mock_streaming_bulk.side_effect = lambda **kwargs: get_bulk_results(kwargs['actions'], failed_ids=[failed_id])
+
+        result = flush_entries(list(IndexOutboxEntry.objects.all()), refresh='false')
+
+        self.assertEqual(result, (1, 1, 1), 'flush_entries() should count letters that failed')
+        self.assertEqual(list(IndexOutboxEntry.objects.values_list('letter_id', flat=True)), [failed_id],
+                         'flush_entries() should leave entries for letters that failed in the outbox')
+
+    @patch('letters.index_outbox.streaming_bulk', autospec=True)
+    def test_flush_entries_not_in_index(self, mock_streaming_bulk):
+        """
+        Deleting a letter that isn't in the index shouldn't count as a failure
+        """
+
+        mock_streaming_bulk.return_value = [
+            (False, {'delete': {'_id': str(self.deleted_letter_id), 'status': 404}})
+        ]
+
+        result = flush_entries(list(IndexOutboxEntry.objects.filter(letter_id=self.deleted_letter_id)), refresh='false')
+
+        self.assertEqual(result, (0, 1, 0),
+                         "flush_entries() should count letter that wasn't in the index as deleted")
+        self.assertFalse(IndexOutboxEntry.objects.filter(letter_id=self.deleted_letter_id).exists(),
+                         "flush_entries() should delete entry for letter that wasn't in the index")
+
+    @patch('letters.index_outbox.streaming_bulk', autospec=True)
+    def test_flush_entries_connection_error(self, mock_streaming_bulk):
+        """
+        If Elasticsearch can't be reached, all the entries should stay in the outbox
+        """
+
+        mock_streaming_bulk.side_effect = ConnectionError('Connection refused')
+
+        with self.assertRaises(ConnectionError):
+            flush_entries(list(IndexOutboxEntry.objects.all()), refresh='false')
+        self.assertEqual(IndexOutboxEntry.objects.count(), 3,
+                         "flush_entries() shouldn't delete any entries if Elasticsearch can't be reached")
+
+
+class FlushIndexOutboxTestCase(TestCase):
+    """
+    flush_index_outbox() should flush the outbox in batches, with the refresh policy from settings by default
+    """
+
+    @override_settings(ELASTICSEARCH_OUTBOX_BATCH_SIZE=2, ELASTICSEARCH_OUTBOX_REFRESH='false')
+    @patch('letters.index_outbox.bump_corpus_generation', autospec=True)
+    @patch('letters.index_outbox.flush_entries', autospec=True)
+    def test_flush_index_outbox(self, mock_flush_entries, mock_bump_corpus_generation):
+        IndexOutboxEntry.queue_letters([1, 2, 3])
+        mock_flush_entries.return_value = (1, 0, 0)
+
+        result = flush_index_outbox()
+
+        self.assertEqual(mock_flush_entries.call_count, 2,
+                         'flush_index_outbox() should flush entries in batches of ELASTICSEARCH_OUTBOX_BATCH_SIZE')
+        args, kwargs = mock_flush_entries.call_args
+        self.assertEqual(args[1], 'false',
+                         'flush_index_outbox() should use ELASTICSEARCH_OUTBOX_REFRESH by default')
+        self.assertEqual(result, (2, 0, 0),
+                         'flush_index_outbox() should return the total numbers of letters indexed, deleted, failed')
+        self.assertEqual(mock_bump_corpus_generation.call_count, 1,
+                         'flush_index_outbox() should call bump_corpus_generation() if the index changed')
+
+        # Refresh policy can be given
+        mock_flush_entries.reset_mock()
+        flush_index_outbox(batch_size=10, refresh='true')
+        args, kwargs = mock_flush_entries.call_args
+        self.assertEqual(args[1], 'true', 'flush_index_outbox() should use the given refresh policy')
+
+    @patch('letters.index_outbox.bump_corpus_generation', autospec=True)
+    @patch('letters.index_outbox.flush_entries', autospec=True)
+    def test_flush_index_outbox_connection_error(self, mock_flush_entries, mock_bump_corpus_generation):
+        """
+        If Elasticsearch stops responding, the error should be raised,
+        after invalidating cached search results for the batches that were flushed before that
+        """
+
+        IndexOutboxEntry.queue_letters([1, 2, 3])
+        mock_flush_entries.side_effect = [(1, 0, 0), ConnectionError('Connection refused')]
+
+        with self.assertRaises(ConnectionError):
+            flush_index_outbox(batch_size=2)
+        self.assertEqual(mock_bump_corpus_generation.call_count, 1,
+                         'flush_index_outbox() should invalidate cached search results for batches already flushed')
+
+
+class GetIndexOutboxStatsTestCase(TestCase):
+    """
+    get_index_outbox_stats() should return the number of entries in the outbox,
+    and how long the oldest one has been waiting
+    """
+
+    def test_get_index_outbox_stats(self):
+        self.assertEqual(get_index_outbox_stats(), {'pending': 0, 'oldest_queued': None, 'lag_seconds': 0},
+                         'get_index_outbox_stats() should return no lag if the outbox is empty')
+
+        IndexOutboxEntry.queue_letters([1, 2])
+        oldest = IndexOutboxEntry.objects.first()
+        oldest.created -= timedelta(minutes=1)
+        oldest.save()
+
+        stats = get_index_outbox_stats()
+        self.assertEqual(stats['pending'], 2, 'get_index_outbox_stats() should return number of entries in outbox')
+        self.assertEqual(stats['oldest_queued'], oldest.created.isoformat(),
+                         'get_index_outbox_stats() should return when the oldest entry was queued')
+        self.assertGreaterEqual(stats['lag_seconds'], 60,
+                                'get_index_outbox_stats() should return how long the oldest entry has been waiting')
+
+
+class GetOutboxActionTestCase(TestCase):
+    """
+    get_outbox_action() should return an index action with the content hash for a letter,
+    or a delete action if the letter doesn't exist
+    """
+
+    def test_get_outbox_action(self):
+        letter = LetterFactory(body='I take my pen in hand')
+
+        action = get_outbox_action(letter.pk, letter)
+        self.assertEqual(action['_op_type'], 'index', 'get_outbox_action() should return index action for a letter')
+        self.assertEqual(action['_index'], Letter._meta.es_index_name,
+                         'get_outbox_action() should return action for the Letter index')
+        self.assertEqual(action['content_hash'], letter.get_content_hash(),
+                         'get_outbox_action() should return action with the content hash of the letter')
+
+        self.assertEqual(get_outbox_action(123, None),
+                         {'_op_type': 'delete', '_index': Letter._meta.es_index_name, '_id': 123},
+                         "get_outbox_action() should return delete action if the letter doesn't exist")
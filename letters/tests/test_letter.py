@@ -2,10 +2,16 @@ from django_date_extensions.fields import ApproximateDate
 
 from unittest.mock import patch
 
+from django.db import transaction
 from django.test import TestCase
 
-from letters.es_settings import ES_CLIENT
-from letters.models import Letter
+from letter_sentiment.models import CustomSentimentScore
+from letter_sentiment.sentiment import Polarity
+from letter_sentiment.tests.factories import CustomSentimentFactory
+from letters.models import IndexOutboxEntry, Letter
+from letters.models.letter import ES_DISPLAY_FIELDS
+from letters.models.util import html_to_text
+from letters.search_cache import get_corpus_generation
 from letters.tests.factories import CorrespondentFactory, DocumentSourceFactory, LetterFactory, PlaceFactory
 
 
@@ -87,6 +93,13 @@ class LetterTestCase(TestCase):
         self.assertEqual(body_as_text, mock_html_to_text.return_value,
                          'Letter.body_as_text() should return value of html_to_text(letter)')
 
+        # Once the text has been stored, the body shouldn't get converted again
+        mock_html_to_text.reset_mock()
+        letter.body_text = 'stored text'
+        self.assertEqual(letter.body_as_text(), 'stored text', 'Letter.body_as_text() should return stored text')
+        self.assertEqual(mock_html_to_text.call_count, 0,
+                         "Letter.body_as_text() shouldn't call html_to_text() if text is stored")
+
     @patch.object(Letter, 'body_as_text', autospec=True)
     def test_contents(self, mock_body_as_text):
         """
@@ -118,24 +131,121 @@ class LetterTestCase(TestCase):
         self.assertEqual(LetterFactory().contents(), '',
                          'If letter is completely blank, Letter.contents() should return empty string')
 
+        # If the body has already been converted to text, body_as_text() shouldn't get called
+        mock_body_as_text.reset_mock()
+        self.assertIn('Already converted', letter.contents(body_as_text='Already converted'),
+                      'Letter.contents() should include body_as_text, if given')
+        self.assertEqual(mock_body_as_text.call_count, 0,
+                         "Letter.contents() shouldn't call Letter.body_as_text() if body_as_text is given")
+
+        # If the contents have been stored, they should be returned as they are
+        letter.contents_text = 'Stored contents'
+        self.assertEqual(letter.contents(), 'Stored contents', 'Letter.contents() should return stored contents')
+        self.assertEqual(mock_body_as_text.call_count, 0,
+                         "Letter.contents() shouldn't call Letter.body_as_text() if contents are stored")
+
     @patch.object(Letter, 'contents', autospec=True)
     @patch('letters.models.letter.get_sentiment', autospec=True)
-    def test_sentiment(self, mock_get_sentiment, mock_contents):
+    @patch('letters.models.letter.format_standard_sentiment', autospec=True)
+    def test_sentiment(self, mock_format_standard_sentiment, mock_get_sentiment, mock_contents):
         """
-        Letter.sentiment() should return get_sentiment(letter.contents())
+        Letter.sentiment() should return stored sentiment formatted by format_standard_sentiment(),
+        or get_sentiment(letter.contents()) if sentiment hasn't been stored
         """
 
         mock_contents.return_value = 'contents'
         mock_get_sentiment.return_value = 'sentiment'
+        mock_format_standard_sentiment.return_value = 'stored sentiment'
 
         letter = LetterFactory()
+        letter.textblob_polarity = 0.25
+        letter.vader_polarity = -0.25
+
+        sentiment = letter.sentiment()
+        args, kwargs = mock_format_standard_sentiment.call_args
+        self.assertEqual(args, (0.25, -0.25),
+                         'Letter.sentiment() should call format_standard_sentiment() with stored polarities')
+        self.assertEqual(sentiment, mock_format_standard_sentiment.return_value,
+                         'Letter.sentiment() should return value of format_standard_sentiment() if sentiment stored')
+        self.assertEqual(mock_get_sentiment.call_count, 0,
+                         "Letter.sentiment() shouldn't call get_sentiment() if sentiment stored")
+
+        letter.vader_polarity = None
 
         sentiment = letter.sentiment()
         args, kwargs = mock_get_sentiment.call_args
         self.assertEqual(args[0], mock_contents.return_value,
-                         'Letter.sentiment() should call get_sentiment(letter.contents())')
+                         'Letter.sentiment() should call get_sentiment(letter.contents()) if sentiment not stored')
         self.assertEqual(sentiment, mock_get_sentiment.return_value,
-                         'Letter.sentiment() should return value of get_sentiment(letter.contents())')
+                         'Letter.sentiment() should return value of get_sentiment(letter.contents()) if not stored')
+
+    @patch.object(Letter, 'contents', autospec=True, return_value='contents')
+    @patch('letters.models.letter.get_textblob_polarity', autospec=True, return_value=0.5)
+    @patch('letters.models.letter.get_vadersentiment_polarity', autospec=True, return_value=-0.5)
+    def test_update_sentiment(self, mock_get_vadersentiment_polarity, mock_get_textblob_polarity, mock_contents):
+        """
+        Letter.update_sentiment() should store TextBlob and vaderSentiment polarities of letter.contents()
+        """
+
+        letter = Letter()
+        letter.update_sentiment()
+
+        args, kwargs = mock_get_textblob_polarity.call_args
+        self.assertEqual(args[0], mock_contents.return_value,
+                         'Letter.update_sentiment() should call get_textblob_polarity(letter.contents())')
+        args, kwargs = mock_get_vadersentiment_polarity.call_args
+        self.assertEqual(args[0], mock_contents.return_value,
+                         'Letter.update_sentiment() should call get_vadersentiment_polarity(letter.contents())')
+        self.assertEqual((letter.textblob_polarity, letter.vader_polarity), (0.5, -0.5),
+                         'Letter.update_sentiment() should store polarities in letter')
+
+    @patch('letters.models.letter.get_polarities', autospec=True)
+    def test_update_sentiment_many(self, mock_get_polarities):
+        """
+        Letter.update_sentiment_many() should store the TextBlob and vaderSentiment polarities
+        of the contents of all the letters, calculated at once
+        """
+
+        letters = [Letter(greeting='Dear sister'), Letter(greeting='Miss Evey')]
+        mock_get_polarities.return_value = [Polarity(0.5, -0.5), Polarity(0.1, 0.2)]
+
+        Letter.update_sentiment_many(letters)
+
+        args, kwargs = mock_get_polarities.call_args
+        self.assertEqual(args[0], [letter.contents() for letter in letters],
+                         'Letter.update_sentiment_many() should call get_polarities() with contents of all letters')
+        self.assertEqual([(letter.textblob_polarity, letter.vader_polarity) for letter in letters],
+                         [(0.5, -0.5), (0.1, 0.2)], 'Letter.update_sentiment_many() should store polarities in letters')
+
+        # Without worker processes, the letters should be analyzed with polarity_many() in this process
+        mock_get_polarities.reset_mock()
+        with patch('letters.models.letter.polarity_many', autospec=True) as mock_polarity_many:
+            mock_polarity_many.return_value = [Polarity(0.3, 0.4), Polarity(0.1, 0.2)]
+            Letter.update_sentiment_many(letters, in_worker_processes=False)
+        self.assertEqual(mock_get_polarities.call_count, 0,
+                         "Letter.update_sentiment_many() shouldn't use worker processes unless in_worker_processes")
+        self.assertEqual((letters[0].textblob_polarity, letters[0].vader_polarity), (0.3, 0.4),
+                         'Letter.update_sentiment_many() should store polarities calculated by polarity_many()')
+
+    def test_update_text(self):
+        """
+        Letter.update_text() should store body converted to text and letter contents,
+        converting the body again even if the text was already stored
+        """
+
+        letter = Letter(greeting='Dear sister', body='<p>I take my pen in hand</p>', body_text='old text',
+                        contents_text='old contents')
+        letter.update_text()
+
+        self.assertEqual(letter.body_text, html_to_text(letter.body),
+                         'Letter.update_text() should store body converted to text')
+        self.assertEqual(letter.contents_text, 'Dear sister\n' + html_to_text(letter.body) + '\n',
+                         'Letter.update_text() should store letter contents')
+
+        letter = LetterFactory(body='<p>Wish you were here</p>')
+        letter = Letter.objects.get(pk=letter.pk)
+        self.assertEqual(letter.body_text, 'Wish you were here', 'Letter.save() should store body converted to text')
+        self.assertEqual(letter.contents_text, 'Wish you were here\n', 'Letter.save() should store letter contents')
 
     @patch.object(Letter, 'field_es_repr', autospec=True)
     def test_es_repr(self, mock_field_es_repr):
@@ -151,6 +261,32 @@ class LetterTestCase(TestCase):
         self.assertGreater(mock_field_es_repr.call_count, 0,
                            'Letter.es_repr() should call Letter.field_es_repr() at least once')
 
+        # Values that have already been calculated shouldn't get calculated again
+        mock_field_es_repr.reset_mock()
+        data = letter.es_repr(contents='Already converted')
+        self.assertEqual(data['contents'], 'Already converted',
+                         'Letter.es_repr() should use the value given for a field')
+        self.assertNotIn('contents', [args[1] for args, kwargs in mock_field_es_repr.call_args_list],
+                         "Letter.es_repr() shouldn't call Letter.field_es_repr() for a field whose value is given")
+
+    def test_get_content_hash(self):
+        """
+        Letter.get_content_hash() should return a hash of the fields indexed in Elasticsearch,
+        apart from the display fields
+        """
+
+        letter = LetterFactory(date=ApproximateDate(1862, 1, 1), body='As this is the beginin of a new year')
+        es_repr = letter.es_repr()
+        content_hash = letter.get_content_hash()
+
+        self.assertEqual(content_hash, letter.get_content_hash(es_repr),
+                         'Letter.get_content_hash() should give the same hash for es_repr given or generated')
+        for field_name in ['_id', 'content_hash'] + ES_DISPLAY_FIELDS:
+            self.assertEqual(letter.get_content_hash(dict(es_repr, **{field_name: 'changed'})), content_hash,
+                             "Letter.get_content_hash() shouldn't depend on '{}'".format(field_name))
+        self.assertNotEqual(letter.get_content_hash(dict(es_repr, contents='changed')), content_hash,
+                            'Letter.get_content_hash() should depend on letter contents')
+
     @patch.object(Letter, 'get_es_contents', autospec=True)
     @patch.object(Letter, 'get_es_date', autospec=True)
     @patch.object(Letter, 'get_es_writer', autospec=True)
@@ -253,79 +389,124 @@ class LetterTestCase(TestCase):
         self.assertEqual(letter.get_es_source(), letter.source.id,
                          'Letter.get_es_source() should return Letter.source.id')
 
-    @patch.object(Letter, 'create_or_update_in_elasticsearch', autospec=True)
-    def test_save(self, mock_create_or_update_in_elasticsearch):
+    @patch.object(Letter, 'list_date', autospec=True)
+    def test_get_es_list_date(self, mock_list_date):
         """
-        Letter.save() should call Letter.create_or_update_in_elasticsearch()
+        Letter.get_es_list_date() should return Letter.list_date()
+        """
+
+        mock_list_date.return_value = 'list date'
+
+        self.assertEqual(LetterFactory().get_es_list_date(), mock_list_date.return_value,
+                         'Letter.get_es_list_date() should return Letter.list_date()')
+
+    def test_get_es_writer_name(self):
+        """
+        Letter.get_es_writer_name() should return str(Letter.writer)
+        """
+
+        letter = LetterFactory()
+        self.assertEqual(letter.get_es_writer_name(), str(letter.writer),
+                         'Letter.get_es_writer_name() should return str(Letter.writer)')
+
+    def test_get_es_recipient_name(self):
+        """
+        Letter.get_es_recipient_name() should return str(Letter.recipient)
+        """
+
+        letter = LetterFactory()
+        self.assertEqual(letter.get_es_recipient_name(), str(letter.recipient),
+                         'Letter.get_es_recipient_name() should return str(Letter.recipient)')
+
+    def test_get_es_place_name(self):
+        """
+        Letter.get_es_place_name() should return str(Letter.place)
+        """
+
+        letter = LetterFactory(place=PlaceFactory(name='Manassas Junction'))
+        self.assertEqual(letter.get_es_place_name(), str(letter.place),
+                         'Letter.get_es_place_name() should return str(Letter.place)')
+
+    def test_es_display_repr(self):
+        """
+        Letter.es_display_repr() should return a dict with the fields shown in search results
+        """
+
+        letter = LetterFactory()
+
+        data = letter.es_display_repr()
+        self.assertEqual(sorted(data.keys()), sorted(ES_DISPLAY_FIELDS),
+                         'Letter.es_display_repr() should return a dict with the fields shown in search results')
+        self.assertEqual(data['place_id'], letter.place_id,
+                         "Letter.es_display_repr() should return a dict with 'place_id' = letter.place_id")
+
+    def test_save(self):
+        """
+        Letter.save() should queue the letter in the index outbox, in the same transaction as the save
         """
 
         letter = Letter(writer=CorrespondentFactory(), recipient=CorrespondentFactory(), source=DocumentSourceFactory(),
                         place=PlaceFactory())
         letter.save()
-        args, kwargs = mock_create_or_update_in_elasticsearch.call_args
-        self.assertIsNone(kwargs['is_new'],
-                          'Letter.save() should call create_or_update_in_elasticsearch(None) on Letter creation')
+        self.assertEqual(list(IndexOutboxEntry.objects.values_list('letter_id', flat=True)), [letter.pk],
+                         'Letter.save() should queue the letter in the index outbox')
 
-        letter.save()
-        args, kwargs = mock_create_or_update_in_elasticsearch.call_args
-        self.assertIsNotNone(kwargs['is_new'],
-                             'Letter.save() should call create_or_update_in_elasticsearch(None) on Letter update')
+        # If the transaction gets rolled back, the letter shouldn't stay queued
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                letter.save()
+                raise ValueError('Something went wrong')
+        self.assertEqual(IndexOutboxEntry.objects.count(), 1,
+                         "Letter.save() shouldn't queue the letter if the transaction gets rolled back")
 
-    # We don't want to be messing with the real Elasticsearch index,
-    # so patch this in case something goes wrong with the mocks
-    @patch('letters.models.Letter._meta.es_index_name', 'letterpress_test')
-    @patch.object(Letter, 'es_repr', autospec=True)
-    @patch.object(ES_CLIENT, 'create')
-    @patch.object(ES_CLIENT, 'update')
-    def test_create_or_update_in_elasticsearch(self, mock_update, mock_create, mock_es_repr):
+    def test_save_deletes_custom_sentiment_scores(self):
         """
-        If this is a newly-created Letter that hasn't been assigned a pk yet,
-        it should get indexed in Elasticsearch
-
-        If it's an existing Letter, Elasticsearch index should get updated
+        Letter.save() should delete the letter's stored custom sentiment scores, because its contents might have changed
         """
 
         letter = LetterFactory()
-        letter.create_or_update_in_elasticsearch(is_new=None)
+        CustomSentimentScore.objects.create(custom_sentiment=CustomSentimentFactory(), letter=letter, score=0.5)
 
-        self.assertEqual(mock_es_repr.call_count, 1,
-                         'Letter.create_or_update_in_elasticsearch() should call Letter.es_repr()')
+        letter.save()
+        self.assertFalse(letter.custom_sentiment_scores.exists(),
+                         "Letter.save() should delete the letter's stored custom sentiment scores")
 
-        # When create_or_update_in_elasticsearch() called with is_new = None, ES_CLIENT.create() should get called
-        self.assertEqual(
-            mock_create.call_count, 1,
-            'When create_or_update_in_elasticsearch(is_new=None) called, ES_CLIENT.create() should get called'
-        )
+    @patch.object(Letter, 'update_sentiment', autospec=True)
+    def test_save_update_sentiment(self, mock_update_sentiment):
+        """
+        Letter.save() should call Letter.update_sentiment(), so stored sentiment always matches letter contents
+        """
 
-        # When create_or_update_in_elasticsearch() called with is_new not None, ES_CLIENT.update() should get called
-        letter.create_or_update_in_elasticsearch(is_new=letter.pk)
-        self.assertEqual(
-            mock_update.call_count, 1,
-            'When create_or_update_in_elasticsearch(is_new=not None) called, ES_CLIENT.mock_update() should get called'
-        )
+        letter = LetterFactory()
+        mock_update_sentiment.reset_mock()
+
+        letter.save()
+        self.assertEqual(mock_update_sentiment.call_count, 1, 'Letter.save() should call Letter.update_sentiment()')
 
-    @patch.object(Letter, 'delete_from_elasticsearch', autospec=True)
-    def test_delete(self, mock_delete_from_elasticsearch):
+    def test_delete(self):
         """
-        Letter.delete() should call delete_from_elasticsearch(letter.pk)
+        Letter.delete() should queue the letter in the index outbox, so it gets deleted from the index
         """
 
-        letter = Letter(pk=1, writer=CorrespondentFactory(), recipient=CorrespondentFactory())
+        letter = LetterFactory()
         letter_pk = letter.pk
+        IndexOutboxEntry.objects.all().delete()
         letter.delete()
 
-        args, kwargs = mock_delete_from_elasticsearch.call_args
-        self.assertEqual(args[1], letter_pk, 'Letter.delete() should call delete_from_elasticsearch(letter.pk)')
+        self.assertEqual(list(IndexOutboxEntry.objects.values_list('letter_id', flat=True)), [letter_pk],
+                         'Letter.delete() should queue the letter in the index outbox')
 
-    @patch.object(ES_CLIENT, 'delete')
-    def test_delete_from_elasticsearch(self, mock_delete):
+    def test_save_and_delete_leave_corpus_generation(self):
         """
-        Letter.delete_from_elasticsearch() should call ES_CLIENT.delete()
+        Letter.save() and Letter.delete() shouldn't invalidate cached search results, because the index
+        hasn't been updated yet, so that gets left to the index outbox
         """
 
         letter = LetterFactory()
-        letter.delete_from_elasticsearch(letter.pk)
+        generation = get_corpus_generation()
+
+        letter.save()
+        self.assertEqual(get_corpus_generation(), generation, "Letter.save() shouldn't bump corpus generation")
 
-        args, kwargs = mock_delete.call_args
-        self.assertEqual(kwargs['id'], letter.pk,
-                         'Letter.delete_from_elasticsearch() should call ES_CLIENT.delete()')
+        letter.delete()
+        self.assertEqual(get_corpus_generation(), generation, "Letter.delete() shouldn't bump corpus generation")
@@ -1,13 +1,24 @@
 from collections import namedtuple
 from unittest.mock import patch
 
+from django.core.cache import cache
+from django.template.loader import render_to_string
 from django.test import RequestFactory, SimpleTestCase, TestCase
 
-from letters.letter_search import do_letter_search, get_doc_highlights, get_date_query, get_doc_word_count, \
-    get_filter_conditions_for_query, get_highlight_options, get_letter_match_query, get_letter_sentiments, \
-    get_letter_word_count, get_multiple_word_frequencies, get_sort_conditions, get_word_counts_per_month, \
-    get_year_month_from_date
+from letterpress.exceptions import ElasticsearchException
+from letters.letter_search import EXPORT_BATCH_SIZE, MAX_RESULT_WINDOW, PIT_KEEP_ALIVE, ES_Result, \
+    LetterSearchParameters, LetterSummary, async_do_letter_search, async_do_point_in_time_search, \
+    async_get_letter_search_result, async_get_multiple_word_frequencies, async_get_search_after_for_offset, \
+    async_get_word_counts_per_month, do_letter_search, do_point_in_time_search, get_cacheable_search_result, \
+    get_custom_sentiment_ids, get_date_query, get_doc_highlights, get_doc_word_count, get_es_result, \
+    get_filter_conditions_for_query, get_highlight_options, get_letter_id_from_doc, get_letter_match_query, \
+    get_letter_search_parameters, get_letter_search_query, get_letter_sentiments, get_letter_summary_from_doc, \
+    get_letter_word_count, get_letters_for_export, get_letters_for_hits, get_matching_docs_from_result, \
+    get_multiple_word_frequencies, get_results_from, get_search_after_for_offset, get_search_cursor_from_request, \
+    get_search_result_letters, get_sort_conditions, get_superseded_pit_id_from_request, get_word_counts_per_month, \
+    get_word_frequencies_from_mtermvectors, get_year_month_from_date, iterate_letters_for_hits
 from letters.models import Letter
+from letters.models.letter import ES_DISPLAY_FIELDS
 from letters.sort_by import DATE, SENTIMENT
 from letters.tests.factories import LetterFactory
 
@@ -19,6 +30,296 @@ def get_filter_values_namedtuple():
                        'sentiment_ids', 'sort_by'])
 
 
+class AsyncDoLetterSearchTestCase(SimpleTestCase):
+    """
+    async_do_letter_search() should return async_get_letter_search_result() for filter values in request,
+    taken from the search cache if use_cache is True
+    """
+
+    def setUp(self):
+        cache.clear()
+        FilterValues = get_filter_values_namedtuple()
+        self.filter_values = FilterValues(search_text='', source_ids=[], writer_ids=[], start_date='', end_date='',
+                                          words=[], sentiment_ids=[1], sort_by=DATE)
+        self.request = RequestFactory().post('/search/', {'pit_id': 'pit_id', 'search_after': '[1]'})
+
+    @patch('letters.letter_search.async_get_letter_search_result', autospec=True)
+    @patch('letters.letter_search.letters_filter.get_filter_values_from_request', autospec=True)
+    async def test_async_do_letter_search(self, mock_get_filter_values_from_request,
+                                          mock_async_get_letter_search_result):
+        mock_get_filter_values_from_request.return_value = self.filter_values
+        mock_async_get_letter_search_result.return_value = ES_Result(search_results=[], total=0, pages=0)
+
+        result = await async_do_letter_search(self.request, size=10, page_number=2, from_index=True, use_pit=True)
+
+        args, kwargs = mock_async_get_letter_search_result.call_args
+        self.assertEqual(args, (self.filter_values, 10, 2, True),
+                         'async_do_letter_search() should call async_get_letter_search_result() with filter values, '
+                         'size, page number and from_index')
+        self.assertEqual((kwargs['use_pit'], kwargs['pit_id'], kwargs['search_after']), (True, 'pit_id', [1]),
+                         'async_do_letter_search() should search with point in time and cursor from request')
+        self.assertEqual(result, mock_async_get_letter_search_result.return_value,
+                         'async_do_letter_search() should return async_get_letter_search_result()')
+
+    @patch('letters.letter_search.async_get_letter_search_result', autospec=True)
+    @patch('letters.letter_search.letters_filter.get_filter_values_from_request', autospec=True)
+    async def test_async_do_letter_search_use_cache(self, mock_get_filter_values_from_request,
+                                                    mock_async_get_letter_search_result):
+        """
+        If use_cache is True, the search result should be cached, and the cached one returned the next time
+        """
+
+        mock_get_filter_values_from_request.return_value = self.filter_values
+        mock_async_get_letter_search_result.return_value = ES_Result(search_results=[], total=0, pages=0)
+
+        result = await async_do_letter_search(self.request, size=10, page_number=1, use_cache=True)
+        cached_result = await async_do_letter_search(self.request, size=10, page_number=1, use_cache=True)
+
+        self.assertEqual(mock_async_get_letter_search_result.call_count, 1,
+                         "async_do_letter_search() shouldn't search again if result is in the search cache")
+        self.assertEqual(cached_result, result, 'async_do_letter_search() should return cached search result')
+
+    @patch('letters.letter_search.async_get_letter_search_result', autospec=True)
+    @patch('letters.letter_search.letters_filter.get_filter_values_from_request', autospec=True)
+    @patch('letters.letter_search.async_close_point_in_time', autospec=True)
+    async def test_async_do_letter_search_use_pit(self, mock_async_close_point_in_time,
+                                                  mock_get_filter_values_from_request,
+                                                  mock_async_get_letter_search_result):
+        """
+        If use_pit is True, point in time and cursor shouldn't be cached, pages of a search with a point in time
+        shouldn't come from the search cache, and the point in time of the previous search should be closed
+        """
+
+        mock_get_filter_values_from_request.return_value = self.filter_values
+        mock_async_get_letter_search_result.return_value = ES_Result(search_results=[], total=0, pages=0,
+                                                                     pit_id='new_pit_id', search_after=[1])
+        request = RequestFactory().post('/search/', {'superseded_pit_id': 'old_pit_id'})
+
+        result = await async_do_letter_search(request, size=10, page_number=0, use_cache=True, use_pit=True)
+        cached_result = await async_do_letter_search(request, size=10, page_number=0, use_cache=True, use_pit=True)
+
+        self.assertEqual(result.pit_id, 'new_pit_id',
+                         'async_do_letter_search() should return point in time to the search that opened it')
+        self.assertEqual((cached_result.pit_id, cached_result.search_after), (None, None),
+                         "async_do_letter_search() shouldn't put point in time or search_after in search cache")
+        mock_async_close_point_in_time.assert_called_with('old_pit_id')
+
+        await async_do_letter_search(self.request, size=10, page_number=2, use_cache=True, use_pit=True)
+        self.assertEqual(mock_async_get_letter_search_result.call_count, 2,
+                         "async_do_letter_search() shouldn't use search cache if there is a point in time in request")
+
+
+class AsyncDoPointInTimeSearchTestCase(SimpleTestCase):
+    """
+    async_do_point_in_time_search() should search for a page of results with an Elasticsearch point in time,
+    starting after search_after if given
+    """
+
+    def setUp(self):
+        self.search_kwargs = {'query': 'query', 'sort': ['sort']}
+
+    @patch('letters.letter_search.async_open_point_in_time', autospec=True, return_value='new_pit_id')
+    @patch('letters.letter_search.async_get_search_after_for_offset', autospec=True, return_value=[5, 6])
+    @patch('letters.letter_search.async_do_es_search', autospec=True, return_value={'hits': {}})
+    async def test_async_do_point_in_time_search(self, mock_async_do_es_search,
+                                                 mock_async_get_search_after_for_offset,
+                                                 mock_async_open_point_in_time):
+        # If no pit_id, a point in time should get opened
+        await async_do_point_in_time_search(self.search_kwargs, size=10, results_from=20)
+        self.assertEqual(mock_async_open_point_in_time.call_count, 1,
+                         'async_do_point_in_time_search() should open a point in time if no pit_id given')
+        args, kwargs = mock_async_do_es_search.call_args
+        self.assertEqual(kwargs['pit'], {'id': 'new_pit_id', 'keep_alive': PIT_KEEP_ALIVE},
+                         'async_do_point_in_time_search() should search with point in time')
+        self.assertEqual((kwargs['from_offset'], kwargs['search_after']), (20, None),
+                         'async_do_point_in_time_search() should search from results_from if no search_after')
+
+        # If pit_id and search_after, they should be used
+        await async_do_point_in_time_search(self.search_kwargs, size=10, results_from=20, pit_id='pit_id',
+                                            search_after=[1, 2])
+        args, kwargs = mock_async_do_es_search.call_args
+        self.assertEqual((kwargs['pit']['id'], kwargs['from_offset'], kwargs['search_after']), ('pit_id', 0, [1, 2]),
+                         'async_do_point_in_time_search() should search after search_after with pit_id')
+
+        # If page is beyond max_result_window, search_after for it should be looked up
+        await async_do_point_in_time_search(self.search_kwargs, size=10, results_from=MAX_RESULT_WINDOW,
+                                            pit_id='pit_id')
+        args, kwargs = mock_async_do_es_search.call_args
+        self.assertEqual((kwargs['from_offset'], kwargs['search_after']), (0, [5, 6]),
+                         'async_do_point_in_time_search() should search after search_after that was looked up')
+
+    @patch('letters.letter_search.async_open_point_in_time', autospec=True, return_value='new_pit_id')
+    @patch('letters.letter_search.async_do_es_search', autospec=True)
+    async def test_async_do_point_in_time_search_expired(self, mock_async_do_es_search,
+                                                         mock_async_open_point_in_time):
+        """
+        If point in time has expired, a new one should get opened, and the page searched from results_from
+        """
+
+        mock_async_do_es_search.side_effect = [ElasticsearchException(error='No search context found', status=404),
+                                               {'hits': {}}]
+
+        result = await async_do_point_in_time_search(self.search_kwargs, size=10, results_from=20,
+                                                     pit_id='old_pit_id', search_after=[1, 2])
+        self.assertEqual(result, {'hits': {}},
+                         'async_do_point_in_time_search() should return result with new point in time')
+        args, kwargs = mock_async_do_es_search.call_args
+        self.assertEqual((kwargs['pit']['id'], kwargs['from_offset'], kwargs['search_after']), ('new_pit_id', 20, None),
+                         'async_do_point_in_time_search() should search from results_from with new point in time')
+
+
+class AsyncGetLetterSearchResultTestCase(SimpleTestCase):
+    """
+    async_get_letter_search_result() should search, then get letters and custom sentiments for the hits
+    at the same time, and return ES_Result made from them
+    """
+
+    def setUp(self):
+        FilterValues = get_filter_values_namedtuple()
+        self.filter_values = FilterValues(search_text='', source_ids=[], writer_ids=[], start_date='', end_date='',
+                                          words=[], sentiment_ids=[0, 2], sort_by=DATE)
+        self.parameters = LetterSearchParameters(search_kwargs={'query': 'query'}, sentiment_id=0,
+                                                 custom_sentiment_name=None, other_sentiment_ids=[0, 2],
+                                                 letter_match_query='')
+
+    @patch('letters.letter_search.get_es_result', autospec=True)
+    @patch('letters.letter_search.async_get_custom_sentiments_for_letters', autospec=True)
+    @patch('letters.letter_search.get_search_result_letters', autospec=True)
+    @patch('letters.letter_search.async_do_es_search', autospec=True)
+    @patch('letters.letter_search.get_letter_search_parameters', autospec=True)
+    async def test_async_get_letter_search_result(self, mock_get_letter_search_parameters, mock_async_do_es_search,
+                                                  mock_get_search_result_letters,
+                                                  mock_async_get_custom_sentiments_for_letters, mock_get_es_result):
+        mock_get_letter_search_parameters.return_value = self.parameters
+        results = {'hits': {'hits': [{'_id': '1'}, {'_id': 'temp'}], 'total': {'value': 1}}}
+        mock_async_do_es_search.return_value = results
+        mock_get_search_result_letters.return_value = {1: 'letter'}
+        mock_async_get_custom_sentiments_for_letters.return_value = {2: {1: 'sentiment'}}
+        mock_get_es_result.return_value = 'es_result'
+
+        result = await async_get_letter_search_result(self.filter_values, size=10, page_number=3, from_index=True)
+
+        args, kwargs = mock_async_do_es_search.call_args
+        self.assertEqual((kwargs['from_offset'], kwargs['size'], kwargs['query']), (20, 10, 'query'),
+                         'async_get_letter_search_result() should search for page with search parameters')
+        args, kwargs = mock_get_search_result_letters.call_args
+        self.assertEqual(args, (results['hits']['hits'], True),
+                         'async_get_letter_search_result() should get letters for hits')
+        args, kwargs = mock_async_get_custom_sentiments_for_letters.call_args
+        self.assertEqual(args, ([1], [2]),
+                         'async_get_letter_search_result() should get custom sentiments for letter ids in hits')
+        args, kwargs = mock_get_es_result.call_args
+        self.assertEqual(args, (results, self.parameters, {1: 'letter'}, {2: {1: 'sentiment'}}, 10, False),
+                         'async_get_letter_search_result() should call get_es_result() with letters and custom '
+                         'sentiments')
+        self.assertEqual(result, 'es_result', 'async_get_letter_search_result() should return get_es_result()')
+
+    @patch('letters.letter_search.get_es_result', autospec=True)
+    @patch('letters.letter_search.async_do_point_in_time_search', autospec=True)
+    @patch('letters.letter_search.async_get_custom_sentiments_for_letters', autospec=True)
+    @patch('letters.letter_search.get_search_result_letters', autospec=True)
+    @patch('letters.letter_search.get_letter_search_parameters', autospec=True)
+    async def test_async_get_letter_search_result_use_pit(self, mock_get_letter_search_parameters,
+                                                          mock_get_search_result_letters,
+                                                          mock_async_get_custom_sentiments_for_letters,
+                                                          mock_async_do_point_in_time_search, mock_get_es_result):
+        """
+        If use_pit is True, async_do_point_in_time_search() should be used
+        """
+
+        mock_get_letter_search_parameters.return_value = self.parameters
+        mock_async_do_point_in_time_search.return_value = {}
+
+        await async_get_letter_search_result(self.filter_values, size=10, page_number=1, from_index=True,
+                                             use_pit=True, pit_id='pit_id', search_after=[1])
+
+        args, kwargs = mock_async_do_point_in_time_search.call_args
+        self.assertEqual(args, ({'query': 'query'}, 10, 0, 'pit_id', [1]),
+                         'async_get_letter_search_result() should call async_do_point_in_time_search() if use_pit')
+        self.assertEqual(mock_get_search_result_letters.call_count, 0,
+                         "async_get_letter_search_result() shouldn't get letters if there are no hits")
+
+
+class AsyncGetMultipleWordFrequenciesTestCase(SimpleTestCase):
+    """
+    async_get_multiple_word_frequencies() should get term frequencies per month for the letters that contain words,
+    using async Elasticsearch requests
+    """
+
+    @patch('letters.letter_search.get_filter_conditions_for_query', autospec=True, return_value=[])
+    @patch('letters.letter_search.async_get_mtermvectors', autospec=True)
+    @patch('letters.letter_search.async_do_es_search', autospec=True)
+    async def test_async_get_multiple_word_frequencies(self, mock_async_do_es_search, mock_async_get_mtermvectors,
+                                                       mock_get_filter_conditions_for_query):
+        FilterValues = get_filter_values_namedtuple()
+        filter_values = FilterValues(search_text='', source_ids=[], writer_ids=[], start_date='', end_date='',
+                                     words=['And'], sentiment_ids=[], sort_by=DATE)
+        mock_async_do_es_search.return_value = {'hits': {'hits': [{'_id': '1', '_source': {'date': '1863-05-01'}}]}}
+        mock_async_get_mtermvectors.return_value = {
+            'docs': [{'_id': '1', 'term_vectors': {'contents': {'terms': {'and': {'term_freq': 3}}}}}]
+        }
+
+        result = await async_get_multiple_word_frequencies(filter_values)
+
+        args, kwargs = mock_async_get_mtermvectors.call_args
+        self.assertEqual(args[0], ['1'], 'async_get_multiple_word_frequencies() should get mtermvectors for hits')
+        self.assertEqual(result, {'1863-05': {'And': 3}},
+                         'async_get_multiple_word_frequencies() should return word frequencies per month')
+
+
+class AsyncGetSearchAfterForOffsetTestCase(SimpleTestCase):
+    """
+    async_get_search_after_for_offset() should page through hits with search_after and return sort values
+    of the hit right before offset
+    """
+
+    @patch('letters.letter_search.MAX_RESULT_WINDOW', 2)
+    @patch('letters.letter_search.async_do_es_search', autospec=True)
+    async def test_async_get_search_after_for_offset(self, mock_async_do_es_search):
+        search_kwargs = {'query': 'query', 'sort': ['sort']}
+        pit = {'id': 'pit_id', 'keep_alive': PIT_KEEP_ALIVE}
+        mock_async_do_es_search.side_effect = [
+            {'hits': {'hits': [{'sort': [1]}, {'sort': [2]}]}},
+            {'hits': {'hits': [{'sort': [3]}]}},
+        ]
+
+        result = await async_get_search_after_for_offset(search_kwargs, pit, 3)
+        self.assertEqual(result, [3],
+                         'async_get_search_after_for_offset() should return sort values of last hit before offset')
+        second_call = mock_async_do_es_search.call_args_list[1]
+        self.assertEqual((second_call[1]['size'], second_call[1]['search_after']), (1, [2]),
+                         'async_get_search_after_for_offset() should continue after the last hit of previous batch')
+
+
+class AsyncGetWordCountsPerMonthTestCase(SimpleTestCase):
+    """
+    async_get_word_counts_per_month() should use async Elasticsearch query with aggregations
+    to retrieve word counts per month
+    """
+
+    @patch('letters.letter_search.get_filter_conditions_for_query', autospec=True, return_value=[])
+    @patch('letters.letter_search.async_do_es_search', autospec=True)
+    async def test_async_get_word_counts_per_month(self, mock_async_do_es_search,
+                                                   mock_get_filter_conditions_for_query):
+        FilterValues = get_filter_values_namedtuple()
+        filter_values = FilterValues(search_text='', source_ids=[], writer_ids=[], start_date='', end_date='',
+                                     words=[], sentiment_ids=[], sort_by=DATE)
+        mock_async_do_es_search.return_value = {
+            'aggregations': {'words_per_month': {'buckets': [{'key_as_string': '1863-05-01',
+                                                              'avg_words': {'value': 42},
+                                                              'total_words': {'value': 84},
+                                                              'doc_count': 2}]}}
+        }
+
+        result = await async_get_word_counts_per_month(filter_values)
+
+        args, kwargs = mock_async_do_es_search.call_args
+        self.assertIn('words_per_month', kwargs['aggs'],
+                      'async_get_word_counts_per_month() should search with words_per_month aggregation')
+        self.assertEqual(result, {'1863-05': {'avg_words': 42, 'total_words': 84, 'doc_count': 2}},
+                         'async_get_word_counts_per_month() should return word counts per month')
+
+
 class DoLetterSearchTestCase(TestCase):
     """
     Based on search criteria in request, do_letter_search() should query elasticsearch and
@@ -51,9 +352,11 @@ class DoLetterSearchTestCase(TestCase):
     @patch('letters.letter_search.get_sort_conditions', autospec=True)
     @patch('letters.letter_search.do_es_search', autospec=True)
     @patch('letters.letter_search.get_doc_highlights', autospec=True)
+    @patch('letters.letter_search.get_custom_sentiments_for_letters', autospec=True, return_value={})
     @patch('letters.letter_search.get_letter_sentiments', autospec=True)
     @patch('letters.letter_search.format_sentiment', autospec=True)
     def test_do_letter_search_bool_query(self, mock_format_sentiment, mock_get_letter_sentiments,
+                                         mock_get_custom_sentiments_for_letters,
                                          mock_get_doc_highlights, mock_do_es_search,
                                          mock_get_sort_conditions, mock_get_highlight_options,
                                          mock_get_sentiment_function_score_query, mock_get_letter_match_query,
@@ -129,9 +432,11 @@ class DoLetterSearchTestCase(TestCase):
     @patch('letters.letter_search.get_sort_conditions', autospec=True)
     @patch('letters.letter_search.do_es_search', autospec=True)
     @patch('letters.letter_search.get_doc_highlights', autospec=True)
+    @patch('letters.letter_search.get_custom_sentiments_for_letters', autospec=True, return_value={})
     @patch('letters.letter_search.get_letter_sentiments', autospec=True)
     @patch('letters.letter_search.format_sentiment', autospec=True)
-    def test_do_letter_search_calls(self, mock_format_sentiment, mock_get_letter_sentiments, mock_get_doc_highlights,
+    def test_do_letter_search_calls(self, mock_format_sentiment, mock_get_letter_sentiments,
+                                    mock_get_custom_sentiments_for_letters, mock_get_doc_highlights,
                                     mock_do_es_search, mock_get_sort_conditions, mock_get_highlight_options,
                                     mock_get_sentiment_function_score_query, mock_get_letter_match_query,
                                     mock_get_filter_conditions_for_query, mock_get_custom_sentiment_name,
@@ -184,9 +489,11 @@ class DoLetterSearchTestCase(TestCase):
     @patch('letters.letter_search.get_sort_conditions', autospec=True)
     @patch('letters.letter_search.do_es_search', autospec=True)
     @patch('letters.letter_search.get_doc_highlights', autospec=True)
+    @patch('letters.letter_search.get_custom_sentiments_for_letters', autospec=True, return_value={})
     @patch('letters.letter_search.get_letter_sentiments', autospec=True)
     @patch('letters.letter_search.format_sentiment', autospec=True)
     def test_do_letter_search_filter_values(self, mock_format_sentiment, mock_get_letter_sentiments,
+                                            mock_get_custom_sentiments_for_letters,
                                             mock_get_doc_highlights,
                                             mock_do_es_search, mock_get_sort_conditions, mock_get_highlight_options,
                                             mock_get_sentiment_function_score_query, mock_get_letter_match_query,
@@ -282,9 +589,11 @@ class DoLetterSearchTestCase(TestCase):
     @patch('letters.letter_search.get_sort_conditions', autospec=True)
     @patch('letters.letter_search.do_es_search', autospec=True)
     @patch('letters.letter_search.get_doc_highlights', autospec=True)
+    @patch('letters.letter_search.get_custom_sentiments_for_letters', autospec=True, return_value={})
     @patch('letters.letter_search.get_letter_sentiments', autospec=True)
     @patch('letters.letter_search.format_sentiment', autospec=True)
     def test_do_letter_search_hits(self, mock_format_sentiment, mock_get_letter_sentiments,
+                                   mock_get_custom_sentiments_for_letters,
                                    mock_get_doc_highlights,
                                    mock_do_es_search, mock_get_sort_conditions, mock_get_highlight_options,
                                    mock_get_sentiment_function_score_query, mock_get_letter_match_query,
@@ -377,9 +686,11 @@ class DoLetterSearchTestCase(TestCase):
     @patch('letters.letter_search.get_sort_conditions', autospec=True)
     @patch('letters.letter_search.do_es_search', autospec=True)
     @patch('letters.letter_search.get_doc_highlights', autospec=True)
+    @patch('letters.letter_search.get_custom_sentiments_for_letters', autospec=True, return_value={})
     @patch('letters.letter_search.get_letter_sentiments', autospec=True)
     @patch('letters.letter_search.format_sentiment', autospec=True)
     def test_do_letter_search_page_number(self, mock_format_sentiment, mock_get_letter_sentiments,
+                                          mock_get_custom_sentiments_for_letters,
                                           mock_get_doc_highlights,
                                           mock_do_es_search, mock_get_sort_conditions, mock_get_highlight_options,
                                           mock_get_sentiment_function_score_query, mock_get_letter_match_query,
@@ -433,9 +744,11 @@ class DoLetterSearchTestCase(TestCase):
     @patch('letters.letter_search.get_sort_conditions', autospec=True)
     @patch('letters.letter_search.do_es_search', autospec=True)
     @patch('letters.letter_search.get_doc_highlights', autospec=True)
+    @patch('letters.letter_search.get_custom_sentiments_for_letters', autospec=True, return_value={})
     @patch('letters.letter_search.get_letter_sentiments', autospec=True)
     @patch('letters.letter_search.format_sentiment', autospec=True)
     def test_do_letter_result(self, mock_format_sentiment, mock_get_letter_sentiments,
+                              mock_get_custom_sentiments_for_letters,
                               mock_get_doc_highlights,
                               mock_do_es_search, mock_get_sort_conditions, mock_get_highlight_options,
                               mock_get_sentiment_function_score_query, mock_get_letter_match_query,
@@ -485,6 +798,316 @@ class DoLetterSearchTestCase(TestCase):
         self.assertEqual(result.pages, 2,
                          'do_letter_search() pages should be total / size if total divisible by size')
 
+    @patch('letters.filter.get_filter_values_from_request', autospec=True)
+    @patch('letters.letter_search.get_selected_sentiment_id', autospec=True)
+    @patch('letters.letter_search.get_sentiment_match_query', autospec=True, return_value='sentiment_match_query')
+    @patch('letters.letter_search.get_custom_sentiment_name', autospec=True, return_value='custom_sentiment_name')
+    @patch('letters.letter_search.get_filter_conditions_for_query', autospec=True, return_value='filter_conditions')
+    @patch('letters.letter_search.get_letter_match_query', autospec=True)
+    @patch('letters.letter_search.get_sentiment_function_score_query', autospec=True)
+    @patch('letters.letter_search.get_highlight_options', autospec=True, return_value='highlight_options')
+    @patch('letters.letter_search.get_sort_conditions', autospec=True)
+    @patch('letters.letter_search.do_es_search', autospec=True)
+    @patch('letters.letter_search.get_doc_highlights', autospec=True)
+    @patch('letters.letter_search.get_custom_sentiments_for_letters', autospec=True, return_value={})
+    @patch('letters.letter_search.get_letter_sentiments', autospec=True)
+    @patch('letters.letter_search.format_sentiment', autospec=True)
+    def test_do_letter_search_query_count(self, mock_format_sentiment, mock_get_letter_sentiments,
+                                          mock_get_custom_sentiments_for_letters,
+                                          mock_get_doc_highlights,
+                                          mock_do_es_search, mock_get_sort_conditions, mock_get_highlight_options,
+                                          mock_get_sentiment_function_score_query, mock_get_letter_match_query,
+                                          mock_get_filter_conditions_for_query, mock_get_custom_sentiment_name,
+                                          mock_get_sentiment_match_query, mock_get_selected_sentiment_id,
+                                          mock_get_filter_values_from_request):
+        """
+        Letters for all hits should be retrieved in a single query, in the order returned by Elasticsearch,
+        and rendering the search results shouldn't cause any more queries, however many hits there are
+        """
+
+        mock_get_filter_values_from_request.return_value = self.filter_values
+        mock_get_letter_match_query.return_value = 'letter_match_query'
+        mock_get_sort_conditions.return_value = 'sort_conditions'
+        mock_get_doc_highlights.return_value = ''
+        mock_get_letter_sentiments.return_value = []
+
+        request = self.request_factory.get('search', data={})
+
+        for number_of_hits in [1, 10]:
+            letters = [LetterFactory() for _ in range(number_of_hits)]
+            letters.reverse()
+            mock_do_es_search.return_value = {'hits': {
+                'hits':
+                    [{'_id': str(letter.id), '_score': 1} for letter in letters],
+                'total': {'value': number_of_hits}}
+            }
+
+            with self.assertNumQueries(1):
+                result = do_letter_search(request, size=number_of_hits, page_number=0)
+                render_to_string('snippets/search_list.html', {'search_results': result.search_results})
+
+            self.assertEqual(
+                [letter for letter, highlight, sentiments, score in result.search_results], letters,
+                'do_letter_search() search_results should be in the order returned by do_es_search()'
+            )
+
+            # Custom sentiments should be calculated for the whole page at once
+            args, kwargs = mock_get_custom_sentiments_for_letters.call_args
+            self.assertEqual(
+                (sorted(args[0]), args[1]), (sorted(letter.id for letter in letters), self.filter_values.sentiment_ids),
+                'do_letter_search() should call get_custom_sentiments_for_letters() once with all letter ids on page'
+            )
+            mock_get_custom_sentiments_for_letters.reset_mock()
+
+        # If a letter returned by Elasticsearch isn't in the database anymore, it should be skipped
+        letter = LetterFactory()
+        mock_do_es_search.return_value = {'hits': {
+            'hits':
+                [{'_id': str(letter.id + 1), '_score': 1}, {'_id': str(letter.id), '_score': 1}],
+            'total': {'value': 2}}
+        }
+        result = do_letter_search(request, size=2, page_number=0)
+        self.assertEqual([letter for letter, highlight, sentiments, score in result.search_results], [letter],
+                         "do_letter_search() search_results shouldn't include letters that aren't in the database")
+
+    @patch('letters.filter.get_filter_values_from_request', autospec=True)
+    @patch('letters.letter_search.get_letter_search_result', autospec=True)
+    @patch('letters.letter_search.get_cached_search_result', autospec=True)
+    @patch('letters.letter_search.cache_search_result', autospec=True)
+    def test_do_letter_search_use_cache(self, mock_cache_search_result, mock_get_cached_search_result,
+                                        mock_get_letter_search_result, mock_get_filter_values_from_request):
+        """
+        If use_cache is True, do_letter_search() should return cached search result if there is one,
+        otherwise do the search and cache the result
+        """
+
+        mock_get_filter_values_from_request.return_value = self.filter_values
+        mock_get_letter_search_result.return_value = ES_Result(search_results=[], total=0, pages=0)
+        request = self.request_factory.get('search', data={})
+
+        # If use_cache is False, search cache shouldn't be used
+        result = do_letter_search(request, size=10, page_number=1)
+        self.assertEqual(result, mock_get_letter_search_result.return_value,
+                         'do_letter_search() should return result of get_letter_search_result()')
+        self.assertEqual(mock_get_cached_search_result.call_count, 0,
+                         "do_letter_search() shouldn't look in search cache if use_cache is False")
+        self.assertEqual(mock_cache_search_result.call_count, 0,
+                         "do_letter_search() shouldn't put result in search cache if use_cache is False")
+
+        # If result isn't cached yet, search should be done and result cached
+        mock_get_letter_search_result.reset_mock()
+        mock_get_cached_search_result.return_value = None
+        result = do_letter_search(request, size=10, page_number=1, use_cache=True)
+        self.assertEqual(mock_get_letter_search_result.call_count, 1,
+                         "do_letter_search() should do search if result isn't in search cache")
+        args, kwargs = mock_cache_search_result.call_args
+        self.assertEqual(args[1], mock_get_letter_search_result.return_value,
+                         'do_letter_search() should put search result in search cache')
+        self.assertEqual(result, mock_get_letter_search_result.return_value,
+                         "do_letter_search() should return search result if it wasn't in search cache")
+
+        # If result is cached, search shouldn't be done
+        mock_get_letter_search_result.reset_mock()
+        mock_get_cached_search_result.return_value = 'cached_es_result'
+        result = do_letter_search(request, size=10, page_number=1, use_cache=True)
+        self.assertEqual(mock_get_letter_search_result.call_count, 0,
+                         "do_letter_search() shouldn't do search if result is in search cache")
+        self.assertEqual(result, mock_get_cached_search_result.return_value,
+                         'do_letter_search() should return result from search cache')
+
+        # Point in time and cursor of the search that opened them shouldn't be cached for other searches
+        mock_get_letter_search_result.reset_mock()
+        mock_get_cached_search_result.return_value = None
+        mock_get_letter_search_result.return_value = ES_Result(search_results=[], total=0, pages=0, pit_id='pit_id',
+                                                               search_after=[1, 2])
+        result = do_letter_search(request, size=10, page_number=1, use_cache=True, use_pit=True)
+        args, kwargs = mock_cache_search_result.call_args
+        self.assertEqual((args[1].pit_id, args[1].search_after), (None, None),
+                         "do_letter_search() shouldn't put point in time or search_after in search cache")
+        self.assertEqual(result, mock_get_letter_search_result.return_value,
+                         'do_letter_search() should return point in time and search_after to the search that '
+                         'opened them')
+
+        # A page of a search that has a point in time has to come from that point in time, not the search cache
+        mock_get_letter_search_result.reset_mock()
+        mock_get_cached_search_result.reset_mock()
+        mock_cache_search_result.reset_mock()
+        request = self.request_factory.post('search', data={'pit_id': 'pit_id', 'search_after': '[1, 2]'})
+        do_letter_search(request, size=10, page_number=2, use_cache=True, use_pit=True)
+        self.assertEqual(mock_get_letter_search_result.call_count, 1,
+                         'do_letter_search() should do search if there is a point in time in request')
+        self.assertEqual((mock_get_cached_search_result.call_count, mock_cache_search_result.call_count), (0, 0),
+                         "do_letter_search() shouldn't use search cache if there is a point in time in request")
+
+    @patch('letters.filter.get_filter_values_from_request', autospec=True)
+    @patch('letters.letter_search.get_letter_search_result', autospec=True)
+    @patch('letters.letter_search.close_point_in_time', autospec=True)
+    def test_do_letter_search_superseded_pit(self, mock_close_point_in_time, mock_get_letter_search_result,
+                                             mock_get_filter_values_from_request):
+        """
+        If use_pit is True, do_letter_search() should close the point in time of the previous search,
+        if it's in the request
+        """
+
+        mock_get_filter_values_from_request.return_value = self.filter_values
+
+        request = self.request_factory.post('search', data={'superseded_pit_id': 'old_pit_id'})
+        do_letter_search(request, size=10, page_number=0, use_pit=True)
+        mock_close_point_in_time.assert_called_once_with('old_pit_id')
+
+        mock_close_point_in_time.reset_mock()
+        do_letter_search(request, size=10, page_number=0)
+        self.assertEqual(mock_close_point_in_time.call_count, 0,
+                         "If use_pit is False, do_letter_search() shouldn't close any point in time")
+
+        request = self.request_factory.post('search', data={'pit_id': 'pit_id'})
+        do_letter_search(request, size=10, page_number=2, use_pit=True)
+        self.assertEqual(mock_close_point_in_time.call_count, 0,
+                         "do_letter_search() shouldn't close any point in time if there's no superseded one")
+
+    @patch('letters.filter.get_filter_values_from_request', autospec=True)
+    @patch('letters.letter_search.get_letter_match_query', autospec=True, return_value='')
+    @patch('letters.letter_search.get_sort_conditions', autospec=True, return_value='sort_conditions')
+    @patch('letters.letter_search.do_es_search', autospec=True)
+    @patch('letters.letter_search.do_point_in_time_search', autospec=True)
+    @patch('letters.letter_search.get_custom_sentiments_for_letters', autospec=True, return_value={})
+    @patch('letters.letter_search.get_letter_sentiments', autospec=True, return_value=[])
+    def test_do_letter_search_use_pit(self, mock_get_letter_sentiments, mock_get_custom_sentiments_for_letters,
+                                      mock_do_point_in_time_search, mock_do_es_search, mock_get_sort_conditions,
+                                      mock_get_letter_match_query, mock_get_filter_values_from_request):
+        """
+        If use_pit is True, do_letter_search() should search with a point in time, using point in time id
+        and search_after from the request, and return them for the next page
+        """
+
+        mock_get_filter_values_from_request.return_value = self.filter_values._replace(sentiment_ids=[])
+        letters = [LetterFactory(), LetterFactory()]
+        mock_do_point_in_time_search.return_value = {
+            'pit_id': 'new_pit_id',
+            'hits': {'hits': [{'_id': str(letter.id), '_score': 1, 'sort': [letter.id, index]}
+                              for index, letter in enumerate(letters)],
+                     'total': {'value': 10}}
+        }
+
+        request = self.request_factory.post('search', data={'pit_id': 'pit_id', 'search_after': '[1, 2]'})
+        result = do_letter_search(request, size=2, page_number=3, use_pit=True)
+
+        self.assertEqual(mock_do_es_search.call_count, 0,
+                         "If use_pit is True, do_letter_search() shouldn't call do_es_search() directly")
+        args, kwargs = mock_do_point_in_time_search.call_args
+        self.assertEqual(args[1:], (2, 4, 'pit_id', [1, 2]),
+                         'If use_pit is True, do_letter_search() should call do_point_in_time_search() with size, '
+                         'offset, pit_id and search_after')
+        self.assertEqual(result.pit_id, 'new_pit_id',
+                         'If use_pit is True, do_letter_search() should return point in time id from result')
+        self.assertEqual(result.search_after, [letters[-1].id, 1],
+                         'If use_pit is True, do_letter_search() should return sort values of last hit')
+
+        # If page isn't full, there's no next page, so search_after should be None
+        result = do_letter_search(request, size=5, page_number=3, use_pit=True)
+        self.assertIsNone(result.search_after, "If page isn't full, do_letter_search() shouldn't return search_after")
+
+        # If use_pit is False, there should be no point in time
+        mock_do_es_search.return_value = mock_do_point_in_time_search.return_value
+        result = do_letter_search(request, size=2, page_number=3)
+        self.assertEqual((result.pit_id, result.search_after), (None, None),
+                         "If use_pit is False, do_letter_search() shouldn't return pit_id or search_after")
+
+
+class DoPointInTimeSearchTestCase(SimpleTestCase):
+    """
+    do_point_in_time_search() should search for a page of results with an Elasticsearch point in time,
+    starting after search_after if given
+    """
+
+    def setUp(self):
+        self.search_kwargs = {'query': 'query', 'sort': ['sort']}
+
+    @patch('letters.letter_search.open_point_in_time', autospec=True, return_value='new_pit_id')
+    @patch('letters.letter_search.get_search_after_for_offset', autospec=True, return_value=[5, 6])
+    @patch('letters.letter_search.do_es_search', autospec=True, return_value={'hits': {}})
+    def test_do_point_in_time_search(self, mock_do_es_search, mock_get_search_after_for_offset,
+                                     mock_open_point_in_time):
+        # If no pit_id, a point in time should get opened
+        do_point_in_time_search(self.search_kwargs, size=10, results_from=20)
+        self.assertEqual(mock_open_point_in_time.call_count, 1,
+                         'do_point_in_time_search() should open a point in time if no pit_id given')
+        args, kwargs = mock_do_es_search.call_args
+        self.assertIsNone(kwargs['index'], "do_point_in_time_search() shouldn't search with index")
+        self.assertEqual(kwargs['pit'], {'id': 'new_pit_id', 'keep_alive': PIT_KEEP_ALIVE},
+                         'do_point_in_time_search() should search with point in time')
+        self.assertEqual((kwargs['from_offset'], kwargs['search_after']), (20, None),
+                         'do_point_in_time_search() should search from results_from if no search_after')
+        self.assertTrue(kwargs['track_total_hits'], 'do_point_in_time_search() should track all hits')
+        self.assertEqual(kwargs['query'], 'query', 'do_point_in_time_search() should search with search_kwargs')
+
+        # If pit_id and search_after, they should be used
+        mock_open_point_in_time.reset_mock()
+        do_point_in_time_search(self.search_kwargs, size=10, results_from=20, pit_id='pit_id', search_after=[1, 2])
+        self.assertEqual(mock_open_point_in_time.call_count, 0,
+                         "do_point_in_time_search() shouldn't open a point in time if pit_id given")
+        args, kwargs = mock_do_es_search.call_args
+        self.assertEqual((kwargs['pit']['id'], kwargs['from_offset'], kwargs['search_after']), ('pit_id', 0, [1, 2]),
+                         'do_point_in_time_search() should search after search_after with pit_id')
+
+        # If page is beyond max_result_window, search_after for it should be looked up
+        do_point_in_time_search(self.search_kwargs, size=10, results_from=MAX_RESULT_WINDOW, pit_id='pit_id')
+        self.assertEqual(mock_get_search_after_for_offset.call_count, 1,
+                         'do_point_in_time_search() should look up search_after if page is beyond max_result_window')
+        args, kwargs = mock_do_es_search.call_args
+        self.assertEqual((kwargs['from_offset'], kwargs['search_after']), (0, [5, 6]),
+                         'do_point_in_time_search() should search after search_after that was looked up')
+
+    @patch('letters.letter_search.open_point_in_time', autospec=True, return_value='new_pit_id')
+    @patch('letters.letter_search.do_es_search', autospec=True)
+    def test_do_point_in_time_search_expired(self, mock_do_es_search, mock_open_point_in_time):
+        """
+        If point in time has expired, a new one should get opened, and the page searched from results_from
+        """
+
+        mock_do_es_search.side_effect = [ElasticsearchException(error='No search context found', status=404),
+                                         {'hits': {}}]
+
+        result = do_point_in_time_search(self.search_kwargs, size=10, results_from=20, pit_id='old_pit_id',
+                                         search_after=[1, 2])
+        self.assertEqual(result, {'hits': {}},
+                         'do_point_in_time_search() should return result with new point in time if old one expired')
+        self.assertEqual(mock_open_point_in_time.call_count, 1,
+                         'do_point_in_time_search() should open new point in time if old one expired')
+        args, kwargs = mock_do_es_search.call_args
+        self.assertEqual((kwargs['pit']['id'], kwargs['from_offset'], kwargs['search_after']), ('new_pit_id', 20, None),
+                         'do_point_in_time_search() should search from results_from with new point in time')
+
+        # Other errors should be raised
+        mock_do_es_search.side_effect = ElasticsearchException(error='Bad request', status=400)
+        with self.assertRaises(ElasticsearchException):
+            do_point_in_time_search(self.search_kwargs, size=10, results_from=20, pit_id='pit_id')
+
+
+class GetCacheableSearchResultTestCase(SimpleTestCase):
+    """
+    get_cacheable_search_result() should return search result without point in time id and search_after
+    """
+
+    def test_get_cacheable_search_result(self):
+        es_result = ES_Result(search_results=['result'], total=1, pages=1, pit_id='pit_id', search_after=[1, 2])
+        self.assertEqual(get_cacheable_search_result(es_result),
+                         ES_Result(search_results=['result'], total=1, pages=1, pit_id=None, search_after=None),
+                         'get_cacheable_search_result() should return search result without point in time id '
+                         'and search_after')
+
+
+class GetCustomSentimentIdsTestCase(SimpleTestCase):
+    """
+    get_custom_sentiment_ids(parameters) should return other sentiment ids, without standard sentiment
+    """
+
+    def test_get_custom_sentiment_ids(self):
+        parameters = LetterSearchParameters(search_kwargs={}, sentiment_id=0, custom_sentiment_name=None,
+                                            other_sentiment_ids=[2, 0, 1], letter_match_query='')
+        self.assertEqual(get_custom_sentiment_ids(parameters), [2, 1],
+                         'get_custom_sentiment_ids() should return other sentiment ids without 0')
+
 
 class GetDateQueryTestCase(SimpleTestCase):
     """
@@ -582,6 +1205,70 @@ class GetDocWordCountTestCase(SimpleTestCase):
         )
 
 
+class GetEsResultTestCase(SimpleTestCase):
+    """
+    get_es_result() should return ES_Result with search results for hits, made from letters and custom sentiments
+    """
+
+    @patch('letters.letter_search.format_sentiment', autospec=True, return_value='formatted_sentiment')
+    def test_get_es_result(self, mock_format_sentiment):
+        letter = LetterSummary(id=1, pk=1, list_date='1863-01-01', writer='Bob', recipient='Alice', place='Here',
+                               place_id=2)
+        hits = [{'_id': '1', '_score': 1.5, 'sort': [1.5]}, {'_id': '5', '_score': 1, 'sort': [1]}]
+        results = {'hits': {'total': {'value': 11}, 'hits': hits}, 'pit_id': 'pit_id'}
+        parameters = LetterSearchParameters(search_kwargs={}, sentiment_id=3, custom_sentiment_name='Ponies',
+                                            other_sentiment_ids=[2], letter_match_query='')
+
+        es_result = get_es_result(results, parameters, {1: letter}, {2: {1: 'custom_sentiment'}}, size=2,
+                                  use_pit=True)
+
+        self.assertEqual(es_result.search_results,
+                         [(letter, '', [(2, 'custom_sentiment'), (3, 'formatted_sentiment')], 1.5)],
+                         "get_es_result() should return search results for letters that exist, with sentiments")
+        self.assertEqual((es_result.total, es_result.pages), (11, 6),
+                         'get_es_result() should return total and number of pages')
+        self.assertEqual((es_result.pit_id, es_result.search_after), ('pit_id', [1]),
+                         'get_es_result() should return point in time id and sort values of last hit if use_pit')
+
+        # Without hits, there shouldn't be any search results
+        es_result = get_es_result({}, parameters, {}, {}, size=2, use_pit=False)
+        self.assertEqual((es_result.search_results, es_result.total, es_result.pages, es_result.pit_id),
+                         ([], 0, 0, None), "get_es_result() should return empty ES_Result if there aren't any hits")
+
+    @patch('letters.letter_search.get_letter_sentiments', autospec=True, return_value=[])
+    @patch('django.db.models.QuerySet.bulk_update', autospec=True)
+    @patch.object(Letter, 'update_sentiment_many', autospec=True)
+    def test_get_es_result_standard_sentiment(self, mock_update_sentiment_many, mock_bulk_update,
+                                              mock_get_letter_sentiments):
+        letters = {1: Letter(pk=1), 2: Letter(pk=2, textblob_polarity=0.1, vader_polarity=0.2)}
+        hits = [{'_id': '1', '_score': 1.5}, {'_id': '2', '_score': 1}]
+        results = {'hits': {'total': {'value': 2}, 'hits': hits}}
+        parameters = LetterSearchParameters(search_kwargs={}, sentiment_id=None, custom_sentiment_name=None,
+                                            other_sentiment_ids=[0], letter_match_query='')
+
+        get_es_result(results, parameters, letters, {}, size=2, use_pit=False)
+
+        args, kwargs = mock_update_sentiment_many.call_args
+        self.assertEqual(args[0], [letters[1]],
+                         'get_es_result() should calculate standard sentiment at once for letters without it')
+        self.assertEqual(kwargs, {'in_worker_processes': False},
+                         "get_es_result() shouldn't make the request wait for worker processes")
+        self.assertEqual(mock_bulk_update.call_count, 0,
+                         "get_es_result() shouldn't store standard sentiment, which is update_letter_sentiment's job")
+
+        # Without standard sentiment, it shouldn't get calculated
+        mock_update_sentiment_many.reset_mock()
+        get_es_result(results, parameters._replace(other_sentiment_ids=[2]), letters, {}, size=2, use_pit=False)
+        self.assertEqual(mock_update_sentiment_many.call_count, 0,
+                         "get_es_result() shouldn't calculate standard sentiment if it isn't needed")
+
+        # If all the letters have standard sentiment already, there's nothing to calculate or store
+        letters[1].textblob_polarity, letters[1].vader_polarity = 0.3, 0.4
+        get_es_result(results, parameters, letters, {}, size=2, use_pit=False)
+        self.assertEqual(mock_update_sentiment_many.call_count, 0,
+                         "get_es_result() shouldn't calculate standard sentiment that letters already have")
+
+
 class GetFilterConditionsForQueryTestCase(SimpleTestCase):
     """
     Get a date_query for Elasticsearch based on filter_values,
@@ -694,6 +1381,21 @@ class GetHighlightOptionsTestCase(SimpleTestCase):
         )
 
 
+class GetLetterIdFromDocTestCase(SimpleTestCase):
+    """
+    get_letter_id_from_doc() should return the letter id for a doc returned by Elasticsearch,
+    or None if it isn't a letter id
+    """
+
+    def test_get_letter_id_from_doc(self):
+        self.assertEqual(get_letter_id_from_doc({'_id': '42'}), 42,
+                         'get_letter_id_from_doc() should return doc id as int')
+        self.assertEqual(get_letter_id_from_doc({'_id': 42}), 42,
+                         'get_letter_id_from_doc() should return doc id as int')
+        self.assertIsNone(get_letter_id_from_doc({'_id': 'temp'}),
+                          "get_letter_id_from_doc() should return None if doc id isn't a letter id")
+
+
 class GetLetterMatchQueryTestCase(SimpleTestCase):
     """
     get_letter_match_query() should take search_text from filter_values and return a query for contents
@@ -752,6 +1454,79 @@ class GetLetterMatchQueryTestCase(SimpleTestCase):
         )
 
 
+class GetLetterSearchQueryTestCase(SimpleTestCase):
+    """
+    get_letter_search_query(filter_values, sentiment_match_query, letter_match_query) should return
+    a bool query, wrapped in a function_score query if there's a sentiment match query
+    """
+
+    @patch('letters.letter_search.get_sentiment_function_score_query', autospec=True)
+    @patch('letters.letter_search.get_filter_conditions_for_query', autospec=True)
+    def test_get_letter_search_query(self, mock_get_filter_conditions_for_query,
+                                     mock_get_sentiment_function_score_query):
+        mock_get_filter_conditions_for_query.return_value = ['filter']
+        mock_get_sentiment_function_score_query.return_value = 'function_score'
+        FilterValues = get_filter_values_namedtuple()
+        filter_values = FilterValues(search_text='', source_ids=[], writer_ids=[], start_date='', end_date='',
+                                     words=[], sentiment_ids=[], sort_by='')
+
+        query = get_letter_search_query(filter_values, sentiment_match_query=[], letter_match_query=[])
+        self.assertEqual(query, {'bool': {'should': [], 'filter': ['filter']}},
+                         "get_letter_search_query() should return bool query with filter if there's no match query")
+
+        query = get_letter_search_query(filter_values, sentiment_match_query=[], letter_match_query=['match'])
+        self.assertEqual(query, {'bool': {'should': [], 'filter': ['filter'], 'must': ['match']}},
+                         'get_letter_search_query() should put letter match query in bool query must')
+
+        query = get_letter_search_query(filter_values, sentiment_match_query=['sentiment'], letter_match_query=[])
+        args, kwargs = mock_get_sentiment_function_score_query.call_args
+        self.assertEqual(args[0], {'should': ['sentiment'], 'filter': ['filter']},
+                         'get_letter_search_query() should put sentiment match query in bool query should')
+        self.assertEqual(query, {'function_score': 'function_score'},
+                         "get_letter_search_query() should return function_score query if there's a sentiment "
+                         "match query")
+
+
+class GetLetterSearchParametersTestCase(SimpleTestCase):
+    """
+    get_letter_search_parameters(filter_values, from_index) should return LetterSearchParameters
+    for a letter search
+    """
+
+    @patch('letters.letter_search.get_letter_search_query', autospec=True, return_value='query')
+    @patch('letters.letter_search.get_custom_sentiment_name', autospec=True, return_value='Ponies')
+    @patch('letters.letter_search.get_sentiment_match_query', autospec=True, return_value=['sentiment_match'])
+    def test_get_letter_search_parameters(self, mock_get_sentiment_match_query, mock_get_custom_sentiment_name,
+                                          mock_get_letter_search_query):
+        FilterValues = get_filter_values_namedtuple()
+        filter_values = FilterValues(search_text='pony', source_ids=[], writer_ids=[], start_date='', end_date='',
+                                     words=[], sentiment_ids=[0, 3], sort_by=DATE)
+
+        parameters = get_letter_search_parameters(filter_values, from_index=True)
+        self.assertEqual(parameters.search_kwargs['query'], 'query',
+                         'get_letter_search_parameters() should return search_kwargs with letter search query')
+        self.assertEqual(parameters.search_kwargs['source'], ES_DISPLAY_FIELDS,
+                         'get_letter_search_parameters() should get display fields from index if from_index')
+        self.assertEqual((parameters.sentiment_id, parameters.custom_sentiment_name, parameters.other_sentiment_ids),
+                         (0, None, [0, 3]),
+                         "get_letter_search_parameters() should return all sentiment ids if not sorting by sentiment")
+        self.assertTrue(parameters.letter_match_query,
+                        'get_letter_search_parameters() should return letter match query for search text')
+        self.assertEqual(mock_get_sentiment_match_query.call_count, 0,
+                         "get_letter_search_parameters() shouldn't get sentiment match query if not sorting by it")
+
+        # If sorting by custom sentiment, it shouldn't be in other sentiment ids
+        parameters = get_letter_search_parameters(filter_values._replace(sort_by=SENTIMENT + '3'), from_index=False)
+        self.assertEqual((parameters.sentiment_id, parameters.custom_sentiment_name, parameters.other_sentiment_ids),
+                         (3, 'Ponies', [0]),
+                         'get_letter_search_parameters() should return id and name of custom sentiment to sort by')
+        self.assertIsNone(parameters.search_kwargs['source'],
+                          "get_letter_search_parameters() shouldn't get display fields from index if not from_index")
+        args, kwargs = mock_get_letter_search_query.call_args
+        self.assertEqual(args[1], ['sentiment_match'],
+                         'get_letter_search_parameters() should search with sentiment match query')
+
+
 class GetLetterSentimentsTestCase(TestCase):
     """
     get_letter_sentiments() should return a list of (id, name/result)
@@ -799,6 +1574,46 @@ class GetLetterSentimentsTestCase(TestCase):
             self.assertTrue((sentiment_id, mock_get_custom_sentiment_for_letter.return_value) in result,
                             'If sentiment_id is 0, (sentiment_id, custom_sentiment) should be in result')
 
+    @patch('letters.letter_search.get_custom_sentiment_for_letter')
+    def test_get_letter_sentiments_with_custom_sentiments(self, mock_get_custom_sentiment_for_letter):
+        # If custom sentiments were already calculated, get_custom_sentiment_for_letter() should only get called
+        # for the ones that weren't
+        custom_sentiments = {1: {self.letter.id: 'precalculated_sentiment'}}
+        mock_get_custom_sentiment_for_letter.return_value = 'custom_sentiment'
+
+        result = get_letter_sentiments(letter=self.letter, sentiment_ids=[1, 2], custom_sentiments=custom_sentiments)
+        self.assertEqual(result, [(1, 'precalculated_sentiment'), (2, 'custom_sentiment')],
+                         'get_letter_sentiments() should use custom sentiments that were already calculated')
+        self.assertEqual(mock_get_custom_sentiment_for_letter.call_count, 1,
+                         "get_letter_sentiments() shouldn't calculate custom sentiments that were already calculated")
+
+
+class GetLetterSummaryFromDocTestCase(SimpleTestCase):
+    """
+    get_letter_summary_from_doc() should return a LetterSummary with the fields shown in search results
+    from a doc returned by Elasticsearch, or None if they aren't all in the doc
+    """
+
+    def test_get_letter_summary_from_doc(self):
+        source = {'list_date': '1862-01-01', 'writer_name': 'Waite, Elizabeth A.', 'recipient_name': 'Black, Francis',
+                  'place_name': 'Barbecue, NC', 'place_id': 3}
+
+        result = get_letter_summary_from_doc({'_id': '42', '_source': source})
+        self.assertEqual(
+            result,
+            LetterSummary(id=42, pk=42, list_date='1862-01-01', writer='Waite, Elizabeth A.',
+                          recipient='Black, Francis', place='Barbecue, NC', place_id=3),
+            'get_letter_summary_from_doc() should return LetterSummary with fields from doc'
+        )
+
+        # If any of the fields are missing, e.g. because the letter was indexed before they were added,
+        # get_letter_summary_from_doc() should return None
+        del source['place_id']
+        self.assertIsNone(get_letter_summary_from_doc({'_id': '42', '_source': source}),
+                          "get_letter_summary_from_doc() should return None if fields aren't all in doc")
+        self.assertIsNone(get_letter_summary_from_doc({'_id': '42'}),
+                          "get_letter_summary_from_doc() should return None if there's no '_source' in doc")
+
 
 class GetLetterWordCountTestCase(SimpleTestCase):
     """
@@ -829,6 +1644,113 @@ class GetLetterWordCountTestCase(SimpleTestCase):
                          'get_letter_word_count() should return the return value of get_doc_word_count()')
 
 
+class GetLettersForExportTestCase(SimpleTestCase):
+    """
+    get_letters_for_export(request) should open a point in time, search for the first batch of hits
+    and return an iterator over the letters
+    """
+
+    def setUp(self):
+        FilterValues = get_filter_values_namedtuple()
+        self.filter_values = FilterValues(search_text='', source_ids=[], writer_ids=[], start_date='', end_date='',
+                                          words=[], sentiment_ids=[], sort_by=DATE)
+        self.request = RequestFactory().post('/letters/')
+
+    @patch('letters.letter_search.iterate_letters_for_hits', autospec=True)
+    @patch('letters.letter_search.close_point_in_time', autospec=True)
+    @patch('letters.letter_search.do_es_search', autospec=True)
+    @patch('letters.letter_search.open_point_in_time', autospec=True)
+    @patch('letters.letter_search.letters_filter.get_filter_values_from_request', autospec=True)
+    def test_get_letters_for_export(self, mock_get_filter_values_from_request, mock_open_point_in_time,
+                                    mock_do_es_search, mock_close_point_in_time, mock_iterate_letters_for_hits):
+        mock_get_filter_values_from_request.return_value = self.filter_values
+        mock_open_point_in_time.return_value = 'pit_id'
+        mock_do_es_search.return_value = {'hits': {'hits': ['hit']}}
+        mock_iterate_letters_for_hits.return_value = 'letters'
+
+        result = get_letters_for_export(self.request)
+
+        args, kwargs = mock_do_es_search.call_args
+        self.assertEqual(kwargs['pit'], {'id': 'pit_id', 'keep_alive': PIT_KEEP_ALIVE},
+                         'get_letters_for_export() should search with point in time')
+        self.assertEqual(kwargs['size'], EXPORT_BATCH_SIZE,
+                         'get_letters_for_export() should search for EXPORT_BATCH_SIZE hits at a time')
+        self.assertFalse(kwargs['source'], "get_letters_for_export() shouldn't retrieve document source")
+
+        args, kwargs = mock_iterate_letters_for_hits.call_args
+        self.assertEqual(args[1:], ('pit_id', ['hit']),
+                         'get_letters_for_export() should call iterate_letters_for_hits() with point in time id '
+                         'and first batch of hits')
+        self.assertEqual(result, 'letters',
+                         'get_letters_for_export() should return value of iterate_letters_for_hits()')
+        self.assertEqual(mock_close_point_in_time.call_count, 0,
+                         "get_letters_for_export() shouldn't close point in time before letters are iterated")
+
+    @patch('letters.letter_search.close_point_in_time', autospec=True)
+    @patch('letters.letter_search.do_es_search', autospec=True)
+    @patch('letters.letter_search.open_point_in_time', autospec=True)
+    @patch('letters.letter_search.letters_filter.get_filter_values_from_request', autospec=True)
+    def test_get_letters_for_export_elasticsearch_exception(self, mock_get_filter_values_from_request,
+                                                            mock_open_point_in_time, mock_do_es_search,
+                                                            mock_close_point_in_time):
+        """
+        If there's an Elasticsearch exception, the point in time should be closed and the exception raised
+        """
+
+        mock_get_filter_values_from_request.return_value = self.filter_values
+        mock_open_point_in_time.return_value = 'pit_id'
+        mock_do_es_search.side_effect = ElasticsearchException(error='error', status=400)
+
+        with self.assertRaises(ElasticsearchException):
+            get_letters_for_export(self.request)
+
+        args, kwargs = mock_close_point_in_time.call_args
+        self.assertEqual(args[0], 'pit_id',
+                         'get_letters_for_export() should close point in time if there was an Elasticsearch exception')
+
+
+class GetLettersForHitsTestCase(TestCase):
+    """
+    get_letters_for_hits() should retrieve the letters for Elasticsearch hits in a single query,
+    with related objects, and return a dict of letters keyed by id
+    """
+
+    def test_get_letters_for_hits(self):
+        letters = [LetterFactory(), LetterFactory()]
+        hits = [{'_id': str(letter.id)} for letter in letters]
+        hits.append({'_id': 'temp'})
+
+        with self.assertNumQueries(1):
+            result = get_letters_for_hits(hits)
+            for letter in letters:
+                self.assertEqual(result[letter.id], letter,
+                                 'get_letters_for_hits() should return letters for hits, keyed by id')
+                # Related objects shown in search results should already be there
+                str(result[letter.id].writer)
+                str(result[letter.id].recipient)
+                str(result[letter.id].place)
+                str(result[letter.id].source)
+
+        self.assertEqual(len(result), len(letters),
+                         "get_letters_for_hits() shouldn't return anything for hits that aren't letters")
+
+        # If no hits, get_letters_for_hits() should return an empty dict
+        self.assertEqual(get_letters_for_hits([]), {}, 'If no hits, get_letters_for_hits() should return {}')
+
+
+class GetMatchingDocsFromResultTestCase(SimpleTestCase):
+    """
+    get_matching_docs_from_result(es_result) should return dates of docs by id
+    """
+
+    def test_get_matching_docs_from_result(self):
+        es_result = {'hits': {'hits': [{'_id': '1', '_source': {'date': '1863-05-01'}}]}}
+        self.assertEqual(get_matching_docs_from_result(es_result), {'1': '1863-05-01'},
+                         'get_matching_docs_from_result() should return dates of docs by id')
+        self.assertEqual(get_matching_docs_from_result({}), {},
+                         "get_matching_docs_from_result() should return {} if there aren't any hits")
+
+
 class GetMultipleWordFrequenciesTestCase(SimpleTestCase):
     """
     get_multiple_word_frequencies() should get term frequencies for mtermvectors
@@ -934,6 +1856,134 @@ class GetMultipleWordFrequenciesTestCase(SimpleTestCase):
         self.assertEqual(word_frequencies['torpedo'], 0)
 
 
+class GetResultsFromTestCase(SimpleTestCase):
+    """
+    get_results_from(page_number, size) should return offset of first result on page
+    """
+
+    def test_get_results_from(self):
+        self.assertEqual(get_results_from(0, 10), 0, 'get_results_from() should return 0 for page 0')
+        self.assertEqual(get_results_from(1, 10), 0, 'get_results_from() should return 0 for page 1')
+        self.assertEqual(get_results_from(3, 10), 20, 'get_results_from() should return offset for page number')
+
+
+class GetSearchAfterForOffsetTestCase(SimpleTestCase):
+    """
+    get_search_after_for_offset() should page through hits with search_after and return sort values
+    of the hit right before offset
+    """
+
+    @patch('letters.letter_search.MAX_RESULT_WINDOW', 2)
+    @patch('letters.letter_search.do_es_search', autospec=True)
+    def test_get_search_after_for_offset(self, mock_do_es_search):
+        search_kwargs = {'query': 'query', 'sort': ['sort']}
+        pit = {'id': 'pit_id', 'keep_alive': PIT_KEEP_ALIVE}
+        mock_do_es_search.side_effect = [
+            {'hits': {'hits': [{'sort': [1]}, {'sort': [2]}]}},
+            {'hits': {'hits': [{'sort': [3]}]}},
+        ]
+
+        result = get_search_after_for_offset(search_kwargs, pit, 3)
+        self.assertEqual(result, [3],
+                         'get_search_after_for_offset() should return sort values of last hit before offset')
+
+        self.assertEqual(mock_do_es_search.call_count, 2,
+                         'get_search_after_for_offset() should page through hits in batches of max_result_window')
+        first_call, second_call = mock_do_es_search.call_args_list
+        self.assertEqual((first_call[1]['size'], first_call[1]['search_after']), (2, None),
+                         'get_search_after_for_offset() should start at the beginning')
+        self.assertEqual((second_call[1]['size'], second_call[1]['search_after']), (1, [2]),
+                         'get_search_after_for_offset() should continue after the last hit of the previous batch')
+        self.assertFalse(first_call[1]['source'], "get_search_after_for_offset() shouldn't fetch _source")
+
+        # If there are fewer hits than offset, sort values of the last hit should be returned
+        mock_do_es_search.reset_mock()
+        mock_do_es_search.side_effect = [{'hits': {'hits': [{'sort': [1]}]}}]
+        self.assertEqual(get_search_after_for_offset(search_kwargs, pit, 3), [1],
+                         'get_search_after_for_offset() should return sort values of last hit if fewer than offset')
+        self.assertEqual(mock_do_es_search.call_count, 1,
+                         "get_search_after_for_offset() shouldn't keep searching if there are no more hits")
+
+        # If there are no hits, None should be returned
+        mock_do_es_search.side_effect = [{'hits': {'hits': []}}]
+        self.assertIsNone(get_search_after_for_offset(search_kwargs, pit, 3),
+                          'get_search_after_for_offset() should return None if there are no hits')
+
+
+class GetSearchCursorFromRequestTestCase(SimpleTestCase):
+    """
+    get_search_cursor_from_request() should return point in time id and search_after from request
+    """
+
+    def test_get_search_cursor_from_request(self):
+        request_factory = RequestFactory()
+
+        request = request_factory.post('search', data={'pit_id': 'pit_id', 'search_after': '["1863-01-01", 4]'})
+        self.assertEqual(get_search_cursor_from_request(request), ('pit_id', ['1863-01-01', 4]),
+                         'get_search_cursor_from_request() should return pit_id and search_after from request')
+
+        request = request_factory.get('search', data={'pit_id': 'pit_id'})
+        self.assertEqual(get_search_cursor_from_request(request), ('pit_id', None),
+                         'get_search_cursor_from_request() should return None if no search_after in request')
+
+        for search_after in ['not json', '{"not": "a list"}', '']:
+            request = request_factory.post('search', data={'pit_id': '', 'search_after': search_after})
+            self.assertEqual(get_search_cursor_from_request(request), (None, None),
+                             "get_search_cursor_from_request() should return None if search_after isn't a list")
+
+
+class GetSupersededPitIdFromRequestTestCase(SimpleTestCase):
+    """
+    get_superseded_pit_id_from_request() should return id of the point in time of the previous search from request
+    """
+
+    def test_get_superseded_pit_id_from_request(self):
+        request_factory = RequestFactory()
+
+        request = request_factory.post('search', data={'superseded_pit_id': 'old_pit_id'})
+        self.assertEqual(get_superseded_pit_id_from_request(request), 'old_pit_id',
+                         'get_superseded_pit_id_from_request() should return superseded_pit_id from request')
+
+        for data in [{}, {'superseded_pit_id': ''}]:
+            request = request_factory.get('search', data=data)
+            self.assertIsNone(get_superseded_pit_id_from_request(request),
+                              "get_superseded_pit_id_from_request() should return None if it isn't in request")
+
+
+class GetSearchResultLettersTestCase(TestCase):
+    """
+    get_search_result_letters() should return a dict of letters for Elasticsearch hits, keyed by id,
+    taken from the index if from_index is True and they're there, and from the database otherwise
+    """
+
+    def test_get_search_result_letters(self):
+        letter = LetterFactory()
+        indexed_letter = LetterFactory()
+        hits = [
+            {'_id': str(letter.id), '_source': {}},
+            {'_id': str(indexed_letter.id), '_source': indexed_letter.es_display_repr()}
+        ]
+
+        # If from_index is False, all letters should come from the database
+        result = get_search_result_letters(hits, from_index=False)
+        self.assertEqual(result, {letter.id: letter, indexed_letter.id: indexed_letter},
+                         'If from_index is False, get_search_result_letters() should return letters from database')
+
+        # If from_index is True, letters with the fields in the index should be LetterSummary,
+        # and the rest should come from the database
+        result = get_search_result_letters(hits, from_index=True)
+        self.assertEqual(result[letter.id], letter,
+                         "get_search_result_letters() should return letters from database if they're not in index")
+        self.assertIsInstance(result[indexed_letter.id], LetterSummary,
+                              'If from_index is True, get_search_result_letters() should return LetterSummary')
+        self.assertEqual(result[indexed_letter.id].writer, str(indexed_letter.writer),
+                         'LetterSummary returned by get_search_result_letters() should contain writer from index')
+
+        # If everything is in the index, the database shouldn't get queried
+        with self.assertNumQueries(0):
+            get_search_result_letters(hits[1:], from_index=True)
+
+
 class GetSortConditionsTestCase(SimpleTestCase):
     """
     get_sort_conditions() should return field/order to use for sorting in Elasticsearch query,
@@ -1036,6 +2086,23 @@ class GetWordCountsPerMonthTestCase(SimpleTestCase):
                          "get_word_counts_per_month() return value should include ['key_as_']['doc_count']")
 
 
+class GetWordFrequenciesFromMtermvectorsTestCase(SimpleTestCase):
+    """
+    get_word_frequencies_from_mtermvectors() should add up term frequencies of words per month
+    """
+
+    def test_get_word_frequencies_from_mtermvectors(self):
+        mtermvectors = {'docs': [
+            {'_id': '1', 'term_vectors': {'contents': {'terms': {'and': {'term_freq': 3}}}}},
+            {'_id': '2', 'term_vectors': {'contents': {'terms': {'and': {'term_freq': 1}, '&': {'term_freq': 2}}}}}
+        ]}
+        matching_docs = {'1': '1863-05-01', '2': '1863-05-20'}
+
+        self.assertEqual(get_word_frequencies_from_mtermvectors(mtermvectors, matching_docs, ['And', '&', 'pony']),
+                         {'1863-05': {'And': 4, '&': 2, 'pony': 0}},
+                         'get_word_frequencies_from_mtermvectors() should return word frequencies per month')
+
+
 class GetYearMonthFromDateTestCase(SimpleTestCase):
     """
     get_year_month_from_date() should extract year/month/day from date_string
@@ -1058,3 +2125,63 @@ class GetYearMonthFromDateTestCase(SimpleTestCase):
         result = get_year_month_from_date(date_string='1867-06')
         self.assertEqual(result, '1867-06',
                          'If year-month in date_string, get_year_month_from_date() should return year-month')
+
+
+class IterateLettersForHitsTestCase(TestCase):
+    """
+    iterate_letters_for_hits(search_kwargs, pit_id, hits) should yield letters for hits in order,
+    searching for more hits after the last one until there aren't any more, and close the point in time
+    """
+
+    @patch('letters.letter_search.close_point_in_time', autospec=True)
+    @patch('letters.letter_search.do_es_search', autospec=True)
+    def test_iterate_letters_for_hits(self, mock_do_es_search, mock_close_point_in_time):
+        letters = [LetterFactory() for _ in range(3)]
+        hits = [{'_id': str(letter.pk), 'sort': [index]} for index, letter in enumerate(letters)]
+        mock_do_es_search.return_value = {'hits': {'hits': [hits[2]]}}
+
+        result = list(iterate_letters_for_hits({'query': 'query', 'size': 2}, 'pit_id', hits[:2]))
+
+        self.assertEqual(result, letters, 'iterate_letters_for_hits() should yield letters for all hits in order')
+        self.assertEqual(mock_do_es_search.call_count, 1,
+                         "iterate_letters_for_hits() shouldn't search again after a batch with fewer hits than size")
+        args, kwargs = mock_do_es_search.call_args
+        self.assertEqual(kwargs['search_after'], [1],
+                         'iterate_letters_for_hits() should search for hits after the last hit of previous batch')
+        self.assertEqual(kwargs['pit'], {'id': 'pit_id', 'keep_alive': PIT_KEEP_ALIVE},
+                         'iterate_letters_for_hits() should search with point in time')
+        args, kwargs = mock_close_point_in_time.call_args
+        self.assertEqual(args[0], 'pit_id', 'iterate_letters_for_hits() should close point in time when done')
+
+    @patch('letters.letter_search.close_point_in_time', autospec=True)
+    @patch('letters.letter_search.do_es_search', autospec=True)
+    def test_iterate_letters_for_hits_deleted_letter(self, mock_do_es_search, mock_close_point_in_time):
+        """
+        Hits for letters that aren't in the database anymore should be skipped
+        """
+
+        letter = LetterFactory()
+        hits = [{'_id': '0', 'sort': [0]}, {'_id': str(letter.pk), 'sort': [1]}]
+
+        result = list(iterate_letters_for_hits({'query': 'query', 'size': 10}, 'pit_id', hits))
+
+        self.assertEqual(result, [letter], "iterate_letters_for_hits() should skip letters that don't exist anymore")
+        self.assertEqual(mock_do_es_search.call_count, 0,
+                         "iterate_letters_for_hits() shouldn't search again if there weren't size hits")
+
+    @patch('letters.letter_search.close_point_in_time', autospec=True)
+    @patch('letters.letter_search.do_es_search', autospec=True)
+    def test_iterate_letters_for_hits_closed(self, mock_do_es_search, mock_close_point_in_time):
+        """
+        If iteration stops early, the point in time should still be closed
+        """
+
+        letters = [LetterFactory() for _ in range(2)]
+        hits = [{'_id': str(letter.pk), 'sort': [index]} for index, letter in enumerate(letters)]
+
+        iterator = iterate_letters_for_hits({'query': 'query', 'size': 2}, 'pit_id', hits)
+        next(iterator)
+        iterator.close()
+
+        self.assertEqual(mock_close_point_in_time.call_count, 1,
+                         'iterate_letters_for_hits() should close point in time when generator gets closed')
@@ -1,12 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from django_date_extensions.fields import ApproximateDate
+from io import StringIO
+import json
+import os
+import tempfile
 from unittest.mock import patch
 
-from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from elastic_transport import ConnectionError
 
+from letterpress.exceptions import ElasticsearchException
+from letter_sentiment.models import CustomSentimentScore
+from letter_sentiment.tests.factories import CustomSentimentFactory, TermFactory
 from letters import es_settings
-from letters.management.commands.push_to_index import Command
-from letters.models import Letter
-from letters.tests.factories import LetterFactory
+from letters.management.commands.benchmark_html_to_text import Command as BenchmarkHtmlToTextCommand
+from letters.management.commands.check_index import Command as CheckIndexCommand
+from letters.management.commands.flush_index_outbox import Command as FlushIndexOutboxCommand
+from letters.management.commands.import_letters import Command as ImportLettersCommand
+from letters.management.commands.push_to_index import BULK_LOAD_INDEX_SETTINGS, SERVING_INDEX_SETTINGS, Command, \
+    iterate_chunks
+from letters.management.commands.sync_index import Command as SyncIndexCommand, get_index_actions, \
+    get_letter_chunks, get_orphan_ids
+from letters.management.commands.update_letter_sentiment import Command as UpdateLetterSentimentCommand
+from letters.management.commands.update_letter_text import Command as UpdateLetterTextCommand
+from letters.models import Correspondent, IndexOutboxEntry, Letter, Place
+from letters.tests.factories import CorrespondentFactory, LetterFactory, PlaceFactory
 
 
 class PushToIndexTestCase(TestCase):
@@ -28,51 +50,186 @@ class PushToIndexTestCase(TestCase):
                                     body='As this is the beginin of a new year I thought as I was a lone to night I '
                                          'would write you a few lines to let you know that we are not all ded yet.')
 
-    @patch.object(Command, 'recreate_index', autospec=True)
+    @patch.object(Command, 'delete_old_versions', autospec=True)
+    @patch.object(Command, 'move_alias', autospec=True)
+    @patch.object(Command, 'check_index', autospec=True)
+    @patch.object(Command, 'finish_index', autospec=True)
     @patch.object(Command, 'push_db_to_index', autospec=True)
-    def test_handle(self, mock_push_db_to_index, mock_recreate_index):
+    @patch.object(Command, 'create_index', autospec=True, return_value='letterpress_v20240101000000')
+    @patch('elasticsearch.client.IndicesClient.delete', autospec=True)
+    def test_handle(self, mock_IndicesClient_delete, mock_create_index, mock_push_db_to_index, mock_finish_index,
+                    mock_check_index, mock_move_alias, mock_delete_old_versions):
         """
-        Command.handle() should call Command.recreate_index() and Command.push_db_to_index()
+        Command.handle() should create a new index, push letters to it, restore its settings, check it,
+        then point the alias at it and delete old versions
+
+        If something goes wrong before the alias is moved, the new index should be deleted
         """
 
         self.command.handle()
 
-        self.assertEqual(mock_recreate_index.call_count, 1, 'Command.handle() should call Command.recreate_index()')
-        self.assertEqual(mock_push_db_to_index.call_count, 1, 'Command.handle() should call Command.push_db_to_index()')
+        methods = {'create_index': mock_create_index, 'push_db_to_index': mock_push_db_to_index,
+                   'finish_index': mock_finish_index, 'check_index': mock_check_index,
+                   'move_alias': mock_move_alias, 'delete_old_versions': mock_delete_old_versions}
+        for method_name, mock_method in methods.items():
+            self.assertEqual(mock_method.call_count, 1, 'Command.handle() should call Command.{}()'.format(method_name))
+        args, kwargs = mock_push_db_to_index.call_args
+        self.assertEqual(kwargs['index_name'], mock_create_index.return_value,
+                         'Command.handle() should push letters to the new index')
+        args, kwargs = mock_move_alias.call_args
+        self.assertEqual(args[1], mock_create_index.return_value,
+                         'Command.handle() should point the alias at the new index')
+        self.assertEqual(mock_IndicesClient_delete.call_count, 0,
+                         "Command.handle() shouldn't delete the new index if everything goes well")
+
+        # If the new index doesn't check out, it should be deleted and the alias shouldn't be moved
+        mock_move_alias.reset_mock()
+        mock_check_index.side_effect = CommandError('Letters missing')
+        with self.assertRaises(CommandError):
+            self.command.handle()
+        self.assertEqual(mock_move_alias.call_count, 0,
+                         "Command.handle() shouldn't move the alias if the new index is incomplete")
+        args, kwargs = mock_IndicesClient_delete.call_args
+        self.assertEqual(kwargs['index'], mock_create_index.return_value,
+                         'Command.handle() should delete the new index if it is incomplete')
+
+    @patch.object(Command, 'rollback', autospec=True)
+    @patch.object(Command, 'create_index', autospec=True)
+    def test_handle_rollback(self, mock_create_index, mock_rollback):
+        """
+        Command.handle() with rollback should call Command.rollback() and not build a new index
+        """
+
+        self.command.handle(rollback=True)
+
+        self.assertEqual(mock_rollback.call_count, 1, 'Command.handle(rollback=True) should call Command.rollback()')
+        self.assertEqual(mock_create_index.call_count, 0,
+                         "Command.handle(rollback=True) shouldn't call Command.create_index()")
 
-    @patch('elasticsearch.client.IndicesClient.exists', autospec=True)
-    @patch('elasticsearch.client.IndicesClient.delete', autospec=True)
     @patch('elasticsearch.client.IndicesClient.create', autospec=True)
     @patch('elasticsearch.client.IndicesClient.put_mapping', autospec=True)
-    def test_recreate_index_with_mocks(self, mock_IndicesClient_put_mapping, mock_IndicesClient_create,
-                                       mock_IndicesClient_delete, mock_IndicesClient_exists):
+    def test_create_index_with_mocks(self, mock_IndicesClient_put_mapping, mock_IndicesClient_create):
         """
-        Command.recreate_index() should delete the Elasticsearch index if it exists, create a new one,
-        and set up a mapping
+        Command.create_index() should create a new version of the index with bulk load settings,
+        set up a mapping, and return the name of the new index
 
         Unit test: mock everything
         """
 
+        index_name = self.command.create_index()
+
+        self.assertTrue(index_name.startswith(Letter._meta.es_index_name + '_v'),
+                        'Command.create_index() should return a versioned index name')
+        args, kwargs = mock_IndicesClient_create.call_args
+        self.assertEqual(kwargs['index'], index_name,
+                         'Command.create_index() should call IndicesClient.create() with the versioned index name')
+        for key, value in BULK_LOAD_INDEX_SETTINGS.items():
+            self.assertEqual(kwargs['settings'][key], value,
+                             'Command.create_index() should create the index with bulk load settings')
+        self.assertIn('analysis', kwargs['settings'],
+                      'Command.create_index() should create the index with the analyzer settings')
+        args, kwargs = mock_IndicesClient_put_mapping.call_args
+        self.assertEqual(kwargs['index'], index_name,
+                         'Command.create_index() should call IndicesClient.put_mapping() for the new index')
+
+    @patch('elasticsearch.client.IndicesClient.put_settings', autospec=True)
+    @patch('elasticsearch.client.IndicesClient.refresh', autospec=True)
+    def test_finish_index_with_mocks(self, mock_IndicesClient_refresh, mock_IndicesClient_put_settings):
+        """
+        Command.finish_index() should restore normal index settings and refresh the index
+        """
+
+        self.command.finish_index('letterpress_v1')
+
+        args, kwargs = mock_IndicesClient_put_settings.call_args
+        self.assertEqual(kwargs['settings'], SERVING_INDEX_SETTINGS,
+                         'Command.finish_index() should restore normal index settings')
+        self.assertEqual(mock_IndicesClient_refresh.call_count, 1,
+                         'Command.finish_index() should refresh the index')
+
+    @patch('elasticsearch.Elasticsearch.count', autospec=True)
+    def test_check_index_with_mocks(self, mock_count):
+        """
+        Command.check_index() should raise CommandError if the index doesn't contain every letter
+        """
+
+        mock_count.return_value = {'count': Letter.objects.count()}
+        self.command.check_index('letterpress_v1')
+
+        mock_count.return_value = {'count': Letter.objects.count() - 1}
+        with self.assertRaises(CommandError):
+            self.command.check_index('letterpress_v1')
+
+    @patch.object(Command, 'get_current_versions', autospec=True)
+    @patch('elasticsearch.client.IndicesClient.exists', autospec=True)
+    @patch('elasticsearch.client.IndicesClient.update_aliases', autospec=True)
+    def test_move_alias_with_mocks(self, mock_IndicesClient_update_aliases, mock_IndicesClient_exists,
+                                   mock_get_current_versions):
+        """
+        Command.move_alias() should point the alias at the given index and away from the old one
+        in a single update, deleting an old index with the name of the alias
+        """
+
+        alias = Letter._meta.es_index_name
+        self.command.stdout = StringIO()
+
+        mock_get_current_versions.return_value = ['letterpress_v1']
+        self.command.move_alias('letterpress_v2')
+        args, kwargs = mock_IndicesClient_update_aliases.call_args
+        self.assertEqual(kwargs['actions'], [{'remove': {'index': 'letterpress_v1', 'alias': alias}},
+                                             {'add': {'index': 'letterpress_v2', 'alias': alias}}],
+                         'Command.move_alias() should remove the alias from the old index and add it to the new one')
+
+        # Index from before versioning, with the name of the alias
+        mock_get_current_versions.return_value = []
         mock_IndicesClient_exists.return_value = True
-        self.command.recreate_index()
+        self.command.move_alias('letterpress_v2')
+        args, kwargs = mock_IndicesClient_update_aliases.call_args
+        self.assertEqual(kwargs['actions'], [{'remove_index': {'index': alias}},
+                                             {'add': {'index': 'letterpress_v2', 'alias': alias}}],
+                         'Command.move_alias() should delete an index with the name of the alias')
 
-        self.assertEqual(mock_IndicesClient_exists.call_count, 1,
-                         'Command.recreate_index() should call IndicesClient.exists()')
+    @patch.object(Command, 'get_current_versions', autospec=True, return_value=['letterpress_v3'])
+    @patch.object(Command, 'get_versions', autospec=True)
+    @patch('elasticsearch.client.IndicesClient.delete', autospec=True)
+    def test_delete_old_versions_with_mocks(self, mock_IndicesClient_delete, mock_get_versions,
+                                            mock_get_current_versions):
+        """
+        Command.delete_old_versions() should delete all but the newest versions, but not the one in use
+        """
+
+        self.command.stdout = StringIO()
+        mock_get_versions.return_value = ['letterpress_v1', 'letterpress_v2', 'letterpress_v3', 'letterpress_v4']
 
-        # If index exists, recreate_index() should call IndicesClient.delete()
-        self.assertEqual(mock_IndicesClient_delete.call_count, 1,
-                         'Command.recreate_index() should call IndicesClient.delete() if index exists')
-        self.assertEqual(mock_IndicesClient_create.call_count, 1,
-                         'Command.recreate_index() should call IndicesClient.create()')
-        self.assertEqual(mock_IndicesClient_put_mapping.call_count, 1,
-                         'Command.recreate_index() should call IndicesClient.put_mapping()')
+        self.command.delete_old_versions(keep=2)
+        args, kwargs = mock_IndicesClient_delete.call_args
+        self.assertEqual(kwargs['index'], 'letterpress_v1,letterpress_v2',
+                         'Command.delete_old_versions() should delete all but the newest versions')
 
-        # If index doesn't exist, recreate_index() shouldn't call IndicesClient.delete()
         mock_IndicesClient_delete.reset_mock()
-        mock_IndicesClient_exists.return_value = False
-        self.command.recreate_index()
-        self.assertEqual(mock_IndicesClient_delete.call_count, 0,
-                         "Command.recreate_index() shouldn't call IndicesClient.delete() if index doesn't exist")
+        self.command.delete_old_versions(keep=1)
+        args, kwargs = mock_IndicesClient_delete.call_args
+        self.assertEqual(kwargs['index'], 'letterpress_v1,letterpress_v2',
+                         "Command.delete_old_versions() shouldn't delete the version in use")
+
+    @patch.object(Command, 'move_alias', autospec=True)
+    @patch.object(Command, 'get_current_versions', autospec=True, return_value=['letterpress_v3'])
+    @patch.object(Command, 'get_versions', autospec=True)
+    def test_rollback_with_mocks(self, mock_get_versions, mock_get_current_versions, mock_move_alias):
+        """
+        Command.rollback() should point the alias at the version before the current one,
+        or raise CommandError if there isn't one
+        """
+
+        mock_get_versions.return_value = ['letterpress_v1', 'letterpress_v2', 'letterpress_v3']
+        self.command.rollback()
+        args, kwargs = mock_move_alias.call_args
+        self.assertEqual(args[1], 'letterpress_v2',
+                         'Command.rollback() should point the alias at the previous version')
+
+        mock_get_versions.return_value = ['letterpress_v3']
+        with self.assertRaises(CommandError):
+            self.command.rollback()
 
     # We don't want to be messing with the real Elasticsearch index
     @patch('letters.models.Letter._meta.es_index_name', 'letterpress_test')
@@ -82,6 +239,87 @@ class PushToIndexTestCase(TestCase):
         # Just make sure this doesn't cause an error
         self.command.push_db_to_index()
 
+    @patch('letters.management.commands.push_to_index.parallel_bulk', autospec=True)
+    def test_push_db_to_index_with_mocks(self, mock_parallel_bulk):
+        """
+        Command.push_db_to_index() should send bulk actions to parallel_bulk() with chunk_size and thread_count,
+        and report the letters that couldn't be indexed
+
+        Unit test: mock parallel_bulk()
+        """
+
+        mock_parallel_bulk.return_value = [
+            (True, {'create': {'_id': self.letter.pk, 'status': 201}}),
+            (False, {'create': {'_id': 99, 'status': 400, 'error': {'type': 'mapper_parsing_exception'}}}),
+        ]
+        self.command.stdout = StringIO()
+        self.command.stderr = StringIO()
+
+        result = self.command.push_db_to_index(chunk_size=10, thread_count=2, processes=1)
+
+        self.assertEqual(result, (1, 1),
+                         'Command.push_db_to_index() should return number of letters indexed and failed')
+        args, kwargs = mock_parallel_bulk.call_args
+        self.assertEqual(kwargs['chunk_size'], 10,
+                         'Command.push_db_to_index() should call parallel_bulk() with chunk_size')
+        self.assertEqual(kwargs['thread_count'], 2,
+                         'Command.push_db_to_index() should call parallel_bulk() with thread_count')
+        self.assertFalse(kwargs['raise_on_error'],
+                         "Command.push_db_to_index() should report failed letters, not stop at the first one")
+        self.assertIn('Failed to create letter 99', self.command.stderr.getvalue(),
+                      'Command.push_db_to_index() should report letters that failed to be indexed')
+        self.assertIn('docs/sec', self.command.stdout.getvalue(),
+                      'Command.push_db_to_index() should report indexing speed')
+
+    def test_get_bulk_actions(self):
+        """
+        Command.get_bulk_actions() should generate a create action for every letter,
+        with contents converted from html by the executor
+        """
+
+        other_letter = LetterFactory(body='<p>Dear sister<br>I take my pen in hand</p>')
+        # Simulate a letter that was saved before the text was stored, so its body has to be converted
+        Letter.objects.filter(pk=self.letter.pk).update(body_text=None, contents_text=None)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            actions = list(self.command.get_bulk_actions(executor, chunk_size=1, processes=2))
+
+        self.assertEqual([action['_id'] for action in actions], [self.letter.pk, other_letter.pk],
+                         'Command.get_bulk_actions() should generate an action for every letter, in order')
+        self.assertEqual(actions[0]['contents'], self.letter.contents(),
+                         'Command.get_bulk_actions() should convert bodies of letters without stored text')
+        self.assertEqual(actions[1]['contents'], other_letter.contents(),
+                         'Command.get_bulk_actions() should generate the same contents as Letter.contents()')
+        self.assertEqual(actions[1]['_op_type'], 'create',
+                         "Command.get_bulk_actions() should generate 'create' actions")
+
+    @patch('letters.management.commands.check_index.get_orphan_ids', autospec=True, return_value=[])
+    @patch('letters.management.commands.check_index.get_index_hashes', autospec=True)
+    @patch('elasticsearch.client.IndicesClient.exists', autospec=True, return_value=True)
+    def test_check_index_after_push(self, mock_IndicesClient_exists, mock_get_index_hashes, mock_get_orphan_ids):
+        """
+        After letters have been pushed to the index, check_index shouldn't find any of them out of date,
+        even if their content hashes hadn't been stored before
+        """
+
+        # LetterFactory doesn't index letters, so they don't have content hashes yet
+        other_letter = LetterFactory(body='<p>Dear sister<br>I take my pen in hand</p>')
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            actions = list(self.command.get_bulk_actions(executor, chunk_size=1, processes=2))
+        index_hashes = {str(action['_id']): action['content_hash'] for action in actions}
+        mock_get_index_hashes.side_effect = lambda letter_ids: {str(letter_id): index_hashes[str(letter_id)]
+                                                                for letter_id in letter_ids}
+
+        check_index_command = CheckIndexCommand()
+        check_index_command.stdout = StringIO()
+        check_index_command.handle(chunk_size=10, report=20)
+
+        self.assertIn('0 out of date in the index', check_index_command.stdout.getvalue(),
+                      "check_index shouldn't find letters out of date right after push_to_index")
+        for letter in [self.letter, other_letter]:
+            self.assertEqual(Letter.objects.get(pk=letter.pk).content_hash, letter.get_content_hash(),
+                             'push_to_index should store the content hashes it indexed')
+
     # We don't want to be messing with the real Elasticsearch index
     @patch('letters.models.Letter._meta.es_index_name', 'letterpress_test')
     def test_convert_for_bulk(self):
@@ -97,3 +335,601 @@ class PushToIndexTestCase(TestCase):
             self.assertIn(key, data, "Data returned from convert_for_bulk() should contain '{}'".format(key))
         self.assertEqual(data.get('_index'), Letter._meta.es_index_name,
                          'Data returned from convert_for_bulk() should contain letter index name')
+        self.assertEqual(data.get('content_hash'), self.letter.get_content_hash(),
+                         'Data returned from convert_for_bulk() should contain the current content hash')
+
+
+class BenchmarkHtmlToTextTestCase(SimpleTestCase):
+    """
+    benchmark_html_to_text should time html_to_text() against BeautifulSoup and check they produce the same text
+    """
+
+    @patch.object(BenchmarkHtmlToTextCommand, 'get_bodies', autospec=True,
+                  return_value=['<p>Dear sister<br>I take my pen in hand</p>', 'We are not all ded yet.'])
+    def test_handle(self, mock_get_bodies):
+        out = StringIO()
+        call_command('benchmark_html_to_text', '--repeat', '1', stdout=out)
+
+        for name in ['BeautifulSoup', 'lxml parser target', 'html_to_text() uncached', 'html_to_text() cached']:
+            self.assertIn(name, out.getvalue(), 'benchmark_html_to_text should report the time for {}'.format(name))
+        self.assertIn('Converted 2 letter bodies', out.getvalue(),
+                      'benchmark_html_to_text should report the number of bodies converted')
+        self.assertIn('0 bodies converted to different text', out.getvalue(),
+                      'benchmark_html_to_text should report bodies that html_to_text() converts differently')
+
+    @patch.object(BenchmarkHtmlToTextCommand, 'get_bodies', autospec=True, return_value=[])
+    def test_handle_no_letters(self, mock_get_bodies):
+        with self.assertRaises(CommandError):
+            call_command('benchmark_html_to_text', stdout=StringIO())
+
+
+class CheckIndexTestCase(TestCase):
+    """
+    check_index should report letters that are missing or out of date in the index
+    and documents in the index that aren't letters, and repair them with --repair
+    """
+
+    def setUp(self):
+        self.command = CheckIndexCommand()
+        self.command.stdout = StringIO()
+        self.command.stderr = StringIO()
+        self.letters = [LetterFactory(date=ApproximateDate(1862, 1, 1), body='We are not all ded yet.')
+                        for _ in range(3)]
+        # The first letter is up to date in the index, the second is out of date, and the third is missing
+        self.index_hashes = {str(self.letters[0].pk): self.letters[0].get_content_hash(),
+                             str(self.letters[1].pk): 'old hash',
+                             'temp': None}
+
+    @patch.object(CheckIndexCommand, 'repair', autospec=True)
+    @patch('letters.management.commands.check_index.get_orphan_ids', autospec=True, return_value=['temp'])
+    @patch('letters.management.commands.check_index.get_index_hashes', autospec=True)
+    @patch('elasticsearch.client.IndicesClient.exists', autospec=True, return_value=True)
+    @patch('letters.management.commands.check_index.bump_corpus_generation', autospec=True)
+    def test_handle(self, mock_bump_corpus_generation, mock_IndicesClient_exists, mock_get_index_hashes,
+                    mock_get_orphan_ids, mock_repair):
+        mock_get_index_hashes.side_effect = lambda letter_ids: {str(letter_id): self.index_hashes[str(letter_id)]
+                                                                for letter_id in letter_ids
+                                                                if str(letter_id) in self.index_hashes}
+
+        self.command.handle(chunk_size=2, report=20)
+
+        output = self.command.stdout.getvalue()
+        self.assertIn('1 missing from the index: {}'.format(self.letters[2].pk), output,
+                      'check_index should report letters that are missing from the index')
+        self.assertIn('1 out of date in the index: {}'.format(self.letters[1].pk), output,
+                      'check_index should report letters that are out of date in the index')
+        self.assertIn('1 orphaned in the index: temp', output,
+                      "check_index should report documents in the index that aren't letters")
+        self.assertEqual(mock_get_index_hashes.call_count, 2, 'check_index should compare letters a chunk at a time')
+        self.assertEqual(mock_repair.call_count, 0, "check_index shouldn't repair anything without --repair")
+
+        def repair(command, actions, chunk_size, letters=()):
+            command.repaired += len(actions)
+
+        mock_repair.side_effect = repair
+        self.command.handle(chunk_size=2, report=20, repair=True)
+        self.assertEqual([[action['_id'] for action in call[0][1]] for call in mock_repair.call_args_list],
+                         [[self.letters[1].pk], [self.letters[2].pk], ['temp']],
+                         'check_index --repair should repair each chunk as it is compared, then delete orphans')
+        self.assertIn('Repaired 3 documents, 0 failed', self.command.stdout.getvalue(),
+                      'check_index --repair should report the number of documents repaired')
+        self.assertEqual(mock_bump_corpus_generation.call_count, 1,
+                         'check_index --repair should invalidate cached search results')
+
+        mock_IndicesClient_exists.return_value = False
+        with self.assertRaises(CommandError):
+            self.command.handle(chunk_size=2, report=20)
+
+    @patch('letters.management.commands.check_index.streaming_bulk', autospec=True)
+    def test_repair(self, mock_streaming_bulk):
+        actions, changed_hashes = get_index_actions(self.letters[1:], self.index_hashes)
+        actions.append({'_op_type': 'delete', '_index': Letter._meta.es_index_name, '_id': 'temp'})
+        mock_streaming_bulk.return_value = [
+            (False, {'index': {'_id': str(self.letters[1].pk), 'status': 500, 'error': 'oops'}}),
+            (True, {'index': {'_id': str(self.letters[2].pk), 'status': 201}}),
+            (True, {'delete': {'_id': 'temp', 'status': 200}}),
+        ]
+
+        self.command.repair(actions, chunk_size=2, letters=self.letters[1:])
+
+        self.assertEqual((self.command.repaired, self.command.failed), (2, 1),
+                         'Command.repair() should count the documents repaired and the ones that failed')
+        args, kwargs = mock_streaming_bulk.call_args
+        self.assertEqual(kwargs['actions'], actions, 'Command.repair() should send all the actions to Elasticsearch')
+        self.assertEqual(Letter.objects.get(pk=self.letters[2].pk).content_hash, self.letters[2].get_content_hash(),
+                         'Command.repair() should store the content hashes of letters that were indexed')
+        self.assertEqual(Letter.objects.get(pk=self.letters[1].pk).content_hash, '',
+                         "Command.repair() shouldn't store the content hashes of letters that failed")
+        self.assertIn('oops', self.command.stderr.getvalue(), 'Command.repair() should report failures')
+
+
+class FlushIndexOutboxTestCase(TestCase):
+    """
+    flush_index_outbox should flush the index outbox once, or keep flushing it with --loop
+    """
+
+    @patch('letters.management.commands.flush_index_outbox.flush_index_outbox', autospec=True, return_value=(2, 1, 0))
+    def test_handle(self, mock_flush_index_outbox):
+        out = StringIO()
+        call_command('flush_index_outbox', '--batch-size', '10', '--refresh', 'true', stdout=out)
+
+        args, kwargs = mock_flush_index_outbox.call_args
+        self.assertEqual(kwargs, {'batch_size': 10, 'refresh': 'true'},
+                         'flush_index_outbox should call flush_index_outbox() with batch size and refresh policy')
+        self.assertIn('Indexed 2 letters and deleted 1 from the index, 0 failed', out.getvalue(),
+                      'flush_index_outbox should report the numbers of letters indexed, deleted and failed')
+
+    @patch('letters.management.commands.flush_index_outbox.time.sleep', autospec=True)
+    @patch.object(FlushIndexOutboxCommand, 'flush', autospec=True)
+    def test_handle_loop(self, mock_flush, mock_sleep):
+        # Stop the loop after the third sleep
+        mock_sleep.side_effect = [None, None, KeyboardInterrupt]
+
+        with self.assertRaises(KeyboardInterrupt):
+            FlushIndexOutboxCommand().handle(loop=True, interval=1)
+        self.assertEqual(mock_flush.call_count, 3, 'flush_index_outbox --loop should keep flushing the outbox')
+        args, kwargs = mock_sleep.call_args
+        self.assertEqual(args[0], 1, 'flush_index_outbox --loop should wait interval seconds between flushes')
+
+    @patch('letters.management.commands.flush_index_outbox.time.sleep', autospec=True)
+    @patch('letters.index_outbox.streaming_bulk', autospec=True)
+    def test_handle_connection_error(self, mock_streaming_bulk, mock_sleep):
+        """
+        If Elasticsearch can't be reached, flush_index_outbox --loop should keep going,
+        leaving the entries in the outbox, and without --loop it should raise CommandError
+        """
+
+        IndexOutboxEntry.objects.all().delete()
+        IndexOutboxEntry.queue_letters([LetterFactory().pk])
+        mock_streaming_bulk.side_effect = ConnectionError('Connection refused')
+        # Stop the loop after the second sleep
+        mock_sleep.side_effect = [None, KeyboardInterrupt]
+
+        command = FlushIndexOutboxCommand()
+        command.stderr = StringIO()
+        with self.assertRaises(KeyboardInterrupt):
+            command.handle(loop=True, interval=1)
+        self.assertEqual(mock_streaming_bulk.call_count, 2,
+                         "flush_index_outbox --loop should keep flushing if Elasticsearch can't be reached")
+        self.assertIn("Couldn't reach Elasticsearch", command.stderr.getvalue(),
+                      "flush_index_outbox --loop should report that Elasticsearch couldn't be reached")
+        self.assertEqual(IndexOutboxEntry.objects.count(), 1,
+                         "flush_index_outbox should leave entries in the outbox if Elasticsearch can't be reached")
+
+        with self.assertRaises(CommandError):
+            command.handle()
+
+
+class ImportLettersTestCase(TestCase):
+    """
+    import_letters should import letters from CSV or JSON Lines files in batches,
+    creating correspondents, places and sources as needed, and index them
+    """
+
+    def setUp(self):
+        self.command = ImportLettersCommand()
+        self.command.stdout = StringIO()
+        self.command.stderr = StringIO()
+        self.writer = CorrespondentFactory(last_name='Fisher', first_names='Francis')
+        self.place = PlaceFactory(name='Manassas', state='VA')
+
+    def write_file(self, suffix, contents):
+        file = tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False, encoding='utf-8')
+        with file:
+            file.write(contents)
+        self.addCleanup(os.remove, file.name)
+        return file.name
+
+    @patch('letters.management.commands.import_letters.bump_corpus_generation', autospec=True)
+    @patch('letters.management.commands.import_letters.flush_entries', autospec=True, return_value=(2, 0, 0))
+    def test_handle_csv(self, mock_flush_entries, mock_bump_corpus_generation):
+        file_name = self.write_file('.csv', 'source,date,writer,recipient,place,body,complete_transcription\n'
+                                            'Library,1862-01-01,"Fisher, Francis","Fisher, Mary (Smith)",'
+                                            '"Manassas, VA",<p>We are not all ded yet.</p>,yes\n'
+                                            'Library,1863-04,"Fisher, Francis","Brown, John, Jr.",'
+                                            '"Halifax, NS, CA",<p>I am well.</p>,no\n')
+        self.command.handle(file_name, batch_size=500)
+
+        letters = Letter.objects.order_by('pk')
+        self.assertEqual(len(letters), 2, 'import_letters should import every letter in the file')
+        self.assertEqual(letters[0].writer, self.writer, 'import_letters should use existing correspondents')
+        self.assertEqual(letters[0].place, self.place, 'import_letters should use existing places')
+        self.assertEqual(letters[0].source, letters[1].source,
+                         'import_letters should create a source only once')
+        self.assertEqual(letters[0].recipient.married_name, 'Smith',
+                         'import_letters should create new correspondents with married name')
+        self.assertEqual(letters[1].recipient.suffix, 'Jr.',
+                         'import_letters should create new correspondents with suffix')
+        self.assertEqual(letters[1].place.country, 'CA', 'import_letters should create new places with country')
+        self.assertEqual(letters[1].date, ApproximateDate(1863, 4),
+                         'import_letters should import dates with unknown elements')
+        self.assertTrue(letters[0].complete_transcription, 'import_letters should import complete_transcription')
+        self.assertFalse(letters[1].complete_transcription, 'import_letters should import complete_transcription')
+        self.assertIsNotNone(letters[0].vader_polarity, 'import_letters should calculate standard sentiment')
+
+        self.assertEqual(mock_flush_entries.call_count, 1, 'import_letters should index each batch at once')
+        args, kwargs = mock_flush_entries.call_args
+        self.assertEqual(sorted(entry.letter_id for entry in args[0]), [letter.pk for letter in letters],
+                         'import_letters should queue the imported letters in the index outbox and index them')
+        self.assertEqual(mock_bump_corpus_generation.call_count, 1,
+                         'import_letters should invalidate cached search results')
+        self.assertIn('Imported 2 letters', self.command.stdout.getvalue(),
+                      'import_letters should report the number of letters imported')
+
+    @patch('letters.management.commands.import_letters.bump_corpus_generation', autospec=True)
+    @patch('letters.management.commands.import_letters.flush_entries', autospec=True, return_value=(1, 0, 0))
+    def test_handle_jsonl(self, mock_flush_entries, mock_bump_corpus_generation):
+        rows = [
+            {'date': '1862', 'writer': 'Fisher, Francis', 'recipient': 'Fisher, Mary', 'place': 'Manassas, VA'},
+            {'date': '1862-13-01', 'writer': 'Fisher, Francis', 'recipient': 'Fisher, Mary', 'place': 'Manassas, VA'},
+            {'writer': 'Fisher, Francis', 'place': 'Manassas, VA'},
+            {'writer': 'Fisher, Francis', 'recipient': 'Fisher, Mary', 'place': 'Manassas, VA', 'language': 'XX'},
+            {'writer': 5, 'recipient': 'Fisher, Mary', 'place': 'Manassas, VA'},
+            {'writer': 'Fisher, Francis', 'recipient': 'Jones, Ann', 'place': 'Manassas, VA', 'notes': ['note']},
+            {'writer': 'Fisher, Francis', 'recipient': 'Jones, Ann', 'place': 'Camp, VA, US, Earth'},
+            {'writer': 'Fisher, Francis', 'recipient': 'Jones, Ann', 'place': 'Camp, VA', 'source': '',
+             'date': '1862-13-01'},
+        ]
+        file_name = self.write_file('.jsonl', '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n')
+        self.command.handle(file_name, batch_size=2, source='Library')
+
+        self.assertEqual(Letter.objects.count(), 1, "import_letters shouldn't import invalid letters")
+        self.assertEqual(Letter.objects.get().source.name, 'Library',
+                         'import_letters should use the --source for letters without one')
+        self.assertEqual(self.command.stderr.getvalue().count('Skipped'), 8,
+                         'import_letters should report each letter that gets skipped')
+        self.assertIn('writer should be text, not 5', self.command.stderr.getvalue(),
+                      'import_letters should skip letters with values of the wrong type')
+        self.assertFalse(Correspondent.objects.filter(last_name='Jones').exists(),
+                         "import_letters shouldn't create correspondents for letters that get skipped")
+        self.assertFalse(Place.objects.filter(name='Camp').exists(),
+                         "import_letters shouldn't create places for letters that get skipped")
+        self.assertEqual(mock_flush_entries.call_count, 1,
+                         "import_letters shouldn't index a batch without any valid letters")
+
+    @patch('letters.index_outbox.streaming_bulk', autospec=True)
+    def test_import_batch_connection_error(self, mock_streaming_bulk):
+        """
+        If Elasticsearch can't be reached, the letters should still be imported and left in the outbox
+        """
+
+        IndexOutboxEntry.objects.all().delete()
+        mock_streaming_bulk.side_effect = ConnectionError('Connection refused')
+        letters = [Letter(writer=self.writer, place=self.place, body='We are not all ded yet.') for _ in range(2)]
+
+        result = self.command.import_batch(letters)
+
+        self.assertEqual(result, (2, 2), "Command.import_batch() should count letters that couldn't be indexed")
+        self.assertEqual(Letter.objects.count(), 2, "Command.import_batch() should keep letters it couldn't index")
+        self.assertEqual(IndexOutboxEntry.objects.count(), 2,
+                         "Command.import_batch() should leave letters it couldn't index in the outbox")
+        self.assertIn("Couldn't reach Elasticsearch", self.command.stderr.getvalue(),
+                      "Command.import_batch() should report that Elasticsearch couldn't be reached")
+
+    def test_handle_unknown_format(self):
+        with self.assertRaises(CommandError):
+            self.command.handle('letters.txt', batch_size=500)
+
+
+class IterateChunksTestCase(SimpleTestCase):
+    """
+    iterate_chunks(iterable, chunk_size) should generate lists of up to chunk_size items from iterable
+    """
+
+    def test_iterate_chunks(self):
+        self.assertEqual(list(iterate_chunks(range(5), 2)), [[0, 1], [2, 3], [4]],
+                         'iterate_chunks() should generate lists of up to chunk_size items')
+        self.assertEqual(list(iterate_chunks([], 2)), [],
+                         "iterate_chunks() shouldn't generate anything for an empty iterable")
+
+
+class SyncIndexTestCase(TestCase):
+    """
+    sync_index should reindex letters that have changed since the last sync,
+    and delete letters from the index that aren't in the database anymore
+    """
+
+    def setUp(self):
+        self.command = SyncIndexCommand()
+        self.command.stdout = StringIO()
+        self.command.stderr = StringIO()
+        self.letters = [LetterFactory(date=ApproximateDate(1862, 1, 1), body='We are not all ded yet.')
+                        for _ in range(2)]
+
+    @patch('letters.management.commands.sync_index.bump_corpus_generation', autospec=True)
+    @patch('letters.management.commands.sync_index.set_index_checkpoint', autospec=True)
+    @patch('letters.management.commands.sync_index.get_index_checkpoint', autospec=True)
+    @patch.object(SyncIndexCommand, 'delete_orphans', autospec=True, return_value=1)
+    @patch.object(SyncIndexCommand, 'reindex_changed_letters', autospec=True, return_value=(2, 0))
+    @patch.object(SyncIndexCommand, 'get_changed_letters', autospec=True)
+    @patch('elasticsearch.client.IndicesClient.put_mapping', autospec=True)
+    @patch('elasticsearch.client.IndicesClient.exists', autospec=True, return_value=True)
+    def test_handle(self, mock_IndicesClient_exists, mock_IndicesClient_put_mapping, mock_get_changed_letters,
+                    mock_reindex_changed_letters, mock_delete_orphans, mock_get_index_checkpoint,
+                    mock_set_index_checkpoint, mock_bump_corpus_generation):
+        """
+        Command.handle() should reindex the letters changed since the checkpoint, delete orphans,
+        and move the checkpoint forward if nothing failed
+        """
+
+        self.command.handle()
+
+        args, kwargs = mock_get_changed_letters.call_args
+        self.assertEqual(args[1], mock_get_index_checkpoint.return_value,
+                         'Command.handle() should get the letters changed since the checkpoint')
+        self.assertEqual(mock_delete_orphans.call_count, 1, 'Command.handle() should call Command.delete_orphans()')
+        self.assertEqual(mock_set_index_checkpoint.call_count, 1,
+                         'Command.handle() should move the checkpoint forward if nothing failed')
+        self.assertEqual(mock_bump_corpus_generation.call_count, 1,
+                         'Command.handle() should call bump_corpus_generation() if letters were reindexed or deleted')
+        self.assertIn('reindexed 2 and deleted 1', self.command.stdout.getvalue(),
+                      'Command.handle() should report the number of letters reindexed and deleted')
+
+        # With full, all letters should be checked
+        self.command.handle(full=True)
+        args, kwargs = mock_get_changed_letters.call_args
+        self.assertIsNone(args[1], 'Command.handle(full=True) should check all letters')
+
+        # If any letters failed, the checkpoint should stay where it is
+        mock_set_index_checkpoint.reset_mock()
+        mock_reindex_changed_letters.return_value = (1, 1)
+        self.command.handle()
+        self.assertEqual(mock_set_index_checkpoint.call_count, 0,
+                         "Command.handle() shouldn't move the checkpoint forward if any letters failed")
+
+        # If there's no index yet, there's nothing to sync
+        mock_IndicesClient_exists.return_value = False
+        with self.assertRaises(CommandError):
+            self.command.handle()
+
+    def test_get_changed_letters(self):
+        """
+        Command.get_changed_letters() should return letters saved since checkpoint or without a content hash,
+        or all letters if there's no checkpoint
+        """
+
+        Letter.objects.update(content_hash='hash')
+        self.assertEqual(self.command.get_changed_letters(None).count(), 2,
+                         "Command.get_changed_letters() should return all letters if there's no checkpoint")
+        self.assertEqual(self.command.get_changed_letters(timezone.now() + timedelta(hours=1)).count(), 0,
+                         "Command.get_changed_letters() shouldn't return letters saved before the checkpoint")
+
+        Letter.objects.filter(pk=self.letters[0].pk).update(content_hash='')
+        self.assertEqual(list(self.command.get_changed_letters(timezone.now() + timedelta(hours=1))),
+                         [self.letters[0]],
+                         'Command.get_changed_letters() should return letters without a content hash')
+
+    def test_get_letter_chunks(self):
+        chunks = list(get_letter_chunks(Letter.objects.order_by('pk'), chunk_size=1))
+
+        self.assertEqual([[letter.pk for letter in chunk] for chunk in chunks],
+                         [[self.letters[0].pk], [self.letters[1].pk]],
+                         'get_letter_chunks() should generate all the letters in chunks, in id order')
+
+    @patch('letters.management.commands.sync_index.scan', autospec=True)
+    def test_get_orphan_ids(self, mock_scan):
+        """
+        get_orphan_ids() should generate the ids of documents that aren't letters in the database,
+        looking them up a chunk at a time
+        """
+
+        orphan_id = str(max(letter.pk for letter in self.letters) + 1)
+        mock_scan.return_value = [{'_id': 'temp'}, {'_id': str(self.letters[0].pk)}, {'_id': orphan_id},
+                                  {'_id': str(self.letters[1].pk)}]
+
+        with self.assertNumQueries(2):
+            orphan_ids = list(get_orphan_ids(chunk_size=2))
+
+        self.assertEqual(orphan_ids, ['temp', orphan_id],
+                         "get_orphan_ids() should generate ids of documents that aren't letters in the database")
+        args, kwargs = mock_scan.call_args
+        self.assertEqual(kwargs['size'], 2, 'get_orphan_ids() should scroll through the index in chunks')
+
+    @patch('letters.management.commands.sync_index.get_index_hashes', autospec=True)
+    def test_get_bulk_actions(self, mock_get_index_hashes):
+        """
+        Command.get_bulk_actions() should generate index actions for letters whose content hash
+        doesn't match the one in the index, and store content hashes that have changed
+        """
+
+        unchanged, changed = self.letters
+        # LetterFactory doesn't index letters, so they don't have content hashes yet
+        for letter in self.letters:
+            letter.content_hash = letter.get_content_hash()
+        Letter.objects.filter(pk=unchanged.pk).update(content_hash=unchanged.content_hash)
+        mock_get_index_hashes.return_value = {str(unchanged.pk): unchanged.content_hash}
+
+        actions = list(self.command.get_bulk_actions(Letter.objects.order_by('pk'), chunk_size=10))
+
+        self.assertEqual([action['_id'] for action in actions], [changed.pk],
+                         "Command.get_bulk_actions() should only generate actions for letters that don't match index")
+        self.assertEqual(actions[0]['_op_type'], 'index', "Command.get_bulk_actions() should generate 'index' actions")
+        self.assertEqual(Letter.objects.get(pk=changed.pk).content_hash, changed.content_hash,
+                         'Command.get_bulk_actions() should store content hashes that have changed')
+        self.assertEqual(actions[0]['content_hash'], changed.content_hash,
+                         'Command.get_bulk_actions() should index the new content hash')
+
+    @patch('letters.management.commands.sync_index.streaming_bulk', autospec=True)
+    @patch('letters.management.commands.sync_index.scan', autospec=True)
+    def test_delete_orphans(self, mock_scan, mock_streaming_bulk):
+        """
+        Command.delete_orphans() should delete letters in the index that aren't in the database,
+        and documents that aren't letters
+        """
+
+        orphan_id = str(max(letter.pk for letter in self.letters) + 1)
+        mock_scan.return_value = [{'_id': str(letter.pk)} for letter in self.letters]
+        mock_scan.return_value += [{'_id': orphan_id}, {'_id': 'temp'}]
+        mock_streaming_bulk.return_value = [(True, {'delete': {'_id': orphan_id, 'status': 200}}),
+                                            (True, {'delete': {'_id': 'temp', 'status': 200}})]
+
+        deleted = self.command.delete_orphans(chunk_size=10)
+
+        self.assertEqual(deleted, 2, 'Command.delete_orphans() should return the number of documents deleted')
+        args, kwargs = mock_streaming_bulk.call_args
+        self.assertEqual(list(kwargs['actions']), [{'_op_type': 'delete', '_index': Letter._meta.es_index_name,
+                                                    '_id': doc_id} for doc_id in [orphan_id, 'temp']],
+                         'Command.delete_orphans() should only delete documents that are not letters in the database')
+
+
+class UpdateLetterSentimentTestCase(TestCase):
+    """
+    update_letter_sentiment should calculate and store standard sentiment for letters
+    that don't have it yet, or for all letters
+    """
+
+    def setUp(self):
+        self.letters = [LetterFactory(body='What a lovely day for a long walk.') for _ in range(3)]
+        # Simulate a letter that was saved before sentiment was stored
+        Letter.objects.filter(pk=self.letters[0].pk).update(textblob_polarity=None, vader_polarity=None)
+
+    def test_handle(self):
+        out = StringIO()
+        call_command('update_letter_sentiment', stdout=out)
+
+        letter = Letter.objects.get(pk=self.letters[0].pk)
+        self.assertIsNotNone(letter.textblob_polarity,
+                             'update_letter_sentiment should store TextBlob polarity for letters without sentiment')
+        self.assertIsNotNone(letter.vader_polarity,
+                             'update_letter_sentiment should store Vader polarity for letters without sentiment')
+        self.assertEqual(letter.sentiment(), self.letters[1].sentiment(),
+                         'update_letter_sentiment should store the same sentiment as Letter.save()')
+        self.assertIn('Updated sentiment for 1 letters', out.getvalue(),
+                      'update_letter_sentiment should only update letters without sentiment by default')
+
+        # With --all, sentiment of all letters should be recalculated
+        out = StringIO()
+        call_command('update_letter_sentiment', '--all', stdout=out)
+        self.assertIn('Updated sentiment for 3 letters', out.getvalue(),
+                      'update_letter_sentiment --all should update all letters')
+
+    def test_handle_start_after(self):
+        """
+        With --start-after, only letters after the given id should be updated
+        """
+
+        out = StringIO()
+        call_command('update_letter_sentiment', '--all', '--start-after', str(self.letters[0].pk), stdout=out)
+        self.assertIn('Updated sentiment for 2 letters', out.getvalue(),
+                      'update_letter_sentiment --start-after should only update letters after the given id')
+
+    @patch('letters.management.commands.update_letter_sentiment.calculate_custom_sentiments', autospec=True)
+    def test_handle_custom(self, mock_calculate_custom_sentiments):
+        """
+        With --custom, custom sentiments should be calculated and stored for letters that don't have them yet
+        """
+
+        custom_sentiment = CustomSentimentFactory(name='OMG Ponies!')
+        TermFactory(text='pony', custom_sentiment=custom_sentiment)
+        CustomSentimentFactory(name='Nothing')
+        CustomSentimentScore.objects.create(custom_sentiment=custom_sentiment, letter=self.letters[0], score=0.75)
+        mock_calculate_custom_sentiments.side_effect = lambda letter_ids, sentiment_ids: {
+            sentiment_id: {letter_id: 0.5 for letter_id in letter_ids} for sentiment_id in sentiment_ids}
+
+        out = StringIO()
+        call_command('update_letter_sentiment', '--custom', stdout=out)
+
+        args, kwargs = mock_calculate_custom_sentiments.call_args
+        self.assertEqual(args, ([letter.pk for letter in self.letters[1:]], [custom_sentiment.id]),
+                         'update_letter_sentiment --custom should calculate custom sentiments with terms '
+                         "that aren't stored yet")
+        self.assertEqual(dict(custom_sentiment.scores.values_list('letter_id', 'score')),
+                         {self.letters[0].pk: 0.75, self.letters[1].pk: 0.5, self.letters[2].pk: 0.5},
+                         'update_letter_sentiment --custom should store calculated custom sentiments')
+        self.assertIn('stored 2 custom sentiment scores', out.getvalue(),
+                      'update_letter_sentiment --custom should report number of custom sentiment scores stored')
+
+        # With --all, stored custom sentiments should be calculated again
+        call_command('update_letter_sentiment', '--all', '--custom', str(custom_sentiment.id), stdout=StringIO())
+        self.assertEqual(custom_sentiment.scores.get(letter=self.letters[0]).score, 0.5,
+                         'update_letter_sentiment --all --custom should replace stored custom sentiments')
+
+    @patch('letters.management.commands.update_letter_sentiment.calculate_custom_sentiments', autospec=True)
+    def test_handle_elasticsearch_exception(self, mock_calculate_custom_sentiments):
+        """
+        If calculating custom sentiments fails, CommandError should be raised saying where to continue from
+        """
+
+        TermFactory(text='pony')
+        mock_calculate_custom_sentiments.side_effect = ElasticsearchException(error='error', status=500)
+
+        with self.assertRaisesRegex(CommandError, 'custom sentiments .*--start-after 0 to continue'):
+            call_command('update_letter_sentiment', '--custom', '--batch-size', '2', stdout=StringIO())
+
+    @patch.object(UpdateLetterSentimentCommand, 'save_batch', autospec=True)
+    def test_handle_interrupted_standard_sentiment(self, mock_save_batch):
+        """
+        If updating standard sentiment gets interrupted, CommandError should say how to continue
+        without skipping custom sentiments of the letters that were done
+        """
+
+        mock_save_batch.side_effect = [2, KeyboardInterrupt]
+        last_pk = self.letters[1].pk
+        with self.assertRaisesRegex(CommandError, 'standard sentiment .*--start-after {} to continue$'.format(last_pk)):
+            call_command('update_letter_sentiment', '--all', '--batch-size', '2', stdout=StringIO())
+
+        mock_save_batch.side_effect = [2, KeyboardInterrupt]
+        with self.assertRaises(CommandError) as context:
+            call_command('update_letter_sentiment', '--all', '--custom', '--batch-size', '2', stdout=StringIO())
+        self.assertIn('--start-after {} and without --custom'.format(last_pk), str(context.exception),
+                      "update_letter_sentiment shouldn't say to continue custom sentiments with --start-after "
+                      'if it was interrupted before calculating them')
+        self.assertIn('then with --custom and without --start-after', str(context.exception),
+                      'update_letter_sentiment should say to calculate custom sentiments without --start-after')
+
+    @patch.object(UpdateLetterSentimentCommand, 'save_batch', autospec=True,
+                  side_effect=lambda self, letters: len(letters))
+    def test_update_sentiment_batches(self, mock_save_batch):
+        """
+        Letters should get saved in batches of batch_size
+        """
+
+        command = UpdateLetterSentimentCommand()
+        count = command.update_sentiment(command.get_letters(update_all=True), batch_size=2)
+
+        self.assertEqual(count, 3, 'Command.update_sentiment() should return number of letters updated')
+        self.assertEqual(mock_save_batch.call_count, 2,
+                         'Command.update_sentiment() should save letters in batches of batch_size')
+
+
+class UpdateLetterTextTestCase(TestCase):
+    """
+    update_letter_text should convert letter bodies to text and store them with the letter contents,
+    for letters that don't have them yet, or for all letters
+    """
+
+    def setUp(self):
+        self.letters = [LetterFactory(greeting='Dear sister', body='<p>I take my pen in hand</p>') for _ in range(3)]
+        # Simulate a letter that was saved before the text was stored
+        Letter.objects.filter(pk=self.letters[0].pk).update(body_text=None, contents_text=None)
+
+    def test_handle(self):
+        out = StringIO()
+        call_command('update_letter_text', stdout=out)
+
+        letter = Letter.objects.get(pk=self.letters[0].pk)
+        self.assertEqual(letter.body_text, self.letters[1].body_text,
+                         'update_letter_text should store the same body text as Letter.save()')
+        self.assertEqual(letter.contents_text, self.letters[1].contents_text,
+                         'update_letter_text should store the same contents as Letter.save()')
+        self.assertIn('Updated text for 1 letters', out.getvalue(),
+                      'update_letter_text should only update letters without stored text by default')
+
+        # With --all, text of all letters should be converted again
+        out = StringIO()
+        call_command('update_letter_text', '--all', stdout=out)
+        self.assertIn('Updated text for 3 letters', out.getvalue(),
+                      'update_letter_text --all should update all letters')
+
+    @patch.object(UpdateLetterTextCommand, 'save_batch', autospec=True, side_effect=lambda self, letters: len(letters))
+    def test_update_text_batches(self, mock_save_batch):
+        """
+        Letters should get saved in batches of batch_size
+        """
+
+        command = UpdateLetterTextCommand()
+        count = command.update_text(command.get_letters(update_all=True), batch_size=2)
+
+        self.assertEqual(count, 3, 'Command.update_text() should return number of letters updated')
+        self.assertEqual(mock_save_batch.call_count, 2,
+                         'Command.update_text() should save letters in batches of batch_size')
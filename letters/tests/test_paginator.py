@@ -0,0 +1,39 @@
+from django.core.paginator import Paginator
+from django.test import SimpleTestCase
+
+from letters.paginator import CountPaginator
+
+
+class CountPaginatorTestCase(SimpleTestCase):
+    """
+    CountPaginator(count, per_page) should work like a Paginator over a list of count objects,
+    without creating the list
+    """
+
+    def test_count_paginator(self):
+        paginator = CountPaginator(count=50000, per_page=10)
+
+        self.assertIsInstance(paginator.object_list, range, "CountPaginator shouldn't create a list of objects")
+        self.assertEqual(paginator.count, 50000, 'CountPaginator.count should be count')
+        self.assertEqual(paginator.num_pages, 5000, 'CountPaginator.num_pages should be based on count and per_page')
+
+        page = paginator.page(3)
+        self.assertEqual((page.start_index(), page.end_index()), (21, 30),
+                         'CountPaginator.page() should return page with start and end index based on per_page')
+        self.assertTrue(page.has_previous() and page.has_next(),
+                        'CountPaginator.page() should return page with previous and next page')
+
+        list_paginator = Paginator(object_list=['x' for _ in range(25)], per_page=10)
+        self.assertEqual(list(CountPaginator(count=25, per_page=10).get_elided_page_range(2)),
+                         list(list_paginator.get_elided_page_range(2)),
+                         'CountPaginator.get_elided_page_range() should be the same as for Paginator over a list')
+
+    def test_count_paginator_no_results(self):
+        """
+        If count is 0, there should be one empty page
+        """
+
+        paginator = CountPaginator(count=0, per_page=10)
+
+        self.assertEqual(paginator.num_pages, 1, 'CountPaginator.num_pages should be 1 if count is 0')
+        self.assertEqual(len(paginator.page(1)), 0, 'CountPaginator.page(1) should be empty if count is 0')
@@ -1,6 +1,7 @@
 from django.test import TestCase
 
-from letters.tests.factories import PlaceFactory
+from letters.models import IndexOutboxEntry, Place
+from letters.tests.factories import LetterFactory, PlaceFactory
 
 
 class PlaceTestCase(TestCase):
@@ -31,3 +32,37 @@ class PlaceTestCase(TestCase):
         place.country = 'US'
         self.assertNotIn(place.country, str(place),
                          "Place.__str__() shouldn't contain country if it's DEFAULT_COUNTRY")
+
+    def test_save(self):
+        """
+        If Place.__str__() has changed, Place.save() should queue the letters written from that place
+        in the index outbox
+        """
+
+        # New place shouldn't need any letters updated
+        place = PlaceFactory(name='Barbecue')
+        self.assertFalse(IndexOutboxEntry.objects.exists(), "Place.save() shouldn't queue any letters for a new place")
+
+        letter = LetterFactory(place=place)
+        LetterFactory()
+        IndexOutboxEntry.objects.all().delete()
+
+        # If nothing shown in search results has changed, letters don't need to be updated
+        place.notes = 'Notes'
+        place.save()
+        self.assertFalse(IndexOutboxEntry.objects.exists(), "Place.save() shouldn't queue any letters if str unchanged")
+
+        place.state = 'NC'
+        place.save()
+        self.assertEqual(list(IndexOutboxEntry.objects.values_list('letter_id', flat=True)), [letter.pk],
+                         'Place.save() should queue letters from place if str changed')
+
+        # A place loaded with deferred fields shouldn't need them queried to tell if it has changed
+        IndexOutboxEntry.objects.all().delete()
+        with self.assertNumQueries(1):
+            place = Place.objects.only('pk', 'notes').get(pk=place.pk)
+        place.notes = 'Other notes'
+        place.save()
+        self.assertFalse(IndexOutboxEntry.objects.exists(),
+                         "Place.save() shouldn't queue any letters if display fields were deferred "
+                         "and haven't been set")
@@ -0,0 +1,173 @@
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from letters.letter_search import ES_Result, LetterSummary
+from letters.search_cache import CORPUS_GENERATION_KEY, SEARCH_CACHE_HITS_KEY, SEARCH_CACHE_MISSES_KEY, \
+    bump_corpus_generation, cache_search_result, get_cached_search_result, get_corpus_generation, \
+    get_normalized_filter_values, get_search_cache_key, get_search_cache_stats
+from letters.tests.test_letter_search import get_filter_values_namedtuple
+
+
+def get_filter_values(**kwargs):
+    FilterValues = get_filter_values_namedtuple()
+    filter_values = {'search_text': 'pony', 'source_ids': [1, 2], 'writer_ids': [3, 4], 'start_date': '1863-01-01',
+                     'end_date': '1863-12-31', 'words': [], 'sentiment_ids': [0, 1], 'sort_by': 'DATE'}
+    filter_values.update(kwargs)
+    return FilterValues(**filter_values)
+
+
+class BumpCorpusGenerationTestCase(SimpleTestCase):
+    """
+    bump_corpus_generation() should set a new corpus generation, even if it isn't in the cache yet
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_bump_corpus_generation(self):
+        bump_corpus_generation()
+        generation = get_corpus_generation()
+        self.assertIsNotNone(generation,
+                             "bump_corpus_generation() should set corpus generation if it isn't in the cache")
+
+        bump_corpus_generation()
+        self.assertNotEqual(get_corpus_generation(), generation,
+                            'bump_corpus_generation() should set a different corpus generation')
+
+
+class CacheSearchResultTestCase(SimpleTestCase):
+    """
+    cache_search_result() should store search result in the cache, so it can be retrieved
+    with get_cached_search_result()
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cache_search_result(self):
+        letter = LetterSummary(id=1, pk=1, list_date='1863-01-01', writer='Bob', recipient='Alice', place='Here',
+                               place_id=2)
+        es_result = ES_Result(search_results=[(letter, 'highlight', [(1, 'sentiment')], 1.5)], total=1, pages=1)
+
+        cache_search_result('key', es_result)
+        self.assertEqual(get_cached_search_result('key'), es_result,
+                         'cache_search_result() should store search result in the cache')
+
+
+class GetCachedSearchResultTestCase(SimpleTestCase):
+    """
+    get_cached_search_result() should return the cached search result or None, and count hits and misses
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_get_cached_search_result(self):
+        self.assertIsNone(get_cached_search_result('key'),
+                          "get_cached_search_result() should return None if search result isn't cached")
+        cache_search_result('key', 'search_result')
+        self.assertEqual(get_cached_search_result('key'), 'search_result',
+                         'get_cached_search_result() should return cached search result')
+        get_cached_search_result('key')
+
+        stats = get_search_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1),
+                         'get_cached_search_result() should count cache hits and misses')
+
+
+class GetCorpusGenerationTestCase(SimpleTestCase):
+    """
+    get_corpus_generation() should return the current corpus generation, starting a new one if there isn't one
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_get_corpus_generation(self):
+        generation = get_corpus_generation()
+        self.assertEqual(get_corpus_generation(), generation,
+                         'get_corpus_generation() should return the same generation until it gets bumped')
+
+        # If the generation gets evicted from the cache, search results cached for an earlier one
+        # mustn't become reachable again
+        cache.delete(CORPUS_GENERATION_KEY)
+        self.assertNotEqual(get_corpus_generation(), generation,
+                            "get_corpus_generation() should start a new generation if it isn't in the cache")
+
+
+class GetNormalizedFilterValuesTestCase(SimpleTestCase):
+    """
+    get_normalized_filter_values() should return the same for equivalent filter values
+    """
+
+    def test_get_normalized_filter_values(self):
+        self.assertEqual(
+            get_normalized_filter_values(get_filter_values()),
+            get_normalized_filter_values(get_filter_values(search_text=' pony ', source_ids=[2, 1, 1],
+                                                           writer_ids=[4, 3])),
+            'get_normalized_filter_values() should ignore order of ids and whitespace around search text'
+        )
+        self.assertEqual(get_normalized_filter_values(get_filter_values(search_text=None))['search_text'], '',
+                         "get_normalized_filter_values() should return '' for empty search text")
+
+        # Sentiments are shown in the order they were selected, so order matters
+        self.assertNotEqual(get_normalized_filter_values(get_filter_values(sentiment_ids=[0, 1])),
+                            get_normalized_filter_values(get_filter_values(sentiment_ids=[1, 0])),
+                            'get_normalized_filter_values() should keep order of sentiment ids')
+
+
+class GetSearchCacheKeyTestCase(SimpleTestCase):
+    """
+    get_search_cache_key() should return a key based on normalized filter values, page number, size
+    and current corpus generation
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_get_search_cache_key(self):
+        key = get_search_cache_key(get_filter_values(), page_number=1, size=10, from_index=True)
+
+        self.assertEqual(
+            key, get_search_cache_key(get_filter_values(writer_ids=[4, 3]), page_number=1, size=10, from_index=True),
+            'get_search_cache_key() should return the same key for equivalent filter values'
+        )
+        # Page number 0 is the same as page number 1
+        self.assertEqual(key, get_search_cache_key(get_filter_values(), page_number=0, size=10, from_index=True),
+                         'get_search_cache_key() should return the same key for page number 0 and 1')
+
+        for kwargs in [{'page_number': 2, 'size': 10, 'from_index': True},
+                       {'page_number': 1, 'size': 5, 'from_index': True},
+                       {'page_number': 1, 'size': 10, 'from_index': False}]:
+            self.assertNotEqual(key, get_search_cache_key(get_filter_values(), **kwargs),
+                                'get_search_cache_key() should return a different key for {}'.format(kwargs))
+
+        self.assertNotEqual(key, get_search_cache_key(get_filter_values(search_text='horse'), page_number=1, size=10,
+                                                      from_index=True),
+                            'get_search_cache_key() should return a different key for different filter values')
+
+        # After corpus generation gets bumped, key should be different
+        bump_corpus_generation()
+        self.assertNotEqual(key, get_search_cache_key(get_filter_values(), page_number=1, size=10, from_index=True),
+                            'get_search_cache_key() should return a different key after corpus generation changes')
+
+
+class GetSearchCacheStatsTestCase(SimpleTestCase):
+    """
+    get_search_cache_stats() should return cache hits, misses, hit rate and corpus generation
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_get_search_cache_stats(self):
+        self.assertEqual(get_search_cache_stats(),
+                         {'hits': 0, 'misses': 0, 'hit_rate': 0, 'corpus_generation': get_corpus_generation()},
+                         'get_search_cache_stats() should return zeros if search cache not used yet')
+
+        cache.set(SEARCH_CACHE_HITS_KEY, 3)
+        cache.set(SEARCH_CACHE_MISSES_KEY, 1)
+        bump_corpus_generation()
+        self.assertEqual(get_search_cache_stats(),
+                         {'hits': 3, 'misses': 1, 'hit_rate': 0.75, 'corpus_generation': get_corpus_generation()},
+                         'get_search_cache_stats() should return cache hits, misses, hit rate and corpus generation')
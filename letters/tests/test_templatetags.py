@@ -1,6 +1,7 @@
 from django.core.paginator import Paginator
 from django.test import TestCase
 
+from letters.paginator import CountPaginator
 from letters.templatetags.utils_tags import get_proper_elided_page_range
 
 
@@ -25,3 +26,15 @@ class GetProperElidedPageRangeTestCase(TestCase):
                              'Page {} should not be in elided page range'.format(page_number))
 
         self.assertEqual(elided_page_range.count(str(Paginator.ELLIPSIS)), 2)
+
+    def test_get_proper_elided_page_range_count_paginator(self):
+        """
+        get_proper_elided_page_range() should work with CountPaginator, which has no list of objects
+        """
+
+        paginator = CountPaginator(count=15, per_page=1)
+        elided_page_range = list(get_proper_elided_page_range(paginator, 8, on_each_side=3, on_ends=2))
+
+        ellipsis = Paginator.ELLIPSIS
+        self.assertEqual(elided_page_range, [1, 2, ellipsis, 5, 6, 7, 8, 9, 10, 11, ellipsis, 14, 15],
+                         'get_proper_elided_page_range() should return elided page range for CountPaginator')
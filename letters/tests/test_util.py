@@ -2,9 +2,26 @@ from unittest.mock import patch
 
 from django.test import SimpleTestCase, TestCase
 
-from letters.models import DocumentImage, Envelope
-from letters.models.util import get_envelope_preview, get_image_preview, html_to_text
-from letters.tests.factories import DocumentImageFactory, EnvelopeFactory, LetterFactory
+from letters.management.commands.benchmark_html_to_text import beautifulsoup_html_to_text
+from letters.models import Correspondent, DocumentImage, Envelope
+from letters.models.util import HTML_TO_TEXT_CACHE, LRUCache, get_content_hash, get_envelope_preview, \
+    get_image_preview, get_loaded_field_values, html_to_text, loaded_field_values_changed
+from letters.tests.factories import CorrespondentFactory, DocumentImageFactory, EnvelopeFactory, LetterFactory
+
+
+class GetContentHashTestCase(SimpleTestCase):
+    """
+    get_content_hash() should return a SHA-256 hash of a dict of field values, which doesn't depend on key order
+    """
+
+    def test_get_content_hash(self):
+        content_hash = get_content_hash({'contents': 'Dear sister', 'date': '1862-01-01'})
+
+        self.assertEqual(len(content_hash), 64, 'get_content_hash() should return a SHA-256 hex digest')
+        self.assertEqual(content_hash, get_content_hash({'date': '1862-01-01', 'contents': 'Dear sister'}),
+                         "get_content_hash() shouldn't depend on key order")
+        self.assertNotEqual(content_hash, get_content_hash({'contents': 'Dear brother', 'date': '1862-01-01'}),
+                            'get_content_hash() should return a different hash for different values')
 
 
 class GetEnvelopePreviewTestCase(TestCase):
@@ -65,11 +82,35 @@ class GetImagePreviewTestCase(TestCase):
                          'get_image_preview() should return &nbsp;-separated list of image previews')
 
 
+class GetLoadedFieldValuesTestCase(TestCase):
+    """
+    get_loaded_field_values(instance, field_names) should return the values of the given fields
+    that have been loaded, without querying for deferred ones
+    """
+
+    def test_get_loaded_field_values(self):
+        CorrespondentFactory(last_name='Waite', first_names='Elizabeth A.')
+
+        correspondent = Correspondent.objects.get()
+        self.assertEqual(get_loaded_field_values(correspondent, ['last_name', 'first_names']),
+                         {'last_name': 'Waite', 'first_names': 'Elizabeth A.'},
+                         'get_loaded_field_values() should return values of loaded fields')
+
+        correspondent = Correspondent.objects.only('last_name').get()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_loaded_field_values(correspondent, ['last_name', 'first_names']),
+                             {'last_name': 'Waite'},
+                             "get_loaded_field_values() shouldn't return or query for deferred fields")
+
+
 class HtmlToTextTestCase(SimpleTestCase):
     """
-    html_to_text() should convert an html snippet to text using BeautifulSoup
+    html_to_text() should convert an html snippet to text, the same way BeautifulSoup does it
     """
 
+    def setUp(self):
+        HTML_TO_TEXT_CACHE.clear()
+
     def test_html_to_text(self):
 
         html = '<div>Some text<br>Some more text<br>Even more text</div>'
@@ -80,3 +121,78 @@ class HtmlToTextTestCase(SimpleTestCase):
         for element in ['<div>', '</div>', '<br>']:
             self.assertNotIn(element, text, "html_to_text() should return text that doesn't contain html")
         self.assertEqual(text.count('\n'), 2, "html_to_text() should replace '<br>' with '\n'")
+        self.assertEqual(html_to_text(None), '', 'html_to_text() should return empty string if there is no html')
+
+    def test_html_to_text_same_as_beautifulsoup(self):
+        snippets = [
+            '<p>Dear sister<br>I take my pen in hand</p>',
+            'As this is the beginin of a new year &amp; I thought&nbsp;I would write',
+            '\n\n<p>  Januery the 1st / 62  </p>\n  \n<p>Miss Evey</p>   ',
+            '<!-- comment --><script>var a = 1;</script><style>p {}</style>Wish you were here',
+            '<pre>  one\n\n  two  </pre> <textarea>\n</textarea>',
+            '<!DOCTYPE html><html><head><title>Letter</title></head><body><p>unclosed <b>bold<br/></body></html>',
+            '<table><tr><td>1</td> <td>2</td></tr></table><br></br>caf\u00e9',
+        ]
+        for html in snippets:
+            self.assertEqual(html_to_text(html), beautifulsoup_html_to_text(html),
+                             'html_to_text() should return the same text as BeautifulSoup for {!r}'.format(html))
+
+    @patch('letters.models.util.convert_html_to_text', autospec=True, return_value='text')
+    def test_html_to_text_cache(self, mock_convert_html_to_text):
+        html_to_text('<p>text</p>')
+        self.assertEqual(html_to_text('<p>text</p>'), 'text', 'html_to_text() should return cached text')
+        self.assertEqual(mock_convert_html_to_text.call_count, 1,
+                         "html_to_text() shouldn't convert the same html twice")
+
+        html_to_text('<p>other text</p>')
+        self.assertEqual(mock_convert_html_to_text.call_count, 2, 'html_to_text() should convert different html')
+
+
+class LoadedFieldValuesChangedTestCase(TestCase):
+    """
+    loaded_field_values_changed(instance, original_values, field_names) should return True if any of the
+    given fields has been changed since original_values were taken, or if there aren't any original values
+    """
+
+    def test_loaded_field_values_changed(self):
+        CorrespondentFactory(last_name='Waite', first_names='Elizabeth A.')
+        field_names = ['last_name', 'first_names']
+
+        correspondent = Correspondent.objects.only('last_name').get()
+        original_values = get_loaded_field_values(correspondent, field_names)
+        with self.assertNumQueries(0):
+            self.assertFalse(loaded_field_values_changed(correspondent, original_values, field_names),
+                             "loaded_field_values_changed() should return False if fields haven't changed, "
+                             "without querying for deferred fields")
+
+        correspondent.last_name = 'Howard'
+        self.assertTrue(loaded_field_values_changed(correspondent, original_values, field_names),
+                        'loaded_field_values_changed() should return True if a loaded field has changed')
+
+        correspondent = Correspondent.objects.only('last_name').get()
+        correspondent.first_names = 'Elizabeth'
+        self.assertTrue(loaded_field_values_changed(correspondent, original_values, field_names),
+                        'loaded_field_values_changed() should return True if a deferred field has been set')
+
+        self.assertTrue(loaded_field_values_changed(correspondent, None, field_names),
+                        'loaded_field_values_changed() should return True if there are no original values')
+
+
+class LRUCacheTestCase(SimpleTestCase):
+    """
+    LRUCache should keep the max_size most recently used items
+    """
+
+    def test_lru_cache(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1, 'LRUCache.get() should return the value that was set')
+        cache.set('c', 3)
+
+        self.assertIsNone(cache.get('b'), 'LRUCache should drop the least recently used item when full')
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3), 'LRUCache should keep recently used items')
+        self.assertEqual(len(cache), 2, "LRUCache shouldn't contain more than max_size items")
+
+        cache.clear()
+        self.assertEqual(len(cache), 0, 'LRUCache.clear() should remove all items')
@@ -1,21 +1,26 @@
 import base64
 from collections import namedtuple
+import csv
+from io import StringIO
 import json
 
 from unittest.mock import MagicMock, patch
 
+from django.contrib.auth.models import User
 from django.contrib.gis.geos import Point
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.test import RequestFactory, SimpleTestCase, TestCase
 from django.urls import reverse
+from django.utils.html import escape
 
 from letterpress.exceptions import ElasticsearchException
+from letters.letter_search import ES_Result
 from letters.models import Correspondent, Letter
 from letters.tests.factories import CorrespondentFactory, LetterFactory, PlaceFactory
-from letters.views import export_csv, export_text, get_elasticsearch_error_response, get_highlighted_letter_sentiment, \
-    get_letter_export_text, GetStatsView, GetTextSentimentView, GetWordCloudView, highlight_for_sentiment, \
-    highlight_letter_for_sentiment, LetterSentimentView, LettersView, PlaceSearchView, SearchView, \
-    show_letter_content
+from letters.views import AsyncGetStatsView, AsyncPlaceSearchView, AsyncSearchView, export_csv, export_text, \
+    get_elasticsearch_error_response, get_highlighted_letter_sentiment, get_letter_export_text, get_search_page_size, \
+    GetStatsView, GetTextSentimentView, GetWordCloudView, highlight_for_sentiment, highlight_letter_for_sentiment, \
+    LetterSentimentView, LettersView, PlaceSearchView, SearchView, show_letter_content
 
 
 class LettersViewTestCase(TestCase):
@@ -44,23 +49,20 @@ class LettersViewTestCase(TestCase):
                              "LettersView context '{}' should be '{}' if GET request".format(key, expected[key]))
         self.assertIn('sort_by', response.context, "LettersView context should contain 'sort_by' if GET request")
 
-    @patch('letters.views.letter_search.do_letter_search', autospec=True)
+    @patch('letters.views.letter_search.get_letters_for_export', autospec=True)
     @patch('letters.views.export_text', autospec=True)
     @patch('letters.views.export_csv', autospec=True)
     @patch('letters.views.letters_filter.get_initial_filter_values', autospec=True)
     def test_letters_view_post(self, mock_get_initial_filter_values, mock_export_csv, mock_export_text,
-                               mock_do_letter_search):
+                               mock_get_letters_for_export):
         """
         If request.method is POST, export_text or export_csv should be called
+        with letters from get_letters_for_export()
         """
 
         letter = LetterFactory()
 
-        ES_Result = namedtuple('ES_Result', ['search_results', 'total', 'pages'])
-        search_results = [(letter, 'highlight', [('1', 'sentiment')], 'score')]
-        es_result = ES_Result(search_results=search_results, total=42, pages=4)
-
-        mock_do_letter_search.return_value = es_result
+        mock_get_letters_for_export.return_value = [letter]
 
         # POST
         # For some reason, it's impossible to request a POST request via the Django test client,
@@ -89,20 +91,20 @@ class LettersViewTestCase(TestCase):
                          "LettersView shouldn't call export_text() if 'export_text' not in POST parameters")
         mock_export_csv.reset_mock()
 
-    @patch('letters.views.letter_search.do_letter_search', autospec=True)
+    @patch('letters.views.letter_search.get_letters_for_export', autospec=True)
     @patch('letters.views.export_text', autospec=True)
     @patch('letters.views.export_csv', autospec=True)
     @patch('letters.views.letters_filter.get_initial_filter_values', autospec=True)
     @patch('letters.views.get_elasticsearch_error_response', autospec=True)
     def test_letters_view_elasticsearch_exception(self, mock_get_elasticsearch_error_response,
                                                   mock_get_initial_filter_values, mock_export_csv, mock_export_text,
-                                                  mock_do_letter_search):
+                                                  mock_get_letters_for_export):
         """
         If request.method is POST and there's an Elasticsearch exception,
         get_elasticsearch_error_response() should be called
         """
 
-        mock_do_letter_search.side_effect = ElasticsearchException(error='error', status=406)
+        mock_get_letters_for_export.side_effect = ElasticsearchException(error='error', status=406)
 
         # POST
         # For some reason, it's impossible to request a POST request via the Django test client,
@@ -317,6 +319,74 @@ class GetStatsViewTestCase(SimpleTestCase):
         mock_get_elasticsearch_error_response.reset_mock()
 
 
+class AsyncGetStatsViewTestCase(SimpleTestCase):
+    """
+    Test AsyncGetStatsView
+    """
+
+    def setUp(self):
+        FilterValues = namedtuple('FilterValues', ['search_text', 'source_ids', 'writer_ids', 'start_date',
+                                                   'end_date', 'words', 'sentiment_ids', 'sort_by'])
+        self.filter_values = FilterValues(search_text='', source_ids=[], writer_ids=[], start_date='', end_date='',
+                                          words=['&', 'and'], sentiment_ids=[], sort_by='')
+
+    @patch('letters.views.letters_filter.get_filter_values_from_request', autospec=True)
+    @patch('letters.views.letter_search.async_get_word_counts_per_month', autospec=True)
+    @patch('letters.views.letter_search.async_get_multiple_word_frequencies', autospec=True)
+    @patch('letters.views.get_stats_response', autospec=True)
+    async def test_async_get_stats_view(self, mock_get_stats_response, mock_async_get_multiple_word_frequencies,
+                                        mock_async_get_word_counts_per_month, mock_get_filter_values_from_request):
+        """
+        AsyncGetStatsView should get word counts and word frequencies and return get_stats_response()
+        """
+
+        mock_get_filter_values_from_request.return_value = self.filter_values
+        mock_async_get_word_counts_per_month.return_value = 'word_counts'
+        mock_async_get_multiple_word_frequencies.return_value = 'word_freqs'
+        mock_get_stats_response.return_value = 'stats_response'
+
+        request = RequestFactory().post(reverse('get_stats'))
+        response = await AsyncGetStatsView.as_view()(request)
+
+        args, kwargs = mock_get_stats_response.call_args
+        self.assertEqual(args, (['&', 'and'], 'word_counts', 'word_freqs'),
+                         'AsyncGetStatsView should call get_stats_response() with word counts and frequencies')
+        self.assertEqual(response, 'stats_response', 'AsyncGetStatsView should return get_stats_response()')
+
+        # If no words in filter_values, word frequencies shouldn't be retrieved
+        mock_async_get_multiple_word_frequencies.reset_mock()
+        mock_get_filter_values_from_request.return_value = self.filter_values._replace(words=[])
+        await AsyncGetStatsView.as_view()(request)
+        self.assertEqual(mock_async_get_multiple_word_frequencies.call_count, 0,
+                         "If no words in filter_values, async_get_multiple_word_frequencies() shouldn't be called")
+        args, kwargs = mock_get_stats_response.call_args
+        self.assertEqual(args, ([], 'word_counts', []),
+                         'If no words in filter_values, AsyncGetStatsView should call get_stats_response() without '
+                         'word frequencies')
+
+    @patch('letters.views.letters_filter.get_filter_values_from_request', autospec=True)
+    @patch('letters.views.letter_search.async_get_word_counts_per_month', autospec=True)
+    @patch('letters.views.letter_search.async_get_multiple_word_frequencies', autospec=True)
+    @patch('letters.views.get_elasticsearch_error_response', autospec=True)
+    async def test_async_get_stats_view_elasticsearch_exception(self, mock_get_elasticsearch_error_response,
+                                                                mock_async_get_multiple_word_frequencies,
+                                                                mock_async_get_word_counts_per_month,
+                                                                mock_get_filter_values_from_request):
+        """
+        If there's an Elasticsearch exception, get_elasticsearch_error_response() should be called
+        """
+
+        mock_get_filter_values_from_request.return_value = self.filter_values
+        mock_async_get_word_counts_per_month.return_value = 'word_counts'
+        mock_async_get_multiple_word_frequencies.side_effect = ElasticsearchException(error='error', status=406)
+
+        request = RequestFactory().post(reverse('get_stats'))
+        await AsyncGetStatsView.as_view()(request)
+
+        self.assertEqual(mock_get_elasticsearch_error_response.call_count, 1,
+                         "If there's an Elasticsearch exception, get_elasticsearch_error_response() should be called")
+
+
 class WordCloudViewTestCase(SimpleTestCase):
     """
     Test WordCloudView
@@ -642,9 +712,9 @@ class GetTextSentimentViewTestCase(SimpleTestCase):
 
     @patch('letters.views.letters_filter.get_filter_values_from_request', autospec=True)
     @patch('letters.views.highlight_for_sentiment', autospec=True)
-    @patch('letters.views.get_sentiment', autospec=True)
+    @patch('letters.views.get_sentiment_and_highlights', autospec=True)
     @patch('letters.views.get_custom_sentiment_for_text', autospec=True)
-    def test_get_text_sentiment_view(self, mock_get_custom_sentiment_for_text, mock_get_sentiment,
+    def test_get_text_sentiment_view(self, mock_get_custom_sentiment_for_text, mock_get_sentiment_and_highlights,
                                      mock_highlight_for_sentiment, mock_get_filter_values_from_request):
 
         # GET request should return HttpResponseNotAllowed
@@ -653,7 +723,9 @@ class GetTextSentimentViewTestCase(SimpleTestCase):
                          'Making a GET request to GetTextSentimentView should return HttpResponseNotAllowed')
 
         mock_get_filter_values_from_request.return_value = self.filter_values
-        mock_highlight_for_sentiment.return_value = 'highlight for sentiment'
+        mock_highlight_for_sentiment.return_value = ['highlight for sentiment']
+        mock_get_sentiment_and_highlights.return_value = (['textblob sentiment', 'vader sentiment'],
+                                                          ['textblob highlight', 'vader highlight'])
         mock_get_custom_sentiment_for_text.return_value = 'custom sentiment for text'
 
         # POST
@@ -662,13 +734,17 @@ class GetTextSentimentViewTestCase(SimpleTestCase):
         request = RequestFactory().post(reverse('get_text_sentiment'), follow=True)
         response = GetTextSentimentView().dispatch(request)
 
-        # highlight_for_sentiment() should be called for each sentiment
-        self.assertEqual(mock_highlight_for_sentiment.call_count, 3,
-                         'GetTextSentimentView should call highlight_for_sentiment() for each sentiment')
+        # highlight_for_sentiment() should be called for each sentiment with id != 0
+        self.assertEqual(mock_highlight_for_sentiment.call_count, 2,
+                         'GetTextSentimentView should call highlight_for_sentiment() for sentiments with id != 0')
 
-        # get_sentiment() should be called for sentiment with id 0
-        self.assertEqual(mock_get_sentiment.call_count, 1,
-                         'GetTextSentimentView should call get_sentiment() for sentiment with id 0')
+        # get_sentiment_and_highlights() should be called once for sentiment with id 0,
+        # analyzing the sentences in this process
+        self.assertEqual(mock_get_sentiment_and_highlights.call_count, 1,
+                         'GetTextSentimentView should call get_sentiment_and_highlights() for sentiment with id 0')
+        args, kwargs = mock_get_sentiment_and_highlights.call_args
+        self.assertEqual((args[1:], kwargs), ((), {}),
+                         "GetTextSentimentView shouldn't have sentences analyzed in worker processes")
 
         # get_custom_sentiment_for_text() should be called for each sentiment with id != 0
         self.assertEqual(mock_get_custom_sentiment_for_text.call_count, 2,
@@ -677,14 +753,19 @@ class GetTextSentimentViewTestCase(SimpleTestCase):
         content = json.loads(response.content.decode('utf-8'))
         self.assertTrue(mock_get_custom_sentiment_for_text.return_value in content['sentiments'],
                         "GetTextSentimentView should return custom sentiment in response content['sentiments']")
+        for text in ['vader sentiment', 'vader highlight']:
+            self.assertTrue(text in content['sentiments'],
+                            "GetTextSentimentView should return standard sentiment and highlights "
+                            "in response content['sentiments']")
 
     @patch('letters.views.letters_filter.get_filter_values_from_request', autospec=True)
     @patch('letters.views.highlight_for_sentiment', autospec=True)
-    @patch('letters.views.get_sentiment', autospec=True)
+    @patch('letters.views.get_sentiment_and_highlights', autospec=True)
     @patch('letters.views.get_custom_sentiment_for_text', autospec=True)
     @patch('letters.views.get_elasticsearch_error_response', autospec=True)
     def test_get_text_sentiment_view_elasticsearch_exception(self, mock_get_elasticsearch_error_response,
-                                                             mock_get_custom_sentiment_for_text, mock_get_sentiment,
+                                                             mock_get_custom_sentiment_for_text,
+                                                             mock_get_sentiment_and_highlights,
                                                              mock_highlight_for_sentiment,
                                                              mock_get_filter_values_from_request):
         """
@@ -692,6 +773,7 @@ class GetTextSentimentViewTestCase(SimpleTestCase):
         """
 
         mock_get_filter_values_from_request.return_value = self.filter_values
+        mock_get_sentiment_and_highlights.return_value = ([], [])
         mock_get_custom_sentiment_for_text.side_effect = ElasticsearchException(error='error', status=406)
 
         request = RequestFactory().post(reverse('get_text_sentiment'))
@@ -726,6 +808,8 @@ class HighlightForSentimentTestCase(SimpleTestCase):
             args[0], text,
             'highlight_for_sentiment() should call highlight_text_for_sentiment() if sentiment_id is 0'
         )
+        self.assertEqual((args[1:], kwargs), ((), {}),
+                         "highlight_for_sentiment() shouldn't have sentences analyzed in worker processes")
         self.assertEqual(
             mock_highlight_for_custom_sentiment.call_count, 0,
             "highlight_for_sentiment() shouldn't call highlight_for_custom_sentiment() if sentiment_id is 0"
@@ -771,9 +855,9 @@ class SearchViewTestCase(TestCase):
 
         letter = LetterFactory()
 
-        ES_Result = namedtuple('ES_Result', ['search_results', 'total', 'pages'])
         search_results = [(letter, 'highlight', [('1', 'sentiment')], 'score')]
-        es_result = ES_Result(search_results=search_results, total=42, pages=4)
+        es_result = ES_Result(search_results=search_results, total=42, pages=4, pit_id='pit_id',
+                              search_after=['1863-01-01', 4])
 
         mock_do_letter_search.return_value = es_result
 
@@ -789,6 +873,12 @@ class SearchViewTestCase(TestCase):
         args, kwargs = mock_do_letter_search.call_args
         self.assertEqual(args, (request, 5, 1),
                          'If search_text supplied to SearchView, the size passed to do_letter_search() should be 5')
+        self.assertTrue(kwargs['from_index'],
+                        'SearchView should call do_letter_search() with from_index=True')
+        self.assertTrue(kwargs['use_cache'],
+                        'SearchView should call do_letter_search() with use_cache=True')
+        self.assertTrue(kwargs['use_pit'],
+                        'SearchView should call do_letter_search() with use_pit=True')
         mock_do_letter_search.reset_mock()
 
         # If search_text not supplied, the size passed to do_letter_search() should be 10
@@ -810,6 +900,13 @@ class SearchViewTestCase(TestCase):
         self.assertTrue(str(letter.writer) in content['letters'],
                         "SearchView response content['letters'] should contain letter found by do_letter_search()")
 
+        # Point in time and search_after for next page should be in pagination
+        self.assertIn('data-pit-id="pit_id"', content['pagination'],
+                      "SearchView response content['pagination'] should contain point in time id")
+        self.assertIn('data-search-after="{}"'.format(escape(json.dumps(es_result.search_after))),
+                      content['pagination'],
+                      "SearchView response content['pagination'] should contain search_after for next page")
+
         # If page_number isn't 0, response content['pagination'] shouldn't be empty string
         self.assertNotEqual(
             content['pagination'], '',
@@ -840,6 +937,122 @@ class SearchViewTestCase(TestCase):
                          "If there's an Elasticsearch exception, get_elasticsearch_error_response() should be called")
 
 
+class AsyncSearchViewTestCase(SimpleTestCase):
+    """
+    Test AsyncSearchView
+    """
+
+    @patch('letters.views.letter_search.async_do_letter_search', autospec=True)
+    @patch('letters.views.get_search_response', autospec=True)
+    async def test_async_search_view(self, mock_get_search_response, mock_async_do_letter_search):
+        """
+        AsyncSearchView should search with async_do_letter_search() and return get_search_response()
+        """
+
+        mock_async_do_letter_search.return_value = 'es_result'
+        mock_get_search_response.return_value = 'search_response'
+
+        request = RequestFactory().post(reverse('search'), {'page_number': '2', 'search_text': 'pony'})
+        response = await AsyncSearchView.as_view()(request)
+
+        args, kwargs = mock_async_do_letter_search.call_args
+        self.assertEqual(args, (request, 5, 2),
+                         'AsyncSearchView should call async_do_letter_search() with request, size and page number')
+        self.assertTrue(kwargs['from_index'] and kwargs['use_cache'] and kwargs['use_pit'],
+                        'AsyncSearchView should call async_do_letter_search() with from_index, use_cache and use_pit')
+        args, kwargs = mock_get_search_response.call_args
+        self.assertEqual(args, ('es_result', 5, 2),
+                         'AsyncSearchView should call get_search_response() with search result, size and page number')
+        self.assertEqual(response, 'search_response', 'AsyncSearchView should return get_search_response()')
+
+    @patch('letters.views.letter_search.async_do_letter_search', autospec=True)
+    @patch('letters.views.get_elasticsearch_error_response', autospec=True)
+    async def test_async_search_view_elasticsearch_exception(self, mock_get_elasticsearch_error_response,
+                                                             mock_async_do_letter_search):
+        """
+        If there's an Elasticsearch exception, get_elasticsearch_error_response() should be called
+        """
+
+        mock_async_do_letter_search.side_effect = ElasticsearchException(error='error', status=406)
+
+        request = RequestFactory().post(reverse('search'), {'page_number': '1'})
+        await AsyncSearchView.as_view()(request)
+
+        self.assertEqual(mock_get_elasticsearch_error_response.call_count, 1,
+                         "If there's an Elasticsearch exception, get_elasticsearch_error_response() should be called")
+
+
+class GetSearchPageSizeTestCase(SimpleTestCase):
+    """
+    get_search_page_size(request) should return 5 if there's search text, otherwise 10
+    """
+
+    def test_get_search_page_size(self):
+        request = RequestFactory().post(reverse('search'), {'search_text': 'pony'})
+        self.assertEqual(get_search_page_size(request), 5,
+                         'get_search_page_size() should return 5 if there is search text')
+
+        request = RequestFactory().post(reverse('search'), {'search_text': ''})
+        self.assertEqual(get_search_page_size(request), 10,
+                         'get_search_page_size() should return 10 if there is no search text')
+
+
+class SearchCacheStatsViewTestCase(TestCase):
+    """
+    Test SearchCacheStatsView
+    """
+
+    @patch('letters.views.get_search_cache_stats', autospec=True)
+    def test_search_cache_stats_view(self, mock_get_search_cache_stats):
+        """
+        SearchCacheStatsView should return search cache stats, but only for staff
+        """
+
+        mock_get_search_cache_stats.return_value = {'hits': 3, 'misses': 1, 'hit_rate': 0.75, 'corpus_generation': 2}
+
+        # Anonymous users should get redirected to login page
+        response = self.client.get(reverse('search_cache_stats'), secure=True)
+        self.assertEqual(response.status_code, 302,
+                         'SearchCacheStatsView should redirect to login if user not logged in')
+        self.assertEqual(mock_get_search_cache_stats.call_count, 0,
+                         "SearchCacheStatsView shouldn't call get_search_cache_stats() if user not staff")
+
+        # Staff should get search cache stats
+        staff_user = User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.client.force_login(staff_user)
+        response = self.client.get(reverse('search_cache_stats'), secure=True)
+        self.assertEqual(json.loads(response.content.decode('utf-8')), mock_get_search_cache_stats.return_value,
+                         'SearchCacheStatsView should return get_search_cache_stats() for staff')
+
+
+class IndexOutboxStatsViewTestCase(TestCase):
+    """
+    Test IndexOutboxStatsView
+    """
+
+    @patch('letters.views.get_index_outbox_stats', autospec=True)
+    def test_index_outbox_stats_view(self, mock_get_index_outbox_stats):
+        """
+        IndexOutboxStatsView should return index outbox stats, but only for staff
+        """
+
+        mock_get_index_outbox_stats.return_value = {'pending': 3, 'oldest_queued': None, 'lag_seconds': 4.2}
+
+        # Anonymous users should get redirected to login page
+        response = self.client.get(reverse('index_outbox_stats'), secure=True)
+        self.assertEqual(response.status_code, 302,
+                         'IndexOutboxStatsView should redirect to login if user not logged in')
+        self.assertEqual(mock_get_index_outbox_stats.call_count, 0,
+                         "IndexOutboxStatsView shouldn't call get_index_outbox_stats() if user not staff")
+
+        # Staff should get index outbox stats
+        staff_user = User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.client.force_login(staff_user)
+        response = self.client.get(reverse('index_outbox_stats'), secure=True)
+        self.assertEqual(json.loads(response.content.decode('utf-8')), mock_get_index_outbox_stats.return_value,
+                         'IndexOutboxStatsView should return get_index_outbox_stats() for staff')
+
+
 class LetterDetailViewTestCase(TestCase):
     """
     Test LetterDetailView
@@ -908,10 +1121,13 @@ class ExportCsvTestCase(TestCase):
     def test_export_csv(self, mock_letter_contents, mock_correspondent_to_export_string, mock_sort_date,
                         mock_csv_writer, mock_StringIO):
         """
-        export_csv(letters) should write content of letters to a csv file and return it in a response
+        export_csv(letters) should write content of letters to a csv file and return it in a streaming response
         """
 
         response = export_csv([LetterFactory()])
+        self.assertEqual(type(response), StreamingHttpResponse, 'export_csv() should return StreamingHttpResponse')
+        # Letters only get written when response is streamed
+        b''.join(response.streaming_content)
 
         self.assertEqual(mock_csv_writer.call_count, 1, 'export_csv() should call csv.writer()')
         self.assertEqual(mock_sort_date.call_count, 1, 'export_csv() should call Letter.sort_date()')
@@ -922,6 +1138,20 @@ class ExportCsvTestCase(TestCase):
         self.assertEqual(response['content-type'],
                          'text/csv', "export_csv() should return response with content_type 'text/csv'")
 
+    def test_export_csv_content(self):
+        """
+        export_csv(letters) should stream a header row, then one row for each letter
+        """
+
+        letters = [LetterFactory(body='Dear Sister'), LetterFactory(body='Dear Brother')]
+
+        content = b''.join(export_csv(iter(letters)).streaming_content).decode('utf-8')
+        rows = list(csv.reader(StringIO(content)))
+        self.assertEqual(rows[0], ['date', 'writer', 'recipient', 'place', 'contents'],
+                         'export_csv() should stream header row first')
+        self.assertEqual([row[4] for row in rows[1:]], [letter.contents() for letter in letters],
+                         'export_csv() should stream one row for each letter')
+
 
 class ExportTextTestCase(TestCase):
     """
@@ -935,14 +1165,18 @@ class ExportTextTestCase(TestCase):
         """
 
         letter = LetterFactory()
+        mock_get_letter_export_text.return_value = 'letter export text'
 
         response = export_text([letter])
+        content = b''.join(response.streaming_content).decode('utf-8')
 
         args, kwargs = mock_get_letter_export_text.call_args
         self.assertEqual(args[0], letter,
                          'export_text(letters) should call get_letter_export_text(letter for each letter)')
+        self.assertEqual(content, 'letter export text\r\n\r\n',
+                         'export_text(letters) should stream get_letter_export_text() for each letter')
 
-        self.assertEqual(type(response), HttpResponse, 'export_text() should return HttpResponse')
+        self.assertEqual(type(response), StreamingHttpResponse, 'export_text() should return StreamingHttpResponse')
         self.assertEqual(response['content-type'],
                          'text/plain', "export_text() should return response with content_type 'text/plain'")
 
@@ -1067,6 +1301,8 @@ class PlaceSearchViewTestCase(SimpleTestCase):
         response = PlaceSearchView().dispatch(request)
 
         self.assertEqual(mock_do_letter_search.call_count, 1, 'PlaceSearchView should call do_letter_search()')
+        args, kwargs = mock_do_letter_search.call_args
+        self.assertTrue(kwargs['use_cache'], 'PlaceSearchView should call do_letter_search() with use_cache=True')
         self.assertEqual(mock_render_to_string.call_count, 1, 'PlaceSearchView should call render_to_string()')
 
         content = json.loads(response.content.decode('utf-8'))
@@ -1092,6 +1328,50 @@ class PlaceSearchViewTestCase(SimpleTestCase):
                          "If there's an Elasticsearch exception, get_elasticsearch_error_response() should be called")
 
 
+class AsyncPlaceSearchViewTestCase(SimpleTestCase):
+    """
+    Test AsyncPlaceSearchView
+    """
+
+    @patch('letters.views.letter_search.async_do_letter_search', autospec=True)
+    @patch('letters.views.get_place_search_response', autospec=True)
+    async def test_async_place_search_view(self, mock_get_place_search_response, mock_async_do_letter_search):
+        """
+        AsyncPlaceSearchView should search with async_do_letter_search() and return get_place_search_response()
+        """
+
+        mock_async_do_letter_search.return_value = 'es_result'
+        mock_get_place_search_response.return_value = 'place_search_response'
+
+        request = RequestFactory().post(reverse('place_search'))
+        response = await AsyncPlaceSearchView.as_view()(request)
+
+        args, kwargs = mock_async_do_letter_search.call_args
+        self.assertTrue(kwargs['use_cache'],
+                        'AsyncPlaceSearchView should call async_do_letter_search() with use_cache=True')
+        args, kwargs = mock_get_place_search_response.call_args
+        self.assertEqual(args[0], 'es_result',
+                         'AsyncPlaceSearchView should call get_place_search_response() with search result')
+        self.assertEqual(response, 'place_search_response',
+                         'AsyncPlaceSearchView should return get_place_search_response()')
+
+    @patch('letters.views.letter_search.async_do_letter_search', autospec=True)
+    @patch('letters.views.get_elasticsearch_error_response', autospec=True)
+    async def test_async_place_search_view_elasticsearch_exception(self, mock_get_elasticsearch_error_response,
+                                                                   mock_async_do_letter_search):
+        """
+        If there's an Elasticsearch exception, get_elasticsearch_error_response() should be called
+        """
+
+        mock_async_do_letter_search.side_effect = ElasticsearchException(error='error', status=406)
+
+        request = RequestFactory().post(reverse('place_search'))
+        await AsyncPlaceSearchView.as_view()(request)
+
+        self.assertEqual(mock_get_elasticsearch_error_response.call_count, 1,
+                         "If there's an Elasticsearch exception, get_elasticsearch_error_response() should be called")
+
+
 class PlaceDetailViewTestCase(TestCase):
     """
     Test PlaceDetailView
@@ -1,10 +1,11 @@
+import asyncio
 import csv
 import json
 import random
 from copy import deepcopy
 
 # for wordcloud, csv
-from io import BytesIO, StringIO
+from io import BytesIO
 import base64
 from matplotlib.colors import LinearSegmentedColormap
 import numpy as np
@@ -13,11 +14,14 @@ from letterpress import settings
 from PIL import Image
 from wordcloud import WordCloud, STOPWORDS
 
-from django.core.paginator import Paginator
-from django.http import HttpResponse
+from asgiref.sync import sync_to_async
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import redirect, render
 from django.template.loader import render_to_string
 from django.urls import reverse
+from django.utils.decorators import method_decorator
 from django.utils.html import mark_safe
 from django.views.generic.base import TemplateView, View
 from django.views.generic.detail import DetailView
@@ -25,13 +29,16 @@ from django.views.generic.list import ListView
 
 from letterpress.exceptions import ElasticsearchException
 from letter_sentiment.custom_sentiment import get_custom_sentiment_for_text, highlight_for_custom_sentiment
-from letter_sentiment.sentiment import get_sentiment, highlight_text_for_sentiment
+from letter_sentiment.sentiment import get_sentiment_and_highlights, highlight_text_for_sentiment
 
 from letters import letter_search
 from letters import filter as letters_filter
 from letters.charts import make_charts
+from letters.index_outbox import get_index_outbox_stats
 from letters.mixins import ObjectNotFoundMixin, object_not_found
 from letters.models import Letter, Place
+from letters.paginator import CountPaginator
+from letters.search_cache import get_search_cache_stats
 from letters.sort_by import DATE, RELEVANCE, get_sentiments_for_sort_by_list
 
 
@@ -43,15 +50,12 @@ class LettersView(TemplateView):
     template_name = 'letters.html'
 
     def post(self, request, *args, **kwargs):
-        # for export, return all matching records, within reason
-        size = 10000
-
+        # for export, return all matching records, retrieved in batches while they're being streamed
         try:
-            es_result = letter_search.do_letter_search(request, size, page_number=0)
+            letters = letter_search.get_letters_for_export(request)
         except ElasticsearchException as ex:
             return get_elasticsearch_error_response(exception=ex, json_response=True)
 
-        letters = [letter for letter, highlight, sentiment, score in es_result.search_results]
         if request.POST.get('export_text'):
             return export_text(letters)
         else:
@@ -106,58 +110,93 @@ class GetStatsView(View):
         except ElasticsearchException as ex:
             return get_elasticsearch_error_response(exception=ex, json_response=True)
 
-        if len(words) == 2:
-            show_proportion = 'true'
-        else:
-            show_proportion = ''
-
-        months = sorted(list(es_word_counts.keys()))
-        results = []
-
-        proportions = []
-        chart_word_freqs = []
-        chart_totals = [es_word_counts[month]['total_words'] for month in months]
-        chart_averages = [es_word_counts[month]['avg_words'] for month in months]
-        chart_doc_counts = [es_word_counts[month]['doc_count'] for month in months]
-        show_charts = False
-
-        for month in months:
-            proportion = 0
-            total = 0
-            freqs = []
-
-            for word in words:
-                if month in es_word_freqs:
-                    freq = es_word_freqs[month][word]
-                    show_charts = True
-                else:
-                    freq = 0
-                total += freq
-                freqs.append(freq)
+        return get_stats_response(words, es_word_counts, es_word_freqs)
+
+
+class AsyncGetStatsView(View):
+    """
+    Async version of GetStatsView, for running under ASGI
+
+    Word counts and word frequencies get retrieved from Elasticsearch at the same time
+    """
+
+    async def post(self, request, *args, **kwargs):
+        filter_values = letters_filter.get_filter_values_from_request(request)
+        words = filter_values.words
+
+        try:
+            if words:
+                es_word_counts, es_word_freqs = await asyncio.gather(
+                    letter_search.async_get_word_counts_per_month(filter_values),
+                    letter_search.async_get_multiple_word_frequencies(filter_values)
+                )
+            else:
+                es_word_counts = await letter_search.async_get_word_counts_per_month(filter_values)
+                es_word_freqs = []
+        except ElasticsearchException as ex:
+            return get_elasticsearch_error_response(exception=ex, json_response=True)
+
+        # Making the charts takes a while, so keep it out of the event loop
+        return await sync_to_async(get_stats_response)(words, es_word_counts, es_word_freqs)
 
-            if show_proportion and (total - freqs[0] != 0):
-                proportion = freqs[0] / (total - freqs[0])
 
-            results.append((month, freqs, proportion,
-                            es_word_counts[month]['avg_words'],
-                            es_word_counts[month]['total_words'],
-                            es_word_counts[month]['doc_count']))
+def get_stats_response(words, es_word_counts, es_word_freqs):
+    """
+    Return json HttpResponse with stats table and charts for word counts and word frequencies per month
+    """
+
+    if len(words) == 2:
+        show_proportion = 'true'
+    else:
+        show_proportion = ''
+
+    months = sorted(list(es_word_counts.keys()))
+    results = []
+
+    proportions = []
+    chart_word_freqs = []
+    chart_totals = [es_word_counts[month]['total_words'] for month in months]
+    chart_averages = [es_word_counts[month]['avg_words'] for month in months]
+    chart_doc_counts = [es_word_counts[month]['doc_count'] for month in months]
+    show_charts = False
+
+    for month in months:
+        proportion = 0
+        total = 0
+        freqs = []
+
+        for word in words:
+            if month in es_word_freqs:
+                freq = es_word_freqs[month][word]
+                show_charts = True
+            else:
+                freq = 0
+            total += freq
+            freqs.append(freq)
+
+        if show_proportion and (total - freqs[0] != 0):
+            proportion = freqs[0] / (total - freqs[0])
 
-            proportions.append(proportion)
-            chart_word_freqs.extend(freqs)
+        results.append((month, freqs, proportion,
+                        es_word_counts[month]['avg_words'],
+                        es_word_counts[month]['total_words'],
+                        es_word_counts[month]['doc_count']))
 
-        stats_html = render_to_string(
-            'snippets/stats_table.html', {'words': words, 'show_proportion': show_proportion, 'results': results}
+        proportions.append(proportion)
+        chart_word_freqs.extend(freqs)
+
+    stats_html = render_to_string(
+        'snippets/stats_table.html', {'words': words, 'show_proportion': show_proportion, 'results': results}
+    )
+    if show_charts:
+        chart = make_charts(
+            words, months, proportions, chart_word_freqs, chart_totals, chart_averages, chart_doc_counts
         )
-        if show_charts:
-            chart = make_charts(
-                words, months, proportions, chart_word_freqs, chart_totals, chart_averages, chart_doc_counts
-            )
-        else:
-            chart = ''
+    else:
+        chart = ''
 
-        # This was Ajax
-        return HttpResponse(json.dumps({'stats': stats_html, 'chart': chart}), content_type="application/json")
+    # This was Ajax
+    return HttpResponse(json.dumps({'stats': stats_html, 'chart': chart}), content_type="application/json")
 
 
 class WordCloudView(TemplateView):
@@ -362,10 +401,14 @@ class GetTextSentimentView(View):
 
         try:
             for sentiment_id in sentiment_ids:
-                highlighted_texts.extend(highlight_for_sentiment(text, sentiment_id))
                 if sentiment_id == 0:
-                    sentiments.extend(get_sentiment(text))
+                    # Split the text into sentences and analyze it only once for the sentiment and the highlights,
+                    # in this process, so requests don't have to wait for the pool of worker processes
+                    sentiment, highlights = get_sentiment_and_highlights(text)
+                    sentiments.extend(sentiment)
+                    highlighted_texts.extend(mark_safe(highlight) for highlight in highlights)
                 else:
+                    highlighted_texts.extend(highlight_for_sentiment(text, sentiment_id))
                     sentiments.append(get_custom_sentiment_for_text(text, sentiment_id))
         except ElasticsearchException as ex:
             return get_elasticsearch_error_response(exception=ex, json_response=True)
@@ -394,31 +437,91 @@ class SearchView(View):
     """
 
     def post(self, request, *args, **kwargs):
-        if request.POST.get('search_text'):
-            size = 5
-        else:
-            size = 10
+        size = get_search_page_size(request)
         page_number = int(request.POST.get('page_number'))
 
         try:
-            es_result = letter_search.do_letter_search(request, size, page_number)
+            es_result = letter_search.do_letter_search(request, size, page_number, from_index=True, use_cache=True,
+                                                       use_pit=True)
         except ElasticsearchException as ex:
             return get_elasticsearch_error_response(exception=ex, json_response=True)
 
-        result_html = render_to_string('snippets/search_list.html', {'search_results': es_result.search_results})
+        return get_search_response(es_result, size, page_number)
 
-        # Manually set Django's paginator to use with Elasticsearch results pages
-        paginator = Paginator(object_list=['x' for _ in range(es_result.total)], per_page=size)
-        # Page number might be 0, if it's the first time the search is carried out
-        page = paginator.page(max(page_number, 1))
-        pagination_html = render_to_string('snippets/pagination.html',
-                                           {'is_paginated': True if paginator.num_pages > 1 else False,
-                                            'paginator': paginator, 'page_obj': page})
 
-        # This was Ajax
-        return HttpResponse(json.dumps({
-            'letters': result_html, 'pagination': pagination_html, 'pages': es_result.pages}),
-            content_type="application/json")
+class AsyncSearchView(View):
+    """
+    Async version of SearchView, for running under ASGI
+    """
+
+    async def post(self, request, *args, **kwargs):
+        size = get_search_page_size(request)
+        page_number = int(request.POST.get('page_number'))
+
+        try:
+            es_result = await letter_search.async_do_letter_search(request, size, page_number, from_index=True,
+                                                                   use_cache=True, use_pit=True)
+        except ElasticsearchException as ex:
+            return get_elasticsearch_error_response(exception=ex, json_response=True)
+
+        return await sync_to_async(get_search_response)(es_result, size, page_number)
+
+
+def get_search_page_size(request):
+    """
+    Fewer letters fit on a page if there's search text, because of the highlights
+    """
+
+    if request.POST.get('search_text'):
+        return 5
+
+    return 10
+
+
+def get_search_response(es_result, size, page_number):
+    """
+    Return json HttpResponse with search results and pagination for a page of search results
+    """
+
+    result_html = render_to_string('snippets/search_list.html', {'search_results': es_result.search_results})
+
+    # Paginator to use with Elasticsearch results pages, which only needs the total number of results
+    paginator = CountPaginator(count=es_result.total, per_page=size)
+    # Page number might be 0, if it's the first time the search is carried out
+    page = paginator.page(max(page_number, 1))
+    # Point in time and cursor for the next page get carried in the pagination links
+    pagination_html = render_to_string('snippets/pagination.html',
+                                       {'is_paginated': True if paginator.num_pages > 1 else False,
+                                        'paginator': paginator, 'page_obj': page,
+                                        'pit_id': es_result.pit_id,
+                                        'search_after': json.dumps(es_result.search_after)
+                                        if es_result.search_after else ''})
+
+    # This was Ajax
+    return HttpResponse(json.dumps({
+        'letters': result_html, 'pagination': pagination_html, 'pages': es_result.pages}),
+        content_type="application/json")
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class SearchCacheStatsView(View):
+    """
+    Return search cache hits and misses, for staff only
+    """
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(json.dumps(get_search_cache_stats()), content_type="application/json")
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class IndexOutboxStatsView(View):
+    """
+    Return the number of letters waiting to be updated in the index and how long they've been waiting,
+    for staff only
+    """
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(json.dumps(get_index_outbox_stats()), content_type="application/json")
 
 
 class LetterDetailView(DetailView, ObjectNotFoundMixin):
@@ -448,12 +551,27 @@ def show_letter_content(request, letter, title, nbar):
                   {'title': title, 'nbar': nbar, 'letter': letter})
 
 
+class Echo:
+    """
+    File-like object that just returns what gets written to it, so csv.writer can be used
+    to generate csv rows one at a time for streaming
+    """
+
+    def write(self, value):
+        return value
+
+
 def export_csv(letters):
-    # write csv file contents to buffer rather than directly to HttpResponse
-    # because that was causing SSL EOF errors
-    buffer = StringIO()
-    csv_writer = csv.writer(buffer)
-    csv_writer.writerow(['date', 'writer', 'recipient', 'place', 'contents'])
+    # Stream the csv rows as they're generated, so letters don't all have to be in memory at once
+    response = StreamingHttpResponse(get_csv_rows(letters), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="letters_export.csv"'
+
+    return response
+
+
+def get_csv_rows(letters):
+    csv_writer = csv.writer(Echo())
+    yield csv_writer.writerow(['date', 'writer', 'recipient', 'place', 'contents'])
 
     for letter in letters:
         date = letter.sort_date()
@@ -461,23 +579,13 @@ def export_csv(letters):
         recipient = letter.recipient.to_export_string()
         place = letter.place
         contents = letter.contents()
-        csv_writer.writerow([date, writer, recipient, place, contents])
-
-    buffer.seek(0)
-    # Create the HttpResponse object with the appropriate CSV header.
-    response = HttpResponse(buffer, content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="letters_export.csv"'
-
-    return response
+        yield csv_writer.writerow([date, writer, recipient, place, contents])
 
 
 def export_text(letters):
-    text_to_export = ''
-    for letter in letters:
-        text_to_export += get_letter_export_text(letter) + '\r\n\r\n'
-
-    # Create the HttpResponse object with the appropriate header.
-    response = HttpResponse(text_to_export, content_type='text/plain')
+    # Stream the text for each letter as it's generated, so letters don't all have to be in memory at once
+    response = StreamingHttpResponse((get_letter_export_text(letter) + '\r\n\r\n' for letter in letters),
+                                     content_type='text/plain')
     response['Content-Disposition'] = 'attachment; filename="letters_export.txt"'
 
     return response
@@ -556,17 +664,44 @@ class PlaceSearchView(View):
         size = 5000
         # Search for letters that meet criteria. Start at beginning, so page number = 0
         try:
-            es_result = letter_search.do_letter_search(request, size, page_number=0)
+            es_result = letter_search.do_letter_search(request, size, page_number=0, from_index=True,
+                                                       use_cache=True)
         except ElasticsearchException as ex:
             return get_elasticsearch_error_response(exception=ex, json_response=True)
 
-        # Get list of corresponding places
-        place_ids = set([letter.place_id for letter, highlight, sentiments, score in es_result.search_results])
-        # Only show the first 100
-        places = Place.objects.filter(pk__in=place_ids, point__isnull=False)[:100]
-        map_html = render_to_string('snippets/map.html', {'places': places})
-        # This was Ajax
-        return HttpResponse(json.dumps({'map': map_html}), content_type="application/json")
+        return get_place_search_response(es_result)
+
+
+class AsyncPlaceSearchView(View):
+    """
+    Async version of PlaceSearchView, for running under ASGI
+    """
+
+    async def post(self, request, *args, **kwargs):
+        # get a bunch of them!
+        size = 5000
+        # Search for letters that meet criteria. Start at beginning, so page number = 0
+        try:
+            es_result = await letter_search.async_do_letter_search(request, size, page_number=0, from_index=True,
+                                                                   use_cache=True)
+        except ElasticsearchException as ex:
+            return get_elasticsearch_error_response(exception=ex, json_response=True)
+
+        return await sync_to_async(get_place_search_response)(es_result)
+
+
+def get_place_search_response(es_result):
+    """
+    Return json HttpResponse with map of the places of the letters in es_result
+    """
+
+    # Get list of corresponding places
+    place_ids = set([letter.place_id for letter, highlight, sentiments, score in es_result.search_results])
+    # Only show the first 100
+    places = Place.objects.filter(pk__in=place_ids, point__isnull=False)[:100]
+    map_html = render_to_string('snippets/map.html', {'places': places})
+    # This was Ajax
+    return HttpResponse(json.dumps({'map': map_html}), content_type="application/json")
 
 
 class PlaceDetailView(DetailView, ObjectNotFoundMixin):
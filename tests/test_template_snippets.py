@@ -6,6 +6,7 @@ from django.core.paginator import Paginator
 from django.template.loader import render_to_string
 from django.test import SimpleTestCase, TestCase
 
+from letters.paginator import CountPaginator
 from letters.tests.factories import CorrespondentFactory, DocumentSourceFactory, LetterFactory, PlaceFactory
 
 
@@ -315,6 +316,28 @@ class PaginationTemplateTestCase(TestCase):
             self.assertFalse(partial_page_link.format(page_number=page_number) in rendered,
                              "Page numbers not 1st or last 2, or within 3 pages of current page, shouldn't have a link")
 
+    def test_count_paginator(self):
+        """
+        Pagination should work with CountPaginator, which only has the number of results
+        """
+
+        paginator = CountPaginator(count=50000, per_page=10)
+        context = {'is_paginated': True,
+                   'paginator': paginator,
+                   'page_obj': paginator.page(number=2500)}
+        rendered = render_to_string(self.template, context)
+
+        current_page_span = \
+            '<span class="page-link">2500 <span class="visually-hidden-focusable">(current)</span></span>'
+        self.assertInHTML(current_page_span, rendered,
+                          msg_prefix="Current page number should be marked with '(current)'")
+        self.assertInHTML(
+            '<a class="page-link" href="#" onclick="return letter_search.do_search(5000);">5000</a>', rendered,
+            msg_prefix='Last page number should have a link to it'
+        )
+        self.assertInHTML('<label class="label">50000 results found</label>', rendered,
+                          msg_prefix='Number of results should be shown')
+
 
 class SearchListTemplateSnippetTestCase(TestCase):
     """